@@ -0,0 +1,158 @@
+'''Load test of the sync (gunicorn) and async (uvicorn) servers.
+
+Both servers run the same number of worker processes pinned to the same
+cores, with the response cache disabled, and are driven by keep-alive clients
+at increasing concurrency with a mix of single movie, listing and country
+page requests. gunicorn and uvicorn must be installed.
+
+    python benchmarks/bench_async.py [cores]'''
+import asyncio
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from os import environ
+
+from psycopg2.extensions import parse_dsn
+
+from catalogue import BENCH_SCHEMA, COUNTRIES, build_catalogue, dsn
+
+MOVIES = 10_000
+PORT = 5055
+DURATION = 10.0
+CONCURRENCY = (8, 64, 256)
+POOL_SIZE = 20
+
+
+def server_env() -> dict[str, str]:
+    'Return an environment pointing the app at the benchmark schema, with caching off'
+    parts = parse_dsn(dsn())
+    return {
+        **environ,
+        'DATABASE_USERNAME': parts.get('user', ''),
+        'DATABASE_PASSWORD': parts.get('password', ''),
+        'DATABASE_IP': parts.get('host', 'localhost'),
+        'DATABASE_PORT': parts.get('port', '5432'),
+        'DATABASE_NAME': parts['dbname'],
+        'DATABASE_POOL_MAX': str(POOL_SIZE),
+        'PGOPTIONS': f'-c search_path={BENCH_SCHEMA},public',
+        'RESPONSE_CACHE_TTL': '0',
+    }
+
+
+def servers(cores: int) -> dict[str, list[str]]:
+    'Return the command line of each server, pinned to `cores` CPUs'
+    pin = ['taskset', '-c', f'0-{cores - 1}']
+    bind = f'127.0.0.1:{PORT}'
+    return {
+        'sync': pin + ['gunicorn', '-b', bind, '-w', str(cores), '-k', 'gthread',
+                       '--threads', str(POOL_SIZE), 'stern_movies_api.app:app'],
+        'async': pin + ['uvicorn', '--host', '127.0.0.1', '--port', str(PORT),
+                        '--workers', str(cores), '--log-level', 'warning',
+                        'stern_movies_api.async_app:app'],
+    }
+
+
+def paths() -> list[str]:
+    'Return a request mix of single movies, listing pages and country pages'
+    mix = [f'/movies/{random.randint(1, MOVIES)}' for _ in range(200)]
+    mix += [f'/movies?limit=20&sort_by={random.choice(["score", "title", "budget"])}'
+            for _ in range(100)]
+    mix += [f'/countries/{random.choice(COUNTRIES)}?limit=20&sort_by=revenue' for _ in range(100)]
+    return mix
+
+
+async def read_response(reader: asyncio.StreamReader) -> int:
+    'Read one HTTP/1.1 response and return its status code'
+    status = int((await reader.readline()).split()[1])
+    length, chunked = 0, False
+    while (line := await reader.readline()) not in (b'\r\n', b''):
+        name, _, value = line.decode().partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+        elif name.lower() == 'transfer-encoding' and 'chunked' in value:
+            chunked = True
+    if not chunked:
+        await reader.readexactly(length)
+        return status
+    while (size := int((await reader.readline()).strip(), 16)):
+        await reader.readexactly(size + 2)
+    await reader.readline()
+    return status
+
+
+async def client(mix: list[str], deadline: float, latencies: list[float], errors: list) -> None:
+    'Send requests over one keep-alive connection until the deadline'
+    reader, writer = await asyncio.open_connection('127.0.0.1', PORT)
+    try:
+        while time.perf_counter() < deadline:
+            path = random.choice(mix)
+            start = time.perf_counter()
+            writer.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n'.encode())
+            status = await read_response(reader)
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors.append(status)
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError) as e:
+        errors.append(type(e).__name__)
+    finally:
+        writer.close()
+
+
+async def load(concurrency: int, mix: list[str]) -> dict:
+    'Drive the server with `concurrency` clients for DURATION seconds'
+    latencies, errors = [], []
+    deadline = time.perf_counter() + DURATION
+    await asyncio.gather(*(client(mix, deadline, latencies, errors)
+                           for _ in range(concurrency)))
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {'rps': len(latencies) / DURATION, 'p50': quantiles[49] * 1000,
+            'p99': quantiles[98] * 1000, 'errors': len(errors)}
+
+
+def wait_until_up(process: subprocess.Popen) -> None:
+    'Block until the server accepts requests'
+    for _ in range(100):
+        if process.poll() is not None:
+            raise RuntimeError('server exited during startup')
+        try:
+            asyncio.run(load_once())
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('server did not start')
+
+
+async def load_once() -> None:
+    'Send a single request'
+    reader, writer = await asyncio.open_connection('127.0.0.1', PORT)
+    writer.write(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+    await read_response(reader)
+    writer.close()
+
+
+def main():
+    'Print throughput and latency of both servers at each concurrency'
+    cores = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    build_catalogue(MOVIES)
+    mix = paths()
+    print(f'{cores} core(s), {DURATION:.0f}s per level, pool of {POOL_SIZE} connections per worker')
+    print(f"{'server':<8} {'clients':>8} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>9} {'errors':>7}")
+    for name, command in servers(cores).items():
+        process = subprocess.Popen(command, env=server_env(), stdout=subprocess.DEVNULL, #pylint: disable=consider-using-with
+                                   stderr=subprocess.DEVNULL, cwd=os.path.dirname(__file__))
+        try:
+            wait_until_up(process)
+            for concurrency in CONCURRENCY:
+                result = asyncio.run(load(concurrency, mix))
+                print(f"{name:<8} {concurrency:>8} {result['rps']:>8.0f} {result['p50']:>8.1f} "
+                      f"{result['p99']:>9.1f} {result['errors']:>7}")
+        finally:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == '__main__':
+    main()
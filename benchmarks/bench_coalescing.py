@@ -0,0 +1,92 @@
+'''Identical concurrent reads with and without request coalescing.
+
+Builds a 100k movie catalogue, then has 8, 32 and 128 threads share out a
+fixed number of the same read and make them back to back: a score-sorted
+listing page, a country page and a relevance-sorted title search. Each run
+is made with every read sent to Postgres and with identical reads in
+flight coalesced, and reports reads/sec, p50/p99 latency, how many queries
+Postgres ran for the same reads and the share of reads answered by
+another's query.
+
+    python benchmarks/bench_coalescing.py'''
+import statistics
+import threading
+import time
+
+from stern_movies_api import database, metrics
+from stern_movies_api.database import (coalescing_stats, configure_coalescing, get_movie_by_country,
+                                       get_movies, warm_lookups)
+from catalogue import build_catalogue, use_catalogue
+
+SIZE = 100_000
+PAGE = 21
+THREADS = (8, 32, 128)
+# The database function timed for each read, the read and how many of it to make per run
+READS = {
+    'listing page': ('_query_movies', lambda: get_movies('', 'score', 'desc', PAGE), 5120),
+    'country page': ('_query_movies_by_country',
+                     lambda: get_movie_by_country('US', 'score', 'desc', PAGE), 5120),
+    'title search': ('_query_movies', lambda: get_movies('storm', 'relevance', 'desc', PAGE),
+                     256),
+}
+
+
+def hammer(read, threads: int, reads: int) -> tuple[list[float], float]:
+    '''Make `reads` calls of `read` from `threads` threads, returning the latency of every
+    call and the wall time of them all'''
+    timings, lock, start = [], threading.Lock(), threading.Barrier(threads + 1)
+
+    def worker():
+        own = []
+        start.wait()
+        for _ in range(reads // threads):
+            began = time.perf_counter()
+            read()
+            own.append(time.perf_counter() - began)
+        with lock:
+            timings.extend(own)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    start.wait()
+    began = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    return timings, time.perf_counter() - began
+
+
+def run(name: str, query: str, read, reads: int, threads: int, #pylint: disable=too-many-arguments,too-many-positional-arguments
+        timeout: float | None) -> None:
+    'Print the throughput, latency and queries of one read at one concurrency'
+    configure_coalescing(timeout)
+    read()
+    queries = metrics.QUERY_SECONDS.count((query,))
+    timings, elapsed = hammer(read, threads, reads)
+    queries = metrics.QUERY_SECONDS.count((query,)) - queries
+    timings.sort()
+    stats = coalescing_stats()
+    ratio = f"{stats['coalesced_ratio']:.0%}" if stats else '-'
+    print(f"{name:<14} {threads:>7} {'on' if timeout else 'off':>10} "
+          f"{len(timings) / elapsed:>9.0f} {statistics.median(timings) * 1000:>8.2f} "
+          f"{timings[int(len(timings) * 0.99)] * 1000:>8.2f} {len(timings):>6} "
+          f"{queries:>8} {ratio:>10}")
+
+
+def main():
+    'Print reads/sec, latency and queries sent with and without coalescing'
+    build_catalogue(SIZE)
+    with use_catalogue():
+        warm_lookups()
+        print(f"pool of {database.get_pool().max_size} connections")
+        print(f"{'read':<14} {'threads':>7} {'coalescing':>10} {'reads/s':>9} {'p50 ms':>8} "
+              f"{'p99 ms':>8} {'reads':>6} {'queries':>8} {'coalesced':>10}")
+        for name, (query, read, reads) in READS.items():
+            for threads in THREADS:
+                for timeout in (None, 30.0):
+                    run(name, query, read, reads, threads, timeout)
+    configure_coalescing(30.0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+'''Country listings filtered by name versus by id, and the /countries rollup.
+
+Skews the catalogue so that one country holds most movies, then times the
+first and a middle page of every sort for that country and for a rare one,
+filtering on country_name as before migration 0004 and on country_id with
+its composite indexes after it. Also times the per-country summary as a
+GROUP BY over the read model against the rollup, and what the extra indexes
+and the rollup trigger add to create_movie.
+
+    python benchmarks/bench_countries.py'''
+import itertools
+import statistics
+import time
+
+from psycopg2 import sql
+
+from stern_movies_api import database, migrations
+from stern_movies_api.database import (create_movie, get_country_summaries, get_movie_by_country,
+                                       warm_lookups)
+from bench_ingest import synthetic_movies
+from catalogue import build_catalogue, connect, use_catalogue
+
+SIZE = 100_000
+LIMIT = 20
+REPEAT = 20
+CREATES = 300
+COMMON, RARE = 'US', 'AU'
+SORTS = list(itertools.product(['title', 'score', 'budget', 'revenue'], ['asc', 'desc']))
+
+SUMMARY_SCAN = '''
+SELECT country_name AS country_code, count(*) AS movie_count, round(avg(score), 2),
+       sum(budget), sum(revenue)
+FROM movie_listing
+GROUP BY country_name
+ORDER BY country_name;'''
+
+
+def timed(run, repeat: int = REPEAT) -> float:
+    'Return the mean ms of `run`'
+    start = time.perf_counter()
+    for _ in range(repeat):
+        run()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def middle(conn, country: str, column: str, direction: str) -> tuple:
+    'Return the sort key of the movie half way through a country listing'
+    with conn.cursor() as curr:
+        curr.execute(sql.SQL(
+            'SELECT {col}, movie_id FROM movie_listing WHERE country_name=%s AND {col} IS NOT NULL '
+            'ORDER BY {col} {dir}, movie_id {dir} '
+            'OFFSET (SELECT count(*) / 2 FROM movie_listing WHERE country_name=%s) LIMIT 1;'
+        ).format(col=sql.Identifier(column), dir=sql.SQL(direction)), (country, country))
+        return tuple(curr.fetchone())
+
+
+def name_page(conn, country: str, column: str, direction: str, after: tuple | None) -> float:
+    'Return the mean ms of a page filtered on country_name'
+    query, params = database._listing_query([sql.SQL('country_name=%s')], [country], #pylint: disable=protected-access
+                                            column, direction, LIMIT, after)
+    def run():
+        with conn.cursor() as curr:
+            curr.execute(query, params)
+            curr.fetchall()
+    return timed(run)
+
+
+def create_p50(movies: list[dict]) -> float:
+    'Return the median ms of create_movie'
+    timings = []
+    for movie in movies:
+        start = time.perf_counter()
+        create_movie(**movie)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def main():
+    'Print country page latency by name and by id, summary latency and create latency'
+    build_catalogue(SIZE, migrate=False)
+    conn = connect()
+    with conn.cursor() as curr:
+        curr.execute("UPDATE movies SET country_id=(SELECT country_id FROM countries "
+                     "WHERE country_name=%s) WHERE movie_id %% 10 < 6;", (COMMON,))
+    conn.commit()
+    every = migrations.MIGRATIONS
+    movies = synthetic_movies(CREATES * 2)
+    with use_catalogue():
+        warm_lookups()
+        migrations.MIGRATIONS = [m for m in every if m[0] < '0004']
+        migrations.apply_migrations(conn)
+        name_create = create_p50(movies[:CREATES])
+        keys = {(country, column, direction): middle(conn, country, column, direction)
+                for country in (COMMON, RARE) for column, direction in SORTS}
+        by_name = {(country, column, direction, page): name_page(conn, country, column,
+                                                                 direction, key)
+                   for (country, column, direction), after in keys.items()
+                   for page, key in (('first', None), ('middle', after))}
+        scan = timed(lambda: conn.cursor().execute(SUMMARY_SCAN), 5)
+        migrations.MIGRATIONS = every
+        migrations.apply_migrations(conn)
+        id_create = create_p50(movies[CREATES:])
+        print(f"{'country':<8} {'sort':<13} {'page':<7} {'by name ms':>11} {'by id ms':>9}")
+        for (country, column, direction, page), name_ms in by_name.items():
+            after = keys[country, column, direction] if page == 'middle' else None
+            id_ms = timed(lambda: get_movie_by_country(country, column, direction, LIMIT, after)) #pylint: disable=cell-var-from-loop
+            print(f"{country:<8} {column + ' ' + direction:<13} {page:<7} "
+                  f"{name_ms:>11.2f} {id_ms:>9.2f}")
+        print(f"country summary: {scan:.2f} ms scanning movie_listing, "
+              f"{timed(get_country_summaries):.2f} ms from the rollup")
+    conn.close()
+    print(f"create_movie p50: {name_create:.2f} ms before, "
+          f"{id_create:.2f} ms with the country indexes and rollup")
+
+
+if __name__ == '__main__':
+    main()
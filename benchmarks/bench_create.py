@@ -0,0 +1,73 @@
+'''Latency of creating a single movie.
+
+Compares the previous write path (a new connection per lookup, two commits
+and a separate id query) with create_movie's single statement and commit.
+
+    python benchmarks/bench_create.py'''
+import statistics
+import time
+
+from stern_movies_api.database import create_movie, warm_lookups
+from bench_ingest import synthetic_movies
+from catalogue import build_catalogue, connect, use_catalogue
+
+CREATES = 500
+
+
+def create_movie_previous(title, release_date, genre, overview, status, budget, revenue, #pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+                          country, language, orig_title) -> int:
+    'The previous write path, with its id lookup fixed to use currval'
+    ids = []
+    for table, column, name in (('genres', 'genre', genre), ('statuses', 'status', status),
+                                ('countries', 'country', country),
+                                ('languages', 'language', language)):
+        conn = connect()
+        with conn.cursor() as curr:
+            curr.execute(f'SELECT {column}_id FROM {table} WHERE {column}_name=%s;', (name,))
+            ids.append(curr.fetchone()[0])
+        conn.close()
+    genre_id, status_id, country_id, language_id = ids
+    conn = connect()
+    with conn.cursor() as curr:
+        curr.execute('''
+INSERT INTO movies
+(title, release_date, overview, status_id, budget, revenue, country_id, language_id, orig_title)
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s);''', (title, release_date, overview, status_id,
+                                                  budget, revenue, country_id, language_id,
+                                                  orig_title))
+        conn.commit()
+        curr.execute("SELECT currval(pg_get_serial_sequence('movies', 'movie_id'));")
+        movie_id = curr.fetchone()[0]
+        curr.execute('INSERT INTO genre_assignments (movie_id, genre_id) VALUES (%s, %s);',
+                     (movie_id, genre_id))
+        conn.commit()
+    conn.close()
+    return movie_id
+
+
+def latencies(func, movies: list[dict]) -> list[float]:
+    'Return the wall time of each call of `func`'
+    timings = []
+    for movie in movies:
+        start = time.perf_counter()
+        func(**movie)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    'Print p50/p95 create latency of both write paths'
+    build_catalogue(1_000)
+    movies = synthetic_movies(CREATES)
+    print(f"{'write path':<12} {'p50 ms':>8} {'p95 ms':>8} {'creates/sec':>12}")
+    with use_catalogue():
+        warm_lookups()
+        for name, func in (('previous', create_movie_previous), ('single', create_movie)):
+            timings = latencies(func, movies)
+            p50 = statistics.median(timings) * 1000
+            p95 = statistics.quantiles(timings, n=20)[-1] * 1000
+            print(f"{name:<12} {p50:>8.2f} {p95:>8.2f} {len(timings) / sum(timings):>12.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+'''Genre selections from the in-process genre bitmaps against Postgres.
+
+Builds a 100k movie catalogue, checks that the bitmaps select exactly the
+movies Postgres does for one genre, two and three genres matched all, two
+matched any and a pair no movie has, and that their facet counts agree,
+then reports: the time of a full load and the memory the bitmaps hold; how
+long selecting and counting facets takes from the bitmaps and from SQL
+over the GIN index; and the latency of a get_movies_by_genre page in
+movie_id order and sorted by score, against the same page filtered in SQL.
+
+    python benchmarks/bench_genre_index.py'''
+import statistics
+import time
+
+import psycopg2.extras
+
+from stern_movies_api import database
+from stern_movies_api.database import get_movies_by_genre, warm_lookups
+from stern_movies_api.genre_index import set_bits
+from catalogue import build_catalogue, connect, use_catalogue
+
+SIZE = 100_000
+LIMIT = 20
+REPEAT = 50
+SELECTIONS = [(['Drama'], True), (['Comedy', 'Romance'], True), (['Comedy', 'Romance'], False),
+              (['Comedy', 'Fantasy', 'Romance'], True), (['Drama', 'War'], True)]
+
+FACETS_QUERY = '''SELECT genre, count(*) AS movies
+FROM movie_listing, unnest(genres) AS genre
+WHERE genres {} %s::text[]
+GROUP BY genre;'''
+
+
+def timed(run, repeat: int = REPEAT) -> float:
+    'Return the median ms of `run`'
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def operator(match_all: bool) -> str:
+    'Return the array operator of a genre selection'
+    return '@>' if match_all else '&&'
+
+
+def sql_ids(curr, genres: list[str], match_all: bool) -> set[int]:
+    'Return the ids of the movies Postgres selects'
+    curr.execute(f'SELECT movie_id FROM movie_listing WHERE genres {operator(match_all)} '
+                 '%s::text[];', (genres,))
+    return {row['movie_id'] for row in curr.fetchall()}
+
+
+def sql_facets(curr, genres: list[str], match_all: bool) -> dict[str, int]:
+    'Return the facet counts Postgres computes'
+    curr.execute(FACETS_QUERY.format(operator(match_all)), (genres,))
+    return {row['genre']: row['movies'] for row in curr.fetchall()}
+
+
+def sql_page(genres: list[str], match_all: bool, sort_by: str) -> list[dict]:
+    'Return a page filtered on the genres array instead of the bitmaps'
+    return database._query_movies_where(f'genres {operator(match_all)} %s::text[]', [genres], #pylint: disable=protected-access
+                                        sort_by, 'desc', LIMIT, None)
+
+
+def main():
+    'Print the bitmap memory, selection and facet latency, and page latency against SQL'
+    build_catalogue(SIZE)
+    conn = connect()
+    curr = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    with use_catalogue():
+        warm_lookups()
+        start = time.perf_counter()
+        bitmaps = database._genre_index.get() #pylint: disable=protected-access
+        print(f"full load of {len(bitmaps):,} movies: "
+              f"{(time.perf_counter() - start) * 1000:.0f} ms, "
+              f"{bitmaps.memory()['total'] / 2**10:.0f} KiB for "
+              f"{bitmaps.memory()['genres']} genres")
+
+        for genres, match_all in SELECTIONS:
+            selected = bitmaps.select(genres, match_all)
+            assert set(set_bits(selected)) == sql_ids(curr, genres, match_all)
+            assert bitmaps.facets(selected) == sql_facets(curr, genres, match_all)
+        print(f"{len(SELECTIONS)} selections and their facets identical from Postgres "
+              "and the bitmaps")
+
+        print(f"{'selection':<28} {'movies':>7} {'select us':>10} {'facets us':>10} "
+              f"{'sql facets ms':>14}")
+        for genres, match_all in SELECTIONS:
+            name = ' & '.join(genres) if match_all else ' | '.join(genres)
+            selected = bitmaps.select(genres, match_all)
+            select_us = timed(lambda: bitmaps.select(genres, match_all), 1000) * 1000 #pylint: disable=cell-var-from-loop
+            facets_us = timed(lambda: bitmaps.facets(selected), 1000) * 1000 #pylint: disable=cell-var-from-loop
+            sql_ms = timed(lambda: sql_facets(curr, genres, match_all)) #pylint: disable=cell-var-from-loop
+            print(f"{name:<28} {selected.bit_count():>7} {select_us:>10.1f} {facets_us:>10.1f} "
+                  f"{sql_ms:>14.2f}")
+
+        print(f"{'page':<40} {'bitmaps ms':>11} {'sql ms':>9}")
+        for genres, match_all in SELECTIONS:
+            name = ' & '.join(genres) if match_all else ' | '.join(genres)
+            for sort_by in ('movie_id', 'score'):
+                indexed = timed(lambda: get_movies_by_genre(genres, match_all, sort_by, 'desc', #pylint: disable=cell-var-from-loop
+                                                            LIMIT))
+                filtered = timed(lambda: sql_page(genres, match_all, sort_by)) #pylint: disable=cell-var-from-loop
+                assert get_movies_by_genre(genres, match_all, sort_by, 'desc', LIMIT) == \
+                    sql_page(genres, match_all, sort_by)
+                print(f"{name + ' by ' + sort_by:<40} {indexed:>11.3f} {filtered:>9.3f}")
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+'''Round trips and wall time of unfiltered listings with their genres.
+
+Compares the per-movie genre lookup that get_movies used to perform with the
+aggregated query it runs now, at 1k, 10k and 100k movies.
+
+    python benchmarks/bench_genres.py'''
+import psycopg2.extras
+
+from stern_movies_api.database import get_movies
+from catalogue import build_catalogue, connect, measure, use_catalogue, CountingConnection
+
+SIZES = [1_000, 10_000, 100_000]
+
+
+def get_movies_n_plus_one() -> list[dict]:
+    'The previous implementation: one genre query per listed movie'
+    conn = connect(connection_factory=CountingConnection)
+    curr = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    curr.execute('SELECT * FROM movie_info;')
+    movies = curr.fetchall()
+    for movie in movies:
+        curr.execute('''SELECT genre_name
+FROM genre_assignments
+JOIN genres ON (genre_assignments.genre_id=genres.genre_id)
+WHERE movie_id=%s;''', (movie['movie_id'],))
+        movie['genres'] = [genre['genre_name'] for genre in curr.fetchall()]
+    conn.close()
+    return movies
+
+
+def main():
+    'Print one line per catalogue size and strategy'
+    print(f"{'movies':>8} {'strategy':<12} {'round trips':>12} {'seconds':>10}")
+    for size in SIZES:
+        build_catalogue(size)
+        with use_catalogue():
+            get_movies()
+            for name, func in (('n+1', get_movies_n_plus_one), ('aggregated', get_movies)):
+                result = measure(func)
+                print(f"{size:>8} {name:<12} {result['round_trips']:>12} "
+                      f"{result['seconds']:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
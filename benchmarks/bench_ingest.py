@@ -0,0 +1,50 @@
+'''Throughput of bulk movie ingestion through create_movies.
+
+Inserts synthetic batches into an empty catalogue and reports rows/sec for
+each batch size.
+
+    python benchmarks/bench_ingest.py'''
+from datetime import date
+
+from stern_movies_api.database import create_movies
+from catalogue import COUNTRIES, GENRES, LANGUAGES, STATUSES, build_catalogue, measure, use_catalogue
+
+BATCH_SIZES = [100, 1_000, 10_000]
+ROWS = 50_000
+
+
+def synthetic_movies(count: int, offset: int = 0) -> list[dict]:
+    'Return `count` valid movies as create_movie arguments'
+    return [{
+        'title': f'Ingested {i}',
+        'release_date': date(1970 + i % 50, 1 + i % 12, 1 + i % 28),
+        'genre': GENRES[i % len(GENRES)],
+        'overview': f'Synthetic overview {i}',
+        'status': STATUSES[i % len(STATUSES)],
+        'budget': i * 1000,
+        'revenue': i * 2500,
+        'country': COUNTRIES[i % len(COUNTRIES)],
+        'language': LANGUAGES[i % len(LANGUAGES)],
+        'orig_title': f'Ingested {i}',
+    } for i in range(offset, offset + count)]
+
+
+def main():
+    'Print rows/sec per batch size'
+    print(f"{'batch size':>10} {'rows':>8} {'round trips':>12} {'seconds':>10} {'rows/sec':>10}")
+    for batch_size in BATCH_SIZES:
+        build_catalogue(0)
+        with use_catalogue():
+            batches = [synthetic_movies(batch_size, offset)
+                       for offset in range(0, ROWS, batch_size)]
+            seconds, round_trips = 0.0, 0
+            for batch in batches:
+                result = measure(create_movies, batch)
+                seconds += result['seconds']
+                round_trips += result['round_trips']
+            print(f"{batch_size:>10} {ROWS:>8} {round_trips:>12} {seconds:>10.3f} "
+                  f"{ROWS / seconds:>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
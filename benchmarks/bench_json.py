@@ -0,0 +1,55 @@
+'''Serialization time of movie listings with the stdlib and orjson providers.
+
+Fetches 10k and 100k movie rows through get_movies and times building the
+JSON response the app would send, and the NDJSON lines of a stream, with
+Flask's default provider and with FastJSONProvider. The response bodies are
+checked to decode to the same listing.
+
+    python benchmarks/bench_json.py'''
+import json
+import time
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+from stern_movies_api.database import get_movies
+from stern_movies_api.json_provider import FastJSONProvider
+from catalogue import build_catalogue, use_catalogue
+
+SIZES = (10_000, 100_000)
+REPEAT = 5
+
+
+def best_ms(func) -> float:
+    'Return the fastest of REPEAT runs of `func` in ms'
+    timings = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+
+def main():
+    'Print response and NDJSON serialization time of both providers'
+    build_catalogue(max(SIZES))
+    app = Flask(__name__)
+    providers = {'stdlib': DefaultJSONProvider(app), 'orjson': FastJSONProvider(app)}
+    with use_catalogue():
+        listings = {size: get_movies(limit=size) for size in SIZES}
+    print(f"{'movies':>8} {'provider':<8} {'response ms':>12} {'ndjson ms':>10} {'MB':>6}")
+    with app.app_context():
+        for size, movies in listings.items():
+            bodies = []
+            for name, provider in providers.items():
+                response = best_ms(lambda p=provider, m=movies: p.response(m))
+                ndjson = best_ms(lambda p=provider, m=movies: [p.dumps(movie) for movie in m])
+                body = provider.response(movies).get_data()
+                bodies.append(json.loads(body))
+                print(f"{size:>8} {name:<8} {response:>12.1f} {ndjson:>10.1f} "
+                      f"{len(body) / 1e6:>6.1f}")
+            assert bodies[0] == bodies[1], 'providers disagree'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+'''Single movie documents and batch fetches.
+
+Compares the old per-genre join get_movie_by_id ran, which returned one row
+per genre and kept the first, with the aggregated read model row it reads
+now, reporting rows and bytes shipped per movie as well as latency. Then
+times fetching a front-end prefetch of ids one call at a time against one
+get_movies_by_ids call.
+
+    python benchmarks/bench_movie_documents.py'''
+import random
+import time
+
+from stern_movies_api.database import MOVIE_QUERY, get_movie_by_id, get_movies_by_ids
+from catalogue import build_catalogue, connect, use_catalogue
+
+MOVIES = 100_000
+CALLS = 1_000
+BATCH_SIZES = (10, 50, 100)
+
+JOIN_QUERY = '''SELECT *
+FROM movies
+JOIN statuses ON (movies.status_id=statuses.status_id)
+JOIN languages ON (movies.language_id=languages.language_id)
+JOIN countries ON (movies.country_id=countries.country_id)
+JOIN genre_assignments ON (movies.movie_id=genre_assignments.movie_id)
+JOIN genres ON (genre_assignments.genre_id=genres.genre_id)
+WHERE movies.movie_id=%s;'''
+
+
+def shipped(conn, query: str, movie_ids: list[int]) -> tuple[float, float]:
+    'Return the mean rows and bytes of text the server sends per movie for `query`'
+    rows = size = 0
+    with conn.cursor() as curr:
+        for movie_id in movie_ids:
+            curr.execute(query, (movie_id,))
+            result = curr.fetchall()
+            rows += len(result)
+            size += sum(len(str(value)) for row in result for value in row)
+    return rows / len(movie_ids), size / len(movie_ids)
+
+
+def mean_ms(conn, query: str, movie_ids: list[int]) -> float:
+    'Return the mean ms of `query` per movie'
+    with conn.cursor() as curr:
+        start = time.perf_counter()
+        for movie_id in movie_ids:
+            curr.execute(query, (movie_id,))
+            curr.fetchall()
+    return (time.perf_counter() - start) / len(movie_ids) * 1000
+
+
+def batch_ms(movie_ids: list[int], repeat: int = 50) -> tuple[float, float]:
+    'Return the mean ms of fetching `movie_ids` one at a time and in one batch'
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for movie_id in movie_ids:
+            get_movie_by_id(movie_id)
+    singles = (time.perf_counter() - start) / repeat * 1000
+    start = time.perf_counter()
+    for _ in range(repeat):
+        get_movies_by_ids(movie_ids)
+    return singles, (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    'Print what each movie document costs and how batching changes prefetches'
+    build_catalogue(MOVIES)
+    conn = connect()
+    movie_ids = random.sample(range(1, MOVIES + 1), CALLS)
+    print(f"{'query':<12} {'rows/movie':>11} {'bytes/movie':>12} {'ms/movie':>9}")
+    for name, query in (('join', JOIN_QUERY), ('aggregated', MOVIE_QUERY)):
+        rows, size = shipped(conn, query, movie_ids)
+        print(f"{name:<12} {rows:>11.2f} {size:>12.0f} {mean_ms(conn, query, movie_ids):>9.3f}")
+    conn.close()
+    print(f"{'ids':>5} {'one by one ms':>14} {'batch ms':>9}")
+    with use_catalogue():
+        for size in BATCH_SIZES:
+            singles, batch = batch_ms(random.sample(range(1, MOVIES + 1), size))
+            print(f"{size:>5} {singles:>14.2f} {batch:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+'''Parse and plan time saved by prepared statements.
+
+Runs each hot read through the database functions with the statement
+registry disabled and enabled, and reports the mean time per call alongside
+the planning time Postgres reports for the unprepared query.
+
+    python benchmarks/bench_prepared.py'''
+import re
+import time
+
+from psycopg2 import sql
+
+from stern_movies_api import database
+from stern_movies_api.database import (get_movie_by_country, get_movie_by_id, get_movies,
+                                       statement_stats)
+from catalogue import build_catalogue, connect, use_catalogue
+
+MOVIES = 100_000
+CALLS = 1_000
+
+QUERIES = {
+    'listing page': (get_movies, ('', 'movie_id', 'desc', 21, (None, 50_000))),
+    'search page': (get_movies, ('night', 'movie_id', 'asc', 21, None)),
+    'movie by id': (get_movie_by_id, (4_242,)),
+    'country page': (get_movie_by_country, ('US', 'movie_id', 'asc', 21, (None, 20_000))),
+}
+
+
+def query_text(name: str, conn) -> str:
+    'Return the SQL the registry would prepare for one of QUERIES, with its parameters bound'
+    func, args = QUERIES[name]
+    if func is get_movie_by_id:
+        return conn.cursor().mogrify(database.MOVIE_QUERY, args).decode()
+    if func is get_movies:
+        search = args[0]
+        conditions, params = database._search_conditions(search) #pylint: disable=protected-access
+        query, params = database._listing_query(conditions, params, *args[1:], search) #pylint: disable=protected-access
+    else:
+        query, params = database._listing_query([sql.SQL('country_name=%s')], [args[0]], #pylint: disable=protected-access
+                                                *args[1:])
+    return conn.cursor().mogrify(query, params).decode()
+
+
+def planning_ms(query: str, conn) -> float:
+    'Return the planning time Postgres reports for `query`, averaged over a few runs'
+    timings = []
+    with conn.cursor() as curr:
+        for _ in range(20):
+            curr.execute('EXPLAIN (SUMMARY) ' + query)
+            plan = '\n'.join(row[0] for row in curr.fetchall())
+            timings.append(float(re.search(r'Planning Time: ([\d.]+) ms', plan).group(1)))
+    return sum(timings) / len(timings)
+
+
+def mean_call_ms(func, args) -> float:
+    'Return the mean wall time of CALLS calls'
+    func(*args)
+    start = time.perf_counter()
+    for _ in range(CALLS):
+        func(*args)
+    return (time.perf_counter() - start) / CALLS * 1000
+
+
+def main():
+    'Print per call latency with and without prepared statements'
+    build_catalogue(MOVIES)
+    conn = connect()
+    print(f"{'query':<14} {'plan ms':>8} {'direct ms':>10} {'prepared ms':>12} {'saved ms':>9}")
+    with use_catalogue():
+        for name, (func, args) in QUERIES.items():
+            planning = planning_ms(query_text(name, conn), conn)
+            database._statements.enabled = False #pylint: disable=protected-access
+            direct = mean_call_ms(func, args)
+            database._statements.enabled = True #pylint: disable=protected-access
+            prepared = mean_call_ms(func, args)
+            print(f"{name:<14} {planning:>8.3f} {direct:>10.3f} {prepared:>12.3f} "
+                  f"{direct - prepared:>9.3f}")
+        pooled = database.get_pool().getconn()
+        with pooled.cursor() as curr:
+            curr.execute('SELECT sum(generic_plans), sum(custom_plans) FROM pg_prepared_statements;')
+            generic, custom = curr.fetchone()
+        database.get_pool().putconn(pooled)
+    conn.close()
+    print(f"registry: {statement_stats()}")
+    print(f"plans on the pooled connection: {generic} generic, {custom} custom")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+'''Listing pages from the movie_info view versus the movie_listing read model.
+
+For every sort column and direction, times the first page and a page from
+the middle of the catalogue as the view query used to run them and as
+get_movies runs them now, and checks with EXPLAIN that the read model page
+is a single index scan with no sort. Also reports what the triggers that
+keep the read model fresh add to create_movie.
+
+    python benchmarks/bench_read_model.py'''
+import itertools
+import json
+import statistics
+import time
+
+from psycopg2 import sql
+
+from stern_movies_api import database
+from stern_movies_api.database import create_movie, get_movies, warm_lookups
+from stern_movies_api.migrations import apply_migrations
+from bench_ingest import synthetic_movies
+from catalogue import build_catalogue, connect, use_catalogue
+
+SIZE = 100_000
+LIMIT = 20
+REPEAT = 20
+CREATES = 300
+SORTS = list(itertools.product(['title', 'score', 'budget', 'revenue'], ['ASC', 'DESC']))
+
+VIEW_QUERY = '''SELECT movie_info.*, ARRAY(
+    SELECT genre_name
+    FROM genre_assignments
+    JOIN genres ON (genre_assignments.genre_id=genres.genre_id)
+    WHERE genre_assignments.movie_id=movie_info.movie_id
+) AS genres
+FROM movie_info
+{where}
+ORDER BY {col} {dir} NULLS LAST, movie_id {dir}
+LIMIT %s;'''
+
+
+def view_page(conn, column: str, direction: str, after: tuple | None) -> float:
+    'Return the mean ms of a page as it was read from the view'
+    where, params = sql.SQL(''), []
+    if after is not None:
+        where = sql.SQL('WHERE (({col}, movie_id) {cmp} (%s, %s) OR {col} IS NULL)').format(
+            col=sql.Identifier(column), cmp=sql.SQL('<' if direction == 'DESC' else '>'))
+        params = list(after)
+    query = sql.SQL(VIEW_QUERY).format(where=where, col=sql.Identifier(column),
+                                       dir=sql.SQL(direction))
+    with conn.cursor() as curr:
+        start = time.perf_counter()
+        for _ in range(REPEAT):
+            curr.execute(query, params + [LIMIT])
+            curr.fetchall()
+    return (time.perf_counter() - start) / REPEAT * 1000
+
+
+def middle(conn, column: str, direction: str) -> tuple:
+    'Return the sort key of the movie half way through the listing'
+    with conn.cursor() as curr:
+        curr.execute(sql.SQL('SELECT {col}, movie_id FROM movie_info WHERE {col} IS NOT NULL '
+                             'ORDER BY {col} {dir}, movie_id {dir} OFFSET %s LIMIT 1;').format(
+                                 col=sql.Identifier(column), dir=sql.SQL(direction)),
+                     (SIZE // 2,))
+        return tuple(curr.fetchone())
+
+
+def read_model_page(column: str, direction: str, after: tuple | None) -> float:
+    'Return the mean ms of a page from get_movies'
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        get_movies('', column, direction, LIMIT, after)
+    return (time.perf_counter() - start) / REPEAT * 1000
+
+
+def single_index_scan(conn, column: str, direction: str, after: tuple) -> bool:
+    'Return whether the read model page is planned as an index scan under a limit'
+    query, params = database._listing_query([], [], column, direction, LIMIT, after) #pylint: disable=protected-access
+    with conn.cursor() as curr:
+        curr.execute(sql.SQL('EXPLAIN (FORMAT JSON) ') + query, params)
+        plan = curr.fetchone()[0]
+    plan = (plan if isinstance(plan, list) else json.loads(plan))[0]['Plan']
+    return (plan['Node Type'] == 'Limit' and len(plan['Plans']) == 1
+            and plan['Plans'][0]['Node Type'] in ('Index Scan', 'Index Only Scan'))
+
+
+def create_p50(movies: list[dict]) -> float:
+    'Return the median ms of create_movie'
+    timings = []
+    for movie in movies:
+        start = time.perf_counter()
+        create_movie(**movie)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def main():
+    'Print page latency from the view and the read model, and create latency with and without it'
+    build_catalogue(SIZE, migrate=False)
+    conn = connect()
+    movies = synthetic_movies(CREATES * 2)
+    with use_catalogue():
+        warm_lookups()
+        database._statements.enabled = False #pylint: disable=protected-access
+        # Without the read model create_movie writes the base tables only
+        view_create = create_p50(movies[:CREATES])
+        apply_migrations(conn)
+        database._statements.enabled = True #pylint: disable=protected-access
+        read_model_create = create_p50(movies[CREATES:])
+        print(f"{'sort':<14} {'page':<7} {'view ms':>8} {'read model ms':>14} {'index scan':>11}")
+        for column, direction in SORTS:
+            after = middle(conn, column, direction)
+            for page, key in (('first', None), ('middle', after)):
+                print(f"{column + ' ' + direction.lower():<14} {page:<7} "
+                      f"{view_page(conn, column, direction, key):>8.2f} "
+                      f"{read_model_page(column, direction, key):>14.2f} "
+                      f"{str(single_index_scan(conn, column, direction, key)):>11}")
+    conn.close()
+    print(f"create_movie p50: {view_create:.2f} ms on the base tables, "
+          f"{read_model_create:.2f} ms with the read model triggers")
+
+
+if __name__ == '__main__':
+    main()
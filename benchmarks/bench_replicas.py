@@ -0,0 +1,140 @@
+'''Reads routed to a streaming replica, with read-your-writes.
+
+Needs a second server streaming from the benchmark database, at
+BENCH_REPLICA_URL. Builds a 10k movie catalogue on the primary, then
+reports: get_movie_by_id and listing page latency from the primary alone and
+routed to the replica; how often a movie read from the replica right after
+create_movie is missing without a session, and that none is with one,
+along with how many of those reads had to fall back to the primary; what
+recording the commit LSN adds to create_movie; and that reads keep being
+served while one of two configured replicas is unreachable.
+
+    BENCH_REPLICA_URL=postgresql://... python benchmarks/bench_replicas.py'''
+import statistics
+import time
+from os import environ
+
+import psycopg2
+
+from stern_movies_api import database
+from stern_movies_api.database import (configure_replicas, create_movie, get_movie_by_id,
+                                       get_movies, replica_stats, warm_lookups)
+from stern_movies_api.replicas import finish_session, start_session
+from bench_ingest import synthetic_movies
+from catalogue import BENCH_SCHEMA, build_catalogue, use_catalogue
+
+SIZE = 10_000
+REPEAT = 500
+WRITES = 200
+UNREACHABLE = 'postgresql://postgres@127.0.0.1:1/stern_movies_bench?connect_timeout=1'
+
+
+def timed(run, repeat: int = REPEAT) -> float:
+    'Return the median ms of `run`'
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def connect_replica(dsn: str):
+    'Open a replica connection whose search path points at the benchmark schema'
+    return psycopg2.connect(dsn, options=f'-c search_path={BENCH_SCHEMA},public')
+
+
+def wait_for_replica(replica: str) -> None:
+    'Wait until the replica has replayed everything the primary has written'
+    conn = database._connect() #pylint: disable=protected-access
+    with conn.cursor() as curr:
+        curr.execute('SELECT pg_current_wal_insert_lsn();')
+        target = curr.fetchone()[0]
+    conn.close()
+    conn = psycopg2.connect(replica)
+    conn.autocommit = True
+    with conn.cursor() as curr:
+        while True:
+            curr.execute('SELECT pg_last_wal_replay_lsn() >= %s::pg_lsn;', (target,))
+            if curr.fetchone()[0]:
+                break
+            time.sleep(0.05)
+    conn.close()
+
+
+def reads(movie_ids: list[int]) -> dict[str, float]:
+    'Return the median ms of a movie and of a listing page'
+    ids = iter(movie_ids * (REPEAT // len(movie_ids) + 1))
+    return {'get_movie_by_id': timed(lambda: get_movie_by_id(next(ids))),
+            'get_movies page': timed(lambda: get_movies('', 'score', 'desc', 20))}
+
+
+def created_then_read(movies: list[dict], session: bool) -> tuple[int, float]:
+    '''Create each movie and read it straight back, returning how many reads missed it
+    and the median ms of create_movie'''
+    missed, timings = 0, []
+    for movie in movies:
+        if session:
+            start_session()
+        start = time.perf_counter()
+        movie_id = create_movie(**movie)['movie_id']
+        timings.append(time.perf_counter() - start)
+        if not session:
+            finish_session()
+        try:
+            get_movie_by_id(movie_id)
+        except ValueError:
+            missed += 1
+        finish_session()
+    return missed, statistics.median(timings) * 1000
+
+
+def main():
+    'Print latency by route, stale reads with and without sessions, and ejection'
+    replica = environ['BENCH_REPLICA_URL']
+    build_catalogue(SIZE)
+    movies = synthetic_movies(WRITES * 3)
+    movie_ids = list(range(1, SIZE + 1, SIZE // 50))
+    original = database._connect_replica #pylint: disable=protected-access
+    database._connect_replica = connect_replica #pylint: disable=protected-access
+    try:
+        with use_catalogue():
+            warm_lookups()
+            wait_for_replica(replica)
+            primary = reads(movie_ids)
+            _, unrouted_create = created_then_read(movies[:WRITES], False)
+            configure_replicas([replica])
+            routed = reads(movie_ids)
+            print(f"{'read':<18} {'primary ms':>11} {'replica ms':>11}")
+            for name, value in primary.items():
+                print(f"{name:<18} {value:>11.3f} {routed[name]:>11.3f}")
+
+            before = replica_stats()['lagging_reads']
+            stale, _ = created_then_read(movies[WRITES:WRITES * 2], False)
+            missed, routed_create = created_then_read(movies[WRITES * 2:], True)
+            lagging = replica_stats()['lagging_reads'] - before
+            assert missed == 0, f'{missed} reads did not see their own write'
+            print(f"reads right after create_movie missing the movie: {stale}/{WRITES} "
+                  f"without a session, {missed}/{WRITES} with one, {lagging} of which "
+                  "went to the primary")
+            print(f"create_movie p50: {unrouted_create:.2f} ms without replicas, "
+                  f"{routed_create:.2f} ms recording the commit LSN")
+
+            configure_replicas([UNREACHABLE, replica], eject_for=60)
+            start = time.perf_counter()
+            for movie_id in movie_ids:
+                get_movie_by_id(movie_id)
+            elapsed = (time.perf_counter() - start) * 1000
+            stats = replica_stats()
+            print(f"{len(movie_ids)} reads with one of two replicas unreachable: "
+                  f"{elapsed:.0f} ms, {stats['primary_reads']} served by the primary")
+            for replica_stat in stats['replicas']:
+                print(f"  {replica_stat['name']:<32} healthy={replica_stat['healthy']} "
+                      f"reads={replica_stat['reads']} failures={replica_stat['failures']}")
+            configure_replicas([])
+    finally:
+        database._connect_replica = original #pylint: disable=protected-access
+
+
+if __name__ == '__main__':
+    main()
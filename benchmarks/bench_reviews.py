@@ -0,0 +1,129 @@
+'''Review counts, pages and writes with millions of reviews.
+
+Loads REVIEWS reviews (default 2,000,000, or the first argument) onto a
+100k movie catalogue, a tenth of them on one popular movie, then reports:
+count_reviews from the counters against COUNT(*); the first and a deep page
+of the popular movie's reviews by keyset against OFFSET; create_review p50
+on the popular and a quiet movie; create_reviews throughput; and reviews/sec
+of concurrent writers all reviewing one movie, whose counter row they share,
+against the same writers reviewing a movie each.
+
+    python benchmarks/bench_reviews.py [reviews]'''
+import statistics
+import sys
+import threading
+import time
+
+from stern_movies_api.database import count_reviews, create_review, create_reviews, read_reviews
+from catalogue import build_catalogue, connect, use_catalogue
+
+SIZE = 100_000
+REVIEWS = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000
+POPULAR, QUIET = 1, 2
+LIMIT = 20
+REPEAT = 50
+CREATES = 300
+BATCH = 1000
+BATCHES = 20
+WRITERS = 8
+WRITES_PER_WRITER = 200
+
+
+def load_reviews(conn) -> float:
+    'Insert REVIEWS synthetic reviews with one statement and return the seconds it took'
+    start = time.perf_counter()
+    with conn.cursor() as curr:
+        curr.execute('''
+INSERT INTO reviews (movie_id, score, review_text)
+SELECT CASE WHEN i %% 10 = 0 THEN %(popular)s ELSE 3 + (i * 7919) %% (%(size)s - 2) END,
+       CASE WHEN i %% 4 = 0 THEN NULL ELSE 1 + i %% 10 END,
+       'Synthetic review ' || i
+FROM generate_series(1::bigint, %(reviews)s) AS i;
+''', {'popular': POPULAR, 'size': SIZE, 'reviews': REVIEWS})
+        curr.execute('ANALYZE reviews;')
+    conn.commit()
+    return time.perf_counter() - start
+
+
+def timed(run, repeat: int = REPEAT) -> float:
+    'Return the mean ms of `run`'
+    start = time.perf_counter()
+    for _ in range(repeat):
+        run()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def sql_ms(conn, query: str, params: tuple, repeat: int = REPEAT) -> float:
+    'Return the mean ms of a query run on `conn`'
+    def run():
+        with conn.cursor() as curr:
+            curr.execute(query, params)
+            curr.fetchall()
+    return timed(run, repeat)
+
+
+def create_p50(movie_id: int) -> float:
+    'Return the median ms of create_review on a movie'
+    timings = []
+    for i in range(CREATES):
+        start = time.perf_counter()
+        create_review(movie_id, f'Benchmark review {i}', 1 + i % 10)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def concurrent_writes(movie_ids: list[int]) -> float:
+    'Return reviews/sec of WRITERS threads, each writing to its movie from `movie_ids`'
+    def write(movie_id: int):
+        for i in range(WRITES_PER_WRITER):
+            create_review(movie_id, f'Concurrent review {i}', 5)
+    threads = [threading.Thread(target=write, args=(movie_id,)) for movie_id in movie_ids]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return WRITERS * WRITES_PER_WRITER / (time.perf_counter() - start)
+
+
+def main():
+    'Print count, page and write latency with REVIEWS reviews loaded'
+    build_catalogue(SIZE)
+    conn = connect()
+    print(f"loaded {REVIEWS:,} reviews in {load_reviews(conn):.1f} s")
+    with use_catalogue():
+        popular_count = count_reviews(POPULAR)
+        counted = sql_ms(conn, 'SELECT count(*) FROM reviews WHERE movie_id=%s;', (POPULAR,), 5)
+        print(f"count_reviews of a movie with {popular_count:,} reviews: "
+              f"{timed(lambda: count_reviews(POPULAR)):.3f} ms from the counters, "
+              f"{counted:.2f} ms with COUNT(*)")
+        with conn.cursor() as curr:
+            curr.execute('SELECT review_id FROM reviews WHERE movie_id=%s ORDER BY review_id '
+                         'OFFSET %s LIMIT 1;', (POPULAR, popular_count // 2))
+            middle = curr.fetchone()[0]
+        offset_query = ('SELECT * FROM reviews WHERE movie_id=%s ORDER BY review_id '
+                        'OFFSET %s LIMIT %s;')
+        print(f"{'page':<8} {'keyset ms':>10} {'offset ms':>10}")
+        for page, after, offset in (('first', 0, 0), ('middle', middle, popular_count // 2)):
+            keyset = timed(lambda: read_reviews(POPULAR, LIMIT, after)) #pylint: disable=cell-var-from-loop
+            print(f"{page:<8} {keyset:>10.2f} "
+                  f"{sql_ms(conn, offset_query, (POPULAR, offset, LIMIT), 5):>10.2f}")
+        print(f"create_review p50: {create_p50(POPULAR):.2f} ms on the popular movie, "
+              f"{create_p50(QUIET):.2f} ms on a quiet one")
+        batches = [[{'movie_id': 3 + (b * BATCH + i) % (SIZE - 2),
+                     'review_text': f'Imported {i}', 'score': 1 + i % 10} for i in range(BATCH)]
+                   for b in range(BATCHES)]
+        start = time.perf_counter()
+        for batch in batches:
+            create_reviews(batch)
+        print(f"create_reviews: {BATCH * BATCHES / (time.perf_counter() - start):,.0f} "
+              f"reviews/sec in batches of {BATCH}")
+        shared = concurrent_writes([POPULAR] * WRITERS)
+        spread = concurrent_writes([10 + writer for writer in range(WRITERS)])
+        print(f"{WRITERS} concurrent writers: {shared:,.0f} reviews/sec on one movie, "
+              f"{spread:,.0f} reviews/sec on a movie each")
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
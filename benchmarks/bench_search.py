@@ -0,0 +1,66 @@
+'''Title search with and without the trigram index.
+
+Builds a catalogue of 200k titles, then for each search term checks with
+EXPLAIN whether the read model's trigram index is used and reports the
+query's execution time and get_movies' wall time, without the index and
+after migrating it back. Needs the pg_trgm extension to be available to
+the server.
+
+    python benchmarks/bench_search.py'''
+import json
+
+from stern_movies_api.database import get_movies, migrate
+from catalogue import build_catalogue, connect, measure, use_catalogue
+
+SIZE = 200_000
+TERMS = ['Storm', 'crimson riv', 'Orchard 1999', 'no such title']
+INDEX = 'movie_listing_title_trgm_idx'
+MIGRATION = '0003_movie_listing_title_trigram_index'
+
+
+def plan_nodes(plan: dict):
+    'Yield every node of an EXPLAIN plan'
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+def explain(term: str) -> tuple[bool, float]:
+    'Return whether the search uses the trigram index and its execution time in ms'
+    conn = connect()
+    with conn.cursor() as curr:
+        curr.execute('EXPLAIN (ANALYZE, FORMAT JSON) SELECT movie_id FROM movie_listing '
+                     'WHERE title ILIKE %s;', (f'%{term}%',))
+        result = curr.fetchone()[0]
+    conn.close()
+    result = result[0] if isinstance(result, list) else json.loads(result)[0]
+    uses_index = any(node.get('Index Name') == INDEX for node in plan_nodes(result['Plan']))
+    return uses_index, result['Execution Time']
+
+
+def main():
+    'Print index usage and latency for each term before and after the migration'
+    build_catalogue(SIZE)
+    conn = connect()
+    with conn, conn.cursor() as curr:
+        curr.execute(f'DROP INDEX {INDEX};')
+        curr.execute('DELETE FROM schema_migrations WHERE name=%s;', (MIGRATION,))
+    conn.close()
+    print(f"{'phase':<10} {'term':<16} {'index':>6} {'exec ms':>9} {'rows':>7} {'call ms':>9}")
+    with use_catalogue():
+        for phase in ('before', 'after'):
+            if phase == 'after':
+                migrate()
+                conn = connect()
+                with conn, conn.cursor() as curr:
+                    curr.execute('ANALYZE movie_listing;')
+                conn.close()
+            for term in TERMS:
+                uses_index, execution_ms = explain(term)
+                result = measure(get_movies, search=term)
+                print(f"{phase:<10} {term:<16} {str(uses_index):>6} {execution_ms:>9.2f} "
+                      f"{result['rows']:>7} {result['seconds'] * 1000:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+'''Listings from the in-memory catalogue snapshot against Postgres.
+
+Builds a 100k movie catalogue with some NULL scores, budgets and revenues,
+checks that the snapshot returns exactly the rows Postgres does for the
+first and a middle page of every sort, for a country and for a title search,
+then reports: the time of a full load and the memory it holds per 100k
+movies; page latency from Postgres and from the snapshot, and for searches
+from the snapshot before it remembers the search; how long an
+incremental refresh takes after 10, 100 and 1000 movies are written,
+against a full load; and what logging listing changes adds to create_movie.
+Requires numpy.
+
+    python benchmarks/bench_snapshot.py'''
+import itertools
+import statistics
+import time
+
+from stern_movies_api import database, migrations
+from stern_movies_api.database import (create_movie, create_movies, disable_snapshot,
+                                       enable_snapshot, warm_lookups)
+from bench_ingest import synthetic_movies
+from catalogue import build_catalogue, connect, use_catalogue
+
+SIZE = 100_000
+LIMIT = 20
+REPEAT = 50
+CREATES = 300
+COUNTRY, SEARCH = 'US', 'river'
+WRITES = [10, 100, 1000]
+SORTS = list(itertools.product(['movie_id', 'title', 'score', 'budget', 'revenue'],
+                               ['asc', 'desc']))
+
+
+def timed(run, repeat: int = REPEAT) -> float:
+    'Return the median ms of `run`'
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def postgres(query: dict) -> list[dict]:
+    'Return a listing as Postgres answers it'
+    if 'country_id' in query:
+        return database._query_movies_by_country(query['country_id'], query['sort_by'], #pylint: disable=protected-access
+                                                 query['sort_order'], query['limit'],
+                                                 query['after'])
+    return database._query_movies(query.get('search'), query['sort_by'], query['sort_order'], #pylint: disable=protected-access
+                                  query['limit'], query['after'])
+
+
+def snapshot(query: dict) -> list[dict]:
+    'Return a listing as the snapshot answers it'
+    return database._snapshot.get().listing(**query) #pylint: disable=protected-access
+
+
+def uncached(query: dict) -> list[dict]:
+    'Return a listing as the snapshot answers it before its search is remembered'
+    current = database._snapshot.get() #pylint: disable=protected-access
+    current._searches.clear() #pylint: disable=protected-access
+    return current.listing(**query)
+
+
+def queries(country_id: int) -> dict[str, dict]:
+    'Return the first and middle page query of every sort, filtered and not'
+    result = {}
+    for (sort_by, sort_order), (name, extra) in itertools.product(
+            SORTS, [('all', {}), (COUNTRY, {'country_id': country_id}),
+                    (f'"{SEARCH}"', {'search': SEARCH})]):
+        query = {'sort_by': sort_by, 'sort_order': sort_order, 'limit': LIMIT, 'after': None,
+                 **extra}
+        middle = postgres({**query, 'limit': None})
+        middle = middle[len(middle) // 2]
+        value = middle[sort_by]
+        result[f'{name} {sort_by} {sort_order} first'] = query
+        result[f'{name} {sort_by} {sort_order} middle'] = {
+            **query, 'after': (str(value) if sort_by == 'score' and value is not None
+                               else value, middle['movie_id'])}
+    return result
+
+
+def create_p50(movies: list[dict]) -> float:
+    'Return the median ms of create_movie'
+    timings = []
+    for movie in movies:
+        start = time.perf_counter()
+        create_movie(**movie)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def main(): #pylint: disable=too-many-locals
+    'Print snapshot memory, page latency against Postgres and refresh latency'
+    build_catalogue(SIZE, migrate=False)
+    conn = connect()
+    with conn.cursor() as curr:
+        curr.execute('UPDATE movies SET score=NULL WHERE movie_id % 23 = 0;')
+        curr.execute('UPDATE movies SET budget=NULL WHERE movie_id % 17 = 0;')
+        curr.execute('UPDATE movies SET revenue=NULL WHERE movie_id % 19 = 0;')
+    conn.commit()
+    every = migrations.MIGRATIONS
+    movies = synthetic_movies(CREATES * 2 + sum(WRITES))
+    with use_catalogue():
+        warm_lookups()
+        migrations.MIGRATIONS = [m for m in every if m[0] < '0006']
+        migrations.apply_migrations(conn)
+        unlogged_create = create_p50(movies[:CREATES])
+        migrations.MIGRATIONS = every
+        migrations.apply_migrations(conn)
+        logged_create = create_p50(movies[CREATES:CREATES * 2])
+
+        enable_snapshot(refresh_interval=3600)
+        start = time.perf_counter()
+        database._snapshot.get() #pylint: disable=protected-access
+        load_ms = (time.perf_counter() - start) * 1000
+        memory = database._snapshot.get().memory() #pylint: disable=protected-access
+        print(f"full load of {SIZE:,} movies: {load_ms:.0f} ms, "
+              f"{memory['per_100k_movies'] / 2**20:.1f} MiB per 100k movies")
+        for column, size in sorted(memory['columns'].items(), key=lambda item: -item[1]):
+            print(f"  {column:<14} {size / 2**20:>6.2f} MiB")
+
+        pages = queries(database._lookups['countries'].get(COUNTRY)) #pylint: disable=protected-access
+        mismatched = [name for name, query in pages.items()
+                      if snapshot(query) != [dict(row) for row in postgres(query)]]
+        assert not mismatched, f'snapshot differs from Postgres for {mismatched}'
+        print(f"{len(pages)} pages identical from Postgres and the snapshot")
+        print(f"{'page':<34} {'postgres ms':>12} {'snapshot ms':>12} {'uncached ms':>12}")
+        for name, query in pages.items():
+            scan = f"{timed(lambda: uncached(query)):>12.3f}" if 'search' in query else '' #pylint: disable=cell-var-from-loop
+            print(f"{name:<34} {timed(lambda: postgres(query)):>12.3f} " #pylint: disable=cell-var-from-loop
+                  f"{timed(lambda: snapshot(query)):>12.3f} {scan}") #pylint: disable=cell-var-from-loop
+
+        written = CREATES * 2
+        for count in WRITES:
+            create_movies(movies[written:written + count])
+            written += count
+            start = time.perf_counter()
+            database._snapshot.get() #pylint: disable=protected-access
+            print(f"refresh after {count:>5} new movies: "
+                  f"{(time.perf_counter() - start) * 1000:.1f} ms")
+        query = {'sort_by': 'revenue', 'sort_order': 'desc', 'limit': LIMIT, 'after': None}
+        assert snapshot(query) == [dict(row) for row in postgres(query)]
+        disable_snapshot()
+    conn.close()
+    print(f"create_movie p50: {unlogged_create:.2f} ms before the change log, "
+          f"{logged_create:.2f} ms with it")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+'''Catalogue statistics from the catalogue_stats rollup against computing them.
+
+Builds a 100k movie catalogue and checks that the rollup holds the same
+groups as a GROUPING SETS query over movie_listing, before and after a run
+of creates and deletes. Reports the latency of /stats grouped by every
+dimension from the rollup, from that query, and as dashboards computed it
+before: fetching the whole listing and aggregating it client side, with
+the bytes each response takes. Also reports what the rollup trigger adds
+to create_movie and delete_movie.
+
+    python benchmarks/bench_stats.py'''
+import json
+import statistics
+import time
+from collections import defaultdict
+from decimal import Decimal
+
+from stern_movies_api import migrations
+from stern_movies_api.app import app
+from stern_movies_api.database import (STATS_DIMENSIONS, create_movie, delete_movie,
+                                       get_catalogue_stats, get_movies, warm_lookups)
+from bench_ingest import synthetic_movies
+from catalogue import build_catalogue, connect, use_catalogue
+
+SIZE = 100_000
+REPEAT = 20
+WRITES = 300
+
+GROUPING_SETS_QUERY = '''
+SELECT CASE WHEN GROUPING(country_name) = 0 THEN 'country'
+            WHEN GROUPING(language_name) = 0 THEN 'language'
+            WHEN GROUPING(year) = 0 THEN 'year' END AS dimension,
+       coalesce(country_name, language_name, year) AS group_key,
+       count(*), count(score), coalesce(sum(score), 0), coalesce(sum(budget), 0),
+       coalesce(sum(revenue), 0)
+FROM (SELECT *, to_char(release_date, 'YYYY') AS year FROM movie_listing) AS movie
+GROUP BY GROUPING SETS ((country_name), (language_name), (year))
+UNION ALL
+SELECT 'genre', genre, count(*), count(score), coalesce(sum(score), 0),
+       coalesce(sum(budget), 0), coalesce(sum(revenue), 0)
+FROM movie_listing, unnest(genres) AS genre
+GROUP BY genre;'''
+ROLLUP_QUERY = '''
+SELECT dimension, group_key, movie_count, scored_count, score_total, budget_total, revenue_total
+FROM catalogue_stats
+WHERE movie_count > 0;'''
+
+
+def timed(run, repeat: int = REPEAT) -> float:
+    'Return the median ms of `run`'
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def groups(conn, query: str) -> set[tuple]:
+    'Return the (dimension, key, aggregates...) rows of `query`'
+    with conn.cursor() as curr:
+        curr.execute(query)
+        return set(curr.fetchall())
+
+
+def client_side(movies: list[dict]) -> dict:
+    'Aggregate a full listing by every dimension as a dashboard had to'
+    totals = defaultdict(lambda: [0, 0, Decimal(0), 0, 0])
+    for movie in movies:
+        keys = [('country', movie['country_name']), ('language', movie['language_name']),
+                ('year', str(movie['release_date'].year))]
+        keys += [('genre', genre) for genre in movie['genres']]
+        for key in keys:
+            total = totals[key]
+            total[0] += 1
+            if movie['score'] is not None:
+                total[1] += 1
+                total[2] += movie['score']
+            total[3] += movie['budget'] or 0
+            total[4] += movie['revenue'] or 0
+    return totals
+
+
+def write_p50(movies: list[dict]) -> tuple[float, float]:
+    'Return the median ms of create_movie and of deleting what it created'
+    creates, deletes, movie_ids = [], [], []
+    for movie in movies:
+        start = time.perf_counter()
+        movie_ids.append(create_movie(**movie)['movie_id'])
+        creates.append(time.perf_counter() - start)
+    for movie_id in movie_ids:
+        start = time.perf_counter()
+        delete_movie(movie_id)
+        deletes.append(time.perf_counter() - start)
+    return statistics.median(creates) * 1000, statistics.median(deletes) * 1000
+
+
+def main():
+    'Print the rollup check, /stats latency by source and write latency with the rollup'
+    build_catalogue(SIZE, migrate=False)
+    conn = connect()
+    every = migrations.MIGRATIONS
+    movies = synthetic_movies(WRITES * 2)
+    client = app.test_client()
+    query = '/stats?group_by=' + ','.join(STATS_DIMENSIONS)
+    with use_catalogue():
+        warm_lookups()
+        migrations.MIGRATIONS = [m for m in every if m[0] < '0008']
+        migrations.apply_migrations(conn)
+        create_before, delete_before = write_p50(movies[:WRITES])
+        migrations.MIGRATIONS = every
+        migrations.apply_migrations(conn)
+        assert groups(conn, ROLLUP_QUERY) == groups(conn, GROUPING_SETS_QUERY)
+        create_after, delete_after = write_p50(movies[WRITES:])
+        assert groups(conn, ROLLUP_QUERY) == groups(conn, GROUPING_SETS_QUERY)
+        print(f"catalogue_stats identical to GROUPING SETS over movie_listing after "
+              f"{WRITES} creates and deletes")
+
+        stats = get_catalogue_stats(STATS_DIMENSIONS)
+        listing = get_movies()
+        stats_bytes = len(client.get(query).data)
+        listing_bytes = len(json.dumps(listing, default=str))
+        print(f"{'/stats by every dimension':<42} {'ms':>9} {'bytes':>11}")
+        print(f"{'from catalogue_stats':<42} "
+              f"{timed(lambda: get_catalogue_stats(STATS_DIMENSIONS)):>9.2f} {stats_bytes:>11,}")
+        print(f"{'GET /stats from the response cache':<42} "
+              f"{timed(lambda: client.get(query), 200):>9.3f} {stats_bytes:>11,}")
+        print(f"{'GROUPING SETS over movie_listing':<42} "
+              f"{timed(lambda: groups(conn, GROUPING_SETS_QUERY), 5):>9.2f}")
+        print(f"{'full listing aggregated client side':<42} "
+              f"{timed(lambda: client_side(get_movies()), 3):>9.2f} {listing_bytes:>11,}")
+        assert len(client_side(listing)) == sum(len(stats[dimension])
+                                                for dimension in STATS_DIMENSIONS)
+    conn.close()
+    print(f"create_movie p50: {create_before:.2f} ms before, {create_after:.2f} ms with the rollup")
+    print(f"delete_movie p50: {delete_before:.2f} ms before, {delete_after:.2f} ms with the rollup")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+'''Synthetic movie catalogue in a local Postgres for benchmarking.
+
+Benchmarks connect to BENCH_DATABASE_URL (default
+postgresql://localhost/stern_movies_bench) and build their tables inside the
+`bench` schema, so they never touch the tables of a real deployment.
+local_postgres() starts a throwaway server for them instead.'''
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+from os import environ
+
+import psycopg2
+import psycopg2.extras
+
+from stern_movies_api import database
+from stern_movies_api.migrations import apply_migrations
+
+BENCH_SCHEMA = 'bench'
+
+SCHEMA = '''
+DROP SCHEMA IF EXISTS bench CASCADE;
+CREATE SCHEMA bench;
+SET search_path TO bench;
+CREATE TABLE genres (genre_id SERIAL PRIMARY KEY, genre_name TEXT UNIQUE NOT NULL);
+CREATE TABLE statuses (status_id SERIAL PRIMARY KEY, status_name TEXT UNIQUE NOT NULL);
+CREATE TABLE languages (language_id SERIAL PRIMARY KEY, language_name TEXT UNIQUE NOT NULL);
+CREATE TABLE countries (country_id SERIAL PRIMARY KEY, country_name TEXT UNIQUE NOT NULL);
+CREATE TABLE movies (
+    movie_id SERIAL PRIMARY KEY,
+    title TEXT NOT NULL,
+    release_date DATE NOT NULL,
+    score NUMERIC(3, 1),
+    overview TEXT,
+    status_id INT NOT NULL REFERENCES statuses,
+    budget BIGINT,
+    revenue BIGINT,
+    country_id INT NOT NULL REFERENCES countries,
+    language_id INT NOT NULL REFERENCES languages,
+    orig_title TEXT
+);
+CREATE TABLE genre_assignments (
+    movie_id INT NOT NULL REFERENCES movies ON DELETE CASCADE,
+    genre_id INT NOT NULL REFERENCES genres,
+    PRIMARY KEY (movie_id, genre_id)
+);
+CREATE VIEW movie_info AS
+SELECT movies.movie_id, title, release_date, score, overview, status_name, budget, revenue,
+       country_name, language_name, orig_title
+FROM movies
+JOIN statuses ON (movies.status_id=statuses.status_id)
+JOIN countries ON (movies.country_id=countries.country_id)
+JOIN languages ON (movies.language_id=languages.language_id);
+'''
+
+GENRES = ['Action', 'Adventure', 'Animation', 'Comedy', 'Crime', 'Documentary', 'Drama',
+          'Family', 'Fantasy', 'History', 'Horror', 'Music', 'Mystery', 'Romance',
+          'Science Fiction', 'Thriller', 'War', 'Western']
+STATUSES = ['Released', 'Post Production', 'In Production']
+LANGUAGES = ['English', 'French', 'German', 'Spanish', 'Japanese', 'Korean', 'Hindi', 'Italian']
+ADJECTIVES = ['Silent', 'Crimson', 'Last', 'Hidden', 'Broken', 'Golden', 'Dark', 'Lost',
+              'Frozen', 'Savage', 'Eternal', 'Midnight', 'Burning', 'Secret', 'Wild', 'Iron']
+NOUNS = ['Night', 'River', 'Empire', 'Storm', 'Garden', 'Kingdom', 'Horizon', 'Shadow',
+         'Harbor', 'Machine', 'Winter', 'Promise', 'Frontier', 'Legacy', 'Signal', 'Orchard',
+         'Voyage']
+COUNTRIES = ['AU', 'BR', 'CA', 'CN', 'DE', 'ES', 'FR', 'GB', 'IN', 'IT', 'JP', 'KR', 'MX', 'US']
+
+
+def dsn() -> str:
+    'Return the connection string of the benchmark database'
+    return environ.get('BENCH_DATABASE_URL', 'postgresql://localhost/stern_movies_bench')
+
+
+def _postgres_tool(name: str) -> str:
+    path = os.path.join(environ['PG_BIN'], name) if 'PG_BIN' in environ else shutil.which(name)
+    if not path or not os.path.exists(path):
+        raise RuntimeError(f'{name} not found; put it on the PATH or set PG_BIN')
+    return path
+
+
+@contextmanager
+def local_postgres():
+    '''Run a throwaway Postgres server and point BENCH_DATABASE_URL at it.
+
+    initdb and pg_ctl are taken from PG_BIN or the PATH. The cluster lives in
+    a temporary directory, listens on a Unix socket only and is removed on
+    exit. Like Postgres itself, this refuses to run as root.'''
+    initdb, pg_ctl = _postgres_tool('initdb'), _postgres_tool('pg_ctl')
+    previous = environ.get('BENCH_DATABASE_URL')
+    with tempfile.TemporaryDirectory(prefix='stern_movies_pg_') as directory:
+        data = os.path.join(directory, 'data')
+        subprocess.run([initdb, '-D', data, '-U', 'postgres', '--auth=trust', '-E', 'UTF8'],
+                       check=True, capture_output=True)
+        subprocess.run([pg_ctl, '-D', data, '-l', os.path.join(directory, 'postgres.log'), '-w',
+                        '-o', f"-k {directory} -c listen_addresses=''", 'start'],
+                       check=True, capture_output=True)
+        try:
+            conn = psycopg2.connect(dbname='postgres', user='postgres', host=directory)
+            conn.autocommit = True
+            with conn.cursor() as curr:
+                curr.execute('CREATE DATABASE stern_movies_bench;')
+            conn.close()
+            environ['BENCH_DATABASE_URL'] = (
+                f'postgresql://postgres@/stern_movies_bench?host={directory}')
+            yield environ['BENCH_DATABASE_URL']
+        finally:
+            if previous is None:
+                environ.pop('BENCH_DATABASE_URL', None)
+            else:
+                environ['BENCH_DATABASE_URL'] = previous
+            subprocess.run([pg_ctl, '-D', data, '-m', 'fast', '-w', 'stop'],
+                           check=False, capture_output=True)
+
+
+def connect(**kwargs):
+    'Open a connection whose search path points at the benchmark schema'
+    return psycopg2.connect(dsn(), options=f'-c search_path={BENCH_SCHEMA},public', **kwargs)
+
+
+def build_catalogue(size: int, migrate: bool = True) -> None:
+    '''Recreate the benchmark schema holding `size` movies.
+
+    Every movie gets one to three genres and a country, language and status
+    spread evenly across the dimension tables. The API's migrations, which
+    need pg_trgm, are applied on top unless `migrate` is false.'''
+    conn = connect()
+    with conn, conn.cursor() as curr:
+        curr.execute(SCHEMA)
+        for table, column, values in (('genres', 'genre_name', GENRES),
+                                      ('statuses', 'status_name', STATUSES),
+                                      ('languages', 'language_name', LANGUAGES),
+                                      ('countries', 'country_name', COUNTRIES)):
+            psycopg2.extras.execute_values(
+                curr, f'INSERT INTO {table} ({column}) VALUES %s;', [(v,) for v in values])
+        curr.execute('''
+INSERT INTO movies
+(title, release_date, score, overview, status_id, budget, revenue, country_id, language_id,
+ orig_title)
+SELECT (%(adjectives)s::text[])[1 + i %% %(adjective_count)s] || ' '
+           || (%(nouns)s::text[])[1 + i * 7 %% %(noun_count)s] || ' ' || i,
+       DATE '1950-01-01' + (i * 7919 %% 27000)::int, (i * 31 %% 100) / 10.0,
+       'Synthetic overview ' || i, 1 + i %% %(statuses)s, (i * 104729) %% 300000000,
+       (i * 1299709) %% 900000000, 1 + i * 13 %% %(countries)s, 1 + i * 7 %% %(languages)s,
+       'Original title ' || i
+FROM generate_series(1::bigint, %(size)s) AS i;
+''', {'size': size, 'statuses': len(STATUSES), 'countries': len(COUNTRIES),
+      'languages': len(LANGUAGES), 'adjectives': ADJECTIVES, 'nouns': NOUNS,
+      'adjective_count': len(ADJECTIVES), 'noun_count': len(NOUNS)})
+        curr.execute('''
+INSERT INTO genre_assignments (movie_id, genre_id)
+SELECT DISTINCT movie_id, 1 + (movie_id * k * 17) %% %(genres)s
+FROM movies, generate_series(1, 1 + movie_id %% 3) AS k;
+''', {'genres': len(GENRES)})
+        curr.execute('ANALYZE;')
+    if migrate:
+        apply_migrations(conn)
+    conn.close()
+
+
+class CountingCursor(psycopg2.extras.RealDictCursor):
+    'RealDictCursor that counts every statement sent to the server'
+    executed = 0
+
+    def execute(self, query, vars=None): #pylint: disable=redefined-builtin
+        CountingCursor.executed += 1
+        return super().execute(query, vars)
+
+
+class CountingConnection(psycopg2.extensions.connection):
+    'Connection whose dict cursors count round trips'
+
+    def cursor(self, *args, **kwargs):
+        if kwargs.get('cursor_factory') is psycopg2.extras.RealDictCursor:
+            kwargs['cursor_factory'] = CountingCursor
+        return super().cursor(*args, **kwargs)
+
+
+@contextmanager
+def use_catalogue():
+    'Point stern_movies_api.database at the benchmark schema for the duration'
+    original = database._connect #pylint: disable=protected-access
+    database.close_pool()
+    database._connect = lambda: connect(connection_factory=CountingConnection) #pylint: disable=protected-access
+    try:
+        yield
+    finally:
+        database.close_pool()
+        database._connect = original #pylint: disable=protected-access
+
+
+def measure(func, *args, **kwargs) -> dict:
+    'Run `func` once and report its wall time, round trips and result size'
+    CountingCursor.executed = 0
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    return {'seconds': elapsed, 'round_trips': CountingCursor.executed,
+            'rows': len(result) if hasattr(result, '__len__') else None}
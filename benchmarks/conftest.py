@@ -0,0 +1,27 @@
+'''Fixtures for running benchmark scenarios under pytest.
+
+The catalogue fixture builds BENCH_SIZE movies (default 1000) in the database
+at BENCH_DATABASE_URL and skips the tests when no server answers there.'''
+#pylint: skip-file
+from os import environ
+
+import psycopg2
+import pytest
+
+from stern_movies_api import database
+from catalogue import build_catalogue, connect, use_catalogue
+from suite import Context, prepare_app
+
+
+@pytest.fixture(scope='session')
+def catalogue():
+    try:
+        connect(connect_timeout=2).close()
+    except psycopg2.OperationalError as e:
+        pytest.skip(f'no benchmark database: {e}'.splitlines()[0])
+    size = int(environ.get('BENCH_SIZE', 1000))
+    build_catalogue(size)
+    prepare_app()
+    with use_catalogue():
+        database.warm_lookups()
+        yield Context(size)
@@ -0,0 +1,431 @@
+'''Benchmark suite driving every endpoint and database function.
+
+Builds a synthetic catalogue, then runs each scenario below for a number of
+iterations and reports its throughput, p50/p95/p99 latency, queries per
+call, errors and the process's peak RSS. The response cache is disabled so
+every request reaches the database. Results are written to
+benchmarks/results/ as JSON and compared with the previous run of the same
+catalogue size; scenarios that got slower or lost throughput past the
+threshold, send more queries or started failing are flagged.
+
+    python benchmarks/suite.py [--size 10000] [--iterations 200] [--local]
+                               [--baseline results/....json] [--fail-on-regression]
+
+--local runs against a throwaway Postgres started with initdb (see
+catalogue.local_postgres) instead of BENCH_DATABASE_URL.'''
+import argparse
+import glob
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from typing import Any, Callable, NamedTuple
+
+from stern_movies_api import database
+from stern_movies_api.app import app, response_cache
+from stern_movies_api.web import encode_cursor
+from bench_ingest import synthetic_movies
+from catalogue import (COUNTRIES, GENRES, NOUNS, CountingCursor, build_catalogue, connect,
+                       local_postgres, use_catalogue)
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+HEAVY_ITERATIONS = 5
+BATCH_SIZE = 100
+PAGE_SIZE = 20
+SORTS = ('title', 'score', 'budget', 'revenue')
+
+# Relative change past which a scenario is flagged, and the latency below which it is noise
+THRESHOLD = 0.2
+NOISE_MS = 0.5
+
+
+class Scenario(NamedTuple):
+    '''One operation to time. `prepare` runs untimed before every iteration.
+    Heavy scenarios read the whole catalogue and run HEAVY_ITERATIONS times;
+    scenarios that write run after every read, so reads see the catalogue as built.'''
+    name: str
+    run: Callable[['Context'], Any]
+    heavy: bool = False
+    writes: bool = False
+    prepare: Callable[['Context'], None] = None
+
+
+class Context:
+    'State shared by the scenarios of one run'
+
+    def __init__(self, size: int, seed: int = 42):
+        self.size = size
+        self.rng = random.Random(seed)
+        self.client = app.test_client()
+        self.target = None
+        self.target_movie = None
+        self.created = 0
+
+    def movie_id(self) -> int:
+        'Return a random id of the synthetic catalogue'
+        return self.rng.randint(1, self.size)
+
+    def sort(self) -> tuple[str, str]:
+        'Return a random listing sort'
+        return self.rng.choice(SORTS), self.rng.choice(('asc', 'desc'))
+
+    def movies(self, count: int) -> list[dict]:
+        'Return `count` new movies as create_movie arguments'
+        movies = synthetic_movies(count, self.created)
+        self.created += count
+        return movies
+
+    def payload(self, movie: dict) -> dict:
+        'Return a movie as the JSON body POST /movies takes'
+        return {**movie, 'release_date': movie['release_date'].strftime('%m/%d/%Y')}
+
+    def request(self, method: str, path: str, **kwargs) -> bytes:
+        'Send a request, read the whole body and raise on a server error'
+        response = self.client.open(path, method=method, **kwargs)
+        body = response.get_data()
+        if response.status_code >= 500:
+            raise RuntimeError(f'{method} {path} returned {response.status_code}')
+        return body
+
+    def new_movie(self) -> None:
+        'Create a movie for a delete scenario to remove'
+        self.target = database.create_movie(**self.movies(1)[0])['movie_id']
+
+    def new_review(self) -> None:
+        'Create a review for an update or delete scenario to change'
+        self.target_movie = self.movie_id()
+        self.target = database.create_review(self.target_movie, 'To change', 5)['review_id']
+
+
+def endpoint_scenarios() -> list[Scenario]:
+    'Return a scenario for every route of app.py'
+    def page(ctx: Context) -> bytes:
+        sort_by, sort_order = ctx.sort()
+        return ctx.request('GET', f'/movies?limit={PAGE_SIZE}&sort_by={sort_by}'
+                                  f'&sort_order={sort_order}')
+
+    def cursor_page(ctx: Context) -> bytes:
+        cursor = encode_cursor('movie_id', 'asc', {'movie_id': ctx.movie_id()})
+        return ctx.request('GET', f'/movies?limit={PAGE_SIZE}&cursor={cursor}')
+
+    def batch(ctx: Context) -> bytes:
+        return ctx.request('POST', '/movies/batch',
+                           json=[ctx.payload(movie) for movie in ctx.movies(BATCH_SIZE)])
+
+    def ids(ctx: Context) -> bytes:
+        return ctx.request('GET', '/movies?ids=' + ','.join(
+            str(ctx.movie_id()) for _ in range(PAGE_SIZE)))
+
+    return [
+        Scenario('GET /', lambda ctx: ctx.request('GET', '/')),
+        Scenario('GET /status', lambda ctx: ctx.request('GET', '/status')),
+        Scenario('GET /metrics', lambda ctx: ctx.request('GET', '/metrics')),
+        Scenario('GET /movies', lambda ctx: ctx.request('GET', '/movies'), heavy=True),
+        Scenario('GET /movies?limit', page),
+        Scenario('GET /movies?cursor', cursor_page),
+        Scenario('GET /movies?search', lambda ctx: ctx.request(
+            'GET', f'/movies?search={ctx.rng.choice(NOUNS)}&limit={PAGE_SIZE}')),
+        Scenario('GET /movies?search&sort_by=relevance', lambda ctx: ctx.request(
+            'GET', f'/movies?search={ctx.rng.choice(NOUNS)}&sort_by=relevance'
+                   f'&limit={PAGE_SIZE}')),
+        Scenario('GET /movies?stream', lambda ctx: ctx.request('GET', '/movies?stream=1'),
+                 heavy=True),
+        Scenario('GET /movies?ids', ids),
+        Scenario('GET /movies?genre', lambda ctx: ctx.request(
+            'GET', f'/movies?genre={ctx.rng.choice(GENRES)}&genre={ctx.rng.choice(GENRES)}'
+                   f'&genre_match=any&limit={PAGE_SIZE}&sort_by=score')),
+        Scenario('POST /movies', lambda ctx: ctx.request(
+            'POST', '/movies', json=ctx.payload(ctx.movies(1)[0])), writes=True),
+        Scenario('POST /movies/batch', batch, writes=True),
+        Scenario('GET /movies/<id>', lambda ctx: ctx.request(
+            'GET', f'/movies/{ctx.movie_id()}')),
+        Scenario('DELETE /movies/<id>', lambda ctx: ctx.request(
+            'DELETE', f'/movies/{ctx.target}'), writes=True, prepare=Context.new_movie),
+        Scenario('GET /countries', lambda ctx: ctx.request('GET', '/countries')),
+        Scenario('GET /stats', lambda ctx: ctx.request(
+            'GET', '/stats?group_by=country,genre,language,year')),
+        Scenario('GET /countries/<code>?limit', lambda ctx: ctx.request(
+            'GET', f'/countries/{ctx.rng.choice(COUNTRIES)}?limit={PAGE_SIZE}'
+                   '&sort_by=revenue')),
+        Scenario('GET /countries/<code>', lambda ctx: ctx.request(
+            'GET', f'/countries/{ctx.rng.choice(COUNTRIES)}'), heavy=True),
+        Scenario('GET /countries/<code>?stream', lambda ctx: ctx.request(
+            'GET', f'/countries/{ctx.rng.choice(COUNTRIES)}?stream=1'), heavy=True),
+        Scenario('GET /genres/<genre>?limit', lambda ctx: ctx.request(
+            'GET', f'/genres/{ctx.rng.choice(GENRES)}?limit={PAGE_SIZE}')),
+        Scenario('GET /movies/<id>/reviews', lambda ctx: ctx.request(
+            'GET', f'/movies/{ctx.movie_id()}/reviews?limit={PAGE_SIZE}')),
+        Scenario('POST /movies/<id>/reviews', lambda ctx: ctx.request(
+            'POST', f'/movies/{ctx.movie_id()}/reviews',
+            json={'review_text': 'Great', 'score': ctx.rng.randint(1, 10)}), writes=True),
+        Scenario('POST /movies/<id>/reviews/batch', lambda ctx: ctx.request(
+            'POST', f'/movies/{ctx.movie_id()}/reviews/batch',
+            json=[{'review_text': 'Imported', 'score': 5}] * BATCH_SIZE), writes=True),
+        Scenario('PATCH /movies/<id>/reviews/<review_id>', lambda ctx: ctx.request(
+            'PATCH', f'/movies/{ctx.target_movie}/reviews/{ctx.target}', json={'score': 3}),
+            writes=True, prepare=Context.new_review),
+        Scenario('DELETE /movies/<id>/reviews/<review_id>', lambda ctx: ctx.request(
+            'DELETE', f'/movies/{ctx.target_movie}/reviews/{ctx.target}'),
+            writes=True, prepare=Context.new_review),
+    ]
+
+
+def database_scenarios() -> list[Scenario]:
+    'Return a scenario for every function of database.py that queries the database'
+    def lookups(ctx: Context) -> None:
+        database.get_genre_id('Drama')
+        database.get_status_id('Released')
+        database.get_language_id('English')
+        database.get_country_id(ctx.rng.choice(COUNTRIES))
+
+    def reload_lookups(ctx: Context) -> None: #pylint: disable=unused-argument
+        database.invalidate_lookups()
+        database.warm_lookups()
+
+    return [
+        Scenario('get_movies page', lambda ctx: database.get_movies(
+            '', *ctx.sort(), PAGE_SIZE)),
+        Scenario('get_movies search', lambda ctx: database.get_movies(
+            ctx.rng.choice(NOUNS), 'relevance', 'desc', PAGE_SIZE)),
+        Scenario('get_movies', lambda ctx: database.get_movies(), heavy=True),
+        Scenario('stream_movies', lambda ctx: sum(1 for _ in database.stream_movies()),
+                 heavy=True),
+        Scenario('get_movie_by_id', lambda ctx: database.get_movie_by_id(ctx.movie_id())),
+        Scenario('get_movies_by_ids', lambda ctx: database.get_movies_by_ids(
+            [ctx.movie_id() for _ in range(PAGE_SIZE)])),
+        Scenario('get_movie_by_country page', lambda ctx: database.get_movie_by_country(
+            ctx.rng.choice(COUNTRIES), *ctx.sort(), PAGE_SIZE)),
+        Scenario('stream_movie_by_country', lambda ctx: sum(
+            1 for _ in database.stream_movie_by_country(ctx.rng.choice(COUNTRIES))), heavy=True),
+        Scenario('get_country_summaries', lambda ctx: database.get_country_summaries()),
+        Scenario('get_catalogue_stats', lambda ctx: database.get_catalogue_stats(
+            database.STATS_DIMENSIONS)),
+        Scenario('lookups', lookups),
+        Scenario('warm_lookups', reload_lookups),
+        Scenario('create_movie', lambda ctx: database.create_movie(**ctx.movies(1)[0]),
+                 writes=True),
+        Scenario('create_movies', lambda ctx: database.create_movies(ctx.movies(BATCH_SIZE)),
+                 writes=True),
+        Scenario('delete_movie', lambda ctx: database.delete_movie(ctx.target), writes=True,
+                 prepare=Context.new_movie),
+        Scenario('get_movies_by_genre page', lambda ctx: database.get_movies_by_genre(
+            ctx.rng.choice(GENRES), limit=PAGE_SIZE)),
+        Scenario('get_movies_by_genre sorted page', lambda ctx: database.get_movies_by_genre(
+            ctx.rng.sample(GENRES, 2), False, *ctx.sort(), PAGE_SIZE)),
+        Scenario('get_genre_facets', lambda ctx: database.get_genre_facets(
+            ctx.rng.sample(GENRES, 2))),
+        Scenario('migrate', lambda ctx: database.migrate()),
+        Scenario('create_review', lambda ctx: database.create_review(
+            ctx.movie_id(), 'Great', ctx.rng.randint(1, 10)), writes=True),
+        Scenario('create_reviews', lambda ctx: database.create_reviews(
+            [{'movie_id': ctx.movie_id(), 'review_text': 'Imported', 'score': 5}
+             for _ in range(BATCH_SIZE)]), writes=True),
+        Scenario('read_reviews', lambda ctx: database.read_reviews(ctx.movie_id(), PAGE_SIZE)),
+        Scenario('get_review_stats', lambda ctx: database.get_review_stats(ctx.movie_id())),
+        Scenario('count_reviews', lambda ctx: database.count_reviews(ctx.movie_id())),
+        Scenario('update_review', lambda ctx: database.update_review(ctx.target, score=3),
+                 writes=True, prepare=Context.new_review),
+        Scenario('delete_review', lambda ctx: database.delete_review(ctx.target), writes=True,
+                 prepare=Context.new_review),
+    ]
+
+
+def percentile(quantiles: list[float], p: int) -> float:
+    'Return the p-th percentile in ms from statistics.quantiles(n=100) output'
+    return quantiles[p - 1] * 1000
+
+
+def peak_rss_mb() -> float:
+    'Return the peak resident set size of this process so far'
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def scenarios() -> dict[str, tuple[str, Scenario]]:
+    'Return every scenario by name with its kind, reads before writes'
+    every = [('endpoint', scenario) for scenario in endpoint_scenarios()]
+    every += [('database', scenario) for scenario in database_scenarios()]
+    every.sort(key=lambda item: item[1].writes)
+    return {scenario.name: (kind, scenario) for kind, scenario in every}
+
+
+def prepare_app() -> None:
+    'Let exceptions reach the suite and send every request to the database'
+    app.testing = True
+    response_cache.ttl = 0
+
+
+def run_scenario(ctx: Context, scenario: Scenario, iterations: int) -> dict:
+    'Run a scenario once untimed, then `iterations` times, and summarise it'
+    latencies, queries, errors, error = [], 0, 0, None
+    for iteration in range(iterations + 1):
+        if scenario.prepare:
+            scenario.prepare(ctx)
+        CountingCursor.executed = 0
+        start = time.perf_counter()
+        try:
+            scenario.run(ctx)
+        except Exception as e: #pylint: disable=broad-exception-caught
+            errors += iteration > 0
+            error = error or f'{type(e).__name__}: {e}'.splitlines()[0]
+        elapsed = time.perf_counter() - start
+        if iteration:
+            latencies.append(elapsed)
+            queries += CountingCursor.executed
+    # quantiles needs two samples
+    quantiles = statistics.quantiles(latencies * (2 if len(latencies) == 1 else 1), n=100,
+                                     method='inclusive')
+    return {
+        'iterations': iterations,
+        'throughput': iterations / sum(latencies),
+        'p50_ms': percentile(quantiles, 50),
+        'p95_ms': percentile(quantiles, 95),
+        'p99_ms': percentile(quantiles, 99),
+        'queries': queries / iterations,
+        'errors': errors,
+        'error': error,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def git_commit() -> str | None:
+    'Return the commit being benchmarked, if this is a git checkout'
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True, cwd=os.path.dirname(__file__)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def server_version() -> str:
+    'Return the version of the benchmarked Postgres server'
+    conn = connect()
+    with conn.cursor() as curr:
+        curr.execute('SHOW server_version;')
+        version = curr.fetchone()[0]
+    conn.close()
+    return version
+
+
+def run_suite(size: int, iterations: int, only: str = None) -> dict:
+    'Build a catalogue of `size` movies, run every scenario and return the results'
+    build_catalogue(size)
+    prepare_app()
+    results = {
+        'meta': {
+            'size': size,
+            'iterations': iterations,
+            'heavy_iterations': HEAVY_ITERATIONS,
+            'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'postgres': server_version(),
+            'cpus': os.cpu_count(),
+        },
+        'scenarios': {},
+    }
+    ctx = Context(size)
+    with use_catalogue():
+        database.warm_lookups()
+        for name, (kind, scenario) in scenarios().items():
+            if only and only not in name:
+                continue
+            result = run_scenario(ctx, scenario, HEAVY_ITERATIONS if scenario.heavy else iterations)
+            results['scenarios'][name] = {'kind': kind, **result}
+            print_result(name, result)
+    return results
+
+
+def print_result(name: str, result: dict) -> None:
+    'Print one scenario as a table row'
+    print(f"{name:<38} {result['throughput']:>9.1f} {result['p50_ms']:>8.2f} "
+          f"{result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f} {result['queries']:>7.2f} "
+          f"{result['peak_rss_mb']:>7.0f}"
+          + (f"  {result['errors']} errors: {result['error']}" if result['errors'] else ''))
+
+
+def compare(baseline: dict, current: dict, threshold: float = THRESHOLD) -> list[str]:
+    '''Return a description of every regression of `current` against `baseline`.
+
+    A scenario regresses when its p95 grows or its throughput falls by more
+    than `threshold`, ignoring changes under NOISE_MS, when it sends more
+    queries per call, or when it starts failing.'''
+    regressions = []
+    for name, now in current['scenarios'].items():
+        before = baseline['scenarios'].get(name)
+        if before is None:
+            continue
+        if (now['p95_ms'] > before['p95_ms'] * (1 + threshold)
+                and now['p95_ms'] - before['p95_ms'] > NOISE_MS):
+            regressions.append(f"{name}: p95 {before['p95_ms']:.2f} -> {now['p95_ms']:.2f} ms")
+        if (now['throughput'] < before['throughput'] * (1 - threshold)
+                and 1000 / now['throughput'] - 1000 / before['throughput'] > NOISE_MS):
+            regressions.append(f"{name}: throughput {before['throughput']:.1f} -> "
+                               f"{now['throughput']:.1f}/s")
+        if now['queries'] > before['queries'] + 0.01:
+            regressions.append(f"{name}: queries {before['queries']:.2f} -> "
+                               f"{now['queries']:.2f} per call")
+        if now['errors'] and not before['errors']:
+            regressions.append(f"{name}: now fails with {now['error']}")
+    return regressions
+
+
+def latest_result(size: int) -> str | None:
+    'Return the path of the most recent stored result for a catalogue of `size` movies'
+    for path in sorted(glob.glob(os.path.join(RESULTS_DIR, '*.json')), reverse=True):
+        with open(path, encoding='utf-8') as file:
+            if json.load(file)['meta']['size'] == size:
+                return path
+    return None
+
+
+def save(results: dict) -> str:
+    'Write results to RESULTS_DIR and return the path'
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    meta = results['meta']
+    stamp = meta['started_at'].replace(':', '').replace('-', '').replace('+0000', 'Z')
+    path = os.path.join(RESULTS_DIR, f"{stamp}-{meta['commit'] or 'local'}-{meta['size']}.json")
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(results, file, indent=2)
+    return path
+
+
+def main():
+    'Run the suite, store its results and flag regressions against a baseline'
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--size', type=int, default=10_000, help='movies in the catalogue')
+    parser.add_argument('--iterations', type=int, default=200, help='timed calls per scenario')
+    parser.add_argument('--only', help='run the scenarios whose name contains this')
+    parser.add_argument('--local', action='store_true', help='start a throwaway Postgres')
+    parser.add_argument('--baseline', help='result file to compare with (default: latest)')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD)
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+
+    baseline_path = args.baseline or latest_result(args.size)
+    print(f"{'scenario':<38} {'ops/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'queries':>7} {'rss MB':>7}")
+    with local_postgres() if args.local else nullcontext():
+        results = run_suite(args.size, args.iterations, args.only)
+    print(f'results: {save(results)}')
+    if baseline_path is None:
+        print('no baseline to compare with')
+        return
+    with open(baseline_path, encoding='utf-8') as file:
+        regressions = compare(json.load(file), results, args.threshold)
+    print(f'compared with {baseline_path}: {len(regressions)} regression(s)')
+    for regression in regressions:
+        print(f'  REGRESSION {regression}')
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
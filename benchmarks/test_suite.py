@@ -0,0 +1,73 @@
+#pylint: skip-file
+import pytest
+
+from stern_movies_api import database
+from suite import compare, run_scenario, scenarios
+
+# Queries each call may send; a regression here is an extra round trip per request
+QUERY_BUDGETS = {
+    'GET /movies?limit': 1,
+    'GET /movies?cursor': 1,
+    'GET /movies?search': 1,
+    'GET /movies?ids': 1,
+    'GET /movies/<id>': 1,
+    'GET /countries': 1,
+    'GET /stats': 1,
+    'GET /countries/<code>?limit': 1,
+    'GET /genres/<genre>?limit': 1,
+    'POST /movies': 1,
+    'get_movies page': 1,
+    'get_movie_by_id': 1,
+    'get_movies_by_ids': 1,
+    'get_movie_by_country page': 1,
+    'get_country_summaries': 1,
+    'get_catalogue_stats': 1,
+    'get_movies_by_genre page': 1,
+    'get_movies_by_genre sorted page': 1,
+    'get_genre_facets': 0,
+    'lookups': 0,
+    'create_movie': 1,
+    'create_movies': 2,
+    'GET /movies/<id>/reviews': 2,
+    'create_review': 1,
+    'read_reviews': 1,
+    'get_review_stats': 1,
+    'count_reviews': 1,
+}
+
+
+@pytest.mark.parametrize('name', QUERY_BUDGETS)
+def test_query_budget(catalogue, name):
+    kind, scenario = scenarios()[name]
+    result = run_scenario(catalogue, scenario, 5)
+    assert result['errors'] == 0, result['error']
+    assert result['queries'] <= QUERY_BUDGETS[name]
+
+
+def test_delete_movie_against_the_database(catalogue):
+    movie_id = database.create_movie(**catalogue.movies(1)[0])['movie_id']
+    assert database.delete_movie(movie_id) is True
+    assert database.delete_movie(movie_id) is False
+    with pytest.raises(ValueError):
+        database.get_movie_by_id(movie_id)
+
+
+def result(p95_ms=10.0, throughput=100.0, queries=1.0, errors=0):
+    return {'scenarios': {'get_movie_by_id': {
+        'p95_ms': p95_ms, 'throughput': throughput, 'queries': queries, 'errors': errors,
+        'error': 'ValueError: boom' if errors else None}}}
+
+
+def test_compare_accepts_noise():
+    assert compare(result(), result(p95_ms=11.0, throughput=90.0)) == []
+    assert compare(result(p95_ms=0.1), result(p95_ms=0.5)) == []
+
+
+def test_compare_flags_regressions():
+    regressions = compare(result(), result(p95_ms=20.0, throughput=50.0, queries=2.0, errors=1))
+    assert len(regressions) == 4
+    assert all(line.startswith('get_movie_by_id: ') for line in regressions)
+
+
+def test_compare_ignores_new_scenarios():
+    assert compare({'scenarios': {}}, result()) == []
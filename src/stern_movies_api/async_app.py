@@ -0,0 +1,409 @@
+'''ASGI variant of the server, serving the same routes and JSON as app.py.
+
+Run it with an ASGI server, e.g.
+
+    uvicorn stern_movies_api.async_app:app --port 5000'''
+from typing import AsyncIterable, Awaitable, Callable
+from quart import Quart, Response, g, request
+from werkzeug.sansio.http import is_resource_modified
+from stern_movies_api.async_database import (get_movies, get_movie_by_id, get_movies_by_ids,
+                                             create_movie,
+                                             delete_movie, create_movies, get_movie_by_country,
+                                             get_country_summaries, get_movies_by_genre,
+                                             get_genre_facets, create_review,
+                                             create_reviews, read_reviews, get_review_stats,
+                                             update_review, delete_review,
+                                             pool_stats, stream_movies, stream_movie_by_country,
+                                             get_country_id,
+                                             lookup_stats, warm_lookups, get_pool, close_pool,
+                                             snapshot_stats, genre_index_stats,
+                                             replica_stats, coalescing_stats,
+                                             get_catalogue_stats)
+from stern_movies_api.cache import build_response_cache
+from stern_movies_api.json_provider import FastJSONProvider
+from stern_movies_api.logs import configure_logging
+from stern_movies_api.metrics import CONTENT_TYPE, render_metrics
+from stern_movies_api.replicas import read_lsn, reading_after, write_lsn
+from stern_movies_api.web import (NDJSON, STREAM_CHUNK_ROWS, LISTINGS_TAG, COUNTRIES_TAG,
+                                  parse_listing_args, parse_movies_args, parse_movie_ids,
+                                  batch_response,
+                                  parse_movie_payload, parse_ndjson, parse_batch, batch_summary,
+                                  parse_review_payload, parse_review_page_args, parse_stats_args,
+                                  review_page_response, wants_stream, ndjson_chunk,
+                                  page_response, parse_genre_match, genre_response,
+                                  cache_validators, with_validators, movie_tag, country_tag,
+                                  reviews_tag, created_movie_tags, pool_gauges, begin_request,
+                                  end_request)
+
+
+app = Quart(__name__)
+app.json = FastJSONProvider(app)
+
+response_cache = build_response_cache()
+
+
+@app.before_serving
+async def open_pool():
+    'Open the connection pool and load the lookup tables before the first request'
+    configure_logging()
+    await get_pool()
+    await warm_lookups()
+
+
+@app.after_serving
+async def shut_pool():
+    'Close the connection pool on shutdown'
+    await close_pool()
+
+
+def ndjson_response(movies: AsyncIterable[dict]) -> Response:
+    '''Stream movies as newline delimited JSON, a chunk of rows at a time'''
+    async def generate():
+        chunk = []
+        async for movie in movies:
+            chunk.append(movie)
+            if len(chunk) >= STREAM_CHUNK_ROWS:
+                yield ndjson_chunk(app.json.dumps, chunk)
+                chunk = []
+        if chunk:
+            yield ndjson_chunk(app.json.dumps, chunk)
+    return Response(generate(), mimetype=NDJSON)
+
+
+async def cached_response(kind: str, params: dict, tags: list[str],
+                          build: Callable[[], Awaitable]) -> Response:
+    '''Serve a JSON response from the cache, or build and cache it, as app.cached_response does'''
+    versions, etag, last_modified = cache_validators(response_cache, kind, params, tags)
+    fresh = read_lsn() is not None
+    if not fresh and not is_resource_modified(
+            http_range=request.headers.get("Range"),
+            http_if_range=request.headers.get("If-Range"),
+            http_if_modified_since=request.headers.get("If-Modified-Since"),
+            http_if_none_match=request.headers.get("If-None-Match"),
+            etag=etag, last_modified=last_modified):
+        response_cache.not_modified += 1
+        return with_validators(Response("", status=304), etag, last_modified)
+
+    entry = None if fresh else response_cache.get(kind, params, versions)
+    if entry is None:
+        with reading_after(response_cache.written_lsn(tags)):
+            response = await app.make_response(await build())
+        if response.status_code != 200 or not response.is_json:
+            return response
+        entry = response_cache.set(kind, params, versions,
+                                   await response.get_data(as_text=True))
+    else:
+        response = Response(entry["body"], status=200, mimetype="application/json")
+    return with_validators(response, entry["etag"], last_modified)
+
+
+@app.before_request
+async def start_request_timer():
+    'Starts timing the request and counting the database work it does'
+    g.request_start = begin_request(request.headers, request.cookies)
+
+
+@app.after_request
+async def record_request(response: Response) -> Response:
+    'Records the latency of the request by route'
+    end_request(response, request.url_rule, request.method, g.request_start)
+    return response
+
+
+async def genre_listing(genres: list[str], params: dict, unknown_status: int) -> Response:
+    '''Serve the movies with the given genres, answering an unknown genre with
+    `unknown_status`'''
+    match_all, error = parse_genre_match(request.args, request.accept_mimetypes)
+    if error:
+        return {"error": error}, 400
+
+    async def build():
+        try:
+            counts = await get_genre_facets(genres, match_all)
+        except ValueError as e:
+            return {"error": str(e)}, unknown_status
+        limit = params["limit"] + 1 if params["limit"] is not None else None
+        movies = await get_movies_by_genre(genres, match_all, params["sort_by"],
+                                           params["sort_order"], limit, params["after"])
+        return genre_response(movies, counts, params), 200
+
+    return await cached_response("genres", {"genres": genres, "match_all": match_all, **params},
+                                 [LISTINGS_TAG], build)
+
+
+async def movies_by_ids(ids: str) -> Response:
+    '''Serve the movies with the given comma separated ids along with the ids not found'''
+    movie_ids, error = parse_movie_ids(ids)
+    if error:
+        return {"error": error}, 400
+
+    async def build():
+        return batch_response(movie_ids, await get_movies_by_ids(movie_ids)), 200
+
+    return await cached_response("movies_by_ids", {"ids": movie_ids},
+             [movie_tag(movie_id) for movie_id in movie_ids], build)
+
+
+@app.route("/", methods=["GET"])
+async def endpoint_index():
+    'Handles the index endpoint'
+    return {"message": "Welcome to the Movie API"}, 200
+
+
+@app.route("/status", methods=["GET"])
+async def endpoint_status():
+    'Reports connection pool gauges and cache counters for monitoring'
+    return {"pool": await pool_stats(), "lookups": lookup_stats(),
+            "response_cache": response_cache.stats(), "snapshot": snapshot_stats(),
+            "genre_index": genre_index_stats(), "replicas": replica_stats(),
+            "coalescing": coalescing_stats()}, 200
+
+
+@app.route("/metrics", methods=["GET"])
+async def endpoint_metrics():
+    'Exposes request metrics in the Prometheus text format'
+    return Response(render_metrics(pool_gauges(await pool_stats())), content_type=CONTENT_TYPE)
+
+
+@app.route("/movies", methods=["GET", "POST"])
+async def endpoint_get_movies(): #pylint: disable=too-many-return-statements
+    'Handles the movies endpoint'
+
+    if request.method == "GET":
+        if "ids" in request.args:
+            return await movies_by_ids(request.args["ids"])
+
+        search, genres, params, error = parse_movies_args(request.args)
+        if error:
+            return {"error": error}, 400
+        if genres:
+            return await genre_listing(genres, params, 400)
+
+        if wants_stream(request.args, request.accept_mimetypes):
+            if params["limit"] is not None:
+                return {"error": "stream cannot be combined with limit or cursor"}, 400
+            return ndjson_response(stream_movies(search, params["sort_by"], params["sort_order"]))
+
+        async def build():
+            if params["limit"] is not None:
+                movies = await get_movies(search, params["sort_by"], params["sort_order"],
+                                          params["limit"] + 1, params["after"])
+                return page_response(movies, params), 200
+
+            movies = await get_movies(search, params["sort_by"], params["sort_order"])
+
+            if not movies:
+                return {"error": "No movies found"}, 404
+
+            return movies, 200
+
+        return await cached_response("movies", {"search": search or None, **params},
+                                     [LISTINGS_TAG], build)
+
+    movie, error = parse_movie_payload(await request.get_json(silent=True))
+    if error:
+        return {"error": error}, 400
+
+    try:
+        created = await create_movie(**movie)
+        response_cache.invalidate([LISTINGS_TAG, country_tag(movie["country"]),
+                                   movie_tag(created["movie_id"])], write_lsn())
+        return {'success': True, "movie": created}, 201
+    except (TypeError, ValueError) as e:
+        return {"error": str(e)}, 500
+
+
+@app.route("/movies/batch", methods=["POST"])
+async def endpoint_create_movies_batch():
+    '''Creates many movies from a JSON array or an NDJSON body (one movie per line).
+    Every movie gets a result with either its new movie_id or the reason it was rejected.'''
+    if request.mimetype == NDJSON:
+        payloads = parse_ndjson(await request.get_data(as_text=True))
+    else:
+        payloads = await request.get_json(silent=True)
+    results, movies, error = parse_batch(payloads, parse_movie_payload, "movies")
+    if error:
+        return {"error": error}, 400
+
+    created = await create_movies([movie for _, movie in movies]) if movies else []
+    tags = created_movie_tags(movies, created)
+    if tags:
+        response_cache.invalidate(tags, write_lsn())
+    return batch_summary(results, movies, created), 200
+
+
+@app.route("/movies/<int:movie_id>", methods=["GET", "DELETE"])
+async def endpoint_get_movie(movie_id: int):
+    'Handles the movies/id endpoint'
+    if request.method == "GET":
+
+        async def build():
+            try:
+                return await get_movie_by_id(movie_id), 200
+            except ValueError:
+                return {"error": "Movie not found"}, 404
+
+        return await cached_response("movie", {"movie_id": movie_id}, [movie_tag(movie_id)],
+                                     build)
+
+    success = await delete_movie(movie_id)
+
+    if not success:
+        return {"error": "Movie could not be deleted"}, 404
+
+    response_cache.invalidate([movie_tag(movie_id), LISTINGS_TAG, COUNTRIES_TAG], write_lsn())
+
+    return {"message": "Movie deleted"}, 200
+
+
+@app.route("/movies/<int:movie_id>/reviews", methods=["GET", "POST"])
+async def endpoint_reviews(movie_id: int):
+    """Lists a movie's reviews a page at a time along with its review count and average score,
+    or adds a review to it."""
+    if request.method == "GET":
+        params, error = parse_review_page_args(request.args)
+        if error:
+            return {"error": error}, 400
+
+        async def build():
+            stats = await get_review_stats(movie_id)
+            if stats is None:
+                return {"error": "Movie not found"}, 404
+            reviews = await read_reviews(movie_id, params["limit"] + 1, params["after"])
+            return review_page_response(movie_id, stats, reviews, params["limit"]), 200
+
+        return await cached_response("reviews", {"movie_id": movie_id, **params},
+                                     [movie_tag(movie_id), reviews_tag(movie_id)], build)
+
+    review, error = parse_review_payload(await request.get_json(silent=True))
+    if error:
+        return {"error": error}, 400
+
+    try:
+        created = await create_review(movie_id, **review)
+    except ValueError as e:
+        return {"error": str(e)}, 404
+    response_cache.invalidate([reviews_tag(movie_id)], write_lsn())
+    return {"success": True, "review": created}, 201
+
+
+@app.route("/movies/<int:movie_id>/reviews/batch", methods=["POST"])
+async def endpoint_create_reviews_batch(movie_id: int):
+    '''Imports many reviews of a movie from a JSON array or an NDJSON body (one review per line).
+    Every review gets a result with either its new review_id or the reason it was rejected.'''
+    if request.mimetype == NDJSON:
+        payloads = parse_ndjson(await request.get_data(as_text=True))
+    else:
+        payloads = await request.get_json(silent=True)
+    results, reviews, error = parse_batch(payloads, parse_review_payload, "reviews")
+    if error:
+        return {"error": error}, 400
+
+    rows = [{"movie_id": movie_id, **review} for _, review in reviews]
+    created = await create_reviews(rows) if rows else []
+    summary = batch_summary(results, reviews, created)
+    if summary["created"]:
+        response_cache.invalidate([reviews_tag(movie_id)], write_lsn())
+    return summary, 200
+
+
+@app.route("/movies/<int:movie_id>/reviews/<int:review_id>", methods=["PATCH", "DELETE"])
+async def endpoint_review(movie_id: int, review_id: int):
+    '''Changes the text and/or score of a review, or deletes it'''
+    if request.method == "PATCH":
+        review, error = parse_review_payload(await request.get_json(silent=True), partial=True)
+        if error:
+            return {"error": error}, 400
+
+        updated = await update_review(review_id, movie_id=movie_id, **review)
+        if updated is None:
+            return {"error": "Review not found"}, 404
+        response_cache.invalidate([reviews_tag(movie_id)], write_lsn())
+        return {"success": True, "review": updated}, 200
+
+    if not await delete_review(review_id, movie_id):
+        return {"error": "Review not found"}, 404
+    response_cache.invalidate([reviews_tag(movie_id)], write_lsn())
+    return {"message": "Review deleted"}, 200
+
+
+@app.route("/countries", methods=["GET"])
+async def endpoint_get_countries():
+    """Get the number of movies, average score and total budget and revenue of each country,
+    read from a rollup that is kept up to date as movies are written."""
+
+    async def build():
+        return await get_country_summaries()
+
+    # Every movie write invalidates the listings, and with them the summary
+    return await cached_response("countries", {}, [LISTINGS_TAG, COUNTRIES_TAG], build)
+
+
+@app.route("/stats", methods=["GET"])
+async def endpoint_get_stats():
+    """Get the number of movies, average score and total and average budget and revenue of
+    the catalogue and of each group of the dimensions asked for with group_by, read from a
+    rollup that is kept up to date as movies are written."""
+    params, error = parse_stats_args(request.args)
+    if error:
+        return {"error": error}, 400
+
+    async def build():
+        return await get_catalogue_stats(params["group_by"], params["aggregates"])
+
+    return await cached_response("stats", params, [LISTINGS_TAG], build)
+
+
+@app.route("/countries/<string:country_code>", methods=["GET"])
+async def endpoint_get_movies_by_country(country_code: str):
+    """Get a list of movie details by country.
+    Optionally, the results can be sorted by a specific field in ascending or descending order,
+    and paginated with limit and cursor."""
+
+    params, error = parse_listing_args(request.args)
+    if error:
+        return {"error": error}, 400
+
+    if wants_stream(request.args, request.accept_mimetypes):
+        if params["limit"] is not None:
+            return {"error": "stream cannot be combined with limit or cursor"}, 400
+        try:
+            await get_country_id(country_code)
+        except ValueError:
+            return {"error": "No movies found for this country"}, 404
+        return ndjson_response(
+            stream_movie_by_country(country_code, params["sort_by"], params["sort_order"]))
+
+    async def build():
+        if params["limit"] is not None:
+            movies = await get_movie_by_country(country_code, params["sort_by"],
+                                                params["sort_order"], params["limit"] + 1,
+                                                params["after"])
+            return page_response(movies, params), 200
+
+        movies = await get_movie_by_country(country_code, params["sort_by"], params["sort_order"])
+
+        if not movies:
+            return {"error": "No movies found for this country"}, 404
+
+        return movies
+
+    return await cached_response("country", {"country_code": country_code, **params},
+                                 [COUNTRIES_TAG, country_tag(country_code)], build)
+
+
+@app.route("/genres/<string:genre>", methods=["GET"])
+async def endpoint_get_movies_by_genre(genre: str):
+    """Get the movies of a genre with how many there are and how many of them have each
+    other genre, counted from in-process genre bitmaps. Sorting and pagination work as for
+    /countries/<country_code>."""
+
+    params, error = parse_listing_args(request.args)
+    if error:
+        return {"error": error}, 400
+
+    return await genre_listing([genre], params, 404)
+
+
+if __name__ == "__main__":
+    app.run(host="0.0.0.0", port=5000)
@@ -0,0 +1,874 @@
+'''Async counterparts of the database functions, for the ASGI app.
+
+Queries are shared with `database` and run on psycopg 3 connections from an
+AsyncConnectionPool, so one process can keep many queries in flight while
+waiting on the database instead of blocking a thread per request. The hot
+reads are executed with `prepare=True`, which has psycopg prepare them once
+per connection and reuse them by name, like database's StatementRegistry.'''
+import logging
+import uuid
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import date
+from functools import partial, wraps
+from os import environ
+from typing import Any, AsyncIterator
+
+import psycopg
+from psycopg import errors
+from psycopg.conninfo import make_conninfo
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool, PoolTimeout
+from psycopg2 import sql
+
+from stern_movies_api.database import (CATALOGUE_STATS_QUERY, COUNTRY_SUMMARY_QUERY,
+                                       GENRE_INDEX_QUERY, MOVIE_QUERY, MOVIES_QUERY,
+                                       PRUNE_CHANGES_QUERY, REPLAY_LSN_QUERY, REVIEW_COLUMNS,
+                                       REVIEW_STATS_QUERY, REVIEWS_QUERY, SNAPSHOT_CHANGES_QUERY,
+                                       SNAPSHOT_COLLATION_QUERY, SNAPSHOT_QUERY,
+                                       SNAPSHOT_XMIN_QUERY, STATS_AGGREGATES, STREAM_BATCH_SIZE,
+                                       WRITE_LSN_QUERY, _c_collation, _catalogue_stats,
+                                       _genre_condition, _in_requested_order, _listing_query,
+                                       _search_conditions, _validate_genres, _validate_movie,
+                                       _validate_movie_ids, _validate_review, _validate_review_id,
+                                       _validate_score, _validate_sort, _validate_stats,
+                                       replica_name)
+from stern_movies_api.genre_index import AsyncGenreIndex, GenreBitmaps
+from stern_movies_api.lookups import AsyncLookupTable
+from stern_movies_api.replicas import ReplicaRouter, parse_lsn, read_lsn, written
+from stern_movies_api.singleflight import AsyncSingleFlight
+from stern_movies_api.snapshot import COLLATION_PROBES, AsyncCatalogueSnapshot, to_columns
+from stern_movies_api.statements import render
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_current = ContextVar('stern_movies_async_connection', default=None)
+_router = None
+_flights = None
+
+
+def _conninfo() -> str:
+    return make_conninfo(
+        user = environ["DATABASE_USERNAME"],
+        password = environ["DATABASE_PASSWORD"],
+        host = environ["DATABASE_IP"],
+        port = environ["DATABASE_PORT"],
+        dbname = environ["DATABASE_NAME"]
+    )
+
+
+def _new_pool(conninfo: str) -> AsyncConnectionPool:
+    return AsyncConnectionPool(
+        conninfo,
+        open = False,
+        min_size = int(environ.get("DATABASE_POOL_MIN", 1)),
+        max_size = int(environ.get("DATABASE_POOL_MAX", 10)),
+        timeout = float(environ.get("DATABASE_POOL_TIMEOUT", 30)),
+        max_lifetime = float(environ.get("DATABASE_POOL_MAX_AGE", 1800)),
+        max_idle = float(environ.get("DATABASE_POOL_MAX_IDLE", 60))
+    )
+
+
+async def get_pool() -> AsyncConnectionPool:
+    '''Return the process-wide async pool, opening it on first use.
+
+    It is sized by the same DATABASE_POOL_* variables as the sync pool; as
+    queries no longer tie up a thread each, DATABASE_POOL_MAX is what bounds
+    the number of queries in flight.'''
+    global _pool #pylint: disable=global-statement
+    if _pool is None:
+        _pool = _new_pool(_conninfo())
+    if _pool.closed:
+        await _pool.open()
+    return _pool
+
+
+async def close_pool() -> None:
+    '''Close the process-wide pool and those of the replicas; the next query opens
+    fresh ones'''
+    global _pool #pylint: disable=global-statement
+    pool, _pool = _pool, None
+    if pool is not None:
+        await pool.close()
+    if _router is not None:
+        for replica_pool in _router.detach_pools():
+            await replica_pool.close()
+
+
+def configure_replicas(dsns: list[str], eject_for: float = 30.0) -> None:
+    '''Serve reads from the read replicas at `dsns`, as database.configure_replicas.
+
+    A replica whose pool cannot hand out a connection within
+    DATABASE_POOL_TIMEOUT is ejected too, as psycopg's pool keeps retrying
+    a connection that fails rather than reporting the error.'''
+    global _router #pylint: disable=global-statement
+    _router = ReplicaRouter({replica_name(dsn): dsn for dsn in dsns}, _new_pool,
+                            eject_for) if dsns else None
+
+
+def replica_stats() -> dict[str, Any] | None:
+    '''Return the replicas' health and read counters, or None without replicas'''
+    return _router.stats() if _router is not None else None
+
+
+def configure_coalescing(timeout: float | None = 30.0) -> None:
+    '''Share each read among the identical reads other tasks start while it runs, as
+    database.configure_coalescing'''
+    global _flights #pylint: disable=global-statement
+    _flights = AsyncSingleFlight(timeout) if timeout is not None else None
+
+
+def coalescing_stats() -> dict[str, Any] | None:
+    '''Return how many reads were shared with an identical read in flight, or None when
+    reads are not coalesced'''
+    return _flights.stats() if _flights is not None else None
+
+
+async def pool_stats() -> dict[str, Any]:
+    '''Return the same gauges and counters as database.pool_stats'''
+    pool = await get_pool()
+    stats = pool.get_stats()
+    size, idle = stats.get('pool_size', 0), stats.get('pool_available', 0)
+    checkouts = stats.get('requests_num', 0)
+    wait_time_total = stats.get('requests_wait_ms', 0) / 1000
+    return {
+        'size': size,
+        'in_use': size - idle,
+        'idle': idle,
+        'waiting': stats.get('requests_waiting', 0),
+        'min_size': pool.min_size,
+        'max_size': pool.max_size,
+        'wait_time_avg': wait_time_total / checkouts if checkouts else 0.0,
+        'checkouts': checkouts,
+        'timeouts': stats.get('requests_errors', 0),
+        'recycled': stats.get('connections_lost', 0),
+        'wait_time_total': wait_time_total,
+    }
+
+
+def __connection(func):
+    '''Supply `conn` and `curr` from the async pool.
+
+    Nested calls made from the same task while a connection is checked out
+    reuse it, so they share the caller's transaction.'''
+    @wraps(func)
+    async def inner(*args, **kwargs):
+        conn = _current.get()
+        if conn is not None:
+            async with conn.cursor(row_factory=dict_row) as curr:
+                return await func(*args, conn=conn, curr=curr, **kwargs)
+        pool = await get_pool()
+        async with pool.connection() as conn:
+            return await _call_checked_out(conn, func, args, kwargs)
+    return inner
+
+
+async def _call_checked_out(conn, func, args: tuple, kwargs: dict):
+    token = _current.set(conn)
+    try:
+        async with conn.cursor(row_factory=dict_row) as curr:
+            return await func(*args, conn=conn, curr=curr, **kwargs)
+    finally:
+        _current.reset(token)
+
+
+class _Lagging(Exception):
+    '''The chosen replica has not replayed the commits this context must see'''
+
+
+@asynccontextmanager
+async def _replica_connection(replica, min_lsn: int | None) -> AsyncIterator:
+    '''Check a connection out of a replica chosen by the router, as
+    database._replica_checkout does'''
+    conn, served = None, False
+    try:
+        pool = _router.pool(replica)
+        if pool.closed:
+            await pool.open()
+        async with pool.connection() as conn:
+            if min_lsn is not None and replica.replayed_lsn < min_lsn:
+                async with conn.cursor() as curr:
+                    await curr.execute(REPLAY_LSN_QUERY)
+                    lsn = (await curr.fetchone())[0]
+                await conn.rollback()
+                _router.replayed(replica, parse_lsn(lsn) if lsn is not None else None)
+                if replica.replayed_lsn < min_lsn:
+                    raise _Lagging()
+            served = True
+            yield conn
+    except (psycopg.OperationalError, psycopg.InterfaceError, PoolTimeout):
+        if conn is None or conn.closed:
+            logger.warning('Ejecting replica %s', replica.name, exc_info=True)
+            _router.failed(replica)
+        raise
+    finally:
+        _router.release(replica, served)
+
+
+def __read_connection(func):
+    '''Supply `conn` and `curr` as __connection does, from a read replica when any
+    are configured, as database.__read_connection does'''
+    @wraps(func)
+    async def inner(*args, **kwargs):
+        conn = _current.get()
+        if conn is not None:
+            async with conn.cursor(row_factory=dict_row) as curr:
+                return await func(*args, conn=conn, curr=curr, **kwargs)
+        if _router is not None:
+            min_lsn = read_lsn()
+            replica = _router.choose(min_lsn)
+            if replica is not None:
+                try:
+                    async with _replica_connection(replica, min_lsn) as conn:
+                        return await _call_checked_out(conn, func, args, kwargs)
+                except _Lagging:
+                    pass
+                except (psycopg.OperationalError, psycopg.InterfaceError, PoolTimeout):
+                    logger.warning('Retrying %s on the primary after replica %s failed',
+                                   func.__name__, replica.name)
+        pool = await get_pool()
+        async with pool.connection() as conn:
+            return await _call_checked_out(conn, func, args, kwargs)
+    return inner
+
+
+def __coalesced(func):
+    '''Answer calls made while an identical call runs in another task with its result,
+    as database.__coalesced does'''
+    @wraps(func)
+    async def inner(*args, **kwargs):
+        flights = _flights
+        if flights is None or _current.get() is not None:
+            return await func(*args, **kwargs)
+        return await flights.do(func.__name__, (args, kwargs, read_lsn()),
+                                partial(func, *args, **kwargs))
+    return inner
+
+
+async def _committed(curr) -> None:
+    '''Make this context's later reads wait for replicas to replay the commit just made'''
+    if _router is not None:
+        await curr.execute(WRITE_LSN_QUERY)
+        written(parse_lsn((await curr.fetchone())['lsn']))
+
+
+if environ.get("DATABASE_COALESCE", "1") != "0":
+    configure_coalescing(float(environ.get("DATABASE_COALESCE_TIMEOUT", 30)))
+
+if environ.get("DATABASE_REPLICAS"):
+    configure_replicas([dsn.strip() for dsn in environ["DATABASE_REPLICAS"].split(',')
+                        if dsn.strip()],
+                       float(environ.get("DATABASE_REPLICA_EJECT", 30)))
+
+
+async def _stream(query: sql.Composed, params: list, batch_size: int) -> AsyncIterator[dict]:
+    '''Yield rows from a server-side cursor, fetching `batch_size` rows per round trip,
+    from a replica when one can serve the reads of this context'''
+    min_lsn = read_lsn()
+    replica = _router.choose(min_lsn) if _router is not None else None
+    if replica is not None:
+        rows = 0
+        try:
+            async with _replica_connection(replica, min_lsn) as conn:
+                async for row in _stream_from(conn, query, params, batch_size):
+                    rows += 1
+                    yield row
+            return
+        except _Lagging:
+            pass
+        except (psycopg.OperationalError, psycopg.InterfaceError, PoolTimeout):
+            # Rows already sent cannot be taken back, so only a stream yet to start moves
+            if rows:
+                raise
+    pool = await get_pool()
+    async with pool.connection() as conn:
+        async for row in _stream_from(conn, query, params, batch_size):
+            yield row
+
+
+async def _stream_from(conn, query: sql.Composed, params: list,
+                       batch_size: int) -> AsyncIterator[dict]:
+    async with conn.cursor(name=f'stream_{uuid.uuid4().hex}', row_factory=dict_row) as curr:
+        curr.itersize = batch_size
+        await curr.execute(render(query), params)
+        async for row in curr:
+            yield row
+
+
+@__coalesced
+@__read_connection
+async def _query_movies(search: str, sort_by: str, sort_order: str, limit: int, after: tuple,
+                        **kwargs) -> list[dict]:
+    curr = kwargs.get('curr')
+    conditions, params = _search_conditions(search)
+    query, params = _listing_query(conditions, params, sort_by, sort_order, limit, after, search)
+    await curr.execute(render(query), params, prepare=True)
+    return await curr.fetchall()
+
+
+async def get_movies(search: str = '', sort_by: str = '', sort_order: str = 'ASC',
+                     limit: int = None, after: tuple = None) -> list[dict]:
+    '''List movies, from the catalogue snapshot when one is enabled and can answer the query'''
+    movies = await _snapshot_listing(search, None, sort_by, sort_order, limit, after)
+    if movies is not None:
+        return movies
+    return await _query_movies(search, sort_by, sort_order, limit, after)
+
+
+def stream_movies(search: str = '', sort_by: str = '', sort_order: str = 'ASC',
+                  batch_size: int = STREAM_BATCH_SIZE) -> AsyncIterator[dict]:
+    '''Lazily yield the same movies as get_movies without buffering the result set'''
+    conditions, params = _search_conditions(search)
+    return _stream(*_listing_query(conditions, params, sort_by, sort_order, search=search),
+                   batch_size)
+
+
+@__coalesced
+@__read_connection
+async def _query_movies_by_country(country_id: int, sort_by: str, sort_order: str, limit: int,
+                                   after: tuple, **kwargs) -> list[dict]:
+    curr = kwargs.get('curr')
+    query, params = _listing_query([sql.SQL('country_id=%s')], [country_id],
+                                   sort_by, sort_order, limit, after)
+    await curr.execute(render(query), params, prepare=True)
+    return await curr.fetchall()
+
+
+async def get_movie_by_country(country_code: str, sort_by: str = None, sort_order: str = None,
+                               limit: int = None, after: tuple = None) -> list[dict]:
+    '''List the movies of a country, found by the id its code maps to in the countries table,
+    or a slice of the catalogue snapshot when one is enabled'''
+    country_id = await _lookups['countries'].get(country_code)
+    _validate_sort(sort_by, sort_order)
+    if country_id is None:
+        return []
+    movies = await _snapshot_listing(None, country_id, sort_by, sort_order, limit, after)
+    if movies is not None:
+        return movies
+    return await _query_movies_by_country(country_id, sort_by, sort_order, limit, after)
+
+
+async def stream_movie_by_country(country_code: str, sort_by: str = None, sort_order: str = None,
+                                  batch_size: int = STREAM_BATCH_SIZE) -> AsyncIterator[dict]:
+    '''Lazily yield the same movies as get_movie_by_country without buffering the result set'''
+    country_id = await _lookups['countries'].get(country_code)
+    query, params = _listing_query([sql.SQL('country_id=%s')], [country_id], sort_by, sort_order)
+    if country_id is None:
+        return
+    async for movie in _stream(query, params, batch_size):
+        yield movie
+
+
+@__coalesced
+@__read_connection
+async def get_country_summaries(**kwargs) -> list[dict]:
+    '''Return the movie count, average score and total budget and revenue of each country'''
+    curr = kwargs.get('curr')
+    await curr.execute(COUNTRY_SUMMARY_QUERY)
+    return await curr.fetchall()
+
+
+async def get_catalogue_stats(group_by: list[str] = None,
+                              aggregates: list[str] = None) -> dict[str, Any]:
+    '''Return the catalogue's totals and each group's aggregates, as
+    database.get_catalogue_stats'''
+    group_by, aggregates = list(group_by or []), list(aggregates or STATS_AGGREGATES)
+    _validate_stats(group_by, aggregates)
+    return _catalogue_stats(await _query_catalogue_stats(sorted(set(group_by))), group_by,
+                            aggregates)
+
+
+@__coalesced
+@__read_connection
+async def _query_catalogue_stats(dimensions: list[str], **kwargs) -> list[dict]:
+    curr = kwargs.get('curr')
+    await curr.execute(CATALOGUE_STATS_QUERY, (dimensions,), prepare=True)
+    return await curr.fetchall()
+
+
+_snapshot = None
+
+
+async def _plain_rows(conn, query: str, params: tuple = None) -> list[tuple]:
+    async with conn.cursor() as curr:
+        await curr.execute(query, params)
+        return await curr.fetchall()
+
+
+async def _snapshot_rows(conn, query: str, params: tuple = None) -> dict[str, list]:
+    return to_columns(await _plain_rows(conn, query, params))
+
+
+@__connection
+async def _load_snapshot(prune_after: float, **kwargs) -> tuple[int, dict[str, list], bool]:
+    '''Read every movie for a full snapshot load, as database._load_snapshot does'''
+    curr = kwargs.get('curr')
+    conn = kwargs.get('conn')
+    await curr.execute(SNAPSHOT_XMIN_QUERY)
+    xmin = int((await curr.fetchone())['xmin'])
+    columns = await _snapshot_rows(conn, SNAPSHOT_QUERY + ';')
+    await curr.execute(SNAPSHOT_COLLATION_QUERY, (COLLATION_PROBES,))
+    c_collation = _c_collation(await curr.fetchone())
+    await curr.execute(PRUNE_CHANGES_QUERY, (prune_after,))
+    await conn.commit()
+    return xmin, columns, c_collation
+
+
+@__connection
+async def _snapshot_changes(xmin: int, **kwargs) -> tuple[int, list[int], dict[str, list]]:
+    '''Read the movies changed by transactions from `xmin` on'''
+    curr = kwargs.get('curr')
+    await curr.execute(SNAPSHOT_CHANGES_QUERY, (str(xmin),))
+    row = await curr.fetchone()
+    columns = to_columns([])
+    if row['movie_ids']:
+        columns = await _snapshot_rows(kwargs.get('conn'),
+                                       SNAPSHOT_QUERY + ' WHERE movie_id = ANY(%s);',
+                                       (row['movie_ids'],))
+    return int(row['xmin']), row['movie_ids'], columns
+
+
+def enable_snapshot(refresh_interval: float = 1.0, rebuild_interval: float = 1800.0) -> None:
+    '''Serve listings from an in-memory catalogue snapshot, as database.enable_snapshot'''
+    global _snapshot #pylint: disable=global-statement
+    _snapshot = AsyncCatalogueSnapshot(partial(_load_snapshot, 2 * rebuild_interval),
+                                       _snapshot_changes, refresh_interval, rebuild_interval)
+
+
+def disable_snapshot() -> None:
+    '''Serve listings from Postgres again and drop the snapshot'''
+    global _snapshot #pylint: disable=global-statement
+    _snapshot = None
+
+
+def snapshot_stats() -> dict[str, Any] | None:
+    '''Return the snapshot's refresh counters and memory, or None when it is disabled'''
+    return _snapshot.stats() if _snapshot is not None else None
+
+
+async def _snapshot_listing(search: str | None, country_id: int | None, sort_by: str, #pylint: disable=too-many-arguments,too-many-positional-arguments
+                            sort_order: str, limit: int, after: tuple,
+                            movies: int = None) -> list[dict] | None:
+    if _snapshot is None or read_lsn() is not None:
+        return None
+    if (limit is not None or after is not None) and not sort_by:
+        sort_by = 'movie_id'
+    _validate_sort(sort_by, sort_order, search)
+    return (await _snapshot.get()).listing(search, country_id, sort_by, sort_order, limit,
+                                           after, movies)
+
+
+def _snapshot_written() -> None:
+    _genre_index.invalidate()
+    if _snapshot is not None:
+        _snapshot.invalidate()
+
+
+if environ.get("CATALOGUE_SNAPSHOT", "0") != "0":
+    enable_snapshot(float(environ.get("CATALOGUE_SNAPSHOT_REFRESH", 1)),
+                    float(environ.get("CATALOGUE_SNAPSHOT_REBUILD", 1800)))
+
+
+@__connection
+async def _load_genre_index(prune_after: float, **kwargs) -> tuple[int, list[tuple]]:
+    '''Read the genres of every movie for the genre bitmaps, as database._load_genre_index'''
+    curr = kwargs.get('curr')
+    conn = kwargs.get('conn')
+    await curr.execute(SNAPSHOT_XMIN_QUERY)
+    xmin = int((await curr.fetchone())['xmin'])
+    rows = await _plain_rows(conn, GENRE_INDEX_QUERY + ';')
+    await curr.execute(PRUNE_CHANGES_QUERY, (prune_after,))
+    await conn.commit()
+    return xmin, rows
+
+
+@__connection
+async def _genre_index_changes(xmin: int, **kwargs) -> tuple[int, list[int], list[tuple]]:
+    '''Read the genres of the movies changed by transactions from `xmin` on'''
+    curr = kwargs.get('curr')
+    await curr.execute(SNAPSHOT_CHANGES_QUERY, (str(xmin),))
+    row = await curr.fetchone()
+    rows = []
+    if row['movie_ids']:
+        rows = await _plain_rows(kwargs.get('conn'),
+                                 GENRE_INDEX_QUERY + ' WHERE movie_id = ANY(%s);',
+                                 (row['movie_ids'],))
+    return int(row['xmin']), row['movie_ids'], rows
+
+
+_genre_index = AsyncGenreIndex(
+    partial(_load_genre_index, 2 * float(environ.get("CATALOGUE_SNAPSHOT_REBUILD", 1800))),
+    _genre_index_changes, float(environ.get("GENRE_INDEX_REFRESH", 1)),
+    float(environ.get("CATALOGUE_SNAPSHOT_REBUILD", 1800)))
+
+
+def genre_index_stats() -> dict[str, Any]:
+    '''Return the genre bitmaps' refresh counters and memory'''
+    return _genre_index.stats()
+
+
+async def _genre_selection(genres: list[str], match_all: bool) -> tuple[GenreBitmaps, int]:
+    for genre in genres:
+        await get_genre_id(genre)
+    bitmaps = await _genre_index.get()
+    return bitmaps, bitmaps.select(genres, match_all)
+
+
+@__coalesced
+@__read_connection
+async def _query_movies_where(condition: str, params: list, sort_by: str, sort_order: str, #pylint: disable=too-many-arguments,too-many-positional-arguments
+                              limit: int, after: tuple, **kwargs) -> list[dict]:
+    curr = kwargs.get('curr')
+    query, params = _listing_query([sql.SQL(condition)], params, sort_by, sort_order, limit,
+                                   after)
+    await curr.execute(render(query), params, prepare=True)
+    return await curr.fetchall()
+
+
+async def get_movies_by_genre(genres: str | list[str], match_all: bool = True, #pylint: disable=too-many-arguments,too-many-positional-arguments
+                              sort_by: str = None, sort_order: str = None, limit: int = None,
+                              after: tuple = None) -> list[dict]:
+    '''List the movies with every one of `genres`, or any of them, as
+    database.get_movies_by_genre does'''
+    genres = _validate_genres(genres)
+    _validate_sort(sort_by, sort_order)
+    _, selected = await _genre_selection(genres, match_all)
+    movies = await _snapshot_listing(None, None, sort_by, sort_order, limit, after, selected)
+    if movies is not None:
+        return movies
+    if not sort_by or sort_by == 'movie_id':
+        descending = (sort_order or 'ASC').upper() == 'DESC'
+        return await get_movies_by_ids(GenreBitmaps.page(
+            selected, descending, after[1] if after is not None else None, limit))
+    return await _query_movies_where(*_genre_condition(genres, match_all, selected), sort_by,
+                                     sort_order, limit, after)
+
+
+async def get_genre_facets(genres: str | list[str], match_all: bool = True) -> dict[str, Any]:
+    '''Return the movie count and genre facet counts of a genre selection, as
+    database.get_genre_facets does'''
+    bitmaps, selected = await _genre_selection(_validate_genres(genres), match_all)
+    return {'movie_count': selected.bit_count(), 'facets': bitmaps.facets(selected)}
+
+
+@__coalesced
+@__read_connection
+async def get_movie_by_id(movie_id: int, **kwargs) -> dict[str, Any]:
+    '''Return a single movie document with its genres as an array'''
+    curr = kwargs.get('curr')
+    if not isinstance(movie_id, int) or isinstance(movie_id, bool):
+        raise TypeError("'movie_id' must be of type int")
+    await curr.execute(MOVIE_QUERY, (movie_id,), prepare=True)
+    movie = await curr.fetchone()
+    if not movie:
+        raise ValueError('No movie with that id was found')
+    return movie
+
+
+@__coalesced
+@__read_connection
+async def get_movies_by_ids(movie_ids: list[int], **kwargs) -> list[dict[str, Any]]:
+    '''Return the movie documents of many ids with one query, in the order given'''
+    curr = kwargs.get('curr')
+    _validate_movie_ids(movie_ids)
+    if not movie_ids:
+        return []
+    await curr.execute(MOVIES_QUERY, (list(movie_ids),), prepare=True)
+    return _in_requested_order(movie_ids, await curr.fetchall())
+
+
+@__read_connection
+async def _load_lookup(table: str, id_column: str, name_column: str,
+                       **kwargs) -> dict[str, int]:
+    curr = kwargs.get('curr')
+    await curr.execute(render(sql.SQL('SELECT {} AS id, {} AS name FROM {};').format(
+        sql.Identifier(id_column), sql.Identifier(name_column), sql.Identifier(table))))
+    return {row['name']: row['id'] for row in await curr.fetchall()}
+
+
+_lookups = {
+    table: AsyncLookupTable(partial(_load_lookup, table, id_column, name_column),
+                            ttl=float(environ.get("LOOKUP_CACHE_TTL", 300)))
+    for table, id_column, name_column in (('genres', 'genre_id', 'genre_name'),
+                                          ('statuses', 'status_id', 'status_name'),
+                                          ('languages', 'language_id', 'language_name'),
+                                          ('countries', 'country_id', 'country_name'))
+}
+
+
+async def warm_lookups() -> None:
+    '''Load every lookup table with one query each'''
+    for lookup in _lookups.values():
+        await lookup.warm()
+
+
+def invalidate_lookups(table: str = None) -> None:
+    '''Drop one cached lookup table, or all of them, after it has been written to'''
+    for name, lookup in _lookups.items():
+        if table in (None, name):
+            lookup.invalidate()
+
+
+def lookup_stats() -> dict[str, dict[str, int]]:
+    '''Return hit and miss counters of each lookup table'''
+    return {name: lookup.stats() for name, lookup in _lookups.items()}
+
+
+async def _lookup_id(table: str, name: str, error: str) -> int:
+    row_id = await _lookups[table].get(name)
+    if row_id is None:
+        raise ValueError(error)
+    return row_id
+
+
+get_genre_id = partial(_lookup_id, 'genres', error='Genre not recognized')
+get_status_id = partial(_lookup_id, 'statuses', error='Status not recognized')
+get_language_id = partial(_lookup_id, 'languages', error='Language not recognized')
+get_country_id = partial(_lookup_id, 'countries', error='Country not recognized')
+
+
+async def _genre_ids(genre: str | list[str]) -> list[int]:
+    genres = [genre] if isinstance(genre, str) else genre
+    return list(dict.fromkeys([await get_genre_id(name) for name in genres]))
+
+
+@__connection
+async def create_movie(title: str, release_date: date, genre: str | list[str], overview: str,
+                       status: str, budget: int, revenue: int, country: str, language: str,
+                       orig_title: str, **kwargs) -> dict:
+    '''Insert a movie and its genre assignments atomically, as database.create_movie does'''
+    _validate_movie(title, release_date, genre, overview, status, budget, revenue, country,
+                    language, orig_title)
+    genre_ids = await _genre_ids(genre)
+    status_id = await get_status_id(status)
+    country_id = await get_country_id(country)
+    language_id = await get_language_id(language)
+    curr = kwargs.get('curr')
+    conn = kwargs.get('conn')
+    await curr.execute('''
+WITH new_movie AS (
+    INSERT INTO movies
+    (title, release_date, overview, status_id, budget, revenue, country_id, language_id,
+     orig_title)
+    VALUES
+    (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+    RETURNING movie_id
+), assigned AS (
+    INSERT INTO genre_assignments (movie_id, genre_id)
+    SELECT movie_id, genre_id FROM new_movie, unnest(%s::int[]) AS genre_id
+)
+SELECT movie_id FROM new_movie;
+''', (title, release_date, overview, status_id, budget, revenue, country_id,
+     language_id, orig_title, genre_ids))
+    movie_id = (await curr.fetchone())['movie_id']
+    await conn.commit()
+    await _committed(curr)
+    _snapshot_written()
+    return {
+        'movie_id': movie_id,
+        'title': title,
+        'genre': genre,
+        'release_date': release_date,
+        'overview': overview,
+        'status': status,
+        'budget': budget,
+        'revenue': revenue,
+        'country': country,
+        'language': language,
+        'orig_title': orig_title
+    }
+
+
+async def _movie_row(title: str, release_date: date, genre: str | list[str], overview: str, #pylint: disable=too-many-arguments,too-many-positional-arguments
+                     status: str, budget: int, revenue: int, country: str, language: str,
+                     orig_title: str) -> tuple[tuple, list[int]]:
+    _validate_movie(title, release_date, genre, overview, status, budget, revenue, country,
+                    language, orig_title)
+    return (title, release_date, overview, await get_status_id(status), budget, revenue,
+            await get_country_id(country), await get_language_id(language),
+            orig_title), await _genre_ids(genre)
+
+
+@__connection
+async def create_movies(movies: list[dict[str, Any]], **kwargs) -> list[dict[str, Any]]:
+    '''Insert many movies and their genres in a single transaction.
+
+    Takes and returns the same values as database.create_movies. The inserts
+    are pipelined by executemany, so the batch costs a handful of round trips.'''
+    curr = kwargs.get('curr')
+    conn = kwargs.get('conn')
+    results, rows, genre_ids = [], [], []
+    for movie in movies:
+        try:
+            row, movie_genre_ids = await _movie_row(**movie)
+        except (TypeError, ValueError) as e:
+            results.append({'error': str(e)})
+            continue
+        results.append(None)
+        rows.append(row)
+        genre_ids.append(movie_genre_ids)
+    if not rows:
+        return results
+    await curr.executemany('''
+INSERT INTO movies
+(title, release_date, overview, status_id, budget, revenue, country_id, language_id, orig_title)
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+RETURNING movie_id;
+''', rows, returning=True)
+    movie_ids = []
+    while True:
+        movie_ids.append((await curr.fetchone())['movie_id'])
+        if not curr.nextset():
+            break
+    await curr.executemany(
+        'INSERT INTO genre_assignments (movie_id, genre_id) VALUES (%s, %s);',
+        [(movie_id, genre_id) for movie_id, movie_genre_ids in zip(movie_ids, genre_ids)
+         for genre_id in movie_genre_ids])
+    await conn.commit()
+    await _committed(curr)
+    _snapshot_written()
+    movie_ids = iter(movie_ids)
+    return [result or {'movie_id': next(movie_ids)} for result in results]
+
+
+@__connection
+async def delete_movie(movie_id: int, **kwargs) -> bool:
+    curr = kwargs.get('curr')
+    conn = kwargs.get('conn')
+    if not isinstance(movie_id, int) or isinstance(movie_id, bool):
+        raise TypeError('movie_id must be of type int')
+    await curr.execute('DELETE FROM movies WHERE movie_id=%s;', (movie_id,))
+    deleted = curr.rowcount > 0
+    await conn.commit()
+    await _committed(curr)
+    _snapshot_written()
+    return deleted
+
+
+@__connection
+async def create_review(movie_id: int, review_text: str, score: int = None, **kwargs) -> dict:
+    '''Insert a review, updating its movie's review counters in the same transaction'''
+    _validate_review(movie_id, review_text, score)
+    curr = kwargs.get('curr')
+    conn = kwargs.get('conn')
+    try:
+        await curr.execute(f'''
+INSERT INTO reviews (movie_id, review_text, score) VALUES (%s, %s, %s)
+RETURNING {REVIEW_COLUMNS};''', (movie_id, review_text, score))
+    except errors.ForeignKeyViolation as e:
+        raise ValueError('No movie with that id was found') from e
+    review = await curr.fetchone()
+    await conn.commit()
+    await _committed(curr)
+    return review
+
+
+@__connection
+async def create_reviews(reviews: list[dict[str, Any]], **kwargs) -> list[dict[str, Any]]:
+    '''Insert many reviews in a single transaction.
+
+    Takes and returns the same values as database.create_reviews. The inserts
+    are pipelined by executemany, so the batch costs a handful of round trips.'''
+    curr = kwargs.get('curr')
+    conn = kwargs.get('conn')
+    results, rows, ordinals = [], [], []
+    for ordinal, review in enumerate(reviews):
+        try:
+            _validate_review(review.get('movie_id'), review.get('review_text'),
+                             review.get('score'))
+        except (TypeError, ValueError) as e:
+            results.append({'error': str(e)})
+            continue
+        results.append({'error': 'No movie with that id was found'})
+        rows.append((review['review_text'], review.get('score'), review['movie_id']))
+        ordinals.append(ordinal)
+    if not rows:
+        return results
+    # Each insert returns no row when its movie does not exist, and locks the movie so that
+    # it cannot be deleted before the insert's foreign key check
+    await curr.executemany('''
+INSERT INTO reviews (movie_id, review_text, score)
+SELECT movie_id, %s::text, %s::smallint FROM movies WHERE movie_id = %s FOR KEY SHARE
+RETURNING review_id;
+''', rows, returning=True)
+    for ordinal in ordinals:
+        row = await curr.fetchone()
+        if row is not None:
+            results[ordinal] = {'review_id': row['review_id']}
+        curr.nextset()
+    await conn.commit()
+    await _committed(curr)
+    return results
+
+
+@__coalesced
+@__read_connection
+async def read_reviews(movie_id: int, limit: int = 100, after: int = 0,
+                       **kwargs) -> list[dict]:
+    '''Return up to `limit` reviews of a movie after review_id `after`, as
+    database.read_reviews does'''
+    if not isinstance(movie_id, int) or isinstance(movie_id, bool):
+        raise TypeError('movie_id must be of type int')
+    curr = kwargs.get('curr')
+    await curr.execute(REVIEWS_QUERY, (movie_id, after, limit), prepare=True)
+    return await curr.fetchall()
+
+
+@__coalesced
+@__read_connection
+async def get_review_stats(movie_id: int, **kwargs) -> dict | None:
+    '''Return the review count and average score of a movie from its counters,
+    or None if there is no such movie'''
+    curr = kwargs.get('curr')
+    await curr.execute(REVIEW_STATS_QUERY, (movie_id,), prepare=True)
+    return await curr.fetchone()
+
+
+@__coalesced
+@__read_connection
+async def count_reviews(movie_id: int, **kwargs) -> int:
+    '''Return the number of reviews of a movie from its counters, without counting rows'''
+    curr = kwargs.get('curr')
+    await curr.execute('SELECT review_count FROM review_stats WHERE movie_id=%s;', (movie_id,),
+                       prepare=True)
+    row = await curr.fetchone()
+    return row['review_count'] if row else 0
+
+
+@__connection
+async def update_review(review_id: int, review_text: str = None, score: int = None,
+                        movie_id: int = None, **kwargs) -> dict | None:
+    '''Change the text and/or score of a review, as database.update_review does'''
+    _validate_review_id(review_id)
+    if review_text is not None and not isinstance(review_text, str):
+        raise TypeError('review_text must be of type str')
+    if review_text is not None and not review_text.strip():
+        raise ValueError('review_text must not be empty')
+    _validate_score(score)
+    curr = kwargs.get('curr')
+    conn = kwargs.get('conn')
+    await curr.execute(f'''
+UPDATE reviews SET review_text=coalesce(%s, review_text), score=coalesce(%s, score),
+                   updated_at=now()
+WHERE review_id=%s AND (%s::int IS NULL OR movie_id=%s)
+RETURNING {REVIEW_COLUMNS};''', (review_text, score, review_id, movie_id, movie_id))
+    review = await curr.fetchone()
+    await conn.commit()
+    await _committed(curr)
+    return review
+
+
+@__connection
+async def delete_review(review_id: int, movie_id: int = None, **kwargs) -> bool:
+    '''Delete a review, returning whether there was one (of `movie_id`, when given)'''
+    _validate_review_id(review_id)
+    curr = kwargs.get('curr')
+    conn = kwargs.get('conn')
+    await curr.execute(
+        'DELETE FROM reviews WHERE review_id=%s AND (%s::int IS NULL OR movie_id=%s);',
+        (review_id, movie_id, movie_id))
+    deleted = curr.rowcount > 0
+    await conn.commit()
+    await _committed(curr)
+    return deleted
@@ -0,0 +1,250 @@
+'Response cache for the read endpoints'
+import hashlib
+import json
+import math
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from os import environ
+from typing import Any
+
+
+class CacheBackend:
+    '''Storage used by ResponseCache.
+
+    Entries may be evicted at any time, but tag versions must not be: an
+    entry is only served while the versions it was stored with are current.
+    `epoch` identifies the lifetime of the versions, so that ETags minted
+    before a restart of a per-process backend never match again.'''
+
+    epoch = ''
+
+    def get(self, key: str) -> dict | None:
+        'Return the entry stored under `key`, if any'
+        raise NotImplementedError
+
+    def set(self, key: str, entry: dict, ttl: float) -> None:
+        'Store `entry` under `key` for at most `ttl` seconds'
+        raise NotImplementedError
+
+    def versions(self, tags: list[str]) -> list[int]:
+        'Return the current version of each tag'
+        raise NotImplementedError
+
+    def bump(self, tags: list[str], lsn: int = None) -> None:
+        '''Increment the version of each tag and record when it changed, and the WAL
+        position (LSN) of the write that changed it when known'''
+        raise NotImplementedError
+
+    def written_lsn(self, tags: list[str]) -> int | None:
+        'Return the highest LSN recorded for any of the tags'
+        raise NotImplementedError
+
+    def modified(self, tags: list[str]) -> float | None:
+        'Return the latest time any of the tags was bumped, as a UNIX timestamp'
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        'Drop every entry and tag version'
+        raise NotImplementedError
+
+
+class MemoryBackend(CacheBackend):
+    'Per-process LRU bounded by entry count and age'
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._modified = {}
+        self._lsns = {}
+        self.epoch = uuid.uuid4().hex
+
+    def get(self, key: str) -> dict | None:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires_at, entry = item
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, entry: dict, ttl: float) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, entry)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def versions(self, tags: list[str]) -> list[int]:
+        with self._lock:
+            return [self._versions.get(tag, 0) for tag in tags]
+
+    def bump(self, tags: list[str], lsn: int = None) -> None:
+        now = time.time()
+        with self._lock:
+            for tag in tags:
+                self._versions[tag] = self._versions.get(tag, 0) + 1
+                self._modified[tag] = now
+                if lsn is not None:
+                    self._lsns[tag] = max(self._lsns.get(tag, 0), lsn)
+
+    def written_lsn(self, tags: list[str]) -> int | None:
+        with self._lock:
+            return max((self._lsns[tag] for tag in tags if tag in self._lsns), default=None)
+
+    def modified(self, tags: list[str]) -> float | None:
+        with self._lock:
+            return max((self._modified[tag] for tag in tags if tag in self._modified),
+                       default=None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+            self._modified.clear()
+            self._lsns.clear()
+            self.epoch = uuid.uuid4().hex
+
+
+class RedisBackend(CacheBackend):
+    '''Backend shared between workers through a redis-py compatible client.
+
+    Only `get`, `set(..., ex=)`, `mget`, `incr`, `scan_iter` and `delete` are
+    used, so any object offering those can stand in for a real server.'''
+
+    def __init__(self, client, prefix: str = 'stern_movies:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key: str) -> dict | None:
+        raw = self.client.get(self.prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key: str, entry: dict, ttl: float) -> None:
+        self.client.set(self.prefix + key, json.dumps(entry), ex=max(1, math.ceil(ttl)))
+
+    def versions(self, tags: list[str]) -> list[int]:
+        if not tags:
+            return []
+        values = self.client.mget([f'{self.prefix}tag:{tag}' for tag in tags])
+        return [int(value or 0) for value in values]
+
+    def bump(self, tags: list[str], lsn: int = None) -> None:
+        now = time.time()
+        for tag in tags:
+            self.client.incr(f'{self.prefix}tag:{tag}')
+            self.client.set(f'{self.prefix}modified:{tag}', now)
+            if lsn is not None:
+                # Kept as the highest LSN, short of two workers racing to record theirs
+                current = self.client.get(f'{self.prefix}lsn:{tag}')
+                if current is None or int(current) < lsn:
+                    self.client.set(f'{self.prefix}lsn:{tag}', lsn)
+
+    def written_lsn(self, tags: list[str]) -> int | None:
+        if not tags:
+            return None
+        values = self.client.mget([f'{self.prefix}lsn:{tag}' for tag in tags])
+        return max((int(value) for value in values if value is not None), default=None)
+
+    def modified(self, tags: list[str]) -> float | None:
+        if not tags:
+            return None
+        values = self.client.mget([f'{self.prefix}modified:{tag}' for tag in tags])
+        return max((float(value) for value in values if value is not None), default=None)
+
+    def clear(self) -> None:
+        for key in self.client.scan_iter(match=self.prefix + '*'):
+            self.client.delete(key)
+
+
+class ResponseCache:
+    '''Caches JSON response bodies keyed on normalized request parameters.
+
+    Every entry depends on a list of tags. Invalidating a tag bumps its
+    version, which makes all entries stored under an older version misses.'''
+
+    def __init__(self, backend: CacheBackend, ttl: float = 60.0):
+        self.backend = backend
+        self.ttl = ttl
+        self.started = time.time()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    @staticmethod
+    def key(kind: str, params: dict[str, Any]) -> str:
+        'Return the cache key of a request'
+        return f'{kind}:{json.dumps(params, sort_keys=True, default=str)}'
+
+    def versions(self, tags: list[str]) -> list[int]:
+        'Snapshot tag versions; take this before building a response to store'
+        return self.backend.versions(tags)
+
+    def etag(self, kind: str, params: dict[str, Any], versions: list[int]) -> str:
+        '''Return the ETag of a request at the given tag versions.
+
+        It is derived from the versions rather than the body, so a client's
+        validator can be checked without running the query.'''
+        token = f'{self.backend.epoch}|{self.key(kind, params)}|{versions}'
+        return hashlib.sha256(token.encode()).hexdigest()[:32]
+
+    def last_modified(self, tags: list[str]) -> float:
+        '''Return when any of `tags` last changed, or when the cache was created'''
+        return self.backend.modified(tags) or self.started
+
+    def get(self, kind: str, params: dict[str, Any], versions: list[int]) -> dict | None:
+        'Return the entry for a request if it was stored under the current versions'
+        entry = self.backend.get(self.key(kind, params))
+        if entry is None or entry['versions'] != versions:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def set(self, kind: str, params: dict[str, Any], versions: list[int], body: str) -> dict:
+        'Store a response body along with its ETag'
+        entry = {
+            'body': body,
+            'etag': self.etag(kind, params, versions),
+            'versions': versions,
+        }
+        self.backend.set(self.key(kind, params), entry, self.ttl)
+        return entry
+
+    def invalidate(self, tags: list[str], lsn: int = None) -> None:
+        '''Make every entry depending on any of `tags` stale, recording `lsn`, the WAL
+        position of the write that changed them, when it is known'''
+        self.backend.bump(tags, lsn)
+
+    def written_lsn(self, tags: list[str]) -> int | None:
+        '''Return the LSN a read must see to include the writes that last invalidated
+        any of `tags`, or None when none was recorded'''
+        return self.backend.written_lsn(tags)
+
+    def clear(self) -> None:
+        'Drop everything'
+        self.backend.clear()
+
+    def stats(self) -> dict[str, int]:
+        'Return hit, miss and 304 counters'
+        return {'hits': self.hits, 'misses': self.misses, 'not_modified': self.not_modified}
+
+
+def build_response_cache() -> ResponseCache:
+    '''Create the response cache described by the environment.
+
+    RESPONSE_CACHE_URL selects a shared redis backend (requires the `redis`
+    package); otherwise entries are kept in a per-process LRU of
+    RESPONSE_CACHE_SIZE entries. Entries live for RESPONSE_CACHE_TTL seconds.'''
+    ttl = float(environ.get("RESPONSE_CACHE_TTL", 60))
+    url = environ.get("RESPONSE_CACHE_URL")
+    if url:
+        import redis #pylint: disable=import-outside-toplevel,import-error
+        return ResponseCache(RedisBackend(redis.Redis.from_url(url)), ttl)
+    return ResponseCache(MemoryBackend(int(environ.get("RESPONSE_CACHE_SIZE", 1024))), ttl)
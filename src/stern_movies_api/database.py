@@ -1,163 +1,603 @@
-#pylint: disable=unused-variable
-from typing import Any
+#pylint: disable=unused-variable,too-many-lines
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from functools import partial, wraps
+from typing import Any, Iterator
 import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
 import psycopg2.extras
 from psycopg2 import sql
 from datetime import date
 from os import environ
 from dotenv import load_dotenv
 
+from stern_movies_api.genre_index import GenreBitmaps, GenreIndex, set_bits
+from stern_movies_api.lookups import LookupTable
+from stern_movies_api.metrics import TimedConnection, TimedCursor, record_connect
+from stern_movies_api.migrations import apply_migrations
+from stern_movies_api.pool import ConnectionPool
+from stern_movies_api.replicas import ReplicaRouter, parse_lsn, read_lsn, written
+from stern_movies_api.singleflight import SingleFlight
+from stern_movies_api.snapshot import (COLLATION_PROBES, COLUMNS as SNAPSHOT_COLUMNS,
+                                      GENRE_SEPARATOR, CatalogueSnapshot, to_columns)
+from stern_movies_api.statements import StatementRegistry
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+STREAM_BATCH_SIZE = 2000
+
+_pool = None
+_pool_lock = threading.Lock()
+_local = threading.local()
+_statements = StatementRegistry(environ.get("DATABASE_PREPARE", "1") != "0")
+_router = None
+_flights = None
+
+# The end of the WAL inserted so far, which a commit just made has reached
+WRITE_LSN_QUERY = 'SELECT pg_current_wal_insert_lsn()::text AS lsn;'
+# How far a standby has replayed; NULL on a server that is not in recovery
+REPLAY_LSN_QUERY = 'SELECT pg_last_wal_replay_lsn()::text AS lsn;'
+# Raised for an insert referencing a row that does not exist (SQLSTATE 23503)
+FOREIGN_KEY_VIOLATION = psycopg2.errors.lookup('23503')
+
+
+def _connect():
+    return psycopg2.connect(
+        user = environ["DATABASE_USERNAME"],
+        password = environ["DATABASE_PASSWORD"],
+        host = environ["DATABASE_IP"],
+        port = environ["DATABASE_PORT"],
+        database = environ["DATABASE_NAME"]
+    )
+
+
+def _connect_replica(dsn: str):
+    return psycopg2.connect(dsn)
+
+
+def _open_pool(connect) -> ConnectionPool:
+    return ConnectionPool(
+        connect,
+        min_size = int(environ.get("DATABASE_POOL_MIN", 1)),
+        max_size = int(environ.get("DATABASE_POOL_MAX", 10)),
+        timeout = float(environ.get("DATABASE_POOL_TIMEOUT", 30)),
+        max_age = float(environ.get("DATABASE_POOL_MAX_AGE", 1800)),
+        max_idle = float(environ.get("DATABASE_POOL_MAX_IDLE", 60))
+    )
+
+
+def get_pool() -> ConnectionPool:
+    '''Return the process-wide connection pool, creating it on first use.
+
+    Sizing is read from DATABASE_POOL_MIN, DATABASE_POOL_MAX, DATABASE_POOL_TIMEOUT,
+    DATABASE_POOL_MAX_AGE and DATABASE_POOL_MAX_IDLE.'''
+    global _pool #pylint: disable=global-statement
+    with _pool_lock:
+        if _pool is None:
+            _pool = _open_pool(_connect)
+        return _pool
+
+
+def close_pool() -> None:
+    '''Close the process-wide pool and those of the replicas; the next query opens
+    fresh ones'''
+    global _pool #pylint: disable=global-statement
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.close()
+    if _router is not None:
+        for replica_pool in _router.detach_pools():
+            replica_pool.close()
+
+
+def replica_name(dsn: str) -> str:
+    '''Return a replica's host, port and database, leaving out its credentials'''
+    params = psycopg2.extensions.parse_dsn(dsn)
+    return (f"{params.get('host', 'localhost')}:{params.get('port', 5432)}"
+            f"/{params.get('dbname', '')}")
+
+
+def configure_replicas(dsns: list[str], eject_for: float = 30.0) -> None:
+    '''Serve reads from the read replicas at `dsns`, or only from the primary when empty.
+
+    Each replica gets a pool sized like the primary's. One that cannot be reached
+    is ejected for `eject_for` seconds.'''
+    global _router #pylint: disable=global-statement
+    previous = _router
+    _router = None
+    if previous is not None:
+        for replica_pool in previous.detach_pools():
+            replica_pool.close()
+    if dsns:
+        _router = ReplicaRouter({replica_name(dsn): dsn for dsn in dsns},
+                                lambda dsn: _open_pool(partial(_connect_replica, dsn)),
+                                eject_for)
+
+
+def replica_stats() -> dict[str, Any] | None:
+    '''Return the replicas' health and read counters, or None without replicas'''
+    return _router.stats() if _router is not None else None
+
+
+def configure_coalescing(timeout: float | None = 30.0) -> None:
+    '''Share each read among the identical reads other threads start while it runs,
+    waiting at most `timeout` seconds for it, or run every read when None'''
+    global _flights #pylint: disable=global-statement
+    _flights = SingleFlight(timeout) if timeout is not None else None
+
+
+def coalescing_stats() -> dict[str, Any] | None:
+    '''Return how many reads were shared with an identical read in flight, or None when
+    reads are not coalesced'''
+    return _flights.stats() if _flights is not None else None
+
+
+def pool_stats() -> dict[str, Any]:
+    '''Return the in-use/idle/wait-time gauges of the connection pool'''
+    return get_pool().stats()
+
+
+def statement_stats() -> dict[str, int]:
+    '''Return how often prepared statements were reused rather than prepared'''
+    return _statements.stats()
+
+
+@contextmanager
+def _checkout(pool: ConnectionPool) -> Iterator:
+    '''Check a connection out of `pool`, handing it back marked broken if it failed'''
+    start = time.perf_counter()
+    conn = pool.getconn()
+    record_connect(time.perf_counter() - start)
+    broken = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        pool.putconn(conn, broken)
+
+
+def _call(conn, func, args: tuple, kwargs: dict):
+    '''Call `func` with `conn` and a cursor, both timed under the function's name'''
+    curr = TimedCursor(conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor),
+                       func.__name__)
+    kwargs['conn'] = TimedConnection(conn, func.__name__)
+    kwargs['curr'] = curr
+    try:
+        return func(*args, **kwargs)
+    finally:
+        curr.close()
+
+
+def _call_checked_out(conn, func, args: tuple, kwargs: dict):
+    _local.conn = conn
+    try:
+        return _call(conn, func, args, kwargs)
+    finally:
+        _local.conn = None
+
+
 def __connection(func):
+    '''Supply `conn` and `curr` from the pool.
+
+    Nested calls made while a connection is already checked out on this thread
+    reuse it, so they share the caller's transaction. Both are wrapped to time
+    and count the work done through them under the function's name.'''
+    @wraps(func)
     def inner(*args, **kwargs):
-        conn = psycopg2.connect(
-            user = environ["DATABASE_USERNAME"],
-            password = environ["DATABASE_PASSWORD"],
-            host = environ["DATABASE_IP"],
-            port = environ["DATABASE_PORT"],
-            database = environ["DATABASE_NAME"]
-        )
-        curr = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        kwargs['conn'] = conn
-        kwargs['curr'] = curr
-        try:
+        conn = getattr(_local, 'conn', None)
+        if conn is not None:
+            return _call(conn, func, args, kwargs)
+        with _checkout(get_pool()) as conn:
+            return _call_checked_out(conn, func, args, kwargs)
+    return inner
+
+
+class _Lagging(Exception):
+    '''The chosen replica has not replayed the commits this context must see'''
+
+
+@contextmanager
+def _replica_checkout(replica, min_lsn: int | None) -> Iterator:
+    '''Check a connection out of a replica chosen by the router, first making sure it
+    has replayed `min_lsn`. A replica whose connection fails is ejected.'''
+    conn, served = None, False
+    try:
+        with _checkout(_router.pool(replica)) as conn:
+            if min_lsn is not None and replica.replayed_lsn < min_lsn:
+                with conn.cursor() as curr:
+                    curr.execute(REPLAY_LSN_QUERY)
+                    lsn = curr.fetchone()[0]
+                conn.rollback()
+                _router.replayed(replica, parse_lsn(lsn) if lsn is not None else None)
+                if replica.replayed_lsn < min_lsn:
+                    raise _Lagging()
+            served = True
+            yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        if conn is None or conn.closed:
+            logger.warning('Ejecting replica %s', replica.name, exc_info=True)
+            _router.failed(replica)
+        raise
+    finally:
+        _router.release(replica, served)
+
+
+def __read_connection(func):
+    '''Supply `conn` and `curr` as __connection does, from a read replica when any
+    are configured.
+
+    The replica must have replayed every commit this context has made or was
+    told to wait for; otherwise, when no replica is healthy or when the replica
+    fails, the read is served by the primary.'''
+    @wraps(func)
+    def inner(*args, **kwargs):
+        conn = getattr(_local, 'conn', None)
+        if conn is not None:
+            return _call(conn, func, args, kwargs)
+        if _router is not None:
+            min_lsn = read_lsn()
+            replica = _router.choose(min_lsn)
+            if replica is not None:
+                try:
+                    with _replica_checkout(replica, min_lsn) as conn:
+                        return _call_checked_out(conn, func, args, kwargs)
+                except _Lagging:
+                    pass
+                except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                    logger.warning('Retrying %s on the primary after replica %s failed',
+                                   func.__name__, replica.name)
+        with _checkout(get_pool()) as conn:
+            return _call_checked_out(conn, func, args, kwargs)
+    return inner
+
+
+def __coalesced(func):
+    '''Answer calls made while an identical call runs on another thread with its result.
+
+    Calls are identical when their arguments and the replay position their
+    reads must see are equal. Nested calls, which read inside the caller's
+    transaction, always run.'''
+    @wraps(func)
+    def inner(*args, **kwargs):
+        flights = _flights
+        if flights is None or getattr(_local, 'conn', None) is not None:
             return func(*args, **kwargs)
-        finally:
-            curr.close()
-            conn.close()
+        return flights.do(func.__name__, (args, kwargs, read_lsn()),
+                          partial(func, *args, **kwargs))
     return inner
 
 
+def _committed(curr) -> None:
+    '''Make this context's later reads wait for replicas to replay the commit just made'''
+    if _router is not None:
+        curr.execute(WRITE_LSN_QUERY)
+        written(parse_lsn(curr.fetchone()['lsn']))
+
+
+if environ.get("DATABASE_COALESCE", "1") != "0":
+    configure_coalescing(float(environ.get("DATABASE_COALESCE_TIMEOUT", 30)))
+
+if environ.get("DATABASE_REPLICAS"):
+    configure_replicas([dsn.strip() for dsn in environ["DATABASE_REPLICAS"].split(',')
+                        if dsn.strip()],
+                       float(environ.get("DATABASE_REPLICA_EJECT", 30)))
+
+
 @__connection
-def get_movies(search: str = '', sort_by: str = '', sort_order: str = 'ASC',
-               **kwargs) -> list[dict]:
-    curr = kwargs.get('curr')
-    if search:
-        search = f"%{search}%"
-    if not (search or sort_by):
-        print(sort_order, sort_by)
-        curr.execute('''SELECT * FROM movie_info;''')
-    elif search and not sort_by:
-        curr.execute('''SELECT *
-FROM movie_info
-WHERE title ILIKE %s;''',
-(search,))
-    else:
-        print(sort_by, sort_order)
-        match sort_by:
-            case 'movie_id':
-                sql_sort_by = 'movie_id'
-            case 'title':
-                sql_sort_by = 'title'
-            case 'score':
-                sql_sort_by = 'score'
-            case 'budget':
-                sql_sort_by = 'budget'
-            case 'revenue':
-                sql_sort_by = 'revenue'
-            case _:
-                raise ValueError('sort_by value not recognized')
-        match sort_order:
-            case 'ASC':
-                sql_sort_order = 'ASC'
-            case 'DESC':
-                sort_order = 'DESC'
-            case _:
-                raise ValueError('sort_order value not recognized')
-        if search:
-            q = 'SELECT * FROM movie_info WHERE title LIKE %s ORDER BY {} {};'
+def migrate(**kwargs) -> list[str]:
+    '''Apply pending schema migrations, returning their names'''
+    return apply_migrations(kwargs.get('conn'))
+
+
+# Listings read the movie_listing read model, which holds each movie_info row with its genres
+LISTING_TABLE = 'movie_listing'
+# Columns of a movie as the API returns it; the read model also keeps the ids it filters on
+MOVIE_COLUMNS = ('movie_id', 'title', 'release_date', 'score', 'overview', 'status_name', 'budget',
+                 'revenue', 'country_name', 'language_name', 'orig_title', 'genres')
+
+
+def _order_by(sort_by: str, sort_order: str) -> tuple[str, str]:
+    match sort_by:
+        case 'movie_id':
+            sql_sort_by = 'movie_id'
+        case 'title':
+            sql_sort_by = 'title'
+        case 'score':
+            sql_sort_by = 'score'
+        case 'budget':
+            sql_sort_by = 'budget'
+        case 'revenue':
+            sql_sort_by = 'revenue'
+        case 'relevance':
+            sql_sort_by = 'relevance'
+        case _:
+            raise ValueError('sort_by value not recognized')
+    match (sort_order or 'ASC').upper():
+        case 'ASC':
+            sql_sort_order = 'ASC'
+        case 'DESC':
+            sql_sort_order = 'DESC'
+        case _:
+            raise ValueError('sort_order value not recognized')
+    return sql_sort_by, sql_sort_order
+
+
+def _validate_sort(sort_by: str, sort_order: str, search: str = None) -> None:
+    '''Raise ValueError for a sort _listing_query would reject, without building the query'''
+    if sort_by and _order_by(sort_by, sort_order)[0] == 'relevance' and not search:
+        raise ValueError('relevance ordering requires a search term')
+
+
+def _listing_query(conditions: list[sql.Composable], params: list, sort_by: str, #pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals,too-many-branches
+                   sort_order: str, limit: int = None, after: tuple = None,
+                   search: str = None) -> tuple[sql.Composed, list]:
+    '''Build a movie listing query.
+
+    `after` is the (sort value, movie_id) of the last row of the previous page;
+    rows after it are found by comparing against the sort key with movie_id as a
+    tiebreaker, so every page costs the same however deep it is. NULL sort values
+    are ordered last in both directions by leading the sort key with whether the
+    value is NULL, which the read model's indexes match, so a page is one index
+    range scan. Sorting by relevance ranks titles by trigram similarity to `search`.'''
+    if (limit is not None or after is not None) and not sort_by:
+        sort_by = 'movie_id'
+    conditions, params = list(conditions), list(params)
+    columns, select_params = sql.SQL(', ').join(map(sql.Identifier, MOVIE_COLUMNS)), []
+    order, order_params = sql.SQL(''), []
+    if sort_by:
+        sql_sort_by, sql_sort_order = _order_by(sort_by, sort_order)
+        direction = sql.SQL(sql_sort_order)
+        column, column_params = sql.Identifier(sql_sort_by), []
+        placeholder = sql.SQL('%s')
+        if sql_sort_by == 'relevance':
+            if not search:
+                raise ValueError('relevance ordering requires a search term')
+            column, column_params = sql.SQL('similarity(title, %s)'), [search]
+            # The cursor holds the rank as a decimal, which must compare as the real it came from
+            placeholder = sql.SQL('CAST(%s AS real)')
+            columns += sql.SQL(', similarity(title, %s) AS relevance')
+            select_params = [search]
+        comparison = sql.SQL('<' if sql_sort_order == 'DESC' else '>')
+        # Sorts before the NULLs in the sort direction: false ascending, true descending
+        if sql_sort_order == 'DESC':
+            nulls, not_null = sql.SQL('{} IS NOT NULL').format(column), sql.SQL('true')
         else:
-            q = 'SELECT * FROM movie_info ORDER BY {} {};'
-        q = sql.SQL(q)
-        q = q.format(sql.Identifier(sql_sort_by), sql.SQL(sql_sort_order))
-        if search:
-            curr.execute(q, (search,))
+            nulls, not_null = sql.SQL('{} IS NULL').format(column), sql.SQL('false')
+        if after is not None:
+            value, movie_id = after
+            if sql_sort_by == 'movie_id':
+                conditions.append(sql.SQL('movie_id {} %s').format(comparison))
+                params.append(movie_id)
+            elif value is None:
+                conditions.append(sql.SQL('({col} IS NULL AND movie_id {cmp} %s)').format(
+                    col=column, cmp=comparison))
+                params.extend(column_params + [movie_id])
+            else:
+                conditions.append(sql.SQL(
+                    '({nulls}, {col}, movie_id) {cmp} ({not_null}, {value}, %s)').format(
+                        nulls=nulls, col=column, cmp=comparison, not_null=not_null,
+                        value=placeholder))
+                params.extend(column_params * 2 + [value, movie_id])
+        if sql_sort_by == 'movie_id':
+            order = sql.SQL(' ORDER BY movie_id {}').format(direction)
         else:
-            curr.execute(q)
-    movies = curr.fetchall()
-    for movie in movies:
-        curr.execute('''SELECT genre_name
-FROM genre_assignments 
-JOIN genres 
-ON (genre_assignments.genre_id=genres.genre_id) 
-WHERE movie_id=%s;''',
-(movie['movie_id'],))
-        genres = curr.fetchall()
-        movie['genres'] = [genre['genre_name'] for genre in genres]
-    return movies
+            order = sql.SQL(' ORDER BY {nulls} {dir}, {col} {dir}, movie_id {dir}').format(
+                nulls=nulls, col=column, dir=direction)
+            order_params = column_params * 2
+    where = sql.SQL('')
+    if conditions:
+        where = sql.SQL(' WHERE ') + sql.SQL(' AND ').join(conditions)
+    query = sql.SQL('SELECT {} FROM {}').format(columns, sql.Identifier(LISTING_TABLE))
+    query += where + order
+    params = select_params + params + order_params
+    if limit is not None:
+        query += sql.SQL(' LIMIT %s')
+        params.append(limit)
+    return query + sql.SQL(';'), params
 
 
-@__connection
-def get_genre_id(genre_name: str, **kwargs):
+def _stream(query: sql.Composed, params: list, batch_size: int, name: str) -> Iterator[dict]:
+    '''Yield rows from a server-side cursor, fetching `batch_size` rows per round trip.
+
+    The connection is checked out on first iteration, from a replica when one
+    can serve the reads of this context, and returned when the generator is
+    exhausted or closed.'''
+    min_lsn = read_lsn()
+    replica = _router.choose(min_lsn) if _router is not None else None
+    if replica is not None:
+        rows = 0
+        try:
+            with _replica_checkout(replica, min_lsn) as conn:
+                for row in _stream_from(conn, query, params, batch_size, name):
+                    rows += 1
+                    yield row
+            return
+        except _Lagging:
+            pass
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # Rows already sent cannot be taken back, so only a stream yet to start moves
+            if rows:
+                raise
+    with _checkout(get_pool()) as conn:
+        yield from _stream_from(conn, query, params, batch_size, name)
+
+
+def _stream_from(conn, query: sql.Composed, params: list, batch_size: int,
+                 name: str) -> Iterator[dict]:
+    curr = TimedCursor(conn.cursor(name=f'stream_{uuid.uuid4().hex}',
+                                   cursor_factory=psycopg2.extras.RealDictCursor), name)
+    try:
+        curr.itersize = batch_size
+        curr.execute(query, params)
+        yield from curr
+    finally:
+        curr.close()
+
+
+def _search_conditions(search: str) -> tuple[list[sql.Composable], list]:
+    '''Match titles containing `search`; the trigram index on title serves this pattern'''
+    if not search:
+        return [], []
+    escaped = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return [sql.SQL('title ILIKE %s')], [f"%{escaped}%"]
+
+
+@__coalesced
+@__read_connection
+def _query_movies(search: str, sort_by: str, sort_order: str, limit: int, after: tuple,
+                  **kwargs) -> list[dict]:
     curr = kwargs.get('curr')
-    curr.execute('SELECT genre_id FROM genres WHERE genre_name=%s;', (genre_name,))
-    genre_id = curr.fetchone()
-    if not genre_id:
-        raise ValueError('Genre not recognized')
-    return genre_id['genre_id']
+    conditions, params = _search_conditions(search)
+    _statements.execute(curr, *_listing_query(conditions, params, sort_by, sort_order, limit,
+                                              after, search))
+    return curr.fetchall()
 
 
-@__connection
-def get_status_id(status_name: str, **kwargs):
+def get_movies(search: str = '', sort_by: str = '', sort_order: str = 'ASC',
+               limit: int = None, after: tuple = None) -> list[dict]:
+    '''List movies, from the catalogue snapshot when one is enabled and can answer the query'''
+    movies = _snapshot_listing(search, None, sort_by, sort_order, limit, after)
+    if movies is not None:
+        return movies
+    return _query_movies(search, sort_by, sort_order, limit, after)
+
+
+def stream_movies(search: str = '', sort_by: str = '', sort_order: str = 'ASC',
+                  batch_size: int = STREAM_BATCH_SIZE) -> Iterator[dict]:
+    '''Lazily yield the same movies as get_movies without buffering the result set'''
+    conditions, params = _search_conditions(search)
+    return _stream(*_listing_query(conditions, params, sort_by, sort_order, search=search),
+                   batch_size, 'stream_movies')
+
+
+@__read_connection
+def _load_lookup(table: str, id_column: str, name_column: str, **kwargs) -> dict[str, int]:
     curr = kwargs.get('curr')
-    curr.execute('SELECT status_id FROM statuses WHERE status_name=%s;', (status_name,))
-    status_id = curr.fetchone()
-    if not status_id:
+    curr.execute(sql.SQL('SELECT {} AS id, {} AS name FROM {};').format(
+        sql.Identifier(id_column), sql.Identifier(name_column), sql.Identifier(table)))
+    return {row['name']: row['id'] for row in curr.fetchall()}
+
+
+_lookups = {
+    table: LookupTable(partial(_load_lookup, table, id_column, name_column),
+                       ttl=float(environ.get("LOOKUP_CACHE_TTL", 300)))
+    for table, id_column, name_column in (('genres', 'genre_id', 'genre_name'),
+                                          ('statuses', 'status_id', 'status_name'),
+                                          ('languages', 'language_id', 'language_name'),
+                                          ('countries', 'country_id', 'country_name'))
+}
+
+
+def warm_lookups() -> None:
+    '''Load every lookup table with one query each'''
+    for lookup in _lookups.values():
+        lookup.warm()
+
+
+def invalidate_lookups(table: str = None) -> None:
+    '''Drop one cached lookup table, or all of them, after it has been written to'''
+    for name, lookup in _lookups.items():
+        if table in (None, name):
+            lookup.invalidate()
+
+
+def lookup_stats() -> dict[str, dict[str, int]]:
+    '''Return hit and miss counters of each lookup table'''
+    return {name: lookup.stats() for name, lookup in _lookups.items()}
+
+
+def get_genre_id(genre_name: str) -> int:
+    genre_id = _lookups['genres'].get(genre_name)
+    if genre_id is None:
+        raise ValueError('Genre not recognized')
+    return genre_id
+
+
+def get_status_id(status_name: str) -> int:
+    status_id = _lookups['statuses'].get(status_name)
+    if status_id is None:
         raise ValueError('Status not recognized')
-    return status_id['status_id']
+    return status_id
 
 
-@__connection
-def get_language_id(language_name: str, **kwargs):
-    curr = kwargs.get('curr')
-    curr.execute('SELECT language_id FROM languages WHERE language_name=%s;', (language_name,))
-    language_id = curr.fetchone()
-    if not language_id:
+def get_language_id(language_name: str) -> int:
+    language_id = _lookups['languages'].get(language_name)
+    if language_id is None:
         raise ValueError('Language not recognized')
-    return language_id['language_id']
+    return language_id
 
 
-@__connection
-def get_country_id(country_name: str, **kwargs):
-    curr = kwargs.get('curr')
-    curr.execute('SELECT country_id FROM countries WHERE country_name=%s;', (country_name,))
-    country_id = curr.fetchone()
-    if not country_id:
+def get_country_id(country_name: str) -> int:
+    country_id = _lookups['countries'].get(country_name)
+    if country_id is None:
         raise ValueError('Country not recognized')
-    return country_id['country_id']
+    return country_id
 
 
-@__connection
+# A movie document is one row of the read model, with its genres already aggregated into an array
+MOVIE_QUERY = f"SELECT {', '.join(MOVIE_COLUMNS)} FROM {LISTING_TABLE} WHERE movie_id=%s;"
+MOVIES_QUERY = f"SELECT {', '.join(MOVIE_COLUMNS)} FROM {LISTING_TABLE} WHERE movie_id = ANY(%s);"
+
+
+def _validate_movie_ids(movie_ids: list[int]) -> None:
+    if not isinstance(movie_ids, list) or not all(
+            isinstance(movie_id, int) and not isinstance(movie_id, bool) for movie_id in movie_ids):
+        raise TypeError("'movie_ids' must be a list of int")
+
+
+def _in_requested_order(movie_ids: list[int], movies: list[dict]) -> list[dict]:
+    found = {movie['movie_id']: movie for movie in movies}
+    return [found[movie_id] for movie_id in dict.fromkeys(movie_ids) if movie_id in found]
+
+
+@__coalesced
+@__read_connection
 def get_movie_by_id(movie_id: int, **kwargs) -> dict[str, Any]:
+    '''Return a single movie document with its genres as an array'''
     curr = kwargs.get('curr')
     if not isinstance(movie_id, int) or isinstance(movie_id, bool):
         raise TypeError("'movie_id' must be of type int")
-    curr.execute('''SELECT *
-FROM movies
-JOIN statuses ON (movies.status_id=statuses.status_id)
-JOIN languages ON (movies.language_id=languages.language_id)
-JOIN countries ON (movies.country_id=countries.country_id)
-JOIN genre_assignments ON (movies.movie_id=genre_assignments.movie_id)
-JOIN genres ON (genre_assignments.genre_id=genres.genre_id)
-WHERE movies.movie_id=%s;''',
-(movie_id,))
+    _statements.execute(curr, MOVIE_QUERY, (movie_id,))
     movie = curr.fetchone()
     if not movie:
         raise ValueError('No movie with that id was found')
     return movie
 
 
-@__connection
-def create_movie(title: str, release_date: date, genre: str, overview: str,
-                status: str, budget: int, revenue: int, country: str, language: str,
-                orig_title: str, **kwargs) -> dict:
+@__coalesced
+@__read_connection
+def get_movies_by_ids(movie_ids: list[int], **kwargs) -> list[dict[str, Any]]:
+    '''Return the movie documents of many ids with one query.
+
+    Movies come back in the order their ids were given; ids with no movie are
+    left out.'''
+    curr = kwargs.get('curr')
+    _validate_movie_ids(movie_ids)
+    if not movie_ids:
+        return []
+    _statements.execute(curr, MOVIES_QUERY, (list(movie_ids),))
+    return _in_requested_order(movie_ids, curr.fetchall())
+
+
+def _validate_movie(title: str, release_date: date, genre: str | list[str], overview: str, #pylint: disable=too-many-arguments,too-many-positional-arguments
+                    status: str, budget: int, revenue: int, country: str, language: str,
+                    orig_title: str) -> None:
     if not isinstance(title, str):
         raise TypeError('title must be of type str')
     if not isinstance(release_date, date):
         raise TypeError('release_date must be of type date')
-    if not isinstance(genre, str):
-        raise TypeError('genre must be of type str')
+    if not (isinstance(genre, str) or (isinstance(genre, list) and genre
+                                       and all(isinstance(g, str) for g in genre))):
+        raise TypeError('genre must be of type str or a non-empty list of str')
     if not isinstance(overview, str):
         raise TypeError('overview must be of type str')
     if not isinstance(status, str):
@@ -172,25 +612,48 @@ def create_movie(title: str, release_date: date, genre: str, overview: str,
         raise TypeError('language must be of type str')
     if not isinstance(orig_title, str):
         raise TypeError('orig_title must be of type str')
-    genre_id = get_genre_id(genre)
+
+
+def _genre_ids(genre: str | list[str]) -> list[int]:
+    genres = [genre] if isinstance(genre, str) else genre
+    return list(dict.fromkeys(get_genre_id(name) for name in genres))
+
+
+@__connection
+def create_movie(title: str, release_date: date, genre: str | list[str], overview: str,
+                status: str, budget: int, revenue: int, country: str, language: str,
+                orig_title: str, **kwargs) -> dict:
+    '''Insert a movie and its genre assignments atomically.
+
+    Names are resolved from the cached lookup tables, so the movie row and its
+    genres are written by a single statement followed by one commit.'''
+    _validate_movie(title, release_date, genre, overview, status, budget, revenue, country,
+                    language, orig_title)
+    genre_ids = _genre_ids(genre)
     status_id = get_status_id(status)
     country_id = get_country_id(country)
     language_id = get_language_id(language)
     curr = kwargs.get('curr')
     conn = kwargs.get('conn')
     curr.execute('''
-INSERT INTO movies
-(title, release_date, overview, status_id, budget, revenue, country_id, language_id, orig_title)
-VALUES
-(%s, %s, %s, %s, %s, %s, %s, %s, %s);
+WITH new_movie AS (
+    INSERT INTO movies
+    (title, release_date, overview, status_id, budget, revenue, country_id, language_id,
+     orig_title)
+    VALUES
+    (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+    RETURNING movie_id
+), assigned AS (
+    INSERT INTO genre_assignments (movie_id, genre_id)
+    SELECT movie_id, genre_id FROM new_movie, unnest(%s::int[]) AS genre_id
+)
+SELECT movie_id FROM new_movie;
 ''', (title, release_date, overview, status_id, budget, revenue, country_id,
-     language_id, orig_title))
-    conn.commit()
-    curr.execute("SELECT pg_get_serial_sequence('movies', 'movie_id');")
+     language_id, orig_title, genre_ids))
     movie_id = curr.fetchone()['movie_id']
-    curr.execute('INSERT INTO genre_assignments (movie_id, genre_id) VALUES (%s, %s);',
-                  (movie_id, genre_id))
     conn.commit()
+    _committed(curr)
+    _snapshot_written()
     return {
         'movie_id': movie_id,
         'title': title,
@@ -206,100 +669,616 @@ VALUES
     }
 
 
+def _movie_row(title: str, release_date: date, genre: str | list[str], overview: str, #pylint: disable=too-many-arguments,too-many-positional-arguments
+               status: str, budget: int, revenue: int, country: str, language: str,
+               orig_title: str) -> tuple[tuple, list[int]]:
+    _validate_movie(title, release_date, genre, overview, status, budget, revenue, country,
+                    language, orig_title)
+    return (title, release_date, overview, get_status_id(status), budget, revenue,
+            get_country_id(country), get_language_id(language), orig_title), _genre_ids(genre)
+
+
+# Ids are drawn before inserting so that each can be reported against its movie's ordinal,
+# as RETURNING does not promise the order of VALUES. Columns that may be NULL in every row
+# of a page are cast, as VALUES alone would make them text.
+CREATE_MOVIES_QUERY = '''
+WITH batch AS (
+    SELECT ordinal, nextval(pg_get_serial_sequence('movies', 'movie_id')) AS movie_id, title,
+           release_date::date, overview::text, status_id::int, budget::bigint,
+           revenue::bigint, country_id::int, language_id::int, orig_title::text
+    FROM (VALUES %s) AS movie (ordinal, title, release_date, overview, status_id, budget,
+                               revenue, country_id, language_id, orig_title)
+), inserted AS (
+    INSERT INTO movies (movie_id, title, release_date, overview, status_id, budget, revenue,
+                        country_id, language_id, orig_title)
+    SELECT movie_id, title, release_date, overview, status_id, budget, revenue, country_id,
+           language_id, orig_title
+    FROM batch
+    RETURNING movie_id
+)
+SELECT ordinal, movie_id FROM batch JOIN inserted USING (movie_id);'''
+
+
+@__connection
+def create_movies(movies: list[dict[str, Any]], page_size: int = 1000,
+                  **kwargs) -> list[dict[str, Any]]:
+    '''Insert many movies and their genres in a single transaction.
+
+    Each movie is a dict of create_movie's arguments. Lookups are served from
+    the cached dimension tables and rows are sent `page_size` at a time with
+    execute_values. Returns one result per movie, in order: {'movie_id': ...}
+    or {'error': ...} for movies that failed validation or named an unknown
+    genre, status, country or language.'''
+    curr = kwargs.get('curr')
+    conn = kwargs.get('conn')
+    results, rows, genre_ids = [], [], {}
+    for ordinal, movie in enumerate(movies):
+        try:
+            row, genre_ids[ordinal] = _movie_row(**movie)
+        except (TypeError, ValueError) as e:
+            results.append({'error': str(e)})
+            continue
+        results.append(None)
+        rows.append((ordinal,) + row)
+    if not rows:
+        return results
+    inserted = psycopg2.extras.execute_values(curr, CREATE_MOVIES_QUERY, rows,
+                                              page_size=page_size, fetch=True)
+    movie_ids = {row['ordinal']: row['movie_id'] for row in inserted}
+    psycopg2.extras.execute_values(
+        curr, 'INSERT INTO genre_assignments (movie_id, genre_id) VALUES %s;',
+        [(movie_id, genre_id) for ordinal, movie_id in movie_ids.items()
+         for genre_id in genre_ids[ordinal]], page_size=page_size)
+    conn.commit()
+    _committed(curr)
+    _snapshot_written()
+    return [result or {'movie_id': movie_ids[ordinal]} for ordinal, result in enumerate(results)]
+
+
 @__connection
 def delete_movie(movie_id: int, **kwargs) -> bool:
     curr = kwargs.get('curr')
     conn = kwargs.get('conn')
     if not isinstance(movie_id, int) or isinstance(movie_id, bool):
         raise TypeError('movie_id must be of type int')
-    curr.execute('DELETE FROM movies WHERE movie_id=%s RETURNING count', (movie_id,))
+    curr.execute('DELETE FROM movies WHERE movie_id=%s;', (movie_id,))
+    deleted = curr.rowcount > 0
     conn.commit()
-    return curr.fetchone()['count'] > 0
+    _committed(curr)
+    _snapshot_written()
+    return deleted
 
 
-@__connection
-def get_movies_by_genre(genre_id: int, **kwargs) -> list[dict[str, Any]]:
-    if not isinstance(genre_id, int) or isinstance(genre_id, bool):
-        raise TypeError('genre_id must be of type int')
+def _validate_genres(genres: str | list[str]) -> list[str]:
+    if isinstance(genres, str):
+        genres = [genres]
+    if not isinstance(genres, list) or not genres or not all(
+            isinstance(genre, str) for genre in genres):
+        raise TypeError('genres must be a genre name or a non-empty list of them')
+    return genres
+
+
+def _genre_condition(genres: list[str], match_all: bool, selected: int) -> tuple[str, list]:
+    '''Return the listing condition of a genre selection sorted by anything but movie_id'''
+    if selected.bit_count() <= GENRE_ID_LIST_MAX:
+        return 'movie_id = ANY(%s)', [list(set_bits(selected))]
+    return 'genres @> %s::text[]' if match_all else 'genres && %s::text[]', [genres]
+
+
+def _genre_selection(genres: list[str], match_all: bool) -> tuple[GenreBitmaps, int]:
+    for genre in genres:
+        get_genre_id(genre)
+    bitmaps = _genre_index.get()
+    return bitmaps, bitmaps.select(genres, match_all)
+
+
+@__coalesced
+@__read_connection
+def _query_movies_where(condition: str, params: list, sort_by: str, sort_order: str, #pylint: disable=too-many-arguments,too-many-positional-arguments
+                        limit: int, after: tuple, **kwargs) -> list[dict]:
     curr = kwargs.get('curr')
-    curr.execute('''
-SELECT * FROM genre_assignments
-JOIN genres ON (genre_assignment.genre_id=genres.genre_id)
-JOIN movies ON (genre_assignment.movie_id=movies.movie_id)
-JOIN statuses ON (statuses.status_id=movies.status_id)
-JOIN languages ON (languages.language_id=movies.language_id)
-JOIN countries ON (countries.country_id=movies.country_id)
-WHERE genre_id=%s
-''', (genre_id,))
+    _statements.execute(curr, *_listing_query([sql.SQL(condition)], params, sort_by, sort_order,
+                                              limit, after))
+    return curr.fetchall()
+
+
+def get_movies_by_genre(genres: str | list[str], match_all: bool = True, sort_by: str = None, #pylint: disable=too-many-arguments,too-many-positional-arguments
+                        sort_order: str = None, limit: int = None,
+                        after: tuple = None) -> list[dict]:
+    '''List the movies with every one of `genres`, or with any of them unless `match_all`.
+
+    The movies are selected from the in-process genre bitmaps. In movie_id
+    order a page is read straight off the bitmap and fetched by id; other
+    sorts filter the listing by the selected ids when there are few, or by
+    the genres array through its GIN index, or slice the catalogue snapshot
+    when one is enabled.'''
+    genres = _validate_genres(genres)
+    _validate_sort(sort_by, sort_order)
+    _, selected = _genre_selection(genres, match_all)
+    movies = _snapshot_listing(None, None, sort_by, sort_order, limit, after, selected)
+    if movies is not None:
+        return movies
+    if not sort_by or sort_by == 'movie_id':
+        descending = (sort_order or 'ASC').upper() == 'DESC'
+        return get_movies_by_ids(GenreBitmaps.page(selected, descending,
+                                                   after[1] if after is not None else None,
+                                                   limit))
+    return _query_movies_where(*_genre_condition(genres, match_all, selected), sort_by,
+                               sort_order, limit, after)
+
+
+def get_genre_facets(genres: str | list[str], match_all: bool = True) -> dict[str, Any]:
+    '''Return how many movies get_movies_by_genre lists, and how many of them have each
+    genre, counted from the genre bitmaps without a query'''
+    bitmaps, selected = _genre_selection(_validate_genres(genres), match_all)
+    return {'movie_count': selected.bit_count(), 'facets': bitmaps.facets(selected)}
+
+
+@__coalesced
+@__read_connection
+def _query_movies_by_country(country_id: int, sort_by: str, sort_order: str, limit: int,
+                             after: tuple, **kwargs) -> list[dict]:
+    curr = kwargs.get('curr')
+    _statements.execute(curr, *_listing_query([sql.SQL('country_id=%s')], [country_id],
+                                              sort_by, sort_order, limit, after))
     return curr.fetchall()
 
 
-@__connection
 def get_movie_by_country(country_code: str, sort_by: str = None, sort_order: str = None,
-                         **kwargs) -> list[dict]:
+                         limit: int = None, after: tuple = None) -> list[dict]:
+    '''List the movies of a country, found by the id its code maps to in the countries
+    table, so that each sort is a range scan of one (country_id, sort key) index, or a
+    slice of the catalogue snapshot when one is enabled'''
+    country_id = _lookups['countries'].get(country_code)
+    _validate_sort(sort_by, sort_order)
+    if country_id is None:
+        return []
+    movies = _snapshot_listing(None, country_id, sort_by, sort_order, limit, after)
+    if movies is not None:
+        return movies
+    return _query_movies_by_country(country_id, sort_by, sort_order, limit, after)
+
+
+def stream_movie_by_country(country_code: str, sort_by: str = None, sort_order: str = None,
+                            batch_size: int = STREAM_BATCH_SIZE) -> Iterator[dict]:
+    '''Lazily yield the same movies as get_movie_by_country without buffering the result set'''
+    country_id = _lookups['countries'].get(country_code)
+    query, params = _listing_query([sql.SQL('country_id=%s')], [country_id], sort_by, sort_order)
+    if country_id is None:
+        return iter(())
+    return _stream(query, params, batch_size, 'stream_movie_by_country')
+
+
+# Read from the rollup the migrations keep up to date, one row per country with movies
+COUNTRY_SUMMARY_QUERY = '''
+SELECT country_name AS country_code, movie_count,
+       round(score_total / NULLIF(scored_count, 0), 2) AS average_score,
+       budget_total::bigint AS total_budget, revenue_total::bigint AS total_revenue
+FROM country_summary
+JOIN countries ON (countries.country_id=country_summary.country_id)
+WHERE movie_count > 0
+ORDER BY country_name;
+'''
+
+
+@__coalesced
+@__read_connection
+def get_country_summaries(**kwargs) -> list[dict]:
+    '''Return the movie count, average score and total budget and revenue of each country'''
     curr = kwargs.get('curr')
-    if not sort_by:
-        curr.execute('''
-SELECT * FROM movie_info
-WHERE country_name=%s;
-''', (country_code,))
-    else:
-        sql_sort_by = ''
-        match sort_by:
-            case 'movie_id':
-                sql_sort_by = 'movie_id'
-            case 'title':
-                sql_sort_by = 'title'
-            case 'score':
-                sql_sort_by = 'score'
-            case 'budget':
-                sql_sort_by = 'budget'
-            case 'revenue':
-                sql_sort_by = 'revenue'
-            case _:
-                raise ValueError('sort_by value not recognized')
-        sql_sort_order = 'DESC'
-        if sort_order == 'ASC':
-            sql_sort_order = 'ASC'
-        q = 'SELECT * FROM movie_info WHERE country_name=%s ORDER BY {} {}'
-        q = sql.SQL(q)
-        q.format(sql.Identifier(sql_sort_by), sql.SQL(sql_sort_order))
-        curr.execute(q, (country_code,))
-
-    movies = curr.fetchall()
-    for movie in movies:
-        curr.execute('''SELECT genre_name 
-                     FROM genre_assignments 
-                     JOIN genres 
-                        ON (genre_assignment.genre_id=genres.genre_id) 
-                     WHERE movie_id=%s;''',
-                      (movie['movie_id']))
-        genres = curr.fetchall()
-        movie['genres'] = [genre['genre_name'] for genre in genres]
-    return movies
+    curr.execute(COUNTRY_SUMMARY_QUERY)
+    return curr.fetchall()
+
+
+# Dimensions /stats groups movies by, and the aggregates reported for each group
+STATS_DIMENSIONS = ('country', 'genre', 'language', 'year')
+STATS_AGGREGATES = ('movies', 'average_score', 'total_budget', 'total_revenue', 'average_budget',
+                    'average_revenue')
+# Every movie has exactly one country, so the catalogue totals are those of its countries
+CATALOGUE_STATS_QUERY = """
+SELECT dimension, group_key, movie_count::bigint AS movies,
+       round(score_total / NULLIF(scored_count, 0), 2) AS average_score,
+       budget_total::bigint AS total_budget, revenue_total::bigint AS total_revenue,
+       round(budget_total / NULLIF(movie_count, 0))::bigint AS average_budget,
+       round(revenue_total / NULLIF(movie_count, 0))::bigint AS average_revenue
+FROM (
+    SELECT dimension, group_key, movie_count, scored_count, score_total, budget_total,
+           revenue_total
+    FROM catalogue_stats
+    WHERE dimension = ANY(%s) AND movie_count > 0
+    UNION ALL
+    SELECT 'totals', NULL, coalesce(sum(movie_count), 0), sum(scored_count), sum(score_total),
+           coalesce(sum(budget_total), 0), coalesce(sum(revenue_total), 0)
+    FROM catalogue_stats
+    WHERE dimension = 'country'
+) AS stats
+ORDER BY dimension, group_key;
+"""
+
+
+def _validate_stats(group_by: list[str], aggregates: list[str]) -> None:
+    for dimension in group_by:
+        if dimension not in STATS_DIMENSIONS:
+            raise ValueError(f'group_by must be one of {", ".join(STATS_DIMENSIONS)}')
+    for aggregate in aggregates:
+        if aggregate not in STATS_AGGREGATES:
+            raise ValueError(f'aggregates must be among {", ".join(STATS_AGGREGATES)}')
+
+
+def _catalogue_stats(rows: list[dict], group_by: list[str],
+                     aggregates: list[str]) -> dict[str, Any]:
+    '''Shape rollup rows into the catalogue totals and a list of groups per dimension'''
+    stats = {dimension: [] for dimension in group_by}
+    for row in rows:
+        values = {aggregate: row[aggregate] for aggregate in aggregates}
+        if row['dimension'] == 'totals':
+            stats['totals'] = values
+        elif row['dimension'] in stats:
+            key = int(row['group_key']) if row['dimension'] == 'year' else row['group_key']
+            stats[row['dimension']].append({row['dimension']: key, **values})
+    return stats
+
+
+def get_catalogue_stats(group_by: list[str] = None,
+                        aggregates: list[str] = None) -> dict[str, Any]:
+    '''Return the catalogue's totals and, for each dimension of `group_by`, the same
+    aggregates for each of its groups, read from the catalogue_stats rollup.
+
+    `aggregates` picks among STATS_AGGREGATES, all of them by default.'''
+    group_by, aggregates = list(group_by or []), list(aggregates or STATS_AGGREGATES)
+    _validate_stats(group_by, aggregates)
+    return _catalogue_stats(_query_catalogue_stats(sorted(set(group_by))), group_by, aggregates)
+
+
+@__coalesced
+@__read_connection
+def _query_catalogue_stats(dimensions: list[str], **kwargs) -> list[dict]:
+    curr = kwargs.get('curr')
+    _statements.execute(curr, CATALOGUE_STATS_QUERY, (dimensions,))
+    return curr.fetchall()
+
+
+# The snapshot holds every movie document with the country id it is filtered on. Parsing a
+# text[] per row is most of what reading it costs, so genres come joined into one string.
+SNAPSHOT_QUERY = (f"SELECT {', '.join(SNAPSHOT_COLUMNS[:-1])}, "
+                  f"array_to_string(genres, E'\\x{ord(GENRE_SEPARATOR):02x}') FROM {LISTING_TABLE}")
+SNAPSHOT_XMIN_QUERY = 'SELECT pg_snapshot_xmin(pg_current_snapshot())::text AS xmin;'
+# Transactions from xmin on may not have been visible to the last read of the change log, so
+# the movies they changed are read again; those before it all were
+SNAPSHOT_CHANGES_QUERY = '''
+SELECT pg_snapshot_xmin(pg_current_snapshot())::text AS xmin,
+       ARRAY(SELECT DISTINCT movie_id FROM movie_listing_changes WHERE xid >= %s::xid8)
+       AS movie_ids;
+'''
+# Whether 'É' ILIKE 'é', spelled in bytes so that it can be asked in any server encoding
+SNAPSHOT_COLLATION_QUERY = r'''
+SELECT ARRAY(SELECT probe FROM unnest(%s::text[]) AS probe ORDER BY probe) AS sorted,
+       convert_from('\xc389', 'UTF8') ILIKE convert_from('\xc3a9', 'UTF8') AS folds;
+'''
+PRUNE_CHANGES_QUERY = '''
+DELETE FROM movie_listing_changes WHERE changed_at < now() - make_interval(secs => %s);
+'''
+
+_snapshot = None
+
+
+def _c_collation(row: dict) -> bool:
+    '''Return if SNAPSHOT_COLLATION_QUERY found that the database orders and folds text as
+    the snapshot does, byte by byte'''
+    return row['sorted'] == sorted(COLLATION_PROBES, key=str.encode) and not row['folds']
+
+
+def _snapshot_rows(conn, query: str, params: tuple = None) -> dict[str, list]:
+    '''Run a SNAPSHOT_QUERY and return its columns; building a dict per row would take
+    longer than the query, so it is read from a plain cursor'''
+    return to_columns(_plain_rows(conn, query, params))
+
+
+@__connection
+def _load_snapshot(prune_after: float, **kwargs) -> tuple[int, dict[str, list], bool]:
+    '''Read every movie for a full snapshot load, and delete changes older than
+    `prune_after` seconds, which no process still catching up from the log can need'''
+    curr = kwargs.get('curr')
+    conn = kwargs.get('conn')
+    curr.execute(SNAPSHOT_XMIN_QUERY)
+    xmin = int(curr.fetchone()['xmin'])
+    columns = _snapshot_rows(conn, SNAPSHOT_QUERY + ';')
+    curr.execute(SNAPSHOT_COLLATION_QUERY, (COLLATION_PROBES,))
+    c_collation = _c_collation(curr.fetchone())
+    curr.execute(PRUNE_CHANGES_QUERY, (prune_after,))
+    conn.commit()
+    return xmin, columns, c_collation
+
+
+@__connection
+def _snapshot_changes(xmin: int, **kwargs) -> tuple[int, list[int], dict[str, list]]:
+    '''Read the movies changed by transactions from `xmin` on'''
+    curr = kwargs.get('curr')
+    curr.execute(SNAPSHOT_CHANGES_QUERY, (str(xmin),))
+    row = curr.fetchone()
+    columns = to_columns([])
+    if row['movie_ids']:
+        columns = _snapshot_rows(kwargs.get('conn'), SNAPSHOT_QUERY + ' WHERE movie_id = ANY(%s);',
+                                 (row['movie_ids'],))
+    return int(row['xmin']), row['movie_ids'], columns
+
+
+def enable_snapshot(refresh_interval: float = 1.0, rebuild_interval: float = 1800.0) -> None:
+    '''Serve listings from an in-memory catalogue snapshot (requires numpy).
+
+    It is loaded on the first listing and then kept up to date from the
+    movie_listing_changes log every `refresh_interval` seconds, so other
+    processes' writes show up in this one's listings that much later.'''
+    global _snapshot #pylint: disable=global-statement
+    # A process loads everything again once its last full load is rebuild_interval old, so no
+    # process reads changes older than that from the log
+    _snapshot = CatalogueSnapshot(partial(_load_snapshot, 2 * rebuild_interval),
+                                  _snapshot_changes, refresh_interval, rebuild_interval)
+
+
+def disable_snapshot() -> None:
+    '''Serve listings from Postgres again and drop the snapshot'''
+    global _snapshot #pylint: disable=global-statement
+    _snapshot = None
+
+
+def snapshot_stats() -> dict[str, Any] | None:
+    '''Return the snapshot's refresh counters and memory, or None when it is disabled'''
+    return _snapshot.stats() if _snapshot is not None else None
+
+
+def _snapshot_listing(search: str | None, country_id: int | None, sort_by: str, #pylint: disable=too-many-arguments,too-many-positional-arguments
+                      sort_order: str, limit: int, after: tuple,
+                      movies: int = None) -> list[dict] | None:
+    # The snapshot can trail the primary by a refresh, too far behind a session's own writes
+    if _snapshot is None or read_lsn() is not None:
+        return None
+    if (limit is not None or after is not None) and not sort_by:
+        sort_by = 'movie_id'
+    _validate_sort(sort_by, sort_order, search)
+    return _snapshot.get().listing(search, country_id, sort_by, sort_order, limit, after,
+                                   movies)
+
+
+def _snapshot_written() -> None:
+    _genre_index.invalidate()
+    if _snapshot is not None:
+        _snapshot.invalidate()
+
+
+if environ.get("CATALOGUE_SNAPSHOT", "0") != "0":
+    enable_snapshot(float(environ.get("CATALOGUE_SNAPSHOT_REFRESH", 1)),
+                    float(environ.get("CATALOGUE_SNAPSHOT_REBUILD", 1800)))
+
+
+# Genre listings selecting at most this many movies are filtered by their ids
+GENRE_ID_LIST_MAX = 1000
+GENRE_INDEX_QUERY = (f"SELECT movie_id, array_to_string(genres, "
+                     f"E'\\x{ord(GENRE_SEPARATOR):02x}') FROM {LISTING_TABLE}")
+
+
+def _plain_rows(conn, query: str, params: tuple = None) -> list[tuple]:
+    with TimedCursor(conn.cursor(), '_plain_rows') as curr:
+        curr.execute(query, params)
+        return curr.fetchall()
 
 
 @__connection
-def create_review(movie_id: int, review_text: str) -> None:
-    ...
+def _load_genre_index(prune_after: float, **kwargs) -> tuple[int, list[tuple]]:
+    '''Read the genres of every movie for the genre bitmaps, and prune the change log as
+    _load_snapshot does'''
+    curr = kwargs.get('curr')
+    conn = kwargs.get('conn')
+    curr.execute(SNAPSHOT_XMIN_QUERY)
+    xmin = int(curr.fetchone()['xmin'])
+    rows = _plain_rows(conn, GENRE_INDEX_QUERY + ';')
+    curr.execute(PRUNE_CHANGES_QUERY, (prune_after,))
+    conn.commit()
+    return xmin, rows
 
 
 @__connection
-def read_reviews(movie_id: int) -> list[int]:
-    ...
+def _genre_index_changes(xmin: int, **kwargs) -> tuple[int, list[int], list[tuple]]:
+    '''Read the genres of the movies changed by transactions from `xmin` on'''
+    curr = kwargs.get('curr')
+    curr.execute(SNAPSHOT_CHANGES_QUERY, (str(xmin),))
+    row = curr.fetchone()
+    rows = []
+    if row['movie_ids']:
+        rows = _plain_rows(kwargs.get('conn'), GENRE_INDEX_QUERY + ' WHERE movie_id = ANY(%s);',
+                           (row['movie_ids'],))
+    return int(row['xmin']), row['movie_ids'], rows
+
+
+_genre_index = GenreIndex(
+    partial(_load_genre_index, 2 * float(environ.get("CATALOGUE_SNAPSHOT_REBUILD", 1800))),
+    _genre_index_changes, float(environ.get("GENRE_INDEX_REFRESH", 1)),
+    float(environ.get("CATALOGUE_SNAPSHOT_REBUILD", 1800)))
+
+
+def genre_index_stats() -> dict[str, Any]:
+    '''Return the genre bitmaps' refresh counters and memory'''
+    return _genre_index.stats()
+
+
+REVIEW_COLUMNS = 'review_id, movie_id, score, review_text, created_at, updated_at'
+# review_id > 0 when there is no cursor keeps first and later pages one prepared statement
+REVIEWS_QUERY = f'''
+SELECT {REVIEW_COLUMNS} FROM reviews
+WHERE movie_id=%s AND review_id > %s
+ORDER BY review_id
+LIMIT %s;'''
+# A movie without counters has no reviews yet; a missing movie has no row at all
+REVIEW_STATS_QUERY = '''
+SELECT coalesce(review_count, 0) AS review_count,
+       round(score_total::numeric / NULLIF(scored_count, 0), 2) AS average_score
+FROM movies
+LEFT JOIN review_stats ON (review_stats.movie_id=movies.movie_id)
+WHERE movies.movie_id=%s;'''
+
+
+def _validate_review(movie_id: int, review_text: str, score: int | None) -> None:
+    if not isinstance(movie_id, int) or isinstance(movie_id, bool):
+        raise TypeError('movie_id must be of type int')
+    if not isinstance(review_text, str):
+        raise TypeError('review_text must be of type str')
+    if not review_text.strip():
+        raise ValueError('review_text must not be empty')
+    _validate_score(score)
+
+
+def _validate_review_id(review_id: int) -> None:
+    if not isinstance(review_id, int) or isinstance(review_id, bool):
+        raise TypeError('review_id must be of type int')
+
+
+def _validate_score(score: int | None) -> None:
+    if score is None:
+        return
+    if not isinstance(score, int) or isinstance(score, bool):
+        raise TypeError('score must be of type int')
+    if not 1 <= score <= 10:
+        raise ValueError('score must be between 1 and 10')
 
 
 @__connection
-def count_reviews(movie_id: int) -> int:
-    ...
+def create_review(movie_id: int, review_text: str, score: int = None, **kwargs) -> dict:
+    '''Insert a review, updating its movie's review counters in the same transaction'''
+    _validate_review(movie_id, review_text, score)
+    curr = kwargs.get('curr')
+    conn = kwargs.get('conn')
+    try:
+        curr.execute(f'''
+INSERT INTO reviews (movie_id, review_text, score) VALUES (%s, %s, %s)
+RETURNING {REVIEW_COLUMNS};''', (movie_id, review_text, score))
+    except FOREIGN_KEY_VIOLATION as e:
+        raise ValueError('No movie with that id was found') from e
+    review = curr.fetchone()
+    conn.commit()
+    _committed(curr)
+    return review
+
+
+# Inserts the reviews of movies that exist, locking them so that they cannot be deleted before
+# the insert's foreign key check. Ids are drawn before inserting so that each can be reported
+# against its review's ordinal, as RETURNING does not promise the order of VALUES.
+CREATE_REVIEWS_QUERY = '''
+WITH batch AS (
+    SELECT review.ordinal, nextval(pg_get_serial_sequence('reviews', 'review_id')) AS review_id,
+           movie_id, review.review_text, review.score::smallint AS score
+    FROM (VALUES %s) AS review (ordinal, movie_id, review_text, score)
+    JOIN movies USING (movie_id)
+    FOR KEY SHARE OF movies
+), inserted AS (
+    INSERT INTO reviews (review_id, movie_id, review_text, score)
+    SELECT review_id, movie_id, review_text, score FROM batch
+    RETURNING review_id
+)
+SELECT ordinal, review_id FROM batch JOIN inserted USING (review_id);'''
 
 
 @__connection
-def update_review(review_id: int) -> None:
-    ...
+def create_reviews(reviews: list[dict[str, Any]], page_size: int = 1000,
+                   **kwargs) -> list[dict[str, Any]]:
+    '''Insert many reviews in a single transaction.
+
+    Each review is a dict of create_review's arguments. Rows are sent
+    `page_size` at a time with execute_values, and the review counters are
+    updated once per statement rather than once per review. Returns one
+    result per review, in order: {'review_id': ...} or {'error': ...} for
+    reviews that failed validation or named a movie that does not exist.'''
+    curr = kwargs.get('curr')
+    conn = kwargs.get('conn')
+    results, rows = [], []
+    for ordinal, review in enumerate(reviews):
+        try:
+            _validate_review(review.get('movie_id'), review.get('review_text'),
+                             review.get('score'))
+        except (TypeError, ValueError) as e:
+            results.append({'error': str(e)})
+            continue
+        results.append({'error': 'No movie with that id was found'})
+        rows.append((ordinal, review['movie_id'], review['review_text'], review.get('score')))
+    if not rows:
+        return results
+    inserted = psycopg2.extras.execute_values(curr, CREATE_REVIEWS_QUERY, rows,
+                                              page_size=page_size, fetch=True)
+    conn.commit()
+    _committed(curr)
+    for row in inserted:
+        results[row['ordinal']] = {'review_id': row['review_id']}
+    return results
+
+
+@__coalesced
+@__read_connection
+def read_reviews(movie_id: int, limit: int = 100, after: int = 0, **kwargs) -> list[dict]:
+    '''Return up to `limit` reviews of a movie in review_id order.
+
+    `after` is the review_id of the last review of the previous page, so each
+    page is one range scan of the (movie_id, review_id) index however deep it is.'''
+    if not isinstance(movie_id, int) or isinstance(movie_id, bool):
+        raise TypeError('movie_id must be of type int')
+    curr = kwargs.get('curr')
+    _statements.execute(curr, REVIEWS_QUERY, (movie_id, after, limit))
+    return curr.fetchall()
+
+
+@__coalesced
+@__read_connection
+def get_review_stats(movie_id: int, **kwargs) -> dict | None:
+    '''Return the review count and average score of a movie from its counters,
+    or None if there is no such movie'''
+    curr = kwargs.get('curr')
+    _statements.execute(curr, REVIEW_STATS_QUERY, (movie_id,))
+    return curr.fetchone()
+
+
+@__coalesced
+@__read_connection
+def count_reviews(movie_id: int, **kwargs) -> int:
+    '''Return the number of reviews of a movie from its counters, without counting rows'''
+    curr = kwargs.get('curr')
+    _statements.execute(curr, 'SELECT review_count FROM review_stats WHERE movie_id=%s;',
+                        (movie_id,))
+    row = curr.fetchone()
+    return row['review_count'] if row else 0
 
 
 @__connection
-def delete_review(review_id: int) -> None:
-    ...
+def update_review(review_id: int, review_text: str = None, score: int = None,
+                  movie_id: int = None, **kwargs) -> dict | None:
+    '''Change the text and/or score of a review, returning it or None if there is no
+    such review (of `movie_id`, when given)'''
+    _validate_review_id(review_id)
+    if review_text is not None and not isinstance(review_text, str):
+        raise TypeError('review_text must be of type str')
+    if review_text is not None and not review_text.strip():
+        raise ValueError('review_text must not be empty')
+    _validate_score(score)
+    curr = kwargs.get('curr')
+    conn = kwargs.get('conn')
+    curr.execute(f'''
+UPDATE reviews SET review_text=coalesce(%s, review_text), score=coalesce(%s, score),
+                   updated_at=now()
+WHERE review_id=%s AND (%s::int IS NULL OR movie_id=%s)
+RETURNING {REVIEW_COLUMNS};''', (review_text, score, review_id, movie_id, movie_id))
+    review = curr.fetchone()
+    conn.commit()
+    _committed(curr)
+    return review
 
+
+@__connection
+def delete_review(review_id: int, movie_id: int = None, **kwargs) -> bool:
+    '''Delete a review, returning whether there was one (of `movie_id`, when given)'''
+    _validate_review_id(review_id)
+    curr = kwargs.get('curr')
+    conn = kwargs.get('conn')
+    curr.execute('''
+DELETE FROM reviews WHERE review_id=%s AND (%s::int IS NULL OR movie_id=%s)
+RETURNING review_id;''', (review_id, movie_id, movie_id))
+    deleted = curr.fetchone() is not None
+    conn.commit()
+    _committed(curr)
+    return deleted
@@ -0,0 +1,150 @@
+'''In-process bitmap index of the movies of each genre.
+
+Each genre's movies are one Python int used as a bitset, bit i standing for
+movie i. Movie ids are dense serial numbers, so a bitmap costs one bit per id
+issued and combining genres is a single AND or OR over a few kilobytes,
+while int.bit_count gives the size of any combination for facet counts.'''
+import sys
+from typing import Any, Iterable, Iterator
+
+from stern_movies_api.snapshot import GENRE_SEPARATOR, AsyncCatalogueSnapshot, CatalogueSnapshot
+
+# Bits a page is read from a bitmap at a time, so that a page costs shifts of a small int
+_CHUNK_BITS = 1024
+_CHUNK_MASK = (1 << _CHUNK_BITS) - 1
+
+
+def _bitmap(movie_ids: Iterable[int]) -> int:
+    '''Return the bitmap of `movie_ids`'''
+    movie_ids = list(movie_ids)
+    if not movie_ids:
+        return 0
+    buffer = bytearray(max(movie_ids) // 8 + 1)
+    for movie_id in movie_ids:
+        buffer[movie_id >> 3] |= 1 << (movie_id & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+def set_bits(bitmap: int, descending: bool = False) -> Iterator[int]:
+    '''Yield the movie ids set in `bitmap`, lowest first or highest first'''
+    if not descending:
+        base = 0
+        while bitmap:
+            # Jump over a run of unset bits before reading the next chunk
+            skip = (bitmap & -bitmap).bit_length() - 1
+            bitmap >>= skip
+            base += skip
+            chunk = bitmap & _CHUNK_MASK
+            while chunk:
+                low = chunk & -chunk
+                yield base + low.bit_length() - 1
+                chunk ^= low
+            bitmap >>= _CHUNK_BITS
+            base += _CHUNK_BITS
+        return
+    while bitmap:
+        base = max(bitmap.bit_length() - _CHUNK_BITS, 0)
+        chunk = bitmap >> base
+        while chunk:
+            top = chunk.bit_length() - 1
+            yield base + top
+            chunk ^= 1 << top
+        bitmap &= (1 << base) - 1
+
+
+class GenreBitmaps:
+    '''Immutable bitmaps of the movies of each genre, and of every movie'''
+
+    def __init__(self, bitmaps: dict[str, int], movies: int):
+        self.bitmaps = bitmaps
+        self.movies = movies
+
+    @staticmethod
+    def _genres(genres: list[str] | str | None) -> list[str]:
+        if isinstance(genres, str):
+            return genres.split(GENRE_SEPARATOR) if genres else []
+        return genres or []
+
+    @classmethod
+    def _ids_by_genre(cls, rows: Iterable[tuple]) -> tuple[dict[str, list[int]], list[int]]:
+        ids_by_genre, movie_ids = {}, []
+        for movie_id, genres in rows:
+            movie_ids.append(movie_id)
+            for genre in cls._genres(genres):
+                ids_by_genre.setdefault(genre, []).append(movie_id)
+        return ids_by_genre, movie_ids
+
+    @classmethod
+    def build(cls, rows: Iterable[tuple]) -> 'GenreBitmaps':
+        '''Build the bitmaps from (movie_id, genres) rows of movie_listing, with the genres
+        as a list or joined by GENRE_SEPARATOR'''
+        ids_by_genre, movie_ids = cls._ids_by_genre(rows)
+        return cls({genre: _bitmap(ids) for genre, ids in ids_by_genre.items()},
+                   _bitmap(movie_ids))
+
+    def __len__(self) -> int:
+        return self.movies.bit_count()
+
+    def apply(self, movie_ids: Iterable[int], rows: Iterable[tuple]) -> 'GenreBitmaps':
+        '''Return new bitmaps with the movies of `movie_ids` replaced by `rows`; changed
+        movies without a row were deleted'''
+        kept = ~_bitmap(movie_ids)
+        ids_by_genre, present = self._ids_by_genre(rows)
+        bitmaps = {genre: bitmap & kept for genre, bitmap in self.bitmaps.items()}
+        for genre, ids in ids_by_genre.items():
+            bitmaps[genre] = bitmaps.get(genre, 0) | _bitmap(ids)
+        return GenreBitmaps({genre: bitmap for genre, bitmap in bitmaps.items() if bitmap},
+                            self.movies & kept | _bitmap(present))
+
+    def select(self, genres: list[str], match_all: bool = True) -> int:
+        '''Return the bitmap of the movies with every one of `genres`, or with any of them'''
+        bitmaps = [self.bitmaps.get(genre, 0) for genre in genres]
+        if not bitmaps:
+            return self.movies
+        selected = bitmaps[0]
+        for bitmap in bitmaps[1:]:
+            selected = selected & bitmap if match_all else selected | bitmap
+        return selected
+
+    def facets(self, selected: int) -> dict[str, int]:
+        '''Return how many of the selected movies each genre has, leaving out those with none'''
+        counts = {genre: (bitmap & selected).bit_count()
+                  for genre, bitmap in sorted(self.bitmaps.items())}
+        return {genre: count for genre, count in counts.items() if count}
+
+    @staticmethod
+    def page(selected: int, descending: bool = False, after: int = None,
+             limit: int = None) -> list[int]:
+        '''Return the ids of the selected movies in movie_id order, from just after the
+        movie_id `after`, at most `limit` of them'''
+        base = 0
+        if after is not None and descending:
+            selected &= (1 << max(after, 0)) - 1
+        elif after is not None:
+            base = after + 1
+            selected >>= base
+        ids = []
+        for movie_id in set_bits(selected, descending):
+            if limit is not None and len(ids) >= limit:
+                break
+            ids.append(base + movie_id)
+        return ids
+
+    def memory(self) -> dict[str, Any]:
+        '''Return the bytes held by the bitmaps'''
+        total = sum(sys.getsizeof(bitmap) for bitmap in self.bitmaps.values())
+        return {'genres': len(self.bitmaps), 'total': total + sys.getsizeof(self.movies)}
+
+
+class GenreIndex(CatalogueSnapshot):
+    '''GenreBitmaps kept in step with the database from the movie_listing_changes log, as
+    CatalogueSnapshot keeps a Snapshot. `load()` returns (xmin, rows) and `changes(xmin)`
+    returns (xmin, movie_ids, rows), with rows of (movie_id, genres).'''
+
+    snapshot_type = GenreBitmaps
+
+
+class AsyncGenreIndex(AsyncCatalogueSnapshot):
+    '''GenreIndex whose `load` and `changes` are coroutine functions'''
+
+    snapshot_type = GenreBitmaps
@@ -0,0 +1,44 @@
+'Leveled, structured logging for the stern_movies_api loggers'
+import json
+import logging
+import sys
+from os import environ
+
+# Attributes every LogRecord has; anything else was passed in `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message'}
+
+
+class JsonFormatter(logging.Formatter):
+    'Formats a record and its `extra` fields as one JSON object per line'
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items()
+                     if key not in _RECORD_ATTRIBUTES)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging() -> None:
+    '''Send the package's logs to stderr at LOG_LEVEL (default WARNING).
+
+    LOG_FORMAT=text switches from JSON lines to plain text. Records below the
+    level are dropped before their message is built, so debug logging costs
+    a level check when it is off.'''
+    logger = logging.getLogger('stern_movies_api')
+    logger.setLevel(environ.get('LOG_LEVEL', 'WARNING').upper())
+    if logger.handlers:
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    if environ.get('LOG_FORMAT', 'json') == 'text':
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s %(message)s'))
+    else:
+        handler.setFormatter(JsonFormatter())
+    logger.addHandler(handler)
+    logger.propagate = False
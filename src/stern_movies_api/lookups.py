@@ -0,0 +1,114 @@
+'In-process cache of the small name to id dimension tables'
+import asyncio
+import threading
+import time
+from typing import Any, Awaitable, Callable
+
+
+class LookupTable:
+    '''Name to id mapping of one dimension table.
+
+    The whole table is loaded with a single call to `load` and served from a
+    dict until it is older than `ttl` seconds or invalidated. A name that is
+    not found triggers one reload, at most every `miss_refresh_interval`
+    seconds, so rows added elsewhere are picked up without hammering the
+    database with unknown names.'''
+
+    def __init__(self, load: Callable[[], dict[str, int]], ttl: float = 300.0,
+                 miss_refresh_interval: float = 5.0):
+        self.ttl = ttl
+        self.miss_refresh_interval = miss_refresh_interval
+        self._load = load
+        self._lock = threading.Lock()
+        self._ids = None
+        self._loaded_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+
+    def _refresh(self, stale_before: float) -> dict[str, int]:
+        # Callers read from the mapping returned, as invalidate() may drop self._ids as
+        # soon as the lock is released
+        with self._lock:
+            ids = self._ids
+            if ids is not None and self._loaded_at > stale_before:
+                return ids
+            ids = self._load()
+            self._ids, self._loaded_at = ids, time.monotonic()
+            self.loads += 1
+            return ids
+
+    def get(self, name: str) -> int | None:
+        'Return the id for `name`, or None if the table has no such row'
+        now = time.monotonic()
+        ids = self._ids
+        if ids is None or now - self._loaded_at > self.ttl:
+            ids = self._refresh(now - self.ttl)
+        row_id = ids.get(name)
+        if row_id is None and now - self._loaded_at > self.miss_refresh_interval:
+            row_id = self._refresh(now - self.miss_refresh_interval).get(name)
+        if row_id is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return row_id
+
+    def warm(self) -> None:
+        'Load the table now rather than on first lookup'
+        self._refresh(time.monotonic())
+
+    def invalidate(self) -> None:
+        'Drop the cached table so the next lookup reloads it'
+        with self._lock:
+            self._ids = None
+
+    def stats(self) -> dict[str, Any]:
+        'Return hit/miss counters and the number of cached names'
+        ids = self._ids
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'loads': self.loads,
+            'size': len(ids) if ids is not None else 0,
+        }
+
+
+class AsyncLookupTable(LookupTable):
+    '''LookupTable whose `load` is a coroutine function, for the async data layer.
+
+    Refreshes are serialized by an asyncio lock, so concurrent lookups of a
+    cold table wait on a single load instead of each querying it.'''
+
+    def __init__(self, load: Callable[[], Awaitable[dict[str, int]]], ttl: float = 300.0,
+                 miss_refresh_interval: float = 5.0):
+        super().__init__(load, ttl, miss_refresh_interval)
+        self._async_lock = asyncio.Lock()
+
+    async def _refresh(self, stale_before: float) -> dict[str, int]: #pylint: disable=invalid-overridden-method
+        async with self._async_lock:
+            ids = self._ids
+            if ids is not None and self._loaded_at > stale_before:
+                return ids
+            ids = await self._load()
+            self._ids, self._loaded_at = ids, time.monotonic()
+            self.loads += 1
+            return ids
+
+    async def get(self, name: str) -> int | None: #pylint: disable=invalid-overridden-method
+        'Return the id for `name`, or None if the table has no such row'
+        now = time.monotonic()
+        ids = self._ids
+        if ids is None or now - self._loaded_at > self.ttl:
+            ids = await self._refresh(now - self.ttl)
+        row_id = ids.get(name)
+        if row_id is None and now - self._loaded_at > self.miss_refresh_interval:
+            row_id = (await self._refresh(now - self.miss_refresh_interval)).get(name)
+        if row_id is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return row_id
+
+    async def warm(self) -> None: #pylint: disable=invalid-overridden-method
+        'Load the table now rather than on first lookup'
+        await self._refresh(time.monotonic())
@@ -0,0 +1,352 @@
+'''Request and database instrumentation, rendered in the Prometheus text format.
+
+The apps time every request by route. database.py wraps its cursors in a
+TimedCursor, which counts queries, round trips and rows and times execute and
+fetch under the name of the database function that ran them. The same work
+is added to the QueryStats of the request being served, so each route also
+reports what it cost the database.'''
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from os import environ
+from typing import Any, Iterator
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PHASES = ('connect', 'execute', 'fetch')
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Statements that run at least this long are logged as slow
+slow_query_seconds = float(environ.get('SLOW_QUERY_MS', 250)) / 1000
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Counter:
+    'Monotonic total per label set'
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, labels: tuple = (), amount: float = 1) -> None:
+        'Add `amount` to the series of `labels`'
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def clear(self) -> None:
+        'Drop every series'
+        with self._lock:
+            self._values.clear()
+
+    def value(self, labels: tuple = ()) -> float:
+        'Return the total of the series of `labels`'
+        return self._values.get(labels, 0)
+
+    def render(self) -> list[str]:
+        'Return the exposition lines of every series'
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(self.labels, labels)} {value}')
+        return lines
+
+
+class Histogram:
+    'Bucketed observations with their sum and count per label set'
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, value: float, labels: tuple = ()) -> None:
+        'Record one observation in the series of `labels`'
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def clear(self) -> None:
+        'Drop every series'
+        with self._lock:
+            self._series.clear()
+
+    def count(self, labels: tuple = ()) -> int:
+        'Return how many observations the series of `labels` holds'
+        series = self._series.get(labels)
+        return sum(series[0]) if series else 0
+
+    def render(self) -> list[str]:
+        'Return the cumulative bucket, sum and count lines of every series'
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((labels, list(counts), total)
+                            for labels, (counts, total) in self._series.items())
+        for labels, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound!r}"'
+                lines.append(f'{self.name}_bucket{_labels(self.labels, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labels, labels)} {total}')
+            lines.append(f'{self.name}_count{_labels(self.labels, labels)} {cumulative}')
+        return lines
+
+
+REQUEST_SECONDS = Histogram('stern_http_request_duration_seconds',
+                            'Time to build a response, by route', ('route', 'method'))
+REQUESTS = Counter('stern_http_requests_total', 'Responses sent, by route and status',
+                   ('route', 'method', 'status'))
+REQUEST_QUERIES = Counter('stern_http_request_db_queries_total',
+                          'Statements executed while serving requests, by route', ('route',))
+REQUEST_ROUND_TRIPS = Counter('stern_http_request_db_round_trips_total',
+                              'Database round trips made while serving requests, by route',
+                              ('route',))
+REQUEST_ROWS = Counter('stern_http_request_db_rows_total',
+                       'Rows fetched while serving requests, by route', ('route',))
+REQUEST_DB_SECONDS = Counter('stern_http_request_db_seconds_total',
+                             'Time spent connecting to, executing on and fetching from the '
+                             'database while serving requests, by route', ('route', 'phase'))
+QUERY_SECONDS = Histogram('stern_db_query_duration_seconds',
+                          'Execute time of each statement, by database function', ('query',))
+QUERY_ROUND_TRIPS = Counter('stern_db_round_trips_total',
+                            'Database round trips, by database function', ('query',))
+QUERY_ROWS = Counter('stern_db_rows_total', 'Rows fetched, by database function', ('query',))
+CONNECT_SECONDS = Histogram('stern_db_connect_duration_seconds',
+                            'Time to check a connection out of the pool')
+SLOW_QUERIES = Counter('stern_db_slow_queries_total',
+                       'Statements slower than SLOW_QUERY_MS, by database function', ('query',))
+COALESCED_READS = Counter('stern_db_coalesced_reads_total',
+                          'Reads by database function and whether they ran their query (executed), '
+                          'got the result or error of an identical read in flight (shared, '
+                          'failed) or gave up waiting for it (timed_out)', ('query', 'outcome'))
+
+METRICS = (REQUEST_SECONDS, REQUESTS, REQUEST_QUERIES, REQUEST_ROUND_TRIPS, REQUEST_ROWS,
+           REQUEST_DB_SECONDS, QUERY_SECONDS, QUERY_ROUND_TRIPS, QUERY_ROWS, CONNECT_SECONDS,
+           SLOW_QUERIES, COALESCED_READS)
+
+
+class QueryStats: #pylint: disable=too-few-public-methods
+    'Database work done on behalf of one request'
+    __slots__ = ('queries', 'round_trips', 'rows', 'connect', 'execute', 'fetch')
+
+    def __init__(self):
+        self.queries = self.round_trips = self.rows = 0
+        self.connect = self.execute = self.fetch = 0.0
+
+    def db_seconds(self) -> float:
+        'Return the total time spent on the database'
+        return self.connect + self.execute + self.fetch
+
+
+_request_stats = ContextVar('stern_movies_request_stats', default=None)
+
+
+def start_request() -> QueryStats:
+    '''Start collecting the database work of the request being served'''
+    stats = QueryStats()
+    _request_stats.set(stats)
+    return stats
+
+
+def finish_request(route: str, method: str, status: int, seconds: float) -> QueryStats:
+    '''Record a served request and return the database work it did'''
+    stats = _request_stats.get() or QueryStats()
+    _request_stats.set(None)
+    REQUEST_SECONDS.observe(seconds, (route, method))
+    REQUESTS.inc((route, method, str(status)))
+    REQUEST_QUERIES.inc((route,), stats.queries)
+    REQUEST_ROUND_TRIPS.inc((route,), stats.round_trips)
+    REQUEST_ROWS.inc((route,), stats.rows)
+    for phase in PHASES:
+        REQUEST_DB_SECONDS.inc((route, phase), getattr(stats, phase))
+    return stats
+
+
+def server_timing(stats: QueryStats, seconds: float) -> str:
+    '''Return a Server-Timing header value splitting a request into database and total time'''
+    return (f'db;dur={stats.db_seconds() * 1000:.2f};desc="{stats.queries} queries", '
+            f'total;dur={seconds * 1000:.2f}')
+
+
+def record_connect(seconds: float) -> None:
+    '''Record the time taken to check a connection out of the pool'''
+    CONNECT_SECONDS.observe(seconds)
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.connect += seconds
+
+
+def _record(name: str, phase: str, seconds: float, round_trips: int = 0, rows: int = 0,
+            queries: int = 0) -> None:
+    if round_trips:
+        QUERY_ROUND_TRIPS.inc((name,), round_trips)
+    if rows:
+        QUERY_ROWS.inc((name,), rows)
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.queries += queries
+        stats.round_trips += round_trips
+        stats.rows += rows
+        setattr(stats, phase, getattr(stats, phase) + seconds)
+
+
+def _statement_text(query: Any) -> str:
+    if isinstance(query, bytes):
+        query = query.decode(errors='replace')
+    return ' '.join(str(query).split())[:200]
+
+
+def _executed(name: str, query: Any, seconds: float, round_trips: int = 1) -> None:
+    QUERY_SECONDS.observe(seconds, (name,))
+    _record(name, 'execute', seconds, round_trips, queries=1)
+    if seconds >= slow_query_seconds:
+        SLOW_QUERIES.inc((name,))
+        logger.warning('slow query %s took %.1f ms', name, seconds * 1000,
+                       extra={'query': name, 'duration_ms': round(seconds * 1000, 1),
+                              'statement': _statement_text(query)})
+
+
+class TimedCursor:
+    '''Wraps a psycopg2 cursor to time and count the work done through it.
+
+    Rows of a client-side cursor arrive with execute, so fetching them only
+    costs decoding; each fetch from a named cursor is a round trip of its
+    own, iteration making one per `itersize` rows.'''
+
+    def __init__(self, cursor, name: str):
+        self._cursor = cursor
+        self._name = name
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self._cursor, attr)
+
+    def __setattr__(self, attr: str, value: Any) -> None:
+        if attr.startswith('_'):
+            super().__setattr__(attr, value)
+        else:
+            setattr(self._cursor, attr, value)
+
+    def __enter__(self) -> 'TimedCursor':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._cursor.close()
+
+    def execute(self, query: Any, params: Any = None) -> None:
+        'Execute and time a statement'
+        start = time.perf_counter()
+        try:
+            self._cursor.execute(query, params)
+        finally:
+            _executed(self._name, query, time.perf_counter() - start)
+
+    def executemany(self, query: Any, params_seq: Any) -> None:
+        'Execute and time a statement once per parameter set, one round trip each'
+        params_seq = list(params_seq)
+        start = time.perf_counter()
+        try:
+            self._cursor.executemany(query, params_seq)
+        finally:
+            _executed(self._name, query, time.perf_counter() - start, len(params_seq))
+
+    def _fetched(self, start: float, rows: int) -> None:
+        _record(self._name, 'fetch', time.perf_counter() - start,
+                round_trips=1 if self._cursor.name else 0, rows=rows)
+
+    def fetchone(self) -> Any:
+        'Fetch and time one row'
+        start = time.perf_counter()
+        row = self._cursor.fetchone()
+        self._fetched(start, int(row is not None))
+        return row
+
+    def fetchmany(self, size: int = None) -> list:
+        'Fetch and time up to `size` rows'
+        start = time.perf_counter()
+        rows = self._cursor.fetchmany(size) if size is not None else self._cursor.fetchmany()
+        self._fetched(start, len(rows))
+        return rows
+
+    def fetchall(self) -> list:
+        'Fetch and time every remaining row'
+        start = time.perf_counter()
+        rows = self._cursor.fetchall()
+        self._fetched(start, len(rows))
+        return rows
+
+    def __iter__(self) -> Iterator:
+        rows = iter(self._cursor)
+        itersize = self._cursor.itersize if self._cursor.name else 0
+        count = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                row = next(rows)
+            except StopIteration:
+                # A named cursor learns it is exhausted from one last, empty fetch
+                _record(self._name, 'fetch', time.perf_counter() - start,
+                        round_trips=int(bool(itersize)))
+                return
+            _record(self._name, 'fetch', time.perf_counter() - start,
+                    round_trips=int(bool(itersize) and count % itersize == 0), rows=1)
+            count += 1
+            yield row
+
+
+class TimedConnection:
+    'Wraps a psycopg2 connection to count and time its commits as round trips'
+
+    def __init__(self, conn, name: str):
+        self._conn = conn
+        self._name = name
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self._conn, attr)
+
+    def commit(self) -> None:
+        'Commit and time the transaction'
+        start = time.perf_counter()
+        try:
+            self._conn.commit()
+        finally:
+            _record(self._name, 'execute', time.perf_counter() - start, round_trips=1)
+
+
+def render_metrics(gauges: dict[str, tuple[str, float]] = None) -> str:
+    '''Return every metric, and the given gauges as {name: (help, value)}, as exposition text'''
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    for name, (help_text, value) in (gauges or {}).items():
+        lines.extend([f'# HELP {name} {help_text}', f'# TYPE {name} gauge', f'{name} {value}'])
+    return '\n'.join(lines) + '\n'
+
+
+def reset_metrics() -> None:
+    '''Drop every recorded series'''
+    for metric in METRICS:
+        metric.clear()
@@ -0,0 +1,454 @@
+'''Versioned schema migrations for the tables the API reads and writes.
+
+Run `python -m stern_movies_api.migrations` to apply pending migrations.
+Each one runs in its own transaction and is recorded in schema_migrations,
+so applying them again is a no-op.'''
+from os import environ
+
+import psycopg2
+from dotenv import load_dotenv
+
+MIGRATIONS = [
+    ('0001_title_trigram_index', '''
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS movies_title_trgm_idx ON movies USING GIN (title gin_trgm_ops);
+'''),
+    # Listings read this table instead of joining movie_info to the genres on every request.
+    # Triggers on the base tables rewrite the rows of every movie a statement touched.
+    ('0002_movie_listing_read_model', '''
+CREATE TABLE movie_listing AS
+SELECT movie_info.*, ARRAY(
+    SELECT genre_name
+    FROM genre_assignments
+    JOIN genres ON (genre_assignments.genre_id=genres.genre_id)
+    WHERE genre_assignments.movie_id=movie_info.movie_id
+) AS genres
+FROM movie_info;
+ALTER TABLE movie_listing ADD PRIMARY KEY (movie_id);
+
+-- Listings sort NULLs last in both directions, so each sort column gets one index per direction
+-- led by whether it is NULL; keyset pages are then a single range scan of one of them.
+CREATE INDEX movie_listing_title_asc_idx ON movie_listing ((title IS NULL), title, movie_id);
+CREATE INDEX movie_listing_title_desc_idx ON movie_listing ((title IS NOT NULL), title, movie_id);
+CREATE INDEX movie_listing_score_asc_idx ON movie_listing ((score IS NULL), score, movie_id);
+CREATE INDEX movie_listing_score_desc_idx ON movie_listing ((score IS NOT NULL), score, movie_id);
+CREATE INDEX movie_listing_budget_asc_idx ON movie_listing ((budget IS NULL), budget, movie_id);
+CREATE INDEX movie_listing_budget_desc_idx
+    ON movie_listing ((budget IS NOT NULL), budget, movie_id);
+CREATE INDEX movie_listing_revenue_asc_idx
+    ON movie_listing ((revenue IS NULL), revenue, movie_id);
+CREATE INDEX movie_listing_revenue_desc_idx
+    ON movie_listing ((revenue IS NOT NULL), revenue, movie_id);
+CREATE INDEX movie_listing_country_idx ON movie_listing (country_name, movie_id);
+
+CREATE FUNCTION refresh_movie_listing(movie_ids INT[]) RETURNS void LANGUAGE sql AS $$
+    DELETE FROM movie_listing WHERE movie_id = ANY(movie_ids);
+    INSERT INTO movie_listing
+    SELECT movie_info.*, ARRAY(
+        SELECT genre_name
+        FROM genre_assignments
+        JOIN genres ON (genre_assignments.genre_id=genres.genre_id)
+        WHERE genre_assignments.movie_id=movie_info.movie_id
+    )
+    FROM movie_info
+    WHERE movie_info.movie_id = ANY(movie_ids);
+$$;
+
+-- Shared by movies and genre_assignments, which both identify rows by movie_id
+CREATE FUNCTION movie_listing_rows_changed() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM refresh_movie_listing(ARRAY(SELECT DISTINCT movie_id FROM new_rows));
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM refresh_movie_listing(ARRAY(SELECT DISTINCT movie_id FROM old_rows));
+    ELSE
+        PERFORM refresh_movie_listing(ARRAY(
+            SELECT movie_id FROM new_rows UNION SELECT movie_id FROM old_rows));
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+-- Renaming a genre, status, country or language rewrites the movies using it
+CREATE FUNCTION movie_listing_names_changed() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    CASE TG_TABLE_NAME
+    WHEN 'genres' THEN
+        PERFORM refresh_movie_listing(ARRAY(
+            SELECT DISTINCT movie_id FROM genre_assignments
+            WHERE genre_id IN (SELECT genre_id FROM new_rows)));
+    WHEN 'statuses' THEN
+        PERFORM refresh_movie_listing(ARRAY(
+            SELECT movie_id FROM movies WHERE status_id IN (SELECT status_id FROM new_rows)));
+    WHEN 'countries' THEN
+        PERFORM refresh_movie_listing(ARRAY(
+            SELECT movie_id FROM movies WHERE country_id IN (SELECT country_id FROM new_rows)));
+    WHEN 'languages' THEN
+        PERFORM refresh_movie_listing(ARRAY(
+            SELECT movie_id FROM movies WHERE language_id IN (SELECT language_id FROM new_rows)));
+    END CASE;
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER movie_listing_movies_insert AFTER INSERT ON movies
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION movie_listing_rows_changed();
+CREATE TRIGGER movie_listing_movies_update AFTER UPDATE ON movies
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION movie_listing_rows_changed();
+CREATE TRIGGER movie_listing_movies_delete AFTER DELETE ON movies
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION movie_listing_rows_changed();
+CREATE TRIGGER movie_listing_genres_insert AFTER INSERT ON genre_assignments
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION movie_listing_rows_changed();
+CREATE TRIGGER movie_listing_genres_update AFTER UPDATE ON genre_assignments
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION movie_listing_rows_changed();
+CREATE TRIGGER movie_listing_genres_delete AFTER DELETE ON genre_assignments
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION movie_listing_rows_changed();
+CREATE TRIGGER movie_listing_genre_names AFTER UPDATE ON genres
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION movie_listing_names_changed();
+CREATE TRIGGER movie_listing_status_names AFTER UPDATE ON statuses
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION movie_listing_names_changed();
+CREATE TRIGGER movie_listing_country_names AFTER UPDATE ON countries
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION movie_listing_names_changed();
+CREATE TRIGGER movie_listing_language_names AFTER UPDATE ON languages
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION movie_listing_names_changed();
+ANALYZE movie_listing;
+'''),
+    ('0003_movie_listing_title_trigram_index', '''
+CREATE INDEX IF NOT EXISTS movie_listing_title_trgm_idx
+    ON movie_listing USING GIN (title gin_trgm_ops);
+DROP INDEX IF EXISTS movies_title_trgm_idx;
+'''),
+    # Country listings filter on the id resolved from the cached countries table, with one index
+    # per sort and direction led by it. country_summary is a rollup of movie_listing kept up to
+    # date by triggers, so /countries reads one row per country instead of every movie.
+    ('0004_country_listing_and_summary', '''
+ALTER TABLE movie_listing ADD COLUMN country_id INT;
+UPDATE movie_listing SET country_id=movies.country_id
+FROM movies WHERE movies.movie_id=movie_listing.movie_id;
+ALTER TABLE movie_listing ALTER COLUMN country_id SET NOT NULL;
+
+CREATE OR REPLACE FUNCTION refresh_movie_listing(movie_ids INT[]) RETURNS void LANGUAGE sql AS $$
+    DELETE FROM movie_listing WHERE movie_id = ANY(movie_ids);
+    INSERT INTO movie_listing
+    SELECT movie_info.*, ARRAY(
+        SELECT genre_name
+        FROM genre_assignments
+        JOIN genres ON (genre_assignments.genre_id=genres.genre_id)
+        WHERE genre_assignments.movie_id=movie_info.movie_id
+    ), movies.country_id
+    FROM movie_info
+    JOIN movies ON (movies.movie_id=movie_info.movie_id)
+    WHERE movie_info.movie_id = ANY(movie_ids);
+$$;
+
+DROP INDEX movie_listing_country_idx;
+CREATE INDEX movie_listing_country_idx ON movie_listing (country_id, movie_id);
+CREATE INDEX movie_listing_country_title_asc_idx
+    ON movie_listing (country_id, (title IS NULL), title, movie_id);
+CREATE INDEX movie_listing_country_title_desc_idx
+    ON movie_listing (country_id, (title IS NOT NULL), title, movie_id);
+CREATE INDEX movie_listing_country_score_asc_idx
+    ON movie_listing (country_id, (score IS NULL), score, movie_id);
+CREATE INDEX movie_listing_country_score_desc_idx
+    ON movie_listing (country_id, (score IS NOT NULL), score, movie_id);
+CREATE INDEX movie_listing_country_budget_asc_idx
+    ON movie_listing (country_id, (budget IS NULL), budget, movie_id);
+CREATE INDEX movie_listing_country_budget_desc_idx
+    ON movie_listing (country_id, (budget IS NOT NULL), budget, movie_id);
+CREATE INDEX movie_listing_country_revenue_asc_idx
+    ON movie_listing (country_id, (revenue IS NULL), revenue, movie_id);
+CREATE INDEX movie_listing_country_revenue_desc_idx
+    ON movie_listing (country_id, (revenue IS NOT NULL), revenue, movie_id);
+
+CREATE TABLE country_summary (
+    country_id INT PRIMARY KEY,
+    movie_count BIGINT NOT NULL,
+    scored_count BIGINT NOT NULL,
+    score_total NUMERIC NOT NULL,
+    budget_total NUMERIC NOT NULL,
+    revenue_total NUMERIC NOT NULL
+);
+INSERT INTO country_summary
+SELECT country_id, count(*), count(score), coalesce(sum(score), 0), coalesce(sum(budget), 0),
+       coalesce(sum(revenue), 0)
+FROM movie_listing
+GROUP BY country_id;
+
+-- refresh_movie_listing only deletes and inserts, so those are the changes to roll up.
+-- Countries are upserted in id order so that concurrent writers lock them in the same order.
+CREATE FUNCTION country_summary_rows_changed() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO country_summary AS summary
+        SELECT country_id, count(*), count(score), coalesce(sum(score), 0),
+               coalesce(sum(budget), 0), coalesce(sum(revenue), 0)
+        FROM new_rows
+        GROUP BY country_id
+        ORDER BY country_id
+        ON CONFLICT (country_id) DO UPDATE SET
+            movie_count=summary.movie_count + excluded.movie_count,
+            scored_count=summary.scored_count + excluded.scored_count,
+            score_total=summary.score_total + excluded.score_total,
+            budget_total=summary.budget_total + excluded.budget_total,
+            revenue_total=summary.revenue_total + excluded.revenue_total;
+    ELSE
+        UPDATE country_summary AS summary SET
+            movie_count=summary.movie_count - removed.movie_count,
+            scored_count=summary.scored_count - removed.scored_count,
+            score_total=summary.score_total - removed.score_total,
+            budget_total=summary.budget_total - removed.budget_total,
+            revenue_total=summary.revenue_total - removed.revenue_total
+        FROM (
+            SELECT country_id, count(*) AS movie_count, count(score) AS scored_count,
+                   coalesce(sum(score), 0) AS score_total,
+                   coalesce(sum(budget), 0) AS budget_total,
+                   coalesce(sum(revenue), 0) AS revenue_total
+            FROM old_rows
+            GROUP BY country_id
+        ) AS removed
+        WHERE summary.country_id=removed.country_id;
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER country_summary_insert AFTER INSERT ON movie_listing
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION country_summary_rows_changed();
+CREATE TRIGGER country_summary_delete AFTER DELETE ON movie_listing
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION country_summary_rows_changed();
+ANALYZE movie_listing;
+'''),
+    # A movie's reviews are paged by review_id within it. review_stats holds each movie's review
+    # count and score total, kept by triggers in the transaction of every review write, so
+    # counting reviews reads one row however many there are.
+    ('0005_reviews', '''
+CREATE TABLE reviews (
+    review_id BIGSERIAL PRIMARY KEY,
+    movie_id INT NOT NULL REFERENCES movies ON DELETE CASCADE,
+    score SMALLINT CHECK (score BETWEEN 1 AND 10),
+    review_text TEXT NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+-- Serves keyset pages of a movie's reviews and the cascade when a movie is deleted
+CREATE INDEX reviews_movie_idx ON reviews (movie_id, review_id);
+
+CREATE TABLE review_stats (
+    movie_id INT PRIMARY KEY REFERENCES movies ON DELETE CASCADE,
+    review_count BIGINT NOT NULL,
+    scored_count BIGINT NOT NULL,
+    score_total BIGINT NOT NULL
+);
+
+-- Removed rows only ever update existing counters, so the cascade from a deleted movie to its
+-- reviews never recreates the counters the same cascade removes.
+-- Movies are upserted in id order so that concurrent writers lock them in the same order.
+CREATE FUNCTION review_stats_rows_changed() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE review_stats AS stats SET
+            review_count=stats.review_count - removed.review_count,
+            scored_count=stats.scored_count - removed.scored_count,
+            score_total=stats.score_total - removed.score_total
+        FROM (
+            SELECT movie_id, count(*) AS review_count, count(score) AS scored_count,
+                   coalesce(sum(score), 0) AS score_total
+            FROM old_rows
+            GROUP BY movie_id
+        ) AS removed
+        WHERE stats.movie_id=removed.movie_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO review_stats AS stats
+        SELECT movie_id, count(*), count(score), coalesce(sum(score), 0)
+        FROM new_rows
+        GROUP BY movie_id
+        ORDER BY movie_id
+        ON CONFLICT (movie_id) DO UPDATE SET
+            review_count=stats.review_count + excluded.review_count,
+            scored_count=stats.scored_count + excluded.scored_count,
+            score_total=stats.score_total + excluded.score_total;
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER review_stats_insert AFTER INSERT ON reviews
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION review_stats_rows_changed();
+CREATE TRIGGER review_stats_update AFTER UPDATE ON reviews
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION review_stats_rows_changed();
+CREATE TRIGGER review_stats_delete AFTER DELETE ON reviews
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION review_stats_rows_changed();
+'''),
+    # Every movie whose listing row is rewritten is logged with the id of the transaction that
+    # did it, so an in-memory copy of the listings can catch up by re-reading only those movies.
+    ('0006_movie_listing_changes', '''
+CREATE TABLE movie_listing_changes (
+    xid XID8 NOT NULL DEFAULT pg_current_xact_id(),
+    movie_id INT NOT NULL,
+    changed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE INDEX movie_listing_changes_xid_idx ON movie_listing_changes (xid);
+
+-- refresh_movie_listing only deletes and inserts, so those are the changes to log
+CREATE FUNCTION movie_listing_changes_logged() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO movie_listing_changes (movie_id) SELECT movie_id FROM new_rows;
+    ELSE
+        INSERT INTO movie_listing_changes (movie_id) SELECT movie_id FROM old_rows;
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER movie_listing_changes_insert AFTER INSERT ON movie_listing
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION movie_listing_changes_logged();
+CREATE TRIGGER movie_listing_changes_delete AFTER DELETE ON movie_listing
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION movie_listing_changes_logged();
+'''),
+    # Genre listings sorted by anything but movie_id filter on the genres array when they
+    # select too many movies to list their ids
+    ('0007_movie_listing_genres_index', '''
+CREATE INDEX movie_listing_genres_idx ON movie_listing USING GIN (genres);
+'''),
+    # catalogue_stats rolls movie_listing up by country, genre, language and release year like
+    # country_summary, so /stats reads a few hundred rows instead of every movie
+    ('0008_catalogue_stats', '''
+CREATE TABLE catalogue_stats (
+    dimension TEXT NOT NULL,
+    group_key TEXT NOT NULL,
+    movie_count BIGINT NOT NULL,
+    scored_count BIGINT NOT NULL,
+    score_total NUMERIC NOT NULL,
+    budget_total NUMERIC NOT NULL,
+    revenue_total NUMERIC NOT NULL,
+    PRIMARY KEY (dimension, group_key)
+);
+
+-- Every movie counts once in its country, language and year and once in each of its genres
+CREATE FUNCTION catalogue_stats_groups(movies movie_listing[]) RETURNS TABLE (
+    dimension TEXT, group_key TEXT, movie_count BIGINT, scored_count BIGINT,
+    score_total NUMERIC, budget_total NUMERIC, revenue_total NUMERIC
+) LANGUAGE sql AS $$
+    SELECT groups.dimension, groups.group_key, count(*), count(movie.score),
+           coalesce(sum(movie.score), 0), coalesce(sum(movie.budget), 0),
+           coalesce(sum(movie.revenue), 0)
+    FROM unnest(movies) AS movie
+    CROSS JOIN LATERAL (
+        VALUES ('country', movie.country_name), ('language', movie.language_name),
+               ('year', to_char(movie.release_date, 'YYYY'))
+        UNION ALL
+        SELECT 'genre', genre FROM unnest(movie.genres) AS genre
+    ) AS groups (dimension, group_key)
+    WHERE groups.group_key IS NOT NULL
+    GROUP BY groups.dimension, groups.group_key
+    ORDER BY groups.dimension, groups.group_key;
+$$;
+
+INSERT INTO catalogue_stats
+SELECT * FROM catalogue_stats_groups(ARRAY(SELECT movie_listing FROM movie_listing));
+
+-- As for country_summary, groups are upserted in key order so that writers lock them in the
+-- same order
+CREATE FUNCTION catalogue_stats_rows_changed() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO catalogue_stats AS stats
+        SELECT * FROM catalogue_stats_groups(ARRAY(SELECT new_rows::movie_listing FROM new_rows))
+        ON CONFLICT (dimension, group_key) DO UPDATE SET
+            movie_count=stats.movie_count + excluded.movie_count,
+            scored_count=stats.scored_count + excluded.scored_count,
+            score_total=stats.score_total + excluded.score_total,
+            budget_total=stats.budget_total + excluded.budget_total,
+            revenue_total=stats.revenue_total + excluded.revenue_total;
+    ELSE
+        UPDATE catalogue_stats AS stats SET
+            movie_count=stats.movie_count - removed.movie_count,
+            scored_count=stats.scored_count - removed.scored_count,
+            score_total=stats.score_total - removed.score_total,
+            budget_total=stats.budget_total - removed.budget_total,
+            revenue_total=stats.revenue_total - removed.revenue_total
+        FROM catalogue_stats_groups(ARRAY(SELECT old_rows::movie_listing FROM old_rows))
+            AS removed
+        WHERE stats.dimension=removed.dimension AND stats.group_key=removed.group_key;
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER catalogue_stats_insert AFTER INSERT ON movie_listing
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION catalogue_stats_rows_changed();
+CREATE TRIGGER catalogue_stats_delete AFTER DELETE ON movie_listing
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION catalogue_stats_rows_changed();
+'''),
+]
+
+# Arbitrary key so that concurrent deploys apply migrations one at a time
+LOCK_KEY = 718_281_828
+
+
+def apply_migrations(conn) -> list[str]:
+    '''Apply every migration not yet recorded, returning the names applied'''
+    applied = []
+    with conn.cursor() as curr:
+        curr.execute('SELECT pg_advisory_lock(%s);', (LOCK_KEY,))
+        try:
+            curr.execute('''
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    name TEXT PRIMARY KEY,
+    applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);''')
+            conn.commit()
+            curr.execute('SELECT name FROM schema_migrations;')
+            done = {row[0] for row in curr.fetchall()}
+            for name, statements in MIGRATIONS:
+                if name in done:
+                    continue
+                curr.execute(statements)
+                curr.execute('INSERT INTO schema_migrations (name) VALUES (%s);', (name,))
+                conn.commit()
+                applied.append(name)
+        finally:
+            conn.rollback()
+            curr.execute('SELECT pg_advisory_unlock(%s);', (LOCK_KEY,))
+            conn.commit()
+    return applied
+
+
+def main() -> None:
+    '''Apply pending migrations to the database described by the environment, as the
+    API connects to it'''
+    load_dotenv()
+    conn = psycopg2.connect(user=environ["DATABASE_USERNAME"],
+                            password=environ["DATABASE_PASSWORD"],
+                            host=environ["DATABASE_IP"], port=environ["DATABASE_PORT"],
+                            database=environ["DATABASE_NAME"])
+    try:
+        for migration in apply_migrations(conn):
+            print(f'Applied {migration}')
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
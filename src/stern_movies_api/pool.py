@@ -0,0 +1,172 @@
+'Process-wide pool of reusable database connections'
+import threading
+import time
+from collections import deque
+from typing import Any, Callable
+
+import psycopg2
+
+
+class PoolTimeout(Exception):
+    'Raised when no connection could be checked out before the timeout'
+
+
+class ConnectionPool: #pylint: disable=too-many-instance-attributes
+    '''Thread-safe pool of psycopg2 connections.
+
+    Connections are opened lazily up to `max_size` and handed back out on
+    checkout. Idle connections that have not been used for `max_idle` seconds
+    are pinged before reuse, and connections older than `max_age` seconds or
+    found closed/broken are discarded and replaced.'''
+
+    def __init__(self, connect: Callable[[], Any], min_size: int = 1, max_size: int = 10, #pylint: disable=too-many-arguments,too-many-positional-arguments
+                 timeout: float = 30.0, max_age: float = 1800.0, max_idle: float = 60.0):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError('pool sizes must satisfy 0 <= min_size <= max_size and max_size >= 1')
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_age = max_age
+        self.max_idle = max_idle
+        self._connect = connect
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._in_use = {}
+        self._size = 0
+        self._waiting = 0
+        self._closed = False
+        self._counters = {
+            'checkouts': 0,
+            'timeouts': 0,
+            'recycled': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+        }
+        for _ in range(min_size):
+            self._size += 1
+            self._idle.append(self._open())
+
+    def _open(self) -> tuple:
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        now = time.monotonic()
+        return conn, now, now
+
+    def _discard(self, conn) -> None:
+        with self._cond:
+            self._size -= 1
+            self._counters['recycled'] += 1
+            self._cond.notify()
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _healthy(self, entry: tuple) -> bool:
+        conn, created_at, last_used = entry
+        now = time.monotonic()
+        if conn.closed or now - created_at > self.max_age:
+            return False
+        if now - last_used > self.max_idle:
+            try:
+                with conn.cursor() as curr:
+                    curr.execute('SELECT 1;')
+                conn.rollback()
+            except psycopg2.Error:
+                return False
+        return True
+
+    def _reserve(self, deadline: float) -> tuple | None:
+        'Pop an idle connection, or return None once a slot for a new one is reserved'
+        with self._cond:
+            self._waiting += 1
+            try:
+                while True:
+                    if self._closed:
+                        raise PoolTimeout('Connection pool is closed')
+                    if self._idle:
+                        return self._idle.pop()
+                    if self._size < self.max_size:
+                        self._size += 1
+                        return None
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._counters['timeouts'] += 1
+                        raise PoolTimeout(
+                            f'No connection available within {self.timeout} seconds')
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+
+    def getconn(self):
+        'Check a healthy connection out of the pool, waiting up to `timeout` seconds'
+        start = time.monotonic()
+        deadline = start + self.timeout
+        while True:
+            entry = self._reserve(deadline)
+            if entry is None:
+                entry = self._open()
+            elif not self._healthy(entry):
+                self._discard(entry[0])
+                continue
+            break
+        waited = time.monotonic() - start
+        with self._cond:
+            self._in_use[id(entry[0])] = entry[1]
+            self._counters['checkouts'] += 1
+            self._counters['wait_time_total'] += waited
+            self._counters['wait_time_max'] = max(self._counters['wait_time_max'], waited)
+        return entry[0]
+
+    def putconn(self, conn, broken: bool = False) -> None:
+        'Return a connection, rolling back any open transaction'
+        with self._cond:
+            created_at = self._in_use.pop(id(conn))
+        if not (broken or self._closed or conn.closed):
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+            else:
+                if time.monotonic() - created_at <= self.max_age:
+                    with self._cond:
+                        if not self._closed:
+                            self._idle.append((conn, created_at, time.monotonic()))
+                            self._cond.notify()
+                            return
+        self._discard(conn)
+
+    def close(self) -> None:
+        'Close every idle connection; checked out ones are closed when returned'
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _, _ in idle:
+            try:
+                conn.close()
+            except psycopg2.Error:
+                pass
+
+    def stats(self) -> dict[str, Any]:
+        'Return gauges and counters describing the pool'
+        with self._cond:
+            checkouts = self._counters['checkouts']
+            return {
+                'size': self._size,
+                'in_use': len(self._in_use),
+                'idle': len(self._idle),
+                'waiting': self._waiting,
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'wait_time_avg': (self._counters['wait_time_total'] / checkouts
+                                  if checkouts else 0.0),
+                **self._counters,
+            }
@@ -0,0 +1,205 @@
+'''Routing of reads to read replicas with read-your-writes consistency.
+
+Reads are spread over the healthy replicas, each going to the one with the
+fewest reads in flight. A replica that cannot be reached is ejected for a
+while and its reads go to the others, or to the primary when none is left.
+
+Writes commit on the primary, which reports the WAL position (LSN) the
+commit reached. A read session carries the highest LSN its client has
+written, and its reads are only served by a replica known to have replayed
+that far, falling back to the primary while every replica is behind.'''
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Iterator
+
+_LSN = re.compile(r'^([0-9A-Fa-f]{1,8})/([0-9A-Fa-f]{1,8})$')
+
+_session = ContextVar('stern_movies_read_session', default=None)
+
+
+def parse_lsn(text: str) -> int:
+    '''Return the position of an LSN written as Postgres does, e.g. 16/B374D848'''
+    match = _LSN.match(text) if isinstance(text, str) else None
+    if match is None:
+        raise ValueError('LSN not recognized')
+    return int(match[1], 16) << 32 | int(match[2], 16)
+
+
+def format_lsn(lsn: int) -> str:
+    '''Return an LSN as Postgres writes it'''
+    return f'{lsn >> 32:X}/{lsn & 0xFFFFFFFF:X}'
+
+
+class ReadSession:
+    '''The LSN the reads of one request or client must see, raised by its own writes'''
+
+    def __init__(self, lsn: int = None):
+        self.lsn = lsn
+        self.wrote = False
+
+    def written(self, lsn: int) -> None:
+        '''Make later reads wait for a commit that reached `lsn`'''
+        self.lsn = lsn if self.lsn is None else max(self.lsn, lsn)
+        self.wrote = True
+
+
+def start_session(lsn: int = None) -> ReadSession:
+    '''Start the read session of the request being served'''
+    session = ReadSession(lsn)
+    _session.set(session)
+    return session
+
+
+def finish_session() -> ReadSession | None:
+    '''End the read session of the request being served and return it'''
+    session = _session.get()
+    _session.set(None)
+    return session
+
+
+def read_lsn() -> int | None:
+    '''Return the LSN replicas must have replayed to serve reads of this context'''
+    session = _session.get()
+    return session.lsn if session is not None else None
+
+
+def write_lsn() -> int | None:
+    '''Return the LSN reads must see to include the writes of this context, or None when
+    it made none'''
+    session = _session.get()
+    return session.lsn if session is not None and session.wrote else None
+
+
+@contextmanager
+def reading_after(lsn: int | None) -> Iterator[None]:
+    '''Make the reads of this context also wait for replicas to replay `lsn`'''
+    if lsn is None:
+        yield
+        return
+    current = read_lsn()
+    token = _session.set(ReadSession(lsn if current is None else max(current, lsn)))
+    try:
+        yield
+    finally:
+        _session.reset(token)
+
+
+def written(lsn: int) -> None:
+    '''Record a commit made from this context, starting a session outside a request'''
+    session = _session.get() or start_session()
+    session.written(lsn)
+
+
+class Replica: #pylint: disable=too-many-instance-attributes
+    '''One read replica and what is known of its health and replay position'''
+
+    def __init__(self, name: str, dsn: str):
+        self.name = name
+        self.dsn = dsn
+        self.pool = None
+        self.in_flight = 0
+        self.reads = 0
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.replayed_lsn = 0
+
+    def stats(self, now: float) -> dict[str, Any]:
+        '''Return the replica's counters'''
+        return {
+            'name': self.name,
+            'healthy': self.ejected_until <= now,
+            'in_flight': self.in_flight,
+            'reads': self.reads,
+            'failures': self.failures,
+            'replayed_lsn': format_lsn(self.replayed_lsn),
+        }
+
+
+class ReplicaRouter:
+    '''Chooses the replica each read is served from.
+
+    `open_pool(dsn)` returns the connection pool of a replica; pools are
+    opened on a replica's first read. A replica that fails is ejected for
+    `eject_for` seconds.'''
+
+    def __init__(self, replicas: dict[str, str], open_pool: Callable[[str], Any],
+                 eject_for: float = 30.0):
+        self.replicas = [Replica(name, dsn) for name, dsn in replicas.items()]
+        self.eject_for = eject_for
+        self._open_pool = open_pool
+        self._lock = threading.Lock()
+        self._turn = 0
+        self.primary_reads = 0
+        self.lagging_reads = 0
+
+    def choose(self, min_lsn: int = None) -> Replica | None:
+        '''Return the healthy replica with the fewest reads in flight, preferring those
+        known to have replayed `min_lsn`, or None when every replica is ejected.
+
+        The chosen replica's read is counted in flight until release().'''
+        now = time.monotonic()
+        with self._lock:
+            healthy = [replica for replica in self.replicas if replica.ejected_until <= now]
+            if not healthy:
+                self.primary_reads += 1
+                return None
+            if min_lsn is not None:
+                healthy = [replica for replica in healthy
+                           if replica.replayed_lsn >= min_lsn] or healthy
+            # Rotating the candidates spreads reads between replicas equally loaded
+            self._turn = (self._turn + 1) % len(healthy)
+            replica = min(healthy[self._turn:] + healthy[:self._turn],
+                          key=lambda replica: replica.in_flight)
+            replica.in_flight += 1
+            return replica
+
+    def pool(self, replica: Replica) -> Any:
+        '''Return the replica's pool, opening it on first use'''
+        with self._lock:
+            if replica.pool is None:
+                replica.pool = self._open_pool(replica.dsn)
+            return replica.pool
+
+    def replayed(self, replica: Replica, lsn: int | None) -> None:
+        '''Record the replay position of a replica; None means it is not in recovery,
+        so has every commit'''
+        with self._lock:
+            replica.replayed_lsn = max(replica.replayed_lsn,
+                                       lsn if lsn is not None else (1 << 64) - 1)
+
+    def release(self, replica: Replica, served: bool = True) -> None:
+        '''Finish a read chosen with choose(); `served` is false when it went to the
+        primary because the replica was behind the session'''
+        with self._lock:
+            replica.in_flight -= 1
+            if served:
+                replica.reads += 1
+            else:
+                self.lagging_reads += 1
+
+    def failed(self, replica: Replica) -> None:
+        '''Eject a replica that could not be reached'''
+        with self._lock:
+            replica.failures += 1
+            replica.ejected_until = time.monotonic() + self.eject_for
+
+    def detach_pools(self) -> list:
+        '''Forget the replicas' pools and return them for the caller to close'''
+        with self._lock:
+            pools = [replica.pool for replica in self.replicas if replica.pool is not None]
+            for replica in self.replicas:
+                replica.pool = None
+            return pools
+
+    def stats(self) -> dict[str, Any]:
+        '''Return each replica's counters and the reads served by the primary instead'''
+        now = time.monotonic()
+        with self._lock:
+            return {
+                'replicas': [replica.stats(now) for replica in self.replicas],
+                'primary_reads': self.primary_reads,
+                'lagging_reads': self.lagging_reads,
+            }
@@ -0,0 +1,149 @@
+'''Coalescing of identical concurrent reads (single-flight).
+
+The first caller of a key runs the read. Callers of the same key arriving
+while it is in flight wait for it instead of running it again, and get its
+result, or the exception it raised. A waiter gives up after `timeout`
+seconds with CoalescingTimeout, leaving the read running for the others.
+Results are shared between every caller, so must not be mutated.'''
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Hashable
+
+from stern_movies_api.metrics import COALESCED_READS
+
+OUTCOMES = ('executed', 'shared', 'failed', 'timed_out')
+
+
+class CoalescingTimeout(Exception):
+    'Raised when a read in flight for another caller did not finish before the timeout'
+
+
+def freeze(value: Any) -> Hashable:
+    '''Return `value` with its lists and dicts turned into tuples, so it can key a read'''
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, freeze(item)) for key, item in value.items()))
+    return value
+
+
+class _Flight: #pylint: disable=too-few-public-methods
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _Coalescer:
+    def __init__(self, timeout: float = 30.0):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._counters = dict.fromkeys(OUTCOMES, 0)
+
+    def _count(self, name: str, outcome: str) -> None:
+        self._counters[outcome] += 1
+        COALESCED_READS.inc((name, outcome))
+
+    @staticmethod
+    def _key(name: str, key: Any) -> Hashable | None:
+        key = (name, freeze(key))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def stats(self) -> dict[str, Any]:
+        '''Return how many reads ran, were answered by a read in flight or gave up waiting,
+        and the share of reads that did not run their own query'''
+        with self._lock:
+            stats = {'in_flight': len(self._flights), **self._counters}
+        reads = sum(stats[outcome] for outcome in OUTCOMES)
+        stats['coalesced_ratio'] = (stats['shared'] + stats['failed']) / reads if reads else 0.0
+        return stats
+
+
+class SingleFlight(_Coalescer):
+    '''Shares one call of a function among the threads calling it with the same arguments'''
+
+    def do(self, name: str, key: Any, func: Callable[[], Any]) -> Any:
+        '''Return func(), from the call of `name` and `key` in flight if any. Lists and dicts
+        in `key` compare by value; calls with an unhashable key are not shared.'''
+        key = self._key(name, key)
+        if key is None:
+            return func()
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if leader:
+            return self._lead(key, name, flight, func)
+        if not flight.done.wait(self.timeout):
+            with self._lock:
+                self._count(name, 'timed_out')
+            raise CoalescingTimeout(f'{name} did not finish within {self.timeout}s')
+        with self._lock:
+            self._count(name, 'failed' if flight.error is not None else 'shared')
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def _lead(self, key: Hashable, name: str, flight: _Flight, func: Callable[[], Any]) -> Any:
+        try:
+            flight.result = func()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                self._count(name, 'executed')
+            flight.done.set()
+
+
+class AsyncSingleFlight(_Coalescer):
+    '''Shares one call of a coroutine function among the tasks of one event loop awaiting
+    it with the same arguments.
+
+    The call runs in a task of its own, so the caller that started it being
+    cancelled, e.g. by its client going away, does not cancel it for the rest.'''
+
+    async def do(self, name: str, key: Any, func: Callable[[], Awaitable]) -> Any:
+        '''Return await func(), from the call of `name` and `key` in flight if any'''
+        key = self._key(name, key)
+        if key is None:
+            return await func()
+        with self._lock:
+            task = self._flights.get(key)
+            leader = task is None
+            if leader:
+                task = self._flights[key] = asyncio.ensure_future(func())
+                task.add_done_callback(lambda task: self._landed(key, name, task))
+        if leader:
+            return await asyncio.shield(task)
+        try:
+            result = await asyncio.wait_for(asyncio.shield(task), self.timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self._count(name, 'timed_out')
+            raise CoalescingTimeout(f'{name} did not finish within {self.timeout}s') from None
+        except Exception:
+            with self._lock:
+                self._count(name, 'failed')
+            raise
+        with self._lock:
+            self._count(name, 'shared')
+        return result
+
+    def _landed(self, key: Hashable, name: str, task: asyncio.Task) -> None:
+        with self._lock:
+            del self._flights[key]
+            self._count(name, 'executed')
+        # Nobody may be left awaiting a failed call, whose error must not go unretrieved
+        if not task.cancelled():
+            task.exception()
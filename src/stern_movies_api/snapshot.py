@@ -0,0 +1,757 @@
+'''In-memory, column-oriented copy of the movie_listing read model.
+
+Numbers and dates are NumPy arrays, text is stored arrow-style as one UTF-8
+buffer per column with the offset each string starts at, and values repeated
+across movies (statuses, languages, genres and the few distinct scores) are
+stored once and referenced by code. Every sort is kept as an order of row
+positions, so a listing page is a bisect for its cursor and a slice of that
+order, filtered by vectorized masks for a search or a country.
+
+NumPy is optional: it is only needed once CATALOGUE_SNAPSHOT is set.'''
+import asyncio
+import bisect
+import sys
+import threading
+import time
+from decimal import Decimal, InvalidOperation
+from typing import Any, Awaitable, Callable, Iterable
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SORT_KEYS = ('movie_id', 'title', 'score', 'budget', 'revenue')
+# Stands in for a NULL budget or revenue; no amount comes near it
+NULL_AMOUNT = -2 ** 63
+# Sorting more changed movies than this fraction of the snapshot is cheaper than merging them
+MERGE_FRACTION = 0.125
+# Title searches whose matches a snapshot remembers, so later pages of one skip the scan
+SEARCH_CACHE_SIZE = 32
+# Names that a C collation and a linguistic one put in different orders
+COLLATION_PROBES = ['a', 'B', 'b', '_', 'Z', 'a b', 'ab']
+# The columns of a snapshot, as movie_listing names them
+COLUMNS = ('movie_id', 'title', 'release_date', 'score', 'overview', 'status_name', 'budget',
+           'revenue', 'country_id', 'country_name', 'language_name', 'orig_title', 'genres')
+# Joins the genres of a movie when they are read as one string
+GENRE_SEPARATOR = '\x1f'
+# date.toordinal() of 1970-01-01, where datetime64 days count from
+_EPOCH_ORDINAL = 719163
+_NAT = -2 ** 63
+
+
+def to_columns(rows: Iterable[tuple | dict]) -> dict[str, list]:
+    '''Return rows of COLUMNS, as tuples in that order or as dicts, as a list per column.
+    Genres may be a list or a string of them joined by GENRE_SEPARATOR.'''
+    rows = [tuple(row[name] for name in COLUMNS) if isinstance(row, dict) else row
+            for row in rows]
+    if not rows:
+        return {name: [] for name in COLUMNS}
+    columns = dict(zip(COLUMNS, map(list, zip(*rows))))
+    columns['genres'] = [(genres.split(GENRE_SEPARATOR) if genres else [])
+                         if isinstance(genres, str) else genres for genres in columns['genres']]
+    return columns
+
+
+def _ranges(starts, lengths):
+    '''Return the indexes of every element of the ranges starting at `starts`, in order'''
+    ends = np.cumsum(lengths)
+    return np.repeat(starts - ends + lengths, lengths) + np.arange(ends[-1] if len(ends) else 0)
+
+
+def _offsets(lengths) -> 'np.ndarray':
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(lengths, dtype=np.int64)
+    return offsets
+
+
+class _Strings:
+    '''Text column: string i is raw[offsets[i]:offsets[i + 1]], NULL where `valid` is False'''
+
+    __slots__ = ('raw', 'data', 'offsets', 'valid')
+
+    def __init__(self, raw: bytes, offsets, valid=None):
+        self.raw = raw
+        self.data = np.frombuffer(raw, dtype=np.uint8)
+        self.offsets = offsets
+        self.valid = valid
+
+    @classmethod
+    def build(cls, values: list[str | None]) -> '_Strings':
+        'Encode a list of strings'
+        encoded = [b'' if value is None else value.encode() for value in values]
+        valid = None
+        if any(value is None for value in values):
+            valid = np.array([value is not None for value in values], dtype=bool)
+        return cls(b''.join(encoded), _offsets([len(value) for value in encoded]), valid)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def validity(self):
+        'Return which strings are not NULL'
+        return np.ones(len(self), dtype=bool) if self.valid is None else self.valid
+
+    def keep(self, mask) -> '_Strings':
+        'Return the strings that `mask` selects'
+        lengths = np.diff(self.offsets)
+        valid = None if self.valid is None else self.valid[mask]
+        return _Strings(self.data[np.repeat(mask, lengths)].tobytes(), _offsets(lengths[mask]),
+                        valid)
+
+    def concat(self, other: '_Strings') -> '_Strings':
+        'Return these strings followed by those of `other`'
+        valid = None
+        if self.valid is not None or other.valid is not None:
+            valid = np.concatenate([self.validity(), other.validity()])
+        return _Strings(self.raw + other.raw,
+                        np.concatenate([self.offsets, other.offsets[1:] + self.offsets[-1]]),
+                        valid)
+
+    def fold(self) -> '_Strings':
+        '''Return the strings with ASCII letters lowercased, as ILIKE compares them under a C
+        collation; the lengths are unchanged, so the offsets are shared'''
+        return _Strings(self.raw.lower(), self.offsets, self.valid)
+
+    def sort_value(self, position: int) -> bytes:
+        'Return the bytes of one string, which order as a C collation orders the strings'
+        return self.raw[self.offsets[position]:self.offsets[position + 1]]
+
+    def sort_column(self, positions):
+        'Return the strings at `positions` as a fixed-width array to sort on'
+        return np.array([self.sort_value(position) for position in positions.tolist()],
+                        dtype=bytes)
+
+    def nulls(self, positions):
+        'Return which of the strings at `positions` are NULL'
+        if self.valid is None:
+            return np.zeros(len(positions), dtype=bool)
+        return ~self.valid[positions]
+
+    def contains(self, needle: bytes):
+        'Return which strings contain `needle`'
+        found = np.zeros(len(self), dtype=bool)
+        size = len(needle)
+        if size > len(self.data):
+            return found
+        starts = np.flatnonzero(self.data[:len(self.data) - size + 1] == needle[0])
+        for index in range(1, size):
+            starts = starts[self.data[starts + index] == needle[index]]
+        rows = np.searchsorted(self.offsets, starts, side='right') - 1
+        # A match that runs past the end of its string spans two of them
+        found[rows[starts + size <= self.offsets[rows + 1]]] = True
+        return found if self.valid is None else found & self.valid
+
+    def values(self, positions) -> list[str | None]:
+        'Return the strings at `positions`'
+        raw = self.raw
+        values = [raw[start:end].decode() for start, end in
+                  zip(self.offsets[positions].tolist(), self.offsets[positions + 1].tolist())]
+        if self.valid is not None:
+            values = [value if valid else None
+                      for value, valid in zip(values, self.valid[positions].tolist())]
+        return values
+
+    @property
+    def nbytes(self) -> int:
+        'Bytes held by the column'
+        return self.data.nbytes + self.offsets.nbytes + (
+            self.valid.nbytes if self.valid is not None else 0)
+
+
+class _Codes:
+    '''Dictionary-encoded column: each distinct value is stored once in `values` and rows hold
+    its index, or -1 for NULL. An ordered dictionary keeps the codes in value order.'''
+
+    __slots__ = ('values', 'codes', 'ordered')
+
+    def __init__(self, values: list, codes, ordered: bool = False):
+        self.values = values
+        self.codes = codes
+        self.ordered = ordered
+
+    @classmethod
+    def build(cls, column: Iterable, ordered: bool = False) -> '_Codes':
+        'Encode a list of values'
+        column = list(column)
+        present = (value for value in column if value is not None)
+        values = sorted(set(present)) if ordered else list(dict.fromkeys(present))
+        index = {value: code for code, value in enumerate(values)}
+        codes = np.fromiter((-1 if value is None else index[value] for value in column),
+                            dtype=np.int16, count=len(column))
+        return cls(values, codes, ordered)
+
+    def keep(self, mask) -> '_Codes':
+        'Return the values that `mask` selects'
+        return _Codes(self.values, self.codes[mask], self.ordered)
+
+    def concat(self, other: '_Codes') -> '_Codes':
+        'Return these values followed by those of `other`, under one dictionary'
+        if self.ordered:
+            values = sorted(set(self.values) | set(other.values))
+        else:
+            known = set(self.values)
+            values = self.values + [value for value in other.values if value not in known]
+        index = {value: code for code, value in enumerate(values)}
+
+        def recode(column: _Codes):
+            # The trailing -1 is where the NULL code -1 indexes
+            mapping = np.array([index[value] for value in column.values] + [-1], dtype=np.int16)
+            return mapping[column.codes]
+
+        return _Codes(values, np.concatenate([recode(self), recode(other)]), self.ordered)
+
+    def code_of(self, value) -> float:
+        '''Return the code of `value` in an ordered dictionary, or half way between the codes
+        of its neighbours when no row holds it'''
+        code = bisect.bisect_left(self.values, value)
+        if code < len(self.values) and self.values[code] == value:
+            return code
+        return code - 0.5
+
+    def get(self, positions) -> list:
+        'Return the values at `positions`'
+        values = self.values + [None]
+        return [values[code] for code in self.codes[positions].tolist()]
+
+    @property
+    def nbytes(self) -> int:
+        'Bytes held by the column'
+        return self.codes.nbytes + sum(sys.getsizeof(value) for value in self.values)
+
+
+class _Lists:
+    'Column of lists of dictionary-encoded values, one flat run of codes per row'
+
+    __slots__ = ('items', 'offsets')
+
+    def __init__(self, items: _Codes, offsets):
+        self.items = items
+        self.offsets = offsets
+
+    @classmethod
+    def build(cls, column: list[list | None]) -> '_Lists':
+        'Encode a list of lists'
+        column = [value or [] for value in column]
+        return cls(_Codes.build(item for value in column for item in value),
+                   _offsets([len(value) for value in column]))
+
+    def keep(self, mask) -> '_Lists':
+        'Return the lists that `mask` selects'
+        lengths = np.diff(self.offsets)
+        return _Lists(self.items.keep(np.repeat(mask, lengths)), _offsets(lengths[mask]))
+
+    def concat(self, other: '_Lists') -> '_Lists':
+        'Return these lists followed by those of `other`'
+        return _Lists(self.items.concat(other.items),
+                      np.concatenate([self.offsets, other.offsets[1:] + self.offsets[-1]]))
+
+    def get(self, positions) -> list[list]:
+        'Return the lists at `positions`'
+        starts = self.offsets[positions]
+        lengths = self.offsets[positions + 1] - starts
+        items = self.items.get(_ranges(starts, lengths))
+        ends = np.cumsum(lengths).tolist()
+        return [items[end - length:end] for end, length in zip(ends, lengths.tolist())]
+
+    @property
+    def nbytes(self) -> int:
+        'Bytes held by the column'
+        return self.items.nbytes + self.offsets.nbytes
+
+
+class _Columns: #pylint: disable=too-many-instance-attributes
+    'The columns of movie_listing, one entry per movie'
+
+    def __init__(self, **columns):
+        self.ids = columns['ids']
+        self.titles = columns['titles']
+        self.folded_titles = columns.get('folded_titles')
+        if self.folded_titles is None:
+            self.folded_titles = self.titles.fold()
+        self.release_dates = columns['release_dates']
+        self.scores = columns['scores']
+        self.overviews = columns['overviews']
+        self.statuses = columns['statuses']
+        self.budgets = columns['budgets']
+        self.revenues = columns['revenues']
+        self.country_ids = columns['country_ids']
+        self.country_names = columns['country_names']
+        self.languages = columns['languages']
+        self.orig_titles = columns['orig_titles']
+        self.genres = columns['genres']
+
+    @classmethod
+    def build(cls, columns: dict[str, list]) -> '_Columns':
+        'Encode the columns of movie_listing, as to_columns returns them'
+        def amounts(name: str):
+            return np.fromiter((NULL_AMOUNT if amount is None else amount
+                                for amount in columns[name]),
+                               dtype=np.int64, count=len(columns[name]))
+
+        dates = columns['release_date']
+        return cls(
+            ids=np.array(columns['movie_id'], dtype=np.int32),
+            titles=_Strings.build(columns['title']),
+            release_dates=np.fromiter(
+                (_NAT if day is None else day.toordinal() - _EPOCH_ORDINAL for day in dates),
+                dtype=np.int64, count=len(dates)).view('datetime64[D]'),
+            scores=_Codes.build(columns['score'], ordered=True),
+            overviews=_Strings.build(columns['overview']),
+            statuses=_Codes.build(columns['status_name']),
+            budgets=amounts('budget'),
+            revenues=amounts('revenue'),
+            country_ids=np.array(columns['country_id'], dtype=np.int32),
+            country_names=dict(zip(columns['country_id'], columns['country_name'])),
+            languages=_Codes.build(columns['language_name']),
+            orig_titles=_Strings.build(columns['orig_title']),
+            genres=_Lists.build(columns['genres']),
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def keep(self, mask) -> '_Columns':
+        '''Return the movies that `mask` selects; masks rather than positions, as a refresh
+        keeps nearly every movie and indexing each byte of the text would cost more'''
+        return _Columns(
+            ids=self.ids[mask], titles=self.titles.keep(mask),
+            folded_titles=self.folded_titles.keep(mask),
+            release_dates=self.release_dates[mask], scores=self.scores.keep(mask),
+            overviews=self.overviews.keep(mask), statuses=self.statuses.keep(mask),
+            budgets=self.budgets[mask], revenues=self.revenues[mask],
+            country_ids=self.country_ids[mask], country_names=self.country_names,
+            languages=self.languages.keep(mask), orig_titles=self.orig_titles.keep(mask),
+            genres=self.genres.keep(mask))
+
+    def concat(self, other: '_Columns') -> '_Columns':
+        'Return these movies followed by those of `other`'
+        return _Columns(
+            ids=np.concatenate([self.ids, other.ids]), titles=self.titles.concat(other.titles),
+            folded_titles=self.folded_titles.concat(other.folded_titles),
+            release_dates=np.concatenate([self.release_dates, other.release_dates]),
+            scores=self.scores.concat(other.scores),
+            overviews=self.overviews.concat(other.overviews),
+            statuses=self.statuses.concat(other.statuses),
+            budgets=np.concatenate([self.budgets, other.budgets]),
+            revenues=np.concatenate([self.revenues, other.revenues]),
+            country_ids=np.concatenate([self.country_ids, other.country_ids]),
+            # A renamed country rewrites all of its movies, so the newer name wins
+            country_names={**self.country_names, **other.country_names},
+            languages=self.languages.concat(other.languages),
+            orig_titles=self.orig_titles.concat(other.orig_titles),
+            genres=self.genres.concat(other.genres))
+
+    def sort_column(self, key: str, positions) -> tuple[Any, Any]:
+        'Return the values to sort `positions` on by `key`, and which of them are NULL'
+        match key:
+            case 'title':
+                return self.titles.sort_column(positions), self.titles.nulls(positions)
+            case 'score':
+                codes = self.scores.codes[positions]
+                return codes, codes == -1
+            case 'budget' | 'revenue':
+                amounts = (self.budgets if key == 'budget' else self.revenues)[positions]
+                return amounts, amounts == NULL_AMOUNT
+        raise ValueError(f'cannot sort by {key}')
+
+    def sort_key(self, key: str) -> Callable[[int], tuple]:
+        'Return a function of a position giving the (value, movie_id) it sorts by'
+        ids = self.ids
+        match key:
+            case 'title':
+                titles = self.titles
+                return lambda position: (titles.sort_value(position), int(ids[position]))
+            case 'score':
+                values = self.scores.codes
+            case 'budget':
+                values = self.budgets
+            case 'revenue':
+                values = self.revenues
+            case _:
+                raise ValueError(f'cannot sort by {key}')
+        return lambda position: (int(values[position]), int(ids[position]))
+
+    def rows(self, positions) -> list[dict]:
+        'Return the movies at `positions` as the documents the read model holds'
+        def amounts(column) -> list[int | None]:
+            return [None if amount == NULL_AMOUNT else amount
+                    for amount in column[positions].tolist()]
+
+        country_names = [self.country_names.get(country_id)
+                         for country_id in self.country_ids[positions].tolist()]
+        columns = zip(self.ids[positions].tolist(), self.titles.values(positions),
+                      self.release_dates[positions].tolist(), self.scores.get(positions),
+                      self.overviews.values(positions), self.statuses.get(positions),
+                      amounts(self.budgets), amounts(self.revenues), country_names,
+                      self.languages.get(positions), self.orig_titles.values(positions),
+                      self.genres.get(positions))
+        return [{'movie_id': movie_id, 'title': title, 'release_date': release_date,
+                 'score': score, 'overview': overview, 'status_name': status_name,
+                 'budget': budget, 'revenue': revenue, 'country_name': country_name,
+                 'language_name': language_name, 'orig_title': orig_title, 'genres': genres}
+                for (movie_id, title, release_date, score, overview, status_name, budget,
+                     revenue, country_name, language_name, orig_title, genres) in columns]
+
+    def memory(self) -> dict[str, int]:
+        'Return the bytes held by each column'
+        return {
+            'movie_id': self.ids.nbytes,
+            'title': self.titles.nbytes + self.folded_titles.data.nbytes,
+            'release_date': self.release_dates.nbytes,
+            'score': self.scores.nbytes,
+            'overview': self.overviews.nbytes,
+            'status_name': self.statuses.nbytes,
+            'budget': self.budgets.nbytes,
+            'revenue': self.revenues.nbytes,
+            'country': self.country_ids.nbytes + sum(
+                sys.getsizeof(name) for name in self.country_names.values()),
+            'language_name': self.languages.nbytes,
+            'orig_title': self.orig_titles.nbytes,
+            'genres': self.genres.nbytes,
+        }
+
+
+class Snapshot:
+    '''Immutable snapshot of the movie listings with every sort order precomputed.
+
+    Orders hold row positions sorted by (value, movie_id) with NULL values
+    last; the descending order is the same array read backwards, NULLs and
+    all, which keeps NULLs last as the SQL listings do. `c_collation` says if
+    the database compares text byte by byte, the only order the snapshot can
+    reproduce for title sorts and searches; without it those are left to
+    Postgres.'''
+
+    def __init__(self, columns: _Columns, c_collation: bool = True,
+                 orders: dict[str, tuple] = None):
+        self.columns = columns
+        self.c_collation = c_collation
+        positions = np.arange(len(columns), dtype=np.int32)
+        self._orders = orders if orders is not None else {
+            key: self._sort(key, positions) for key in SORT_KEYS}
+        self._searches = {}
+
+    @classmethod
+    def build(cls, columns: dict[str, list], c_collation: bool = True) -> 'Snapshot':
+        'Build a snapshot from every row of movie_listing, as to_columns returns them'
+        return cls(_Columns.build(columns), c_collation)
+
+    def __len__(self) -> int:
+        return len(self.columns)
+
+    def _sort(self, key: str, positions) -> tuple[Any, int]:
+        '''Return `positions` in the order of `key`, and how many of them are not NULL'''
+        ids = self.columns.ids[positions]
+        if key == 'movie_id':
+            return positions[np.argsort(ids, kind='stable')], len(positions)
+        values, nulls = self.columns.sort_column(key, positions)
+        return positions[np.lexsort((ids, values, nulls))], len(positions) - int(nulls.sum())
+
+    def _merge(self, key: str, order, nonnull: int, positions) -> tuple[Any, int]:
+        '''Insert `positions` into an order of the other rows, bisecting for where each goes'''
+        added, added_nonnull = self._sort(key, positions)
+        ids = self.columns.ids
+        by_id = lambda position: int(ids[position]) #pylint: disable=unnecessary-lambda-assignment
+        if key == 'movie_id':
+            points = [bisect.bisect_left(order, by_id(position), key=by_id)
+                      for position in added.tolist()]
+        else:
+            sort_key = self.columns.sort_key(key)
+            points = [bisect.bisect_left(order, sort_key(position), 0, nonnull, key=sort_key)
+                      for position in added[:added_nonnull].tolist()]
+            points += [bisect.bisect_left(order, by_id(position), nonnull, len(order), key=by_id)
+                       for position in added[added_nonnull:].tolist()]
+        return np.insert(order, points, added), nonnull + added_nonnull
+
+    def apply(self, movie_ids: Iterable[int], columns: dict[str, list]) -> 'Snapshot':
+        '''Return a new snapshot with the movies of `movie_ids` replaced by the rows of
+        `columns`.
+
+        Changed movies without a row were deleted. The surviving rows keep their
+        relative order in every sort, so only the changed movies are sorted and
+        bisected into place; past MERGE_FRACTION of the snapshot everything is
+        sorted again instead. This snapshot is left as it was.'''
+        by_id, _ = self._orders['movie_id']
+        changed = np.unique(np.fromiter(movie_ids, dtype=np.int32))
+        index = np.searchsorted(self.columns.ids[by_id], changed)
+        index = index[index < len(by_id)]
+        index = index[np.isin(self.columns.ids[by_id[index]], changed)]
+        keep = np.ones(len(self), dtype=bool)
+        keep[by_id[index]] = False
+        kept = self.columns.keep(keep)
+        columns = kept.concat(_Columns.build(columns))
+        added = np.arange(len(kept), len(columns), dtype=np.int32)
+        if len(added) > MERGE_FRACTION * len(columns):
+            return Snapshot(columns, self.c_collation)
+        # Where each kept row now sits
+        moved = (np.cumsum(keep, dtype=np.int32) - 1).astype(np.int32)
+        snapshot = Snapshot(columns, self.c_collation, orders={})
+        for key, (order, nonnull) in self._orders.items():
+            survivors = keep[order]
+            snapshot._orders[key] = snapshot._merge(key, moved[order[survivors]], #pylint: disable=protected-access
+                                                    int(survivors[:nonnull].sum()), added)
+        return snapshot
+
+    def _start(self, key: str, descending: bool, after: tuple) -> int | None: #pylint: disable=too-many-return-statements
+        '''Return how many rows of the sort come before the first row after `after`, or None
+        if its value cannot be compared the way Postgres would compare it'''
+        order, nonnull = self._orders[key]
+        value, movie_id = after
+        ids = self.columns.ids
+        by_id = lambda position: int(ids[position]) #pylint: disable=unnecessary-lambda-assignment
+        if key == 'movie_id':
+            if descending:
+                return len(order) - bisect.bisect_left(order, movie_id, key=by_id)
+            return bisect.bisect_right(order, movie_id, key=by_id)
+        if value is None:
+            if descending:
+                return (len(order) + nonnull
+                        - bisect.bisect_left(order, movie_id, nonnull, key=by_id))
+            return bisect.bisect_right(order, movie_id, nonnull, key=by_id)
+        target = self._cursor_value(key, value)
+        if target is None:
+            return None
+        sort_key = self.columns.sort_key(key)
+        if descending:
+            return nonnull - bisect.bisect_left(order, (target, movie_id), 0, nonnull,
+                                                key=sort_key)
+        return bisect.bisect_right(order, (target, movie_id), 0, nonnull, key=sort_key)
+
+    def _cursor_value(self, key: str, value) -> Any:
+        '''Return a cursor's sort value in the form the order compares, or None if it is not
+        a value of the column'''
+        try:
+            match key:
+                case 'title':
+                    return value.encode() if isinstance(value, str) else None
+                case 'score':
+                    return self.columns.scores.code_of(Decimal(str(value)))
+                case _:
+                    return value if isinstance(value, int) and not isinstance(
+                        value, bool) else None
+        except InvalidOperation:
+            return None
+
+    def _segments(self, key: str, descending: bool, start: int) -> list:
+        '''Return the positions of the sort from `start` on, as views of its order'''
+        order, nonnull = self._orders[key]
+        if not descending:
+            return [order[start:]]
+        if start < nonnull:
+            return [order[:nonnull - start][::-1], order[nonnull:][::-1]]
+        return [order[nonnull:len(order) - (start - nonnull)][::-1]]
+
+    @staticmethod
+    def _page(segments: list, mask, limit: int | None):
+        '''Return the first `limit` positions of the segments that `mask` selects, filtering
+        a growing window of them at a time so a page rarely looks at the whole order'''
+        pages, remaining = [], limit
+        for segment in segments:
+            start = 0
+            step = len(segment) if mask is None or remaining is None else max(remaining * 4,
+                                                                               1024)
+            while start < len(segment) and remaining != 0:
+                part = segment[start:start + step]
+                if mask is not None:
+                    part = part[mask[part]]
+                if remaining is not None:
+                    part = part[:remaining]
+                    remaining -= len(part)
+                pages.append(part)
+                start += step
+                step *= 2
+        return np.concatenate(pages) if pages else np.empty(0, dtype=np.int32)
+
+    def _search(self, needle: bytes):
+        '''Return which movies have a title containing `needle`. Up to SEARCH_CACHE_SIZE
+        masks of a byte per movie are remembered, and all forgotten once that many are.'''
+        mask = self._searches.get(needle)
+        if mask is None:
+            mask = self.columns.folded_titles.contains(needle)
+            if len(self._searches) >= SEARCH_CACHE_SIZE:
+                self._searches = {}
+            self._searches[needle] = mask
+        return mask
+
+    def _selected(self, movies: int):
+        'Return which rows are of movies whose bit is set in the bitmap `movies`'
+        bits = np.unpackbits(np.frombuffer(movies.to_bytes((movies.bit_length() + 7) // 8,
+                                                           'little'), dtype=np.uint8),
+                             bitorder='little').view(bool)
+        ids = self.columns.ids
+        selected = np.zeros(len(ids), dtype=bool)
+        inside = ids < len(bits)
+        selected[inside] = bits[ids[inside]]
+        return selected
+
+    def listing(self, search: str = None, country_id: int = None, sort_by: str = None, #pylint: disable=too-many-arguments,too-many-positional-arguments
+                sort_order: str = None, limit: int = None, after: tuple = None,
+                movies: int = None) -> list[dict] | None:
+        '''Return the movies a listing query returns, or None if it is one the snapshot cannot
+        answer as Postgres would: relevance sorts, or title sorts and searches without a C
+        collation. Unsorted listings come back in movie_id order. `movies` is a bitmap, as
+        genre_index holds them, of the movie ids to list.'''
+        sort_by = sort_by or 'movie_id'
+        if sort_by not in SORT_KEYS:
+            return None
+        if not self.c_collation and (search or sort_by == 'title'):
+            return None
+        mask = None
+        if search:
+            mask = self._search(search.encode().lower())
+        if country_id is not None:
+            in_country = self.columns.country_ids == country_id
+            mask = in_country if mask is None else mask & in_country
+        if movies is not None:
+            selected = self._selected(movies)
+            mask = selected if mask is None else mask & selected
+        descending = (sort_order or 'ASC').upper() == 'DESC'
+        start = 0
+        if after is not None:
+            start = self._start(sort_by, descending, after)
+            if start is None:
+                return None
+        return self.columns.rows(self._page(self._segments(sort_by, descending, start),
+                                            mask, limit))
+
+    def memory(self) -> dict[str, Any]:
+        '''Return the bytes held by each column and by the sort orders, their total, and
+        the total scaled to 100k movies'''
+        columns = self.columns.memory()
+        columns['sort_orders'] = sum(order.nbytes for order, _ in self._orders.values())
+        total = sum(columns.values())
+        return {'columns': columns, 'total': total,
+                'per_100k_movies': round(total * 100_000 / len(self)) if len(self) else 0}
+
+
+class CatalogueSnapshot:
+    '''Holds the current Snapshot and keeps it in step with the database.
+
+    `load()` returns (xmin, columns, c_collation) for a full load and
+    `changes(xmin)` returns (xmin, movie_ids, columns): the movies changed by
+    transactions from `xmin` on, the rows of those that still exist, as
+    to_columns returns them, and the
+    xmin to ask from next time. The snapshot is refreshed from the changes at
+    most every `refresh_interval` seconds, and loaded whole again every
+    `rebuild_interval` seconds. Each refresh builds a new Snapshot and swaps
+    it in with one assignment, so a reader finishes on the one it started
+    with, and other threads keep reading the old one while a refresh runs.
+    `invalidate` makes the next read wait for a refresh, so a process sees
+    its own writes. Subclasses may hold another `snapshot_type` with the same
+    `build` and `apply`, built from what their `load` returns after the xmin.'''
+
+    snapshot_type = Snapshot
+
+    def __init__(self, load: Callable[[], tuple[int, dict[str, list], bool]],
+                 changes: Callable[[int], tuple[int, list[int], dict[str, list]]],
+                 refresh_interval: float = 1.0, rebuild_interval: float = 1800.0):
+        if np is None and self.snapshot_type is Snapshot:
+            raise ImportError('The catalogue snapshot requires numpy')
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self._load = load
+        self._changes = changes
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._xmin = None
+        self._stale = False
+        self._refreshed_at = 0.0
+        self._loaded_at = 0.0
+        self.loads = 0
+        self.refreshes = 0
+        self.changes_applied = 0
+        self.refresh_ms = 0.0
+
+    def _due(self, now: float) -> bool:
+        return (self._snapshot is None or self._stale
+                or now - self._refreshed_at > self.refresh_interval)
+
+    def _must_wait(self) -> bool:
+        return self._snapshot is None or self._stale
+
+    def _refresh(self) -> None:
+        start, now = time.perf_counter(), time.monotonic()
+        if self._snapshot is None or now - self._loaded_at > self.rebuild_interval:
+            xmin, *loaded = self._load()
+            self._snapshot = self.snapshot_type.build(*loaded)
+            self._loaded_at = now
+            self.loads += 1
+        else:
+            xmin, movie_ids, columns = self._changes(self._xmin)
+            if movie_ids:
+                self._snapshot = self._snapshot.apply(movie_ids, columns)
+                self.changes_applied += len(movie_ids)
+            self.refreshes += 1
+        self._xmin, self._refreshed_at, self._stale = xmin, now, False
+        self.refresh_ms = (time.perf_counter() - start) * 1000
+
+    def get(self) -> Snapshot:
+        'Return the current snapshot, refreshing it first when it is due'
+        if not self._due(time.monotonic()):
+            return self._snapshot
+        if self._must_wait():
+            self._lock.acquire() #pylint: disable=consider-using-with
+        elif not self._lock.acquire(blocking=False): #pylint: disable=consider-using-with
+            return self._snapshot
+        try:
+            if self._due(time.monotonic()):
+                self._refresh()
+        finally:
+            self._lock.release()
+        return self._snapshot
+
+    def invalidate(self) -> None:
+        'Make the next read refresh the snapshot before answering'
+        self._stale = True
+
+    def stats(self) -> dict[str, Any]:
+        'Return refresh counters and the memory the snapshot holds'
+        snapshot = self._snapshot
+        return {
+            'movies': len(snapshot) if snapshot is not None else 0,
+            'loads': self.loads,
+            'refreshes': self.refreshes,
+            'changes_applied': self.changes_applied,
+            'refresh_ms': round(self.refresh_ms, 3),
+            'memory': snapshot.memory() if snapshot is not None else None,
+        }
+
+
+class AsyncCatalogueSnapshot(CatalogueSnapshot):
+    '''CatalogueSnapshot whose `load` and `changes` are coroutine functions.
+
+    Full loads are encoded in a worker thread so that the event loop keeps
+    serving requests from the previous snapshot meanwhile.'''
+
+    def __init__(self, load: Callable[[], Awaitable[tuple[int, dict[str, list], bool]]],
+                 changes: Callable[[int], Awaitable[tuple[int, list[int], dict[str, list]]]],
+                 refresh_interval: float = 1.0, rebuild_interval: float = 1800.0):
+        super().__init__(load, changes, refresh_interval, rebuild_interval)
+        self._async_lock = asyncio.Lock()
+
+    async def _refresh(self) -> None: #pylint: disable=invalid-overridden-method
+        start, now = time.perf_counter(), time.monotonic()
+        if self._snapshot is None or now - self._loaded_at > self.rebuild_interval:
+            xmin, *loaded = await self._load()
+            self._snapshot = await asyncio.to_thread(self.snapshot_type.build, *loaded)
+            self._loaded_at = now
+            self.loads += 1
+        else:
+            xmin, movie_ids, columns = await self._changes(self._xmin)
+            if movie_ids:
+                self._snapshot = self._snapshot.apply(movie_ids, columns)
+                self.changes_applied += len(movie_ids)
+            self.refreshes += 1
+        self._xmin, self._refreshed_at, self._stale = xmin, now, False
+        self.refresh_ms = (time.perf_counter() - start) * 1000
+
+    async def get(self) -> Snapshot: #pylint: disable=invalid-overridden-method
+        'Return the current snapshot, refreshing it first when it is due'
+        if not self._due(time.monotonic()):
+            return self._snapshot
+        if self._async_lock.locked() and not self._must_wait():
+            return self._snapshot
+        async with self._async_lock:
+            if self._due(time.monotonic()):
+                await self._refresh()
+        return self._snapshot
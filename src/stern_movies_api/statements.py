@@ -0,0 +1,97 @@
+'Server-side prepared statements for the hot read queries'
+import hashlib
+import re
+import threading
+import weakref
+from typing import Any
+
+from psycopg2 import sql
+
+PLACEHOLDER = re.compile(r'%%|%s')
+
+
+def render(query: sql.Composable | str) -> str:
+    '''Render a query built with psycopg2.sql into a string without a connection.
+
+    Only SQL fragments and identifiers are used by the query builders, and
+    neither needs a connection's encoding to be rendered.'''
+    if isinstance(query, str):
+        return query
+    if isinstance(query, sql.Composed):
+        return ''.join(render(part) for part in query.seq)
+    if isinstance(query, sql.SQL):
+        return query.string
+    if isinstance(query, sql.Identifier):
+        return '.'.join('"' + name.replace('"', '""') + '"' for name in query.strings)
+    raise TypeError(f'cannot render {type(query).__name__}')
+
+
+class StatementRegistry:
+    '''Prepares each distinct query once per connection and executes it by name.
+
+    A query is identified by its text, so every sort column, direction and
+    pagination shape the listing builder produces gets its own statement. The
+    first use on a connection sends PREPARE and EXECUTE together, keeping it
+    to one round trip; later uses send only EXECUTE, which skips parsing and,
+    once Postgres settles on a generic plan, planning too.'''
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._statements = {}
+        self._connections = weakref.WeakKeyDictionary()
+        self.prepares = 0
+        self.executions = 0
+        self.reused = 0
+
+    def statement(self, query: str) -> tuple[str, str, int]:
+        '''Return the name, PREPARE body and parameter count of a %s-style query'''
+        statement = self._statements.get(query)
+        if statement is None:
+            count = 0
+
+            def number(match: re.Match) -> str:
+                nonlocal count
+                if match.group() == '%%':
+                    return '%'
+                count += 1
+                return f'${count}'
+            body = PLACEHOLDER.sub(number, query.strip().rstrip(';'))
+            name = 'stern_' + hashlib.sha1(body.encode()).hexdigest()[:16]
+            statement = self._statements.setdefault(query, (name, body, count))
+        return statement
+
+    def execute(self, curr, query: sql.Composable | str, params: Any = ()) -> None:
+        '''Execute `query` on `curr` as a prepared statement.
+
+        If a first use fails, PREPARE may or may not have taken effect, so
+        the next use on that connection checks pg_prepared_statements.'''
+        if not self.enabled:
+            curr.execute(query, params)
+            return
+        name, body, count = self.statement(render(query))
+        with self._lock:
+            prepared = self._connections.setdefault(curr.connection, {})
+        state = prepared.get(name, False)
+        if state is None:
+            curr.execute('SELECT name FROM pg_prepared_statements WHERE name=%s;', (name,))
+            state = curr.fetchone() is not None
+        execute = f'EXECUTE {name}' + (f" ({', '.join(['%s'] * count)})" if count else '') + ';'
+        if state:
+            curr.execute(execute, params)
+            self.reused += 1
+        else:
+            prepared[name] = None
+            curr.execute(f"PREPARE {name} AS {body.replace('%', '%%')}; {execute}", params)
+            prepared[name] = True
+            self.prepares += 1
+        self.executions += 1
+
+    def stats(self) -> dict[str, int]:
+        'Return how many statements were prepared, executed and reused'
+        return {
+            'statements': len(self._statements),
+            'prepares': self.prepares,
+            'executions': self.executions,
+            'reused': self.reused,
+        }
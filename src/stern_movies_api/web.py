@@ -0,0 +1,453 @@
+'''Request parsing, response bodies and cache tags shared by app.py and async_app.py.
+
+Nothing here depends on Flask or Quart: helpers take the request's args,
+headers and cookies and return plain values, so both apps serve the same
+JSON and the same errors.'''
+import json
+import logging
+import time
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime, timezone
+from os import environ
+from typing import Callable
+from werkzeug.sansio.response import Response
+from stern_movies_api.cache import ResponseCache
+from stern_movies_api.database import STATS_AGGREGATES, STATS_DIMENSIONS
+from stern_movies_api.metrics import finish_request, server_timing, start_request
+from stern_movies_api.replicas import (ReadSession, finish_session, format_lsn, parse_lsn,
+                                       start_session)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 1000
+NDJSON = "application/x-ndjson"
+STREAM_CHUNK_ROWS = 500
+MAX_BATCH_ROWS = 10000
+MAX_BATCH_IDS = 100
+
+# Carries the LSN of a client's latest write, so its reads wait for replicas to replay it
+READ_AFTER_HEADER = "X-Read-After-LSN"
+READ_AFTER_COOKIE = "read_after_lsn"
+READ_AFTER_TTL = int(environ.get("READ_AFTER_TTL", 60))
+
+LISTINGS_TAG = "listings"
+COUNTRIES_TAG = "countries"
+
+
+def validate_sort_by(sort_by, relevance=False):
+    '''Return if sort query is valid; relevance is only valid alongside a search'''
+    return sort_by in {'movie_id', 'title', 'score', 'budget', 'revenue'} or (
+        relevance and sort_by == 'relevance')
+
+
+def validate_sort_order(order_by):
+    '''Return if order query is valid'''
+    return order_by in {'asc', 'desc'}
+
+
+def encode_cursor(sort_by: str, sort_order: str, movie: dict) -> str:
+    '''Return an opaque cursor pointing just after the given movie'''
+    key = [sort_by, sort_order, movie.get(sort_by), movie['movie_id']]
+    return urlsafe_b64encode(json.dumps(key, default=str).encode()).decode()
+
+
+def decode_cursor(cursor: str, relevance: bool = False) -> tuple | None:
+    '''Return (sort_by, sort_order, (sort value, movie_id)) or None if the cursor is invalid'''
+    try:
+        sort_by, sort_order, value, movie_id = json.loads(urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        return None
+    if not (validate_sort_by(sort_by, relevance) and validate_sort_order(sort_order)):
+        return None
+    if not isinstance(movie_id, int) or isinstance(movie_id, bool):
+        return None
+    return sort_by, sort_order, (value, movie_id)
+
+
+def parse_listing_args(args, search: str = None) -> tuple[dict | None, str | None]: #pylint: disable=too-many-return-statements
+    '''Validate the sort and pagination query parameters.
+
+    Returns (params, None) on success or (None, error message).'''
+    params = {
+        "sort_by": args.get("sort_by"),
+        "sort_order": args.get("sort_order"),
+        "limit": None,
+        "after": None,
+    }
+    if params["sort_by"] and not validate_sort_by(params["sort_by"], bool(search)):
+        return None, "Invalid sort_by parameter"
+
+    if params["sort_order"] and not validate_sort_order(params["sort_order"]):
+        return None, "Invalid sort_order parameter"
+
+    if params["sort_by"] == "relevance" and not params["sort_order"]:
+        params["sort_order"] = "desc"
+
+    limit = args.get("limit")
+    cursor = args.get("cursor")
+    if limit is None and cursor is None:
+        return params, None
+
+    try:
+        params["limit"] = int(limit) if limit is not None else DEFAULT_PAGE_LIMIT
+    except ValueError:
+        return None, "Invalid limit parameter"
+    if not 1 <= params["limit"] <= MAX_PAGE_LIMIT:
+        return None, f"limit must be between 1 and {MAX_PAGE_LIMIT}"
+
+    params["sort_by"] = params["sort_by"] or "movie_id"
+    params["sort_order"] = params["sort_order"] or "asc"
+    if cursor is not None:
+        decoded = decode_cursor(cursor, bool(search))
+        if decoded is None:
+            return None, "Invalid cursor parameter"
+        sort_by, sort_order, params["after"] = decoded
+        if (args.get("sort_by", sort_by) != sort_by
+                or args.get("sort_order", sort_order) != sort_order):
+            return None, "cursor does not match sort_by and sort_order"
+        params["sort_by"], params["sort_order"] = sort_by, sort_order
+    return params, None
+
+
+def parse_movies_args(args) -> tuple[str | None, list[str], dict | None, str | None]:
+    '''Read a movie listing's search, genres and sort and pagination parameters. A listing
+    may be searched or filtered by genre, not both.
+
+    Returns (search, genres, params, None) on success or (search, genres, None, error
+    message).'''
+    search = args.get("search")
+    genres = args.getlist("genre")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("listing movies", extra={"search": search, "params": args.to_dict()})
+    params, error = parse_listing_args(args, search)
+    if not error and genres and search:
+        params, error = None, "genre cannot be combined with search"
+    return search, genres, params, error
+
+
+def parse_movie_ids(ids: str) -> tuple[list[int] | None, str | None]:
+    '''Read a comma separated list of movie ids, dropping repeats.
+
+    Returns (ids, None) on success or (None, error message).'''
+    try:
+        movie_ids = list(dict.fromkeys(int(movie_id) for movie_id in ids.split(",")))
+    except ValueError:
+        return None, "Invalid ids parameter"
+    if len(movie_ids) > MAX_BATCH_IDS:
+        return None, f"ids may list at most {MAX_BATCH_IDS} movies"
+    return movie_ids, None
+
+
+def batch_response(movie_ids: list[int], movies: list[dict]) -> dict:
+    '''Return the movies found for a batch of ids along with the ids that were not'''
+    found = {movie["movie_id"] for movie in movies}
+    return {"movies": movies,
+            "missing": [movie_id for movie_id in movie_ids if movie_id not in found]}
+
+
+def parse_movie_payload(data) -> tuple[dict | None, str | None]:
+    '''Read a movie from a request payload into create_movie's arguments.
+
+    Returns (movie, None) on success or (None, error message).'''
+    if not isinstance(data, dict):
+        return None, "Each movie must be a JSON object"
+    movie = {
+        "title": data.get("title"),
+        "release_date": data.get("release_date"),
+        "genre": data.get("genre"),
+        "overview": data.get("overview", ""),
+        "status": data.get("status", "released"),
+        "budget": data.get("budget", 0),
+        "revenue": data.get("revenue", 0),
+        "country": data.get("country"),
+        "language": data.get("language"),
+        "orig_title": data.get("orig_title") or data.get("title"),
+    }
+
+    if not all(movie[field] for field in ("title", "release_date", "genre", "country", "language")):
+        return None, "Missing required fields"
+
+    try:
+        movie["release_date"] = datetime.strptime(movie["release_date"], "%m/%d/%Y").date()
+    except (TypeError, ValueError):
+        return None, "Invalid release_date format. Please use MM/DD/YYYY"
+
+    return movie, None
+
+
+def parse_ndjson(text: str) -> list:
+    '''Read one JSON value per non-blank line; lines that are not JSON become None'''
+    payloads = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            payloads.append(json.loads(line))
+        except ValueError:
+            payloads.append(None)
+    return payloads
+
+
+def parse_batch(payloads, parse: Callable, noun: str) -> tuple[list | None, list | None,
+                                                                str | None]:
+    '''Read every payload of a batch with `parse`, giving each one that is rejected its
+    error result and keeping (index, value) for the rest.
+
+    Returns (results, values, None) on success or (None, None, error message).'''
+    if not isinstance(payloads, list):
+        return None, None, f"Expected a JSON array of {noun}"
+    if len(payloads) > MAX_BATCH_ROWS:
+        return None, None, f"A batch may contain at most {MAX_BATCH_ROWS} {noun}"
+
+    results = [None] * len(payloads)
+    values = []
+    for index, data in enumerate(payloads):
+        value, error = parse(data)
+        if error:
+            results[index] = {"index": index, "error": error}
+        else:
+            values.append((index, value))
+    return results, values, None
+
+
+def batch_summary(results: list, values: list, created: list[dict]) -> dict:
+    '''Fill in the results of the values a batch created and count them'''
+    for (index, _), result in zip(values, created):
+        results[index] = {"index": index, **result}
+    failed = sum(1 for result in results if "error" in result)
+    return {"created": len(results) - failed, "failed": failed, "results": results}
+
+
+def parse_review_payload(data, partial: bool = False) -> tuple[dict | None, str | None]:
+    '''Read a review from a request payload into create_review's arguments, or with
+    `partial` into the fields update_review should change.
+
+    Returns (review, None) on success or (None, error message).'''
+    if not isinstance(data, dict):
+        return None, "Each review must be a JSON object"
+    review = {"review_text": data.get("review_text"), "score": data.get("score")}
+
+    if partial and review["review_text"] is None and review["score"] is None:
+        return None, "Nothing to update"
+    if not partial and review["review_text"] is None:
+        return None, "Missing required fields"
+
+    if review["review_text"] is not None and (not isinstance(review["review_text"], str)
+                                              or not review["review_text"].strip()):
+        return None, "review_text must be a non-empty string"
+    score = review["score"]
+    if score is not None and (not isinstance(score, int) or isinstance(score, bool)
+                              or not 1 <= score <= 10):
+        return None, "score must be an integer between 1 and 10"
+
+    return review, None
+
+
+def encode_review_cursor(review_id: int) -> str:
+    '''Return an opaque cursor pointing just after the given review'''
+    return urlsafe_b64encode(json.dumps(["review_id", review_id]).encode()).decode()
+
+
+def decode_review_cursor(cursor: str) -> int | None:
+    '''Return the review_id a review cursor points after, or None if it is invalid'''
+    try:
+        key, review_id = json.loads(urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        return None
+    if key != "review_id" or not isinstance(review_id, int) or isinstance(review_id, bool):
+        return None
+    return review_id
+
+
+def parse_review_page_args(args) -> tuple[dict | None, str | None]:
+    '''Validate the limit and cursor of a page of reviews.
+
+    Returns (params, None) on success or (None, error message).'''
+    params = {"limit": DEFAULT_PAGE_LIMIT, "after": 0}
+    try:
+        params["limit"] = int(args.get("limit", DEFAULT_PAGE_LIMIT))
+    except ValueError:
+        return None, "Invalid limit parameter"
+    if not 1 <= params["limit"] <= MAX_PAGE_LIMIT:
+        return None, f"limit must be between 1 and {MAX_PAGE_LIMIT}"
+
+    cursor = args.get("cursor")
+    if cursor is not None:
+        params["after"] = decode_review_cursor(cursor)
+        if params["after"] is None:
+            return None, "Invalid cursor parameter"
+    return params, None
+
+
+def parse_stats_args(args) -> tuple[dict | None, str | None]:
+    '''Read the dimensions to group by and the aggregates to report, each given comma
+    separated or repeated, in the order first asked for. Every aggregate is reported
+    when none is asked for.
+
+    Returns (params, None) on success or (None, error message).'''
+    params = {}
+    for name, allowed in (("group_by", STATS_DIMENSIONS), ("aggregates", STATS_AGGREGATES)):
+        values = [value.strip() for arg in args.getlist(name) for value in arg.split(",")]
+        values = list(dict.fromkeys(value for value in values if value))
+        unknown = [value for value in values if value not in allowed]
+        if unknown:
+            return None, f"{name} must be among {', '.join(allowed)}"
+        params[name] = values
+    params["aggregates"] = params["aggregates"] or list(STATS_AGGREGATES)
+    return params, None
+
+
+def review_page_response(movie_id: int, stats: dict, reviews: list[dict], limit: int) -> dict:
+    '''Trim reviews fetched with one extra row into a page carrying the movie's review
+    counters and next_cursor'''
+    next_cursor = None
+    if len(reviews) > limit:
+        reviews = reviews[:limit]
+        next_cursor = encode_review_cursor(reviews[-1]["review_id"])
+    return {"movie_id": movie_id, "review_count": stats["review_count"],
+            "average_score": stats["average_score"], "reviews": reviews,
+            "next_cursor": next_cursor}
+
+
+def wants_stream(args, accept_mimetypes) -> bool:
+    '''Return if the client asked for an NDJSON stream'''
+    if args.get("stream") in {"1", "true"}:
+        return True
+    return accept_mimetypes.best_match(["application/json", NDJSON]) == NDJSON
+
+
+def ndjson_chunk(dumps: Callable[[dict], str], movies: list[dict]) -> str:
+    '''Return a chunk of movies as newline delimited JSON'''
+    return "".join(dumps(movie) + "\n" for movie in movies)
+
+
+def page_response(movies: list[dict], params: dict) -> dict:
+    '''Trim a listing fetched with one extra row into a page carrying next_cursor'''
+    next_cursor = None
+    if len(movies) > params["limit"]:
+        movies = movies[:params["limit"]]
+        next_cursor = encode_cursor(params["sort_by"], params["sort_order"], movies[-1])
+    return {"movies": movies, "next_cursor": next_cursor}
+
+
+def parse_genre_match(args, accept_mimetypes) -> tuple[bool | None, str | None]:
+    '''Read genre_match: whether movies must have every requested genre (all, the default)
+    or any of them. Genre listings cannot be streamed.
+
+    Returns (match_all, None) on success or (None, error message).'''
+    match = args.get("genre_match", "all")
+    if match not in {"all", "any"}:
+        return None, "genre_match must be all or any"
+    if wants_stream(args, accept_mimetypes):
+        return None, "genre cannot be combined with stream"
+    return match == "all", None
+
+
+def genre_response(movies: list[dict], counts: dict, params: dict) -> dict:
+    '''Return a genre listing, as a page when a limit was asked for, with how many movies
+    it lists and how many of them have each genre'''
+    body = page_response(movies, params) if params["limit"] is not None else {"movies": movies}
+    return {**body, **counts}
+
+
+def cache_validators(cache: ResponseCache, kind: str, params: dict,
+                     tags: list[str]) -> tuple[dict, str, datetime | None]:
+    '''Return the tag versions a cached response is stored under, with the ETag and
+    Last-Modified it is validated against.
+
+    Last-Modified only has whole seconds, so a write later in the same second as the
+    last one would not move it and If-Modified-Since would answer 304 with a stale body.
+    It is left out until that second is over, when any later write falls in a later
+    second; until then clients revalidate with the ETag alone.'''
+    versions = cache.versions(tags)
+    modified = int(cache.last_modified(tags))
+    last_modified = None
+    if modified < int(time.time()):
+        last_modified = datetime.fromtimestamp(modified, timezone.utc)
+    return versions, cache.etag(kind, params, versions), last_modified
+
+
+def with_validators(response: Response, etag: str, last_modified: datetime | None) -> Response:
+    '''Set a cached response's ETag and, if it has one yet, Last-Modified'''
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response
+
+
+def movie_tag(movie_id: int) -> str:
+    '''Return the cache tag of a single movie'''
+    return f"movie:{movie_id}"
+
+
+def country_tag(country_code: str) -> str:
+    '''Return the cache tag of a country listing'''
+    return f"country:{country_code}"
+
+
+def reviews_tag(movie_id: int) -> str:
+    '''Return the cache tag of a movie's reviews'''
+    return f"reviews:{movie_id}"
+
+
+def created_movie_tags(movies: list[tuple[int, dict]], created: list[dict]) -> list[str]:
+    '''Return the cache tags the movies a batch created invalidate, or none if it created
+    none'''
+    countries, movie_ids = set(), []
+    for (_, movie), result in zip(movies, created):
+        if "movie_id" in result:
+            countries.add(movie["country"])
+            movie_ids.append(result["movie_id"])
+    if not countries:
+        return []
+    return ([LISTINGS_TAG] + [country_tag(c) for c in sorted(countries)]
+            + [movie_tag(movie_id) for movie_id in movie_ids])
+
+
+def route_label(url_rule) -> str:
+    '''Return the URL rule a request matched, keeping metric labels bounded'''
+    return url_rule.rule if url_rule is not None else "unmatched"
+
+
+def pool_gauges(stats: dict) -> dict[str, tuple[str, float]]:
+    '''Return the numeric connection pool gauges as metrics'''
+    return {f"stern_db_pool_{name}": (f"Connection pool {name.replace('_', ' ')}", value)
+            for name, value in stats.items() if isinstance(value, (int, float))}
+
+
+def read_after_lsn(headers, cookies) -> int | None:
+    '''Return the LSN of the client's latest write, sent as a header or a cookie'''
+    token = headers.get(READ_AFTER_HEADER) or cookies.get(READ_AFTER_COOKIE)
+    try:
+        return parse_lsn(token) if token else None
+    except ValueError:
+        return None
+
+
+def remember_writes(response: Response, session: ReadSession | None) -> None:
+    '''Hand a client that wrote the LSN its later reads must see, for READ_AFTER_TTL
+    seconds, which replicas are expected to catch up well within'''
+    if session is not None and session.wrote:
+        token = format_lsn(session.lsn)
+        response.headers[READ_AFTER_HEADER] = token
+        response.set_cookie(READ_AFTER_COOKIE, token, max_age=READ_AFTER_TTL, httponly=True,
+                            samesite="Lax")
+
+
+def begin_request(headers, cookies) -> float:
+    '''Start counting the database work of a request and the writes it must read after,
+    returning when it started'''
+    started = time.perf_counter()
+    start_request()
+    start_session(read_after_lsn(headers, cookies))
+    return started
+
+
+def end_request(response: Response, url_rule, method: str, started: float) -> None:
+    '''Record the latency and database work of a request by route, and hand the client
+    the LSN of any write it made'''
+    seconds = time.perf_counter() - started
+    stats = finish_request(route_label(url_rule), method, response.status_code, seconds)
+    response.headers["Server-Timing"] = server_timing(stats, seconds)
+    remember_writes(response, finish_session())
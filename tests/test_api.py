@@ -1,22 +1,58 @@
 #pylint: skip-file
 import pytest
-from stern_movies_api.app import app
+from stern_movies_api.app import app, response_cache
+from stern_movies_api.web import encode_cursor, decode_cursor
 from unittest.mock import patch
+from stern_movies_api.replicas import read_lsn, written
 
 
 @pytest.fixture
 def client():
     app.config["TESTING"] = True
+    response_cache.clear()
     with app.test_client() as client:
         yield client
 
 
+@patch('stern_movies_api.app.pool_stats')
+@patch('stern_movies_api.app.get_movie_by_id')
+def test_endpoint_metrics(mock_movie, mock_pool, client):
+    mock_movie.return_value = {'movie_id': 1}
+    mock_pool.return_value = {'in_use': 2, 'idle': 1}
+    assert 'db;dur=' in client.get("/movies/1").headers["Server-Timing"]
+    client.get("/nowhere")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain; version=0.0.4")
+    text = response.get_data(as_text=True)
+    assert ('stern_http_request_duration_seconds_count{route="/movies/<int:movie_id>",'
+            'method="GET"}') in text
+    assert 'stern_http_requests_total{route="unmatched",method="GET",status="404"}' in text
+    assert 'stern_db_pool_in_use 2' in text
+
+
 def test_endpoint_index(client):
     response = client.get("/")
     assert response.status_code == 200
     assert response.json == {"message": "Welcome to the Movie API"}
 
 
+@patch('stern_movies_api.app.lookup_stats')
+@patch('stern_movies_api.app.pool_stats')
+def test_endpoint_status(mock_stats, mock_lookups, client):
+    mock_stats.return_value = {'in_use': 1, 'idle': 2}
+    mock_lookups.return_value = {'genres': {'hits': 3}}
+    response = client.get("/status")
+    assert response.status_code == 200
+    assert response.json["pool"] == {'in_use': 1, 'idle': 2}
+    assert response.json["lookups"] == {'genres': {'hits': 3}}
+    assert set(response.json["response_cache"]) == {'hits', 'misses', 'not_modified'}
+    assert response.json["snapshot"] is None
+    assert response.json["genre_index"]["loads"] >= 0
+    assert response.json["replicas"] is None
+    assert response.json["coalescing"]["coalesced_ratio"] >= 0
+
+
 @patch('stern_movies_api.app.get_movies')
 def test_endpoint_get_movies(mock_movies, client):
     response = client.get("/movies")
@@ -27,3 +63,457 @@ def test_endpoint_get_movies(mock_movies, client):
 def test_endpoint_get_movie(mock_movies, client):
     response = client.get("/movies/1")
     assert response.status_code == 200
+
+
+@patch('stern_movies_api.app.get_movies')
+def test_endpoint_get_movies_paginates(mock_movies, client):
+    mock_movies.return_value = [{'movie_id': 1, 'score': 7}, {'movie_id': 2, 'score': 6},
+                                {'movie_id': 3, 'score': 5}]
+    response = client.get("/movies?limit=2&sort_by=score&sort_order=desc")
+    assert response.status_code == 200
+    assert response.json['movies'] == mock_movies.return_value[:2]
+    assert decode_cursor(response.json['next_cursor']) == ('score', 'desc', (6, 2))
+    mock_movies.assert_called_once_with(None, 'score', 'desc', 3, None)
+
+
+@patch('stern_movies_api.app.get_movies')
+def test_endpoint_get_movies_follows_cursor(mock_movies, client):
+    mock_movies.return_value = [{'movie_id': 4, 'title': 'D'}]
+    cursor = encode_cursor('title', 'asc', {'movie_id': 3, 'title': 'C'})
+    response = client.get(f"/movies?limit=2&cursor={cursor}")
+    assert response.json == {'movies': [{'movie_id': 4, 'title': 'D'}], 'next_cursor': None}
+    mock_movies.assert_called_once_with(None, 'title', 'asc', 3, ('C', 3))
+
+
+@pytest.mark.parametrize('query', ['limit=0', 'limit=ten', 'cursor=not-a-cursor',
+                                   'sort_by=score&cursor=' + encode_cursor(
+                                       'title', 'asc', {'movie_id': 1, 'title': 'A'}),
+                                   'cursor=' + encode_cursor(
+                                       'genre', 'asc', {'movie_id': 1, 'genre': 'A'})])
+@patch('stern_movies_api.app.get_movies')
+def test_endpoint_get_movies_rejects_bad_pagination(mock_movies, query, client):
+    response = client.get(f"/movies?{query}")
+    assert response.status_code == 400
+    assert not mock_movies.called
+
+
+@patch('stern_movies_api.app.get_movie_by_country')
+def test_endpoint_get_movies_by_country_paginates(mock_movies, client):
+    mock_movies.return_value = [{'movie_id': 1}, {'movie_id': 2}]
+    response = client.get("/countries/US?limit=1")
+    assert response.json['movies'] == [{'movie_id': 1}]
+    assert decode_cursor(response.json['next_cursor']) == ('movie_id', 'asc', (1, 1))
+    mock_movies.assert_called_once_with('US', 'movie_id', 'asc', 2, None)
+
+
+@patch('stern_movies_api.app.get_genre_facets')
+@patch('stern_movies_api.app.get_movies_by_genre')
+def test_endpoint_get_movies_by_genre(mock_movies, mock_facets, client):
+    mock_movies.return_value = [{'movie_id': 1}, {'movie_id': 2}]
+    mock_facets.return_value = {'movie_count': 2, 'facets': {'Drama': 2, 'War': 1}}
+    response = client.get("/genres/Drama?limit=1&sort_by=score&sort_order=desc")
+    assert response.status_code == 200
+    assert response.json['movies'] == [{'movie_id': 1}]
+    assert response.json['facets'] == {'Drama': 2, 'War': 1}
+    assert 'next_cursor' in response.json
+    mock_movies.assert_called_once_with(['Drama'], True, 'score', 'desc', 2, None)
+    client.get("/genres/Drama?limit=1&sort_by=score&sort_order=desc")
+    assert mock_movies.call_count == 1, "Genre listings are cached."
+
+
+@patch('stern_movies_api.app.get_genre_facets')
+@patch('stern_movies_api.app.get_movies_by_genre')
+def test_endpoint_get_movies_filters_genres(mock_movies, mock_facets, client):
+    mock_movies.return_value = [{'movie_id': 3}]
+    mock_facets.return_value = {'movie_count': 1, 'facets': {'War': 1}}
+    response = client.get("/movies?genre=Drama&genre=War&genre_match=any")
+    assert response.json == {'movies': [{'movie_id': 3}], 'movie_count': 1,
+                             'facets': {'War': 1}}
+    mock_movies.assert_called_once_with(['Drama', 'War'], False, None, None, None, None)
+
+
+@pytest.mark.parametrize("path,status", [
+    ("/genres/Western", 404),
+    ("/movies?genre=Western", 400),
+    ("/movies?genre=Drama&search=star", 400),
+    ("/movies?genre=Drama&genre_match=some", 400),
+    ("/genres/Drama?stream=1", 400),
+])
+@patch('stern_movies_api.app.get_genre_facets')
+@patch('stern_movies_api.app.get_movies_by_genre')
+def test_endpoint_get_movies_by_genre_rejects(mock_movies, mock_facets, client, path, status):
+    mock_facets.side_effect = ValueError('Genre not recognized')
+    assert client.get(path).status_code == status
+    assert not mock_movies.called
+
+
+@patch('stern_movies_api.app.get_country_summaries')
+@patch('stern_movies_api.app.create_movie')
+def test_endpoint_get_countries_is_invalidated_by_writes(mock_create, mock_summaries, client):
+    mock_summaries.return_value = [{'country_code': 'US', 'movie_count': 1}]
+    mock_create.return_value = {'movie_id': 2}
+    assert client.get("/countries").json == [{'country_code': 'US', 'movie_count': 1}]
+    client.get("/countries")
+    assert mock_summaries.call_count == 1
+    client.post("/movies", json={"title": "T", "release_date": "01/01/2000", "genre": "Drama",
+                                 "country": "US", "language": "English"})
+    client.get("/countries")
+    assert mock_summaries.call_count == 2
+
+
+@patch('stern_movies_api.app.get_catalogue_stats')
+@patch('stern_movies_api.app.delete_movie')
+def test_endpoint_get_stats_is_cached_until_writes(mock_delete, mock_stats, client):
+    mock_stats.return_value = {'totals': {'movies': 3}, 'genre': [{'genre': 'Drama', 'movies': 2}]}
+    response = client.get("/stats?group_by=genre,year&group_by=genre&aggregates=movies")
+    assert response.status_code == 200
+    assert response.json == mock_stats.return_value
+    mock_stats.assert_called_once_with(['genre', 'year'], ['movies'])
+    client.get("/stats?group_by=genre,year&group_by=genre&aggregates=movies")
+    assert mock_stats.call_count == 1
+    client.delete("/movies/1")
+    client.get("/stats?group_by=genre,year&group_by=genre&aggregates=movies")
+    assert mock_stats.call_count == 2
+
+
+@pytest.mark.parametrize('query', ['group_by=director', 'aggregates=median', 'group_by=year,'
+                                   'country&aggregates=movies,mode'])
+def test_endpoint_get_stats_rejects_unknown(query, client):
+    response = client.get(f"/stats?{query}")
+    assert response.status_code == 400
+
+
+@patch('stern_movies_api.app.stream_movies')
+def test_endpoint_get_movies_streams_ndjson(mock_stream, client):
+    mock_stream.return_value = iter([{'movie_id': 1}, {'movie_id': 2}])
+    response = client.get("/movies?sort_by=title", headers={"Accept": "application/x-ndjson"})
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    assert response.data == b'{"movie_id":1}\n{"movie_id":2}\n'
+    mock_stream.assert_called_once_with(None, 'title', None)
+
+
+@patch('stern_movies_api.app.get_country_id')
+@patch('stern_movies_api.app.stream_movie_by_country')
+def test_endpoint_get_movies_by_country_streams_ndjson(mock_stream, mock_country, client):
+    mock_country.return_value = 1
+    mock_stream.return_value = iter([{'movie_id': 3}])
+    response = client.get("/countries/US?stream=1")
+    assert response.data == b'{"movie_id":3}\n'
+
+
+@patch('stern_movies_api.app.get_country_id')
+@patch('stern_movies_api.app.stream_movie_by_country')
+def test_endpoint_get_movies_by_country_stream_unknown_code(mock_stream, mock_country, client):
+    mock_country.side_effect = ValueError('Country not recognized')
+    response = client.get("/countries/XX?stream=1")
+    assert response.status_code == 404
+    assert response.json == {"error": "No movies found for this country"}
+    assert not mock_stream.called
+
+
+@patch('stern_movies_api.app.stream_movies')
+def test_endpoint_get_movies_stream_rejects_pagination(mock_stream, client):
+    response = client.get("/movies?stream=1&limit=5")
+    assert response.status_code == 400
+    assert not mock_stream.called
+
+
+@patch('stern_movies_api.app.get_movies')
+def test_endpoint_get_movies_is_cached(mock_movies, client):
+    mock_movies.return_value = [{'movie_id': 1}]
+    first = client.get("/movies?sort_by=title&sort_order=asc")
+    second = client.get("/movies?sort_order=asc&sort_by=title")
+    assert mock_movies.call_count == 1
+    assert second.json == first.json == [{'movie_id': 1}]
+    assert second.headers["ETag"] == first.headers["ETag"]
+
+
+@patch('stern_movies_api.app.get_movies')
+def test_endpoint_get_movies_does_not_cache_errors(mock_movies, client):
+    mock_movies.return_value = []
+    client.get("/movies")
+    client.get("/movies")
+    assert mock_movies.call_count == 2
+
+
+@patch('stern_movies_api.app.delete_movie')
+@patch('stern_movies_api.app.get_movie_by_country')
+@patch('stern_movies_api.app.get_movie_by_id')
+def test_delete_invalidates_cached_movie(mock_movie, mock_country, mock_delete, client):
+    mock_movie.return_value = {'movie_id': 1}
+    mock_country.return_value = [{'movie_id': 1}]
+    client.get("/movies/1")
+    client.get("/movies/2")
+    client.get("/countries/US")
+    client.delete("/movies/1")
+    client.get("/movies/1")
+    client.get("/movies/2")
+    client.get("/countries/US")
+    assert mock_movie.call_count == 3
+    assert mock_country.call_count == 2
+
+
+@patch('stern_movies_api.app.delete_movie')
+@patch('stern_movies_api.app.get_movie_by_id')
+def test_writes_hand_out_read_after_token(mock_movie, mock_delete, client):
+    mock_delete.side_effect = lambda movie_id: written(0x20) or True
+    mock_movie.return_value = {'movie_id': 2}
+    response = client.delete("/movies/1")
+    assert response.headers["X-Read-After-LSN"] == "0/20"
+    assert "read_after_lsn=0/20" in response.headers["Set-Cookie"]
+    mock_movie.side_effect = lambda movie_id: {'movie_id': movie_id, 'lsn': read_lsn()}
+    response = client.get("/movies/2")
+    assert response.json == {'movie_id': 2, 'lsn': 0x20}, "The cookie carries the token."
+    assert "X-Read-After-LSN" not in response.headers
+    client.get("/movies/2", headers={"X-Read-After-LSN": "0/20"})
+    assert mock_movie.call_count == 2, "Reads after a write skip the cache."
+    client.delete_cookie("read_after_lsn")
+    assert client.get("/movies/2").json == {'movie_id': 2, 'lsn': 0x20}
+    assert mock_movie.call_count == 2, "Other clients are served the entry it stored."
+    assert client.get("/movies/2", headers={"X-Read-After-LSN": "nonsense"}).status_code == 200
+
+
+@patch('stern_movies_api.app.delete_movie')
+@patch('stern_movies_api.app.get_movie_by_id')
+def test_lagging_replica_does_not_refill_the_cache(mock_movie, mock_delete, client):
+    # A replica that has replayed up to 0/10 serves reads unless they must see later writes
+    def replica_read(movie_id):
+        if (read_lsn() or 0) > 0x10:
+            raise ValueError('No movie with that id was found')
+        return {'movie_id': movie_id}
+
+    mock_movie.side_effect = replica_read
+    mock_delete.side_effect = lambda movie_id: written(0x20) or True
+    etag = client.get("/movies/1").headers["ETag"]
+    client.delete("/movies/1")
+    client.delete_cookie("read_after_lsn")
+    assert client.get("/movies/1").status_code == 404, "Rebuilt past the delete."
+    response = client.get("/movies/1", headers={"If-None-Match": etag})
+    assert response.status_code == 404
+    mock_movie.side_effect = None
+    mock_movie.return_value = {'movie_id': 3}
+    assert client.get("/movies/3").status_code == 200, "Untouched tags read as before."
+    assert mock_movie.call_args_list[-1].args == (3,)
+
+
+@patch('stern_movies_api.app.get_movie_by_id')
+def test_endpoint_get_missing_movie(mock_movie, client):
+    mock_movie.side_effect = ValueError('No movie with that id was found')
+    response = client.get("/movies/404")
+    assert response.status_code == 404
+    assert response.json == {"error": "Movie not found"}
+
+
+@patch('stern_movies_api.app.get_movies_by_ids')
+def test_endpoint_get_movies_by_ids(mock_movies, client):
+    mock_movies.return_value = [{'movie_id': 3}, {'movie_id': 1}]
+    response = client.get("/movies?ids=3,2,1,3")
+    assert response.status_code == 200
+    assert response.json == {"movies": [{'movie_id': 3}, {'movie_id': 1}], "missing": [2]}
+    mock_movies.assert_called_once_with([3, 2, 1])
+
+
+@pytest.mark.parametrize('ids', ['', '1,x', '1,,2', ','.join(str(i) for i in range(101))])
+def test_endpoint_get_movies_by_ids_rejects_bad_ids(ids, client):
+    assert client.get(f"/movies?ids={ids}").status_code == 400
+
+
+@patch('stern_movies_api.app.delete_movie')
+@patch('stern_movies_api.app.get_movies_by_ids')
+def test_delete_invalidates_batches_holding_the_movie(mock_movies, mock_delete, client):
+    mock_movies.return_value = [{'movie_id': 1}]
+    client.get("/movies?ids=1,2")
+    client.get("/movies?ids=3")
+    client.delete("/movies/2")
+    client.get("/movies?ids=1,2")
+    client.get("/movies?ids=3")
+    assert [c.args[0] for c in mock_movies.call_args_list] == [[1, 2], [3], [1, 2]]
+
+
+@patch('stern_movies_api.app.create_movie')
+@patch('stern_movies_api.app.get_movie_by_country')
+def test_create_invalidates_only_its_country(mock_country, mock_create, client):
+    mock_country.return_value = [{'movie_id': 1}]
+    mock_create.return_value = {'movie_id': 2}
+    client.get("/countries/US")
+    client.get("/countries/GB")
+    client.post("/movies", json={"title": "T", "release_date": "01/01/2000", "genre": "Drama",
+                                 "country": "US", "language": "English"})
+    client.get("/countries/US")
+    client.get("/countries/GB")
+    assert [c.args[0] for c in mock_country.call_args_list] == ['US', 'GB', 'US']
+
+
+@patch('stern_movies_api.app.get_movie_by_id')
+def test_endpoint_get_movie_not_modified(mock_movie, client):
+    mock_movie.return_value = {'movie_id': 1}
+    etag = client.get("/movies/1").headers["ETag"]
+    hits = response_cache.stats()['hits']
+    response = client.get("/movies/1", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert mock_movie.call_count == 1
+    assert response_cache.stats()['hits'] == hits, "A 304 should not build or fetch the body."
+
+
+@patch('stern_movies_api.app.delete_movie')
+@patch('stern_movies_api.app.get_movie_by_country')
+def test_endpoint_get_movies_by_country_etag_changes_after_delete(mock_country, mock_delete, client):
+    mock_country.return_value = [{'movie_id': 1}]
+    etag = client.get("/countries/US").headers["ETag"]
+    assert client.get("/countries/US", headers={"If-None-Match": etag}).status_code == 304
+    client.delete("/movies/1")
+    response = client.get("/countries/US", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+@patch('time.time')
+@patch('stern_movies_api.app.get_movie_by_id')
+def test_endpoint_get_movie_if_modified_since(mock_movie, mock_time, client):
+    mock_movie.return_value = {'movie_id': 1}
+    mock_time.return_value = 1000.2
+    response_cache.invalidate(['movie:1'])
+    mock_time.return_value = 1001.5
+    last_modified = client.get("/movies/1").headers["Last-Modified"]
+    response = client.get("/movies/1", headers={"If-Modified-Since": last_modified})
+    assert response.status_code == 304
+
+
+@patch('time.time')
+@patch('stern_movies_api.app.get_movie_by_id')
+def test_same_second_write_is_not_hidden_by_if_modified_since(mock_movie, mock_time, client):
+    mock_movie.return_value = {'movie_id': 1}
+    mock_time.return_value = 1000.2
+    response_cache.invalidate(['movie:1'])
+    mock_time.return_value = 1000.5
+    assert "Last-Modified" not in client.get("/movies/1").headers, "The second is not over."
+    mock_time.return_value = 1000.7
+    response_cache.invalidate(['movie:1'])
+    mock_movie.return_value = {'movie_id': 1, 'title': 'Changed'}
+    # Whole seconds cannot tell the two writes apart, so the date is not trusted yet
+    since = "Thu, 01 Jan 1970 00:16:40 GMT"
+    response = client.get("/movies/1", headers={"If-Modified-Since": since})
+    assert response.status_code == 200
+    assert response.json == {'movie_id': 1, 'title': 'Changed'}
+    mock_time.return_value = 1001.5
+    response = client.get("/movies/1", headers={"If-Modified-Since": since})
+    assert response.status_code == 304
+
+
+@patch('stern_movies_api.app.create_movies')
+def test_endpoint_create_movies_batch(mock_create, client):
+    mock_create.return_value = [{'movie_id': 7}, {'error': 'Genre not recognized'}]
+    movie = {"title": "T", "release_date": "01/01/2000", "genre": "Drama",
+             "country": "US", "language": "English"}
+    response = client.post("/movies/batch", json=[movie, {"title": "No date"}, movie])
+    assert response.status_code == 200
+    assert response.json == {"created": 1, "failed": 2, "results": [
+        {"index": 0, "movie_id": 7},
+        {"index": 1, "error": "Missing required fields"},
+        {"index": 2, "error": "Genre not recognized"}]}
+    assert len(mock_create.call_args.args[0]) == 2
+
+
+@patch('stern_movies_api.app.create_movies')
+def test_endpoint_create_movies_batch_ndjson(mock_create, client):
+    mock_create.return_value = [{'movie_id': 8}]
+    body = '{"title": "T", "release_date": "01/01/2000", "genre": "Drama", "country": "US", "language": "English"}\n{oops\n'
+    response = client.post("/movies/batch", data=body, content_type="application/x-ndjson")
+    assert response.json["results"] == [{"index": 0, "movie_id": 8},
+                                        {"index": 1, "error": "Each movie must be a JSON object"}]
+
+
+def test_endpoint_create_movies_batch_rejects_non_array(client):
+    response = client.post("/movies/batch", json={"title": "T"})
+    assert response.status_code == 400
+
+
+def test_endpoint_create_movie_rejects_a_non_json_body(client):
+    response = client.post("/movies", data="title=T", content_type="text/plain")
+    assert response.status_code == 400
+    assert response.json == {"error": "Each movie must be a JSON object"}
+
+
+@patch('stern_movies_api.app.get_movies')
+def test_endpoint_get_movies_relevance_requires_search(mock_movies, client):
+    assert client.get("/movies?sort_by=relevance").status_code == 400
+    mock_movies.return_value = [{'movie_id': 1}]
+    assert client.get("/movies?sort_by=relevance&search=star").status_code == 200
+    mock_movies.assert_called_once_with('star', 'relevance', 'desc')
+
+
+@patch('stern_movies_api.app.read_reviews')
+@patch('stern_movies_api.app.get_review_stats')
+def test_endpoint_get_reviews_paginates(mock_stats, mock_reviews, client):
+    mock_stats.return_value = {'review_count': 3, 'average_score': '6.50'}
+    mock_reviews.return_value = [{'review_id': 4}, {'review_id': 9}, {'review_id': 12}]
+    response = client.get("/movies/5/reviews?limit=2")
+    assert response.json['reviews'] == [{'review_id': 4}, {'review_id': 9}]
+    assert (response.json['review_count'], response.json['average_score']) == (3, '6.50')
+    mock_reviews.assert_called_once_with(5, 3, 0)
+    client.get(f"/movies/5/reviews?limit=2&cursor={response.json['next_cursor']}")
+    mock_reviews.assert_called_with(5, 3, 9)
+
+
+@patch('stern_movies_api.app.get_review_stats')
+def test_endpoint_get_reviews_of_missing_movie(mock_stats, client):
+    mock_stats.return_value = None
+    assert client.get("/movies/5/reviews").status_code == 404
+    assert client.get("/movies/5/reviews?cursor=bad").status_code == 400
+    assert client.get("/movies/5/reviews?limit=0").status_code == 400
+
+
+@patch('stern_movies_api.app.create_review')
+@patch('stern_movies_api.app.read_reviews')
+@patch('stern_movies_api.app.get_review_stats')
+def test_endpoint_create_review_invalidates_reviews(mock_stats, mock_reviews, mock_create, client):
+    mock_stats.return_value = {'review_count': 0, 'average_score': None}
+    mock_reviews.return_value = []
+    mock_create.return_value = {'review_id': 1}
+    client.get("/movies/5/reviews")
+    response = client.post("/movies/5/reviews", json={"review_text": "Great", "score": 9})
+    assert response.status_code == 201
+    mock_create.assert_called_once_with(5, review_text="Great", score=9)
+    client.get("/movies/5/reviews")
+    assert mock_stats.call_count == 2
+
+
+@pytest.mark.parametrize('payload', [{}, {"review_text": ""}, {"review_text": "Ok", "score": 0},
+                                     {"review_text": "Ok", "score": "9"}, []])
+@patch('stern_movies_api.app.create_review')
+def test_endpoint_create_review_rejects_bad_payload(mock_create, payload, client):
+    assert client.post("/movies/5/reviews", json=payload).status_code == 400
+    assert not mock_create.called
+
+
+@patch('stern_movies_api.app.create_review')
+def test_endpoint_create_review_of_missing_movie(mock_create, client):
+    mock_create.side_effect = ValueError('No movie with that id was found')
+    assert client.post("/movies/5/reviews", json={"review_text": "Ok"}).status_code == 404
+
+
+@patch('stern_movies_api.app.create_reviews')
+def test_endpoint_create_reviews_batch(mock_create, client):
+    mock_create.return_value = [{'review_id': 3}]
+    body = '{"review_text": "Ok", "score": 5}\n{oops\n'
+    response = client.post("/movies/5/reviews/batch", data=body,
+                           content_type="application/x-ndjson")
+    assert response.json == {"created": 1, "failed": 1, "results": [
+        {"index": 0, "review_id": 3}, {"index": 1, "error": "Each review must be a JSON object"}]}
+    mock_create.assert_called_once_with([{'movie_id': 5, 'review_text': 'Ok', 'score': 5}])
+
+
+@patch('stern_movies_api.app.delete_review')
+@patch('stern_movies_api.app.update_review')
+def test_endpoint_update_and_delete_review(mock_update, mock_delete, client):
+    mock_update.return_value = {'review_id': 1, 'score': 2}
+    assert client.patch("/movies/5/reviews/1", json={"score": 2}).status_code == 200
+    mock_update.assert_called_once_with(1, movie_id=5, review_text=None, score=2)
+    assert client.patch("/movies/5/reviews/1", json={}).status_code == 400
+    mock_update.return_value = None
+    assert client.patch("/movies/5/reviews/1", json={"score": 2}).status_code == 404
+    mock_delete.return_value = False
+    assert client.delete("/movies/5/reviews/1").status_code == 404
+    mock_delete.assert_called_once_with(1, 5)
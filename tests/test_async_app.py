@@ -0,0 +1,145 @@
+#pylint: skip-file
+import asyncio
+from unittest.mock import patch
+
+import pytest
+
+from stern_movies_api.async_app import app, response_cache
+from stern_movies_api.web import decode_cursor
+from stern_movies_api.database import STATS_AGGREGATES
+from stern_movies_api.replicas import read_lsn
+
+
+def get(path, headers=None):
+    async def request():
+        response = await app.test_client().get(path, headers=headers)
+        return response.status_code, response.headers, await response.get_json()
+    return asyncio.run(request())
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    response_cache.clear()
+
+
+def test_endpoint_index():
+    status, _, body = get("/")
+    assert status == 200
+    assert body == {"message": "Welcome to the Movie API"}
+
+
+@patch('stern_movies_api.async_app.get_movies')
+def test_endpoint_get_movies_paginates(mock_movies):
+    mock_movies.return_value = [{'movie_id': 1, 'score': 7}, {'movie_id': 2, 'score': 6},
+                                {'movie_id': 3, 'score': 5}]
+    status, _, body = get("/movies?limit=2&sort_by=score&sort_order=desc")
+    assert status == 200
+    assert body['movies'] == mock_movies.return_value[:2]
+    assert decode_cursor(body['next_cursor']) == ('score', 'desc', (6, 2))
+    mock_movies.assert_awaited_once_with(None, 'score', 'desc', 3, None)
+
+
+@patch('stern_movies_api.async_app.get_movie_by_id')
+def test_endpoint_get_movie_is_cached(mock_movie):
+    mock_movie.return_value = {'movie_id': 1}
+    status, headers, body = get("/movies/1")
+    assert (status, body) == (200, {'movie_id': 1})
+    assert get("/movies/1", {"If-None-Match": headers["ETag"]})[0] == 304
+    assert get("/movies/1")[2] == {'movie_id': 1}
+    mock_movie.assert_awaited_once_with(1)
+
+
+@patch('stern_movies_api.async_app.get_movie_by_id')
+def test_endpoint_get_missing_movie(mock_movie):
+    mock_movie.side_effect = ValueError('No movie with that id was found')
+    status, _, body = get("/movies/404")
+    assert (status, body) == (404, {"error": "Movie not found"})
+
+
+@patch('stern_movies_api.async_app.get_movie_by_id')
+def test_read_after_token_skips_the_cache(mock_movie):
+    mock_movie.side_effect = lambda movie_id: {'movie_id': movie_id, 'lsn': read_lsn()}
+    assert get("/movies/1")[2] == {'movie_id': 1, 'lsn': None}
+    assert get("/movies/1", {"X-Read-After-LSN": "0/20"})[2] == {'movie_id': 1, 'lsn': 0x20}
+    assert mock_movie.await_count == 2
+
+
+@patch('stern_movies_api.async_app.get_movie_by_id')
+def test_rebuild_after_invalidation_reads_past_the_write(mock_movie):
+    mock_movie.side_effect = lambda movie_id: {'movie_id': movie_id, 'lsn': read_lsn()}
+    get("/movies/1")
+    response_cache.invalidate(["movie:1"], 0x20)
+    assert get("/movies/1")[2] == {'movie_id': 1, 'lsn': 0x20}
+    assert get("/movies/1")[2] == {'movie_id': 1, 'lsn': 0x20}
+    assert mock_movie.await_count == 2
+
+
+@patch('stern_movies_api.async_app.get_catalogue_stats')
+def test_endpoint_get_stats(mock_stats):
+    mock_stats.return_value = {'totals': {'movies': 3}}
+    status, _, body = get("/stats?group_by=country")
+    assert (status, body) == (200, {'totals': {'movies': 3}})
+    mock_stats.assert_awaited_once_with(['country'], list(STATS_AGGREGATES))
+    assert get("/stats?group_by=director")[0] == 400
+
+
+@patch('stern_movies_api.async_app.get_genre_facets')
+@patch('stern_movies_api.async_app.get_movies_by_genre')
+def test_endpoint_get_movies_by_genre(mock_movies, mock_facets):
+    mock_movies.return_value = [{'movie_id': 1}, {'movie_id': 2}]
+    mock_facets.return_value = {'movie_count': 2, 'facets': {'Drama': 2}}
+    status, _, body = get("/genres/Drama?limit=1")
+    assert status == 200
+    assert body['movies'] == [{'movie_id': 1}] and body['movie_count'] == 2
+    mock_movies.assert_awaited_once_with(['Drama'], True, 'movie_id', 'asc', 2, None)
+    mock_facets.side_effect = ValueError('Genre not recognized')
+    assert get("/genres/Western")[0] == 404
+    assert get("/movies?genre=Western&genre_match=any")[0] == 400
+
+
+@patch('stern_movies_api.async_app.get_country_id')
+@patch('stern_movies_api.async_app.stream_movie_by_country')
+def test_endpoint_get_movies_by_country_stream_unknown_code(mock_stream, mock_country):
+    mock_country.side_effect = ValueError('Country not recognized')
+    status, _, body = get("/countries/XX?stream=1")
+    assert (status, body) == (404, {"error": "No movies found for this country"})
+    assert not mock_stream.called
+
+
+def test_endpoint_create_movie_rejects_a_non_json_body():
+    async def request():
+        response = await app.test_client().post("/movies", data="title=T",
+                                                headers={"Content-Type": "text/plain"})
+        return response.status_code, await response.get_json()
+    assert asyncio.run(request()) == (400, {"error": "Each movie must be a JSON object"})
+
+
+def test_endpoint_get_movies_rejects_bad_sort():
+    assert get("/movies?sort_by=bad")[0] == 400
+
+
+@patch('stern_movies_api.async_app.get_movies_by_ids')
+def test_endpoint_get_movies_by_ids(mock_movies):
+    mock_movies.return_value = [{'movie_id': 2}]
+    status, _, body = get("/movies?ids=2,5")
+    assert (status, body) == (200, {"movies": [{'movie_id': 2}], "missing": [5]})
+    mock_movies.assert_awaited_once_with([2, 5])
+
+
+@patch('stern_movies_api.async_app.get_country_summaries')
+def test_endpoint_get_countries(mock_summaries):
+    mock_summaries.return_value = [{'country_code': 'US', 'movie_count': 1}]
+    assert get("/countries")[2] == [{'country_code': 'US', 'movie_count': 1}]
+    mock_summaries.assert_awaited_once_with()
+
+
+@patch('stern_movies_api.async_app.read_reviews')
+@patch('stern_movies_api.async_app.get_review_stats')
+def test_endpoint_get_reviews(mock_stats, mock_reviews):
+    mock_stats.return_value = {'review_count': 1, 'average_score': None}
+    mock_reviews.return_value = [{'review_id': 4}]
+    status, _, body = get("/movies/5/reviews?limit=10")
+    assert status == 200
+    assert body == {'movie_id': 5, 'review_count': 1, 'average_score': None,
+                    'reviews': [{'review_id': 4}], 'next_cursor': None}
+    mock_reviews.assert_awaited_once_with(5, 11, 0)
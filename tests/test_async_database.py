@@ -0,0 +1,237 @@
+#pylint: skip-file
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import date
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from psycopg import errors
+
+from stern_movies_api import async_database
+from stern_movies_api.async_database import (create_movie, create_movies, delete_movie,
+                                             get_movies, get_movies_by_ids, invalidate_lookups,
+                                             get_movie_by_country, stream_movie_by_country,
+                                             create_reviews, count_reviews,
+                                             get_movies_by_genre, get_genre_facets)
+from stern_movies_api.genre_index import GenreBitmaps
+from stern_movies_api.replicas import ReplicaRouter, finish_session
+
+
+@pytest.fixture
+def mock_connection():
+    conn = MagicMock()
+    conn.commit = AsyncMock()
+    curr = MagicMock()
+    curr.execute = AsyncMock()
+    curr.executemany = AsyncMock()
+    curr.fetchall = AsyncMock()
+    curr.fetchone = AsyncMock()
+
+    @asynccontextmanager
+    async def cursor(**kwargs):
+        yield curr
+
+    @asynccontextmanager
+    async def connection():
+        yield conn
+
+    conn.cursor = cursor
+    pool = MagicMock()
+    pool.connection = connection
+    invalidate_lookups()
+    with patch('stern_movies_api.async_database.get_pool', AsyncMock(return_value=pool)):
+        yield conn, curr
+    invalidate_lookups()
+
+
+@pytest.fixture
+def lookups():
+    rows = {'genres': {'Drama': 1, 'War': 2}, 'statuses': {'released': 1},
+            'countries': {'US': 1}, 'languages': {'English': 1}}
+    loaders = {table: lookup._load for table, lookup in async_database._lookups.items()}
+    for table, lookup in async_database._lookups.items():
+        lookup._load = AsyncMock(return_value=rows[table])
+    yield
+    for table, lookup in async_database._lookups.items():
+        lookup._load = loaders[table]
+
+
+def test_get_movies_shares_listing_query(mock_connection):
+    _, curr = mock_connection
+    curr.fetchall.return_value = [{'movie_id': 1}]
+    assert asyncio.run(get_movies('star', 'score', 'desc', 5, (7.5, 9))) == [{'movie_id': 1}]
+    query, params = curr.execute.call_args.args
+    assert 'ORDER BY "score" IS NOT NULL DESC, "score" DESC, movie_id DESC LIMIT %s;' in query
+    assert params == ['%star%', 7.5, 9, 5]
+
+
+def test_identical_concurrent_reads_share_one_query(mock_connection):
+    _, curr = mock_connection
+    curr.fetchall.return_value = [{'movie_id': 1}]
+
+    async def main():
+        return await asyncio.gather(*(get_movies_by_ids([1, 2]) for _ in range(5)),
+                                    get_movies_by_ids([2]))
+
+    assert asyncio.run(main()) == [[{'movie_id': 1}]] * 5 + [[]]
+    assert curr.execute.await_count == 2, "Only identical reads are shared."
+
+
+def test_get_movies_by_ids_fetches_once_in_order(mock_connection):
+    _, curr = mock_connection
+    curr.fetchall.return_value = [{'movie_id': 1}, {'movie_id': 2}]
+    assert asyncio.run(get_movies_by_ids([2, 1])) == [{'movie_id': 2}, {'movie_id': 1}]
+    query, params = curr.execute.call_args.args
+    assert query.endswith('FROM movie_listing WHERE movie_id = ANY(%s);')
+    assert params == ([2, 1],)
+
+
+def test_get_movie_by_country_filters_on_id(mock_connection, lookups):
+    _, curr = mock_connection
+    curr.fetchall.return_value = [{'movie_id': 1}]
+    assert asyncio.run(get_movie_by_country('US', 'title', 'asc', 5)) == [{'movie_id': 1}]
+    query, params = curr.execute.call_args.args
+    assert 'WHERE country_id=%s ORDER BY' in query
+    assert params == [1, 5]
+
+
+def test_country_listing_of_unknown_code_is_empty(mock_connection, lookups):
+    _, curr = mock_connection
+
+    async def stream():
+        return [movie async for movie in stream_movie_by_country('XX')]
+
+    assert asyncio.run(get_movie_by_country('XX')) == []
+    assert asyncio.run(stream()) == []
+    assert not curr.execute.called
+
+
+def test_create_movie_commits_once(mock_connection, lookups):
+    conn, curr = mock_connection
+    curr.fetchone.return_value = {'movie_id': 42}
+    movie = asyncio.run(create_movie('Title', date(2000, 1, 1), ['Drama', 'War'], '', 'released',
+                                     0, 0, 'US', 'English', 'Title'))
+    assert movie['movie_id'] == 42
+    assert curr.execute.call_args.args[1][-1] == [1, 2]
+    conn.commit.assert_awaited_once()
+
+
+def test_create_movies_reports_each_movie(mock_connection, lookups):
+    conn, curr = mock_connection
+    curr.fetchone.side_effect = [{'movie_id': 7}]
+    curr.nextset.return_value = None
+    movie = {'title': 'Title', 'release_date': date(2000, 1, 1), 'genre': 'Drama',
+             'overview': '', 'status': 'released', 'budget': 0, 'revenue': 0,
+             'country': 'US', 'language': 'English', 'orig_title': 'Title'}
+    results = asyncio.run(create_movies([movie, {**movie, 'genre': 'Horror'}]))
+    assert results == [{'movie_id': 7}, {'error': 'Genre not recognized'}]
+    assert curr.executemany.call_args.args[1] == [(7, 1)]
+    conn.commit.assert_awaited_once()
+
+
+def test_get_movie_by_country_from_snapshot(mock_connection, lookups):
+    _, curr = mock_connection
+    snapshot = MagicMock()
+    snapshot.get = AsyncMock(return_value=MagicMock())
+    snapshot.get.return_value.listing.return_value = [{'movie_id': 1}]
+    with patch('stern_movies_api.async_database._snapshot', snapshot):
+        assert asyncio.run(get_movie_by_country('US', 'score', 'desc', 5)) == [{'movie_id': 1}]
+        curr.rowcount = 1
+        asyncio.run(delete_movie(3))
+    snapshot.get.return_value.listing.assert_called_once_with(None, 1, 'score', 'desc', 5, None, None)
+    snapshot.invalidate.assert_called_once()
+
+
+@pytest.fixture
+def genre_index():
+    index = MagicMock()
+    index.get = AsyncMock(return_value=GenreBitmaps.build([(1, ['Drama']), (2, ['Drama', 'War']),
+                                                           (4, ['War'])]))
+    with patch('stern_movies_api.async_database._genre_index', index):
+        yield index
+
+
+def test_get_movies_by_genre(mock_connection, lookups, genre_index):
+    _, curr = mock_connection
+    curr.fetchall.return_value = [{'movie_id': 2}, {'movie_id': 4}]
+    assert asyncio.run(get_movies_by_genre('War', limit=5)) == [{'movie_id': 2}, {'movie_id': 4}]
+    assert curr.execute.call_args.args[1] == ([2, 4],)
+    asyncio.run(get_movies_by_genre(['Drama', 'War'], False, 'title', 'desc'))
+    query, params = curr.execute.call_args.args
+    assert 'movie_id = ANY(%s)' in query and params[0] == [1, 2, 4]
+    with pytest.raises(ValueError):
+        asyncio.run(get_movies_by_genre('Western'))
+
+
+def test_get_genre_facets(mock_connection, lookups, genre_index):
+    assert asyncio.run(get_genre_facets(['Drama', 'War'])) == \
+        {'movie_count': 1, 'facets': {'Drama': 1, 'War': 1}}
+
+
+def test_reads_after_write_wait_for_replica(mock_connection):
+    conn, curr = mock_connection
+    replica_curr = MagicMock()
+    replica_curr.execute = AsyncMock()
+    replica_curr.fetchone = AsyncMock(side_effect=[('0/10',), ('0/30',), {'movie_id': 2}])
+    replica_conn = MagicMock(closed=False, rollback=AsyncMock())
+
+    @asynccontextmanager
+    async def cursor(**kwargs):
+        yield replica_curr
+
+    @asynccontextmanager
+    async def connection():
+        yield replica_conn
+
+    replica_conn.cursor = cursor
+    pool = MagicMock(closed=False, connection=connection)
+    router = ReplicaRouter({'replica': 'dsn'}, lambda dsn: pool)
+    curr.fetchone.side_effect = [{'review_id': 1}, {'lsn': '0/20'}, {'movie_id': 1}]
+
+    async def main():
+        await async_database.create_review(5, 'Great', 8)
+        assert await async_database.get_movie_by_id(1) == {'movie_id': 1}
+        assert await async_database.get_movie_by_id(2) == {'movie_id': 2}
+
+    with patch('stern_movies_api.async_database._router', router):
+        try:
+            asyncio.run(main())
+        finally:
+            finish_session()
+    assert router.stats()['lagging_reads'] == 1
+    assert router.stats()['replicas'][0]['reads'] == 1
+
+
+def test_delete_movie_reports_missing(mock_connection):
+    _, curr = mock_connection
+    curr.rowcount = 0
+    assert asyncio.run(delete_movie(3)) is False
+
+
+def test_create_review_of_missing_movie(mock_connection):
+    conn, curr = mock_connection
+    curr.execute.side_effect = errors.ForeignKeyViolation()
+    with pytest.raises(ValueError, match='No movie with that id was found'):
+        asyncio.run(async_database.create_review(5, 'Great'))
+    conn.commit.assert_not_awaited()
+
+
+def test_create_reviews_skips_missing_movies(mock_connection):
+    conn, curr = mock_connection
+    # The insert for movie 6 finds no movie, so returns no row
+    curr.fetchone.side_effect = [None, {'review_id': 7}]
+    results = asyncio.run(create_reviews([{'movie_id': 6, 'review_text': 'a'},
+                                          {'movie_id': 5, 'review_text': 'b', 'score': 4}]))
+    assert results == [{'error': 'No movie with that id was found'}, {'review_id': 7}]
+    query, rows = curr.executemany.call_args.args
+    assert 'FROM movies WHERE movie_id = %s FOR KEY SHARE' in query
+    assert rows == [('a', None, 6), ('b', 4, 5)]
+    curr.execute.assert_not_awaited()
+    conn.commit.assert_awaited_once()
+
+
+def test_count_reviews_reads_the_counter(mock_connection):
+    _, curr = mock_connection
+    curr.fetchone.return_value = None
+    assert asyncio.run(count_reviews(5)) == 0
+    assert 'FROM review_stats' in curr.execute.call_args.args[0]
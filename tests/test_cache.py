@@ -0,0 +1,99 @@
+#pylint: skip-file
+
+import pytest
+
+from stern_movies_api.cache import MemoryBackend, RedisBackend, ResponseCache
+
+
+class FakeRedis:
+    'Just enough of redis-py for RedisBackend'
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def incr(self, key):
+        self.data[key] = str(int(self.data.get(key, 0)) + 1)
+
+    def scan_iter(self, match):
+        return [key for key in list(self.data) if key.startswith(match.rstrip('*'))]
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+@pytest.fixture(params=['memory', 'redis'])
+def cache(request):
+    if request.param == 'memory':
+        return ResponseCache(MemoryBackend())
+    return ResponseCache(RedisBackend(FakeRedis()))
+
+
+def test_cache_round_trip(cache):
+    versions = cache.versions(['listings'])
+    entry = cache.set('movies', {'sort_by': 'title'}, versions, '[]')
+    assert cache.get('movies', {'sort_by': 'title'}, versions) == entry
+    assert entry['etag']
+
+
+def test_cache_invalidation_by_tag(cache):
+    versions = cache.versions(['movie:1'])
+    cache.set('movie', {'movie_id': 1}, versions, '{}')
+    cache.invalidate(['movie:1'])
+    assert cache.get('movie', {'movie_id': 1}, cache.versions(['movie:1'])) is None
+    assert cache.stats() == {'hits': 0, 'misses': 1, 'not_modified': 0}
+
+
+def test_cache_other_tags_survive(cache):
+    versions = cache.versions(['movie:2'])
+    cache.set('movie', {'movie_id': 2}, versions, '{}')
+    cache.invalidate(['movie:1'])
+    assert cache.get('movie', {'movie_id': 2}, cache.versions(['movie:2'])) is not None
+
+
+def test_cache_etag_follows_versions(cache):
+    before = cache.etag('movie', {'movie_id': 1}, cache.versions(['movie:1']))
+    assert before == cache.etag('movie', {'movie_id': 1}, cache.versions(['movie:1']))
+    assert before != cache.etag('movie', {'movie_id': 2}, cache.versions(['movie:1']))
+    cache.invalidate(['movie:1'])
+    assert before != cache.etag('movie', {'movie_id': 1}, cache.versions(['movie:1']))
+
+
+def test_cache_last_modified(cache):
+    assert cache.last_modified(['movie:1']) == cache.started
+    cache.invalidate(['movie:1'])
+    assert cache.last_modified(['movie:1', 'movie:2']) >= cache.started
+
+
+def test_cache_keeps_highest_write_lsn(cache):
+    assert cache.written_lsn(['movie:1']) is None
+    cache.invalidate(['movie:1', 'listings'], 0x30)
+    cache.invalidate(['movie:1'], 0x20)
+    cache.invalidate(['movie:2'])
+    assert cache.written_lsn(['movie:1']) == 0x30
+    assert cache.written_lsn(['movie:2', 'listings']) == 0x30
+    assert cache.written_lsn(['movie:2']) is None
+
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = MemoryBackend(max_entries=2)
+    backend.set('a', {}, 60)
+    backend.set('b', {}, 60)
+    backend.get('a')
+    backend.set('c', {}, 60)
+    assert backend.get('b') is None
+    assert backend.get('a') is not None
+
+
+def test_memory_backend_expires_entries():
+    backend = MemoryBackend()
+    backend.set('a', {}, -1)
+    assert backend.get('a') is None
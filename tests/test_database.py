@@ -1,20 +1,34 @@
 #pylint: skip-file
 
-from unittest.mock import patch
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock, patch
+import psycopg2.errors
 import pytest
 from datetime import date
 
 from stern_movies_api.database import (get_movies, get_movie_by_id, create_movie, 
                       get_genre_id, get_country_id, get_status_id,
-                      get_language_id)
+                      get_language_id, get_movie_by_country, close_pool, pool_stats,
+                      stream_movies, invalidate_lookups, lookup_stats, create_movies,
+                      get_movies_by_ids, stream_movie_by_country, get_country_summaries,
+                      create_review, create_reviews, read_reviews, count_reviews,
+                      get_review_stats, update_review, delete_review, get_movies_by_genre,
+                      get_genre_facets, coalescing_stats, get_catalogue_stats, delete_movie)
+from stern_movies_api.genre_index import GenreBitmaps
+from stern_movies_api.replicas import ReplicaRouter, finish_session, read_lsn
 
 
 @pytest.fixture(autouse=True)
 def mock_connection():
     with patch('psycopg2.connect') as mock_connect:
         mock_con = mock_connect.return_value
+        mock_con.closed = 0
+        invalidate_lookups()
         mock_cur = mock_con.cursor.return_value
         yield mock_con, mock_cur
+        close_pool()
         assert mock_con.close.called, "Connection not closed."
 
 @pytest.fixture(autouse=True)
@@ -37,13 +51,209 @@ def test_get_movies_rejects_bad_input_values(sort_by, sort_order):
     with pytest.raises(ValueError):
         get_movies(sort_by=sort_by, sort_order=sort_order)
 
+def test_connections_are_reused(mock_connection):
+    _, mock_cur = mock_connection
+    mock_cur.fetchone.return_value = {'movie_id': 1}
+    get_movie_by_id(1)
+    get_movie_by_id(2)
+    stats = pool_stats()
+    assert stats['checkouts'] == 2
+    assert stats['in_use'] == 0
+    assert stats['size'] == 1
+
+def test_identical_concurrent_reads_share_one_query(mock_connection):
+    _, mock_cur = mock_connection
+    started, release = threading.Event(), threading.Event()
+    mock_cur.execute.side_effect = lambda *args: started.set() or release.wait(5)
+    mock_cur.fetchone.return_value = {'movie_id': 1}
+    shared = coalescing_stats()['shared']
+    with ThreadPoolExecutor(4) as executor:
+        first = executor.submit(get_movie_by_id, 1)
+        started.wait(5)
+        others = [executor.submit(get_movie_by_id, 1) for _ in range(3)]
+        time.sleep(0.05)
+        release.set()
+        assert [future.result() for future in [first] + others] == [{'movie_id': 1}] * 4
+    assert mock_cur.execute.call_count == 1
+    assert coalescing_stats()['shared'] - shared == 3
+
 def test_get_movies_return(mock_connection):
     _, mock_cur = mock_connection
-    mock_cur.fetchall.side_effect = [
-        [{'movie_id': 1}],  # First call
-        [{'genre_name': 'sci-fi'}]  # Second call
-    ]
+    mock_cur.fetchall.return_value = [{'movie_id': 1, 'genres': ['sci-fi']}]
     assert get_movies() == [{'movie_id': 1, 'genres': ['sci-fi']}]
+    assert mock_cur.execute.call_count == 1, "Genres should not be fetched per movie."
+
+def test_get_movies_keyset_page(mock_connection):
+    _, mock_cur = mock_connection
+    mock_cur.fetchall.return_value = []
+    get_movies(sort_by='score', sort_order='desc', limit=10, after=(7.5, 42))
+    query, params = mock_cur.execute.call_args.args
+    assert params == [7.5, 42, 10]
+
+def test_get_movies_keyset_page_defaults_to_movie_id(mock_connection):
+    _, mock_cur = mock_connection
+    mock_cur.fetchall.return_value = []
+    get_movies(limit=10, after=(42, 42))
+    query, params = mock_cur.execute.call_args.args
+    assert params == [42, 10]
+
+def test_stream_movies_uses_server_side_cursor(mock_connection):
+    mock_con, mock_cur = mock_connection
+    mock_cur.__iter__.return_value = iter([{'movie_id': 1}, {'movie_id': 2}])
+    movies = stream_movies(sort_by='title', batch_size=50)
+    assert not mock_con.cursor.called, "Nothing should run before the stream is consumed."
+    assert list(movies) == [{'movie_id': 1}, {'movie_id': 2}]
+    assert mock_con.cursor.call_args.kwargs['name']
+    assert mock_cur.itersize == 50
+    assert mock_cur.close.called
+    assert pool_stats()['in_use'] == 0
+
+def test_get_movies_escapes_search_wildcards(mock_connection):
+    _, mock_cur = mock_connection
+    mock_cur.fetchall.return_value = []
+    get_movies(search='100%')
+    query, params = mock_cur.execute.call_args.args
+    assert params == ['%100\\%%']
+
+def test_get_movies_relevance_page(mock_connection):
+    _, mock_cur = mock_connection
+    mock_cur.fetchall.return_value = []
+    get_movies(search='star', sort_by='relevance', sort_order='desc', limit=5, after=(0.5, 9))
+    query, params = mock_cur.execute.call_args.args
+    assert params == ['star', '%star%', 'star', 'star', 0.5, 9, 'star', 'star', 5]
+
+def test_get_movies_reuses_prepared_statement(mock_connection):
+    _, mock_cur = mock_connection
+    mock_cur.fetchall.return_value = []
+    get_movies(sort_by='title', sort_order='desc', limit=10)
+    assert mock_cur.execute.call_args.args[0].startswith('PREPARE ')
+    get_movies(sort_by='title', sort_order='desc', limit=10, after=None)
+    query, params = mock_cur.execute.call_args.args
+    assert query.startswith('EXECUTE ') and '(%s)' in query
+    assert params == [10]
+
+def test_get_movies_from_snapshot(mock_connection):
+    _, mock_cur = mock_connection
+    snapshot = MagicMock()
+    snapshot.get.return_value.listing.side_effect = [[{'movie_id': 1}], None]
+    mock_cur.fetchall.return_value = [{'movie_id': 2}]
+    with patch('stern_movies_api.database._snapshot', snapshot):
+        assert get_movies(sort_by='budget', limit=1) == [{'movie_id': 1}]
+        assert mock_cur.execute.call_count == 0, "The snapshot answers without a query."
+        assert get_movies(search='star', sort_by='relevance') == [{'movie_id': 2}]
+        assert mock_cur.execute.call_count == 1, "Postgres answers what the snapshot cannot."
+        with pytest.raises(ValueError):
+            get_movies(sort_by='relevance')
+    assert snapshot.get.return_value.listing.call_args_list[0].args == \
+        ('', None, 'budget', 'ASC', 1, None, None)
+
+@pytest.fixture
+def genre_index():
+    index = MagicMock()
+    index.get.return_value = GenreBitmaps.build([(1, ['Drama']), (2, ['Drama', 'War']),
+                                                 (3, ['War']), (5, ['Drama'])])
+    with patch('stern_movies_api.database._genre_index', index):
+        yield index
+
+def test_get_movies_by_genre_in_movie_id_order(mock_connection, genre_index):
+    _, mock_cur = mock_connection
+    mock_cur.fetchall.side_effect = [[{'id': 1, 'name': 'Drama'}],
+                                     [{'movie_id': 2}, {'movie_id': 1}]]
+    assert get_movies_by_genre('Drama', sort_order='desc', limit=2, after=(5, 5)) == \
+        [{'movie_id': 2}, {'movie_id': 1}]
+    query, params = mock_cur.execute.call_args.args
+    assert params == ([2, 1],), "The page of ids comes from the bitmaps."
+
+@pytest.mark.parametrize('id_list_max,condition,params', [
+    (1000, 'movie_id = ANY($1)', [[1, 2, 3, 5]]),
+    (2, 'genres && $1::text[]', [['Drama', 'War']]),
+])
+def test_get_movies_by_genre_sorted(mock_connection, genre_index, id_list_max, condition,
+                                    params):
+    _, mock_cur = mock_connection
+    mock_cur.fetchall.side_effect = [[{'id': 1, 'name': 'Drama'}, {'id': 2, 'name': 'War'}],
+                                     [{'movie_id': 3}]]
+    with patch('stern_movies_api.database.GENRE_ID_LIST_MAX', id_list_max):
+        assert get_movies_by_genre(['Drama', 'War'], match_all=False, sort_by='score') == \
+            [{'movie_id': 3}]
+    query, query_params = mock_cur.execute.call_args.args
+    assert condition in query
+    assert query_params[:1] == params
+
+def test_get_movies_by_genre_rejects_unknown_genre(mock_connection, genre_index):
+    _, mock_cur = mock_connection
+    mock_cur.fetchall.return_value = [{'id': 1, 'name': 'Drama'}]
+    with pytest.raises(ValueError):
+        get_movies_by_genre(['Drama', 'Western'])
+    with pytest.raises(TypeError):
+        get_movies_by_genre([])
+    assert not genre_index.get.called
+
+def test_get_genre_facets(mock_connection, genre_index):
+    _, mock_cur = mock_connection
+    mock_cur.fetchall.return_value = [{'id': 1, 'name': 'Drama'}]
+    assert get_genre_facets('Drama') == {'movie_count': 3, 'facets': {'Drama': 3, 'War': 1}}
+
+def test_get_movie_by_country_rejects_relevance():
+    with pytest.raises(ValueError):
+        get_movie_by_country('US', sort_by='relevance')
+
+def test_get_movie_by_country_return(mock_connection):
+    _, mock_cur = mock_connection
+    mock_cur.fetchall.side_effect = [[{'id': 3, 'name': 'GB'}],
+                                     [{'movie_id': 1, 'genres': ['drama', 'war']}]]
+    assert get_movie_by_country('GB') == [{'movie_id': 1, 'genres': ['drama', 'war']}]
+    assert mock_cur.execute.call_count == 2, "Only the countries table and the listing are read."
+    query, params = mock_cur.execute.call_args.args
+    assert params == [3]
+
+def test_get_movie_by_country_filters_on_id(mock_connection):
+    _, mock_cur = mock_connection
+    mock_cur.fetchall.side_effect = [[{'id': 3, 'name': 'GB'}], []]
+    get_movie_by_country('GB', sort_by='revenue', sort_order='desc', limit=5)
+    query, params = mock_cur.execute.call_args.args
+    assert 'WHERE country_id=$1 ORDER BY "revenue" IS NOT NULL DESC' in query
+    assert params == [3, 5]
+
+def test_get_movie_by_country_unknown_code(mock_connection):
+    _, mock_cur = mock_connection
+    mock_cur.fetchall.return_value = [{'id': 3, 'name': 'GB'}]
+    assert get_movie_by_country('XX') == []
+    assert list(stream_movie_by_country('XX')) == []
+    assert mock_cur.execute.call_count == 1, "Only the countries table should be read."
+
+def test_get_country_summaries(mock_connection):
+    _, mock_cur = mock_connection
+    mock_cur.fetchall.return_value = [{'country_code': 'GB', 'movie_count': 2}]
+    assert get_country_summaries() == [{'country_code': 'GB', 'movie_count': 2}]
+    assert 'FROM country_summary' in mock_cur.execute.call_args.args[0]
+
+def test_get_catalogue_stats_groups_rollup_rows(mock_connection):
+    _, mock_cur = mock_connection
+    mock_cur.fetchall.return_value = [
+        {'dimension': 'genre', 'group_key': 'Drama', 'movies': 2, 'average_score': 7},
+        {'dimension': 'totals', 'group_key': None, 'movies': 3, 'average_score': 6},
+        {'dimension': 'year', 'group_key': '1999', 'movies': 3, 'average_score': 6}]
+    assert get_catalogue_stats(['year', 'genre'], ['movies']) == {
+        'totals': {'movies': 3}, 'year': [{'year': 1999, 'movies': 3}],
+        'genre': [{'genre': 'Drama', 'movies': 2}]}
+    query, params = mock_cur.execute.call_args.args
+    assert 'FROM catalogue_stats' in query
+    assert params == (['genre', 'year'],)
+    with pytest.raises(ValueError):
+        get_catalogue_stats(['director'])
+    with pytest.raises(ValueError):
+        get_catalogue_stats(aggregates=['median'])
+
+def test_delete_movie_reports_whether_deleted(mock_connection):
+    mock_con, mock_cur = mock_connection
+    # As psycopg2 does, a DELETE without RETURNING has a row count but no rows to fetch
+    mock_cur.fetchone.side_effect = psycopg2.ProgrammingError('no results to fetch')
+    mock_cur.rowcount = 1
+    assert delete_movie(1) is True
+    mock_cur.rowcount = 0
+    assert delete_movie(2) is False
+    assert mock_con.commit.call_count == 2
 
 def test_get_movie_by_id_value_reject(mock_connection):
     _, mock_cur = mock_connection
@@ -72,12 +282,43 @@ def test_get_movie_by_id_good(mock_connection):
     movie = get_movie_by_id(1)
     assert movie == {'foo': 'bar'}
 
+def test_get_movie_by_id_reads_one_aggregated_row(mock_connection):
+    _, mock_cur = mock_connection
+    mock_cur.fetchone.return_value = {'movie_id': 1, 'genres': ['Drama', 'War']}
+    get_movie_by_id(1)
+    query = mock_cur.execute.call_args.args[0]
+    assert 'FROM movie_listing WHERE movie_id=$1' in query
+    assert 'SELECT movie_id, title,' in query and 'genres FROM' in query
+    assert 'JOIN' not in query and '*' not in query
+
+def test_get_movies_by_ids_keeps_requested_order(mock_connection):
+    _, mock_cur = mock_connection
+    mock_cur.fetchall.return_value = [{'movie_id': 1}, {'movie_id': 3}]
+    assert get_movies_by_ids([3, 2, 1, 3]) == [{'movie_id': 3}, {'movie_id': 1}]
+    assert mock_cur.execute.call_count == 1
+    assert 'movie_id = ANY($1)' in mock_cur.execute.call_args.args[0]
+    assert mock_cur.execute.call_args.args[1] == ([3, 2, 1, 3],)
+
+@pytest.mark.parametrize('inp', [1, '1,2', [1, '2'], [True], None])
+def test_get_movies_by_ids_type_reject(inp):
+    with pytest.raises(TypeError):
+        get_movies_by_ids(inp)
+
 def test_get_genre_id(mock_connection):
     _, mock_cur = mock_connection
     mock_cur.fetchone.return_value = {}
     with pytest.raises(ValueError):
         get_genre_id(1)
 
+def test_lookups_are_cached(mock_connection):
+    _, mock_cur = mock_connection
+    mock_cur.fetchall.return_value = [{'id': 1, 'name': 'Drama'}, {'id': 2, 'name': 'Comedy'}]
+    hits = lookup_stats()['genres']['hits']
+    assert get_genre_id('Drama') == 1
+    assert get_genre_id('Comedy') == 2
+    assert mock_cur.execute.call_count == 1
+    assert lookup_stats()['genres']['hits'] == hits + 2
+
 def test_get_status_id(mock_connection):
     _, mock_cur = mock_connection
     mock_cur.fetchone.return_value = {}
@@ -121,14 +362,14 @@ def test_create_movie_rejects_bad_type(title, release_date, genre, overview, sta
 
 
 def test_create_movie_returns_correctly(mock_connection):
-    _, mock_cur = mock_connection
-    mock_cur.fetchone.side_effect = [
-                                        {'genre_id': 1},
-                                        {'status_id': 1}, 
-                                        {'country_id': 1}, 
-                                        {'language_id': 1},
-                                        {'movie_id': 1}
+    mock_con, mock_cur = mock_connection
+    mock_cur.fetchall.side_effect = [
+                                        [{'id': 1, 'name': 'Science Fiction'}],
+                                        [{'id': 1, 'name': 'Released'}],
+                                        [{'id': 1, 'name': 'USA'}],
+                                        [{'id': 1, 'name': 'English'}]
                                     ]
+    mock_cur.fetchone.side_effect = [{'movie_id': 1}]
     movie = create_movie(title = "Inception",
     release_date = date(2010, 7, 16),
     genre = "Science Fiction",
@@ -152,3 +393,208 @@ def test_create_movie_returns_correctly(mock_connection):
         "orig_title": "Inception",
         "movie_id": 1
     }
+    assert pool_stats()['checkouts'] == 1, "Nested lookups should reuse the caller's connection."
+    mock_con.commit.assert_called_once()
+
+
+
+def test_create_movies_inserts_valid_rows_in_bulk(mock_connection):
+    mock_con, mock_cur = mock_connection
+    mock_cur.fetchall.side_effect = [
+        [{'id': 1, 'name': 'Released'}],
+        [{'id': 2, 'name': 'USA'}],
+        [{'id': 3, 'name': 'English'}],
+        [{'id': 4, 'name': 'Drama'}],
+    ]
+    movie = dict(title="Inception", release_date=date(2010, 7, 16), genre="Drama",
+                 overview="", status="Released", budget=1, revenue=2, country="USA",
+                 language="English", orig_title="Inception")
+    with patch('psycopg2.extras.execute_values') as mock_execute_values:
+        # Inserted ids come back with their movie's ordinal, in any order
+        mock_execute_values.side_effect = [[{'ordinal': 3, 'movie_id': 11},
+                                            {'ordinal': 0, 'movie_id': 10}], None]
+        results = create_movies([movie, {**movie, 'budget': 'lots'},
+                                 {**movie, 'genre': 'Nope'}, movie])
+    assert results == [{'movie_id': 10}, {'error': 'budget must be of type int'},
+                       {'error': 'Genre not recognized'}, {'movie_id': 11}]
+    rows = mock_execute_values.call_args_list[0].args[2]
+    assert [row[0] for row in rows] == [0, 3]
+    assert sorted(mock_execute_values.call_args.args[2]) == [(10, 4), (11, 4)]
+    assert mock_con.commit.call_count == 1
+
+
+
+def test_create_movie_with_several_genres(mock_connection):
+    mock_con, mock_cur = mock_connection
+    mock_cur.fetchall.side_effect = [
+        [{'id': 1, 'name': 'Drama'}, {'id': 2, 'name': 'War'}],
+        [{'id': 1, 'name': 'Released'}],
+        [{'id': 1, 'name': 'USA'}],
+        [{'id': 1, 'name': 'English'}],
+    ]
+    mock_cur.fetchone.return_value = {'movie_id': 5}
+    movie = create_movie("1917", date(2019, 12, 25), ["War", "Drama", "War"], "", "Released",
+                         1, 2, "USA", "English", "1917")
+    assert movie['movie_id'] == 5
+    assert mock_cur.execute.call_args.args[1][-1] == [2, 1]
+    mock_con.commit.assert_called_once()
+
+
+@pytest.mark.parametrize('genre', [[], ["Drama", 3]])
+def test_create_movie_rejects_bad_genre_lists(genre):
+    with pytest.raises(TypeError):
+        create_movie("1917", date(2019, 12, 25), genre, "", "Released", 1, 2, "USA", "English",
+                     "1917")
+
+
+@pytest.fixture
+def replica():
+    conn = MagicMock()
+    conn.closed = 0
+    pool = MagicMock()
+    pool.getconn.return_value = conn
+    router = ReplicaRouter({'replica': 'dsn'}, lambda dsn: pool)
+    with patch('stern_movies_api.database._router', router):
+        yield router, pool, conn
+    finish_session()
+
+def test_reads_go_to_replica_and_writes_to_primary(mock_connection, replica):
+    _, mock_cur = mock_connection
+    router, pool, conn = replica
+    conn.cursor.return_value.fetchone.return_value = {'movie_id': 1}
+    assert get_movie_by_id(1) == {'movie_id': 1}
+    assert mock_cur.execute.call_count == 0, "Reads are served by the replica."
+    mock_cur.fetchone.side_effect = [{'review_id': 1}, {'lsn': '0/20'}]
+    create_review(5, "Great", 8)
+    assert 'pg_current_wal_insert_lsn' in mock_cur.execute.call_args.args[0]
+    assert read_lsn() == 0x20, "A write makes later reads wait for its commit."
+    assert router.stats()['replicas'][0]['reads'] == 1
+
+def test_reads_after_write_wait_for_replica(mock_connection, replica):
+    _, mock_cur = mock_connection
+    router, pool, conn = replica
+    mock_cur.fetchone.side_effect = [{'review_id': 1}, {'lsn': '0/20'}, {'movie_id': 1}]
+    create_review(5, "Great", 8)
+    replay = conn.cursor.return_value.__enter__.return_value
+    replay.fetchone.return_value = ('0/10',)
+    assert get_movie_by_id(1) == {'movie_id': 1}
+    assert mock_cur.execute.call_count == 3, "The primary serves a replica that is behind."
+    assert router.stats()['lagging_reads'] == 1
+    replay.fetchone.return_value = ('0/30',)
+    conn.cursor.return_value.fetchone.return_value = {'movie_id': 2}
+    assert get_movie_by_id(2) == {'movie_id': 2}
+    get_movie_by_id(2)
+    assert replay.execute.call_count == 2, "A replica known to have caught up is not asked again."
+
+def test_unreachable_replica_is_ejected(mock_connection, replica):
+    _, mock_cur = mock_connection
+    router, pool, conn = replica
+    pool.getconn.side_effect = psycopg2.OperationalError('could not connect')
+    mock_cur.fetchone.return_value = {'movie_id': 1}
+    assert get_movie_by_id(1) == {'movie_id': 1}
+    assert get_movie_by_id(1) == {'movie_id': 1}
+    assert pool.getconn.call_count == 1, "An ejected replica is not tried again."
+    assert router.stats()['primary_reads'] == 1
+    assert router.stats()['replicas'][0]['failures'] == 1
+
+def test_failed_replica_query_is_retried_on_primary(mock_connection, replica):
+    _, mock_cur = mock_connection
+    router, pool, conn = replica
+    conn.cursor.return_value.execute.side_effect = psycopg2.OperationalError('conflict')
+    mock_cur.fetchone.return_value = {'movie_id': 1}
+    assert get_movie_by_id(1) == {'movie_id': 1}
+    assert router.stats()['replicas'][0]['healthy'], "A live connection is not ejected."
+    pool.putconn.assert_called_once_with(conn, True)
+
+def test_create_review_returns_review(mock_connection):
+    mock_con, mock_cur = mock_connection
+    mock_cur.fetchone.return_value = {'review_id': 1, 'movie_id': 5, 'score': 8}
+    assert create_review(5, "Great", 8) == {'review_id': 1, 'movie_id': 5, 'score': 8}
+    assert mock_cur.execute.call_args.args[1] == (5, "Great", 8)
+    mock_con.commit.assert_called_once()
+
+
+@pytest.mark.parametrize('movie_id,review_text,score,error', [
+    ('5', "Great", None, TypeError),
+    (5, None, None, TypeError),
+    (5, "  ", None, ValueError),
+    (5, "Great", 7.5, TypeError),
+    (5, "Great", True, TypeError),
+    (5, "Great", 11, ValueError),
+])
+def test_create_review_rejects_bad_input(movie_id, review_text, score, error):
+    with pytest.raises(error):
+        create_review(movie_id, review_text, score)
+
+
+def test_create_review_of_missing_movie(mock_connection):
+    mock_con, mock_cur = mock_connection
+    mock_cur.execute.side_effect = psycopg2.errors.lookup('23503')()
+    with pytest.raises(ValueError, match='No movie with that id was found'):
+        create_review(5, "Great")
+    mock_con.commit.assert_not_called()
+    mock_cur.execute.side_effect = psycopg2.errors.lookup('23505')()
+    with pytest.raises(psycopg2.IntegrityError):
+        create_review(5, "Great")
+
+
+def test_create_reviews_reports_each_review(mock_connection):
+    mock_con, mock_cur = mock_connection
+    with patch('psycopg2.extras.execute_values') as mock_execute_values:
+        # Movie 6 does not exist, so no row comes back for it; rows come in any order
+        mock_execute_values.return_value = [{'ordinal': 3, 'review_id': 11},
+                                            {'ordinal': 0, 'review_id': 10}]
+        results = create_reviews([{'movie_id': 5, 'review_text': 'a', 'score': 3},
+                                  {'movie_id': 5, 'review_text': ''},
+                                  {'movie_id': 6, 'review_text': 'b'},
+                                  {'movie_id': 5, 'review_text': 'c'}])
+    assert results == [{'review_id': 10}, {'error': 'review_text must not be empty'},
+                       {'error': 'No movie with that id was found'}, {'review_id': 11}]
+    query, rows = mock_execute_values.call_args.args[1:3]
+    assert 'JOIN movies USING (movie_id)' in query and 'FOR KEY SHARE OF movies' in query
+    assert rows == [(0, 5, 'a', 3), (2, 6, 'b', None), (3, 5, 'c', None)]
+    mock_cur.execute.assert_not_called()
+    assert mock_con.commit.call_count == 1
+
+
+def test_read_reviews_is_a_keyset_page(mock_connection):
+    _, mock_cur = mock_connection
+    mock_cur.fetchall.return_value = [{'review_id': 8}]
+    assert read_reviews(5, 20, 7) == [{'review_id': 8}]
+    query, params = mock_cur.execute.call_args.args
+    assert 'WHERE movie_id=$1 AND review_id > $2' in query
+    assert params == (5, 7, 20)
+
+
+def test_count_reviews_reads_the_counter(mock_connection):
+    _, mock_cur = mock_connection
+    mock_cur.fetchone.return_value = {'review_count': 3}
+    assert count_reviews(5) == 3
+    assert 'FROM review_stats' in mock_cur.execute.call_args.args[0]
+    assert 'count(' not in mock_cur.execute.call_args.args[0].lower()
+    mock_cur.fetchone.return_value = None
+    assert count_reviews(6) == 0
+
+
+def test_get_review_stats_of_missing_movie(mock_connection):
+    _, mock_cur = mock_connection
+    mock_cur.fetchone.return_value = None
+    assert get_review_stats(5) is None
+
+
+def test_update_review_scoped_to_movie(mock_connection):
+    mock_con, mock_cur = mock_connection
+    mock_cur.fetchone.return_value = None
+    assert update_review(1, score=4, movie_id=5) is None
+    assert mock_cur.execute.call_args.args[1] == (None, 4, 1, 5, 5)
+    with pytest.raises(ValueError):
+        update_review(1, score=0)
+
+
+def test_delete_review(mock_connection):
+    mock_con, mock_cur = mock_connection
+    mock_cur.fetchone.return_value = {'review_id': 1}
+    assert delete_review(1, 5) is True
+    mock_cur.fetchone.return_value = None
+    assert delete_review(2) is False
+    assert mock_con.commit.call_count == 2
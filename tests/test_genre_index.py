@@ -0,0 +1,98 @@
+#pylint: skip-file
+
+import random
+from unittest.mock import MagicMock
+
+from stern_movies_api.genre_index import GenreBitmaps, GenreIndex, set_bits
+from stern_movies_api.snapshot import GENRE_SEPARATOR
+
+GENRES = ['Comedy', 'Drama', 'Horror', 'War']
+
+
+def catalogue(count, seed=1, start=1):
+    rng = random.Random(seed)
+    return [(movie_id, rng.sample(GENRES, rng.randint(0, 3)))
+            for movie_id in range(start, start + count)]
+
+
+def with_genre(rows, genre):
+    return {movie_id for movie_id, genres in rows if genre in genres}
+
+
+def test_set_bits_in_both_orders():
+    ids = [0, 5, 1023, 1024, 1025, 4000, 10_000]
+    bitmap = sum(1 << movie_id for movie_id in ids)
+    assert list(set_bits(bitmap)) == ids
+    assert list(set_bits(bitmap, descending=True)) == ids[::-1]
+    assert list(set_bits(0)) == []
+
+
+def test_build_accepts_joined_genres():
+    rows = catalogue(50)
+    joined = [(movie_id, GENRE_SEPARATOR.join(genres)) for movie_id, genres in rows]
+    assert GenreBitmaps.build(joined).bitmaps == GenreBitmaps.build(rows).bitmaps
+    assert len(GenreBitmaps.build(joined)) == 50
+
+
+def test_select_all_and_any():
+    rows = catalogue(300)
+    bitmaps = GenreBitmaps.build(rows)
+    both = with_genre(rows, 'Drama') & with_genre(rows, 'War')
+    either = with_genre(rows, 'Drama') | with_genre(rows, 'War')
+    assert set(set_bits(bitmaps.select(['Drama', 'War']))) == both
+    assert set(set_bits(bitmaps.select(['Drama', 'War'], match_all=False))) == either
+    assert bitmaps.select(['Drama', 'Western']) == 0
+    assert bitmaps.select([]) == bitmaps.movies
+
+
+def test_facets_count_selected_movies():
+    rows = catalogue(300)
+    bitmaps = GenreBitmaps.build(rows)
+    drama = with_genre(rows, 'Drama')
+    facets = bitmaps.facets(bitmaps.select(['Drama']))
+    assert list(facets) == sorted(facets)
+    assert facets['Drama'] == len(drama)
+    assert facets['War'] == len(drama & with_genre(rows, 'War'))
+    assert bitmaps.facets(0) == {}
+
+
+def test_page_follows_cursor():
+    rows = catalogue(3000)
+    bitmaps = GenreBitmaps.build(rows)
+    selected = bitmaps.select(['Horror'])
+    expected = sorted(with_genre(rows, 'Horror'))
+    for descending, ordered in [(False, expected), (True, expected[::-1])]:
+        pages, after = [], None
+        while page := GenreBitmaps.page(selected, descending, after, 97):
+            pages.extend(page)
+            after = page[-1]
+        assert pages == ordered
+    assert GenreBitmaps.page(selected, True, 0, 5) == []
+
+
+def test_apply_matches_rebuild():
+    rows = catalogue(500)
+    bitmaps = GenreBitmaps.build(rows)
+    current = dict(rows)
+    changed = [(movie_id, ['War']) for movie_id in range(10, 60)] + catalogue(20, 2, 1000)
+    current.update(changed)
+    deleted = [3, 4, 70]
+    for movie_id in deleted:
+        del current[movie_id]
+    applied = bitmaps.apply([movie_id for movie_id, _ in changed] + deleted, changed)
+    rebuilt = GenreBitmaps.build(current.items())
+    assert applied.bitmaps == rebuilt.bitmaps
+    assert applied.movies == rebuilt.movies
+    assert bitmaps.bitmaps == GenreBitmaps.build(rows).bitmaps, "Bitmaps are never changed."
+
+
+def test_genre_index_refreshes_from_changes():
+    rows = catalogue(100)
+    changes = MagicMock(return_value=(11, [1, 2], [(1, ['Western'])]))
+    index = GenreIndex(MagicMock(return_value=(10, rows)), changes, refresh_interval=0)
+    assert len(index.get()) == 100
+    bitmaps = index.get()
+    assert len(bitmaps) == 99
+    assert list(set_bits(bitmaps.select(['Western']))) == [1]
+    assert changes.call_args.args == (10,)
+    assert index.stats()['memory']['genres'] == 5
@@ -0,0 +1,49 @@
+#pylint: skip-file
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from psycopg2.extras import RealDictRow
+
+from stern_movies_api.json_provider import FastJSONProvider
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.json = FastJSONProvider(app)
+    return app
+
+
+def movie_row():
+    row = RealDictRow()
+    row.update(title='Amélie', movie_id=1, release_date=date(2001, 4, 25), score=Decimal('7.9'),
+               genres=['Comedy', 'Romance'], updated=datetime(2024, 1, 2, 3, 4, 5))
+    return row
+
+
+def test_matches_default_provider(app):
+    rows = [movie_row(), {'movie_id': 2, 'score': None}]
+    default = DefaultJSONProvider(app)
+    assert app.json.loads(app.json.dumps(rows)) == default.loads(default.dumps(rows))
+    assert app.json.dumps(rows).startswith('[{"genres":["Comedy","Romance"],"movie_id":1,')
+    assert '"release_date":"Wed, 25 Apr 2001 00:00:00 GMT","score":"7.9"' in app.json.dumps(rows)
+
+
+def test_response_is_compact_with_newline(app):
+    with app.app_context():
+        response = app.json.response({'b': 1, 'a': [1, 2]})
+    assert response.mimetype == 'application/json'
+    assert response.get_data() == b'{"a":[1,2],"b":1}\n'
+
+
+def test_falls_back_without_orjson(app):
+    app.json.fast = False
+    assert app.json.dumps({'score': Decimal('1.5')}) == '{"score": "1.5"}'
+    assert app.json.loads('{"a": 1}') == {'a': 1}
+
+
+def test_dumps_arguments_use_stdlib(app):
+    assert app.json.dumps({'a': 1}, indent=2) == '{\n  "a": 1\n}'
@@ -0,0 +1,17 @@
+#pylint: skip-file
+import json
+import logging
+
+from stern_movies_api.logs import JsonFormatter
+
+
+def test_json_formatter_includes_extra_fields():
+    record = logging.LogRecord('stern_movies_api.app', logging.DEBUG, __file__, 1,
+                               'listing %s', ('movies',), None)
+    record.search = 'star'
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry['level'] == 'DEBUG'
+    assert entry['logger'] == 'stern_movies_api.app'
+    assert entry['message'] == 'listing movies'
+    assert entry['search'] == 'star'
+    assert 'args' not in entry and 'msg' not in entry
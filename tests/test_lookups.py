@@ -0,0 +1,98 @@
+#pylint: skip-file
+
+import asyncio
+import threading
+from unittest.mock import AsyncMock, MagicMock
+import pytest
+
+from stern_movies_api.lookups import AsyncLookupTable, LookupTable
+
+
+@pytest.fixture
+def load():
+    return MagicMock(return_value={'Drama': 1, 'Comedy': 2})
+
+
+def test_lookup_loads_once(load):
+    table = LookupTable(load)
+    assert table.get('Drama') == 1
+    assert table.get('Comedy') == 2
+    assert load.call_count == 1
+    assert table.stats() == {'hits': 2, 'misses': 0, 'loads': 1, 'size': 2}
+
+
+def test_lookup_reloads_after_ttl(load):
+    table = LookupTable(load, ttl=0)
+    table.get('Drama')
+    table.get('Drama')
+    assert load.call_count == 2
+
+
+def test_lookup_miss_reloads_once_per_interval(load):
+    table = LookupTable(load, miss_refresh_interval=0)
+    table.warm()
+    load.return_value = {'Drama': 1, 'Comedy': 2, 'Horror': 3}
+    assert table.get('Horror') == 3
+    assert load.call_count == 2
+
+
+def test_lookup_miss_is_rate_limited(load):
+    table = LookupTable(load, miss_refresh_interval=60)
+    assert table.get('Horror') is None
+    assert table.get('Horror') is None
+    assert load.call_count == 1
+    assert table.stats()['misses'] == 2
+
+
+def test_lookup_invalidate(load):
+    table = LookupTable(load)
+    table.get('Drama')
+    table.invalidate()
+    table.get('Drama')
+    assert load.call_count == 2
+
+
+def invalidating_after_refresh(table):
+    '''Make every refresh of `table` be followed by an invalidate() from another thread'''
+    refresh = table._refresh
+
+    def racing(stale_before):
+        ids = refresh(stale_before)
+        thread = threading.Thread(target=table.invalidate)
+        thread.start()
+        thread.join()
+        return ids
+    table._refresh = racing
+
+
+def test_lookup_survives_invalidate_racing_get(load):
+    table = LookupTable(load, miss_refresh_interval=0)
+    invalidating_after_refresh(table)
+    assert table.get('Drama') == 1
+    assert table.get('Horror') is None
+    assert table.stats()['size'] == 0
+
+
+def test_async_lookup_survives_invalidate_racing_get(load):
+    table = AsyncLookupTable(AsyncMock(return_value=load.return_value))
+    refresh = table._refresh
+
+    async def racing(stale_before):
+        ids = await refresh(stale_before)
+        thread = threading.Thread(target=table.invalidate)
+        thread.start()
+        thread.join()
+        return ids
+    table._refresh = racing
+    assert asyncio.run(table.get('Drama')) == 1
+
+
+def test_async_lookup_loads_once(load):
+    async def main():
+        table = AsyncLookupTable(AsyncMock(return_value=load.return_value))
+        assert await table.get('Drama') == 1
+        assert await table.get('Horror') is None
+        return table
+
+    table = asyncio.run(main())
+    assert table.stats() == {'hits': 1, 'misses': 1, 'loads': 1, 'size': 2}
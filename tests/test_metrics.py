@@ -0,0 +1,102 @@
+#pylint: skip-file
+import logging
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from stern_movies_api import metrics
+from stern_movies_api.metrics import (Counter, Histogram, TimedConnection, TimedCursor,
+                                      finish_request, record_connect, render_metrics,
+                                      reset_metrics, start_request)
+
+
+@pytest.fixture(autouse=True)
+def reset():
+    reset_metrics()
+    yield
+    metrics._request_stats.set(None)
+
+
+def cursor(name=None, rows=()):
+    curr = MagicMock()
+    curr.name = name
+    curr.itersize = 2
+    curr.fetchall.return_value = list(rows)
+    curr.__iter__.return_value = iter(rows)
+    return curr
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram('latency_seconds', 'Latency', ('route',), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value, ('/movies',))
+    assert histogram.render() == [
+        '# HELP latency_seconds Latency',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{route="/movies",le="0.1"} 2',
+        'latency_seconds_bucket{route="/movies",le="1.0"} 3',
+        'latency_seconds_bucket{route="/movies",le="+Inf"} 4',
+        'latency_seconds_sum{route="/movies"} 3.65',
+        'latency_seconds_count{route="/movies"} 4',
+    ]
+
+
+def test_counter_escapes_labels():
+    counter = Counter('hits_total', 'Hits', ('route',))
+    counter.inc(('say "hi"\\',), 2)
+    assert counter.render()[-1] == 'hits_total{route="say \\"hi\\"\\\\"} 2'
+
+
+def test_timed_cursor_counts_per_request_and_function():
+    stats = start_request()
+    curr = TimedCursor(cursor(rows=[{'movie_id': 1}, {'movie_id': 2}]), 'get_movies')
+    curr.execute('SELECT 1;', ())
+    assert curr.fetchall() == [{'movie_id': 1}, {'movie_id': 2}]
+    TimedConnection(MagicMock(), 'get_movies').commit()
+    record_connect(0.5)
+    assert (stats.queries, stats.round_trips, stats.rows) == (1, 2, 2)
+    assert stats.connect == 0.5 and stats.execute > 0
+    assert metrics.QUERY_SECONDS.count(('get_movies',)) == 1
+    assert metrics.QUERY_ROWS.value(('get_movies',)) == 2
+
+
+def test_named_cursor_fetches_cost_round_trips():
+    stats = start_request()
+    curr = TimedCursor(cursor('stream', rows=[{'movie_id': i} for i in range(5)]), 'stream')
+    curr.execute('DECLARE', ())
+    assert len(list(curr)) == 5
+    # DECLARE, FETCH of rows 0-1, 2-3 and 4, then the empty FETCH that ends the stream
+    assert (stats.round_trips, stats.rows) == (5, 5)
+
+
+def test_executemany_is_a_round_trip_per_row():
+    stats = start_request()
+    TimedCursor(cursor(), 'create_movies').executemany('INSERT', iter([(1,), (2,), (3,)]))
+    assert (stats.queries, stats.round_trips) == (1, 3)
+
+
+def test_slow_queries_are_logged(caplog):
+    with patch.object(metrics, 'slow_query_seconds', 0):
+        with caplog.at_level(logging.WARNING, logger='stern_movies_api.metrics'):
+            TimedCursor(cursor(), 'get_movie_by_id').execute('SELECT\n  1;', ())
+    record, = caplog.records
+    assert record.query == 'get_movie_by_id'
+    assert record.statement == 'SELECT 1;'
+    assert metrics.SLOW_QUERIES.value(('get_movie_by_id',)) == 1
+
+
+def test_finish_request_records_route():
+    start_request()
+    TimedCursor(cursor(rows=[{}]), 'get_movies').execute('SELECT 1;')
+    stats = finish_request('/movies', 'GET', 200, 0.02)
+    assert stats.queries == 1
+    text = render_metrics({'stern_db_pool_in_use': ('Connections in use', 3)})
+    assert 'stern_http_requests_total{route="/movies",method="GET",status="200"} 1' in text
+    assert 'stern_http_request_db_queries_total{route="/movies"} 1' in text
+    assert 'stern_http_request_duration_seconds_count{route="/movies",method="GET"} 1' in text
+    assert text.endswith('# TYPE stern_db_pool_in_use gauge\nstern_db_pool_in_use 3\n')
+
+
+def test_work_outside_a_request_is_not_attributed():
+    TimedCursor(cursor(), '_load_lookup').execute('SELECT 1;')
+    assert finish_request('/', 'GET', 200, 0.001).queries == 0
@@ -0,0 +1,42 @@
+#pylint: skip-file
+
+from unittest.mock import MagicMock, patch
+
+from stern_movies_api.migrations import apply_migrations, main
+
+
+def make_connection(done):
+    conn = MagicMock()
+    curr = conn.cursor.return_value.__enter__.return_value
+    curr.fetchall.return_value = [(name,) for name in done]
+    return conn, curr
+
+
+@patch('stern_movies_api.migrations.MIGRATIONS', [('0001_a', 'SELECT 1;'), ('0002_b', 'SELECT 2;')])
+def test_apply_migrations_applies_pending_in_order():
+    conn, curr = make_connection(['0001_a'])
+    assert apply_migrations(conn) == ['0002_b']
+    statements = [call.args[0] for call in curr.execute.call_args_list]
+    assert 'SELECT 2;' in statements
+    assert 'SELECT 1;' not in statements
+
+
+@patch('stern_movies_api.migrations.MIGRATIONS', [('0001_a', 'SELECT 1;')])
+def test_apply_migrations_is_idempotent():
+    conn, curr = make_connection(['0001_a'])
+    assert apply_migrations(conn) == []
+    assert 'pg_advisory_unlock' in curr.execute.call_args_list[-1].args[0]
+
+
+@patch('stern_movies_api.migrations.MIGRATIONS', [('0001_a', 'SELECT 1;')])
+@patch.dict('stern_movies_api.migrations.environ', {
+    'DATABASE_USERNAME': 'user', 'DATABASE_PASSWORD': 'secret', 'DATABASE_IP': 'db',
+    'DATABASE_PORT': '5432', 'DATABASE_NAME': 'movies'})
+@patch('stern_movies_api.migrations.psycopg2.connect')
+def test_main_applies_migrations_on_its_own_connection(mock_connect, capsys):
+    conn, _ = make_connection([])
+    mock_connect.return_value = conn
+    main()
+    assert mock_connect.call_args.kwargs['database'] == 'movies'
+    assert capsys.readouterr().out == 'Applied 0001_a\n'
+    conn.close.assert_called_once()
@@ -0,0 +1,69 @@
+#pylint: skip-file
+
+from unittest.mock import MagicMock
+import pytest
+import psycopg2
+
+from stern_movies_api.pool import ConnectionPool, PoolTimeout
+
+
+def make_connection():
+    conn = MagicMock()
+    conn.closed = 0
+    return conn
+
+
+def test_pool_opens_min_size():
+    connect = MagicMock(side_effect=make_connection)
+    pool = ConnectionPool(connect, min_size=2, max_size=4)
+    assert connect.call_count == 2
+    assert pool.stats()['idle'] == 2
+
+
+def test_pool_reuses_returned_connection():
+    pool = ConnectionPool(make_connection, min_size=0, max_size=2)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    assert pool.getconn() is conn
+    assert conn.rollback.called
+
+
+def test_pool_times_out_when_exhausted():
+    pool = ConnectionPool(make_connection, min_size=0, max_size=1, timeout=0.01)
+    pool.getconn()
+    with pytest.raises(PoolTimeout):
+        pool.getconn()
+    assert pool.stats()['timeouts'] == 1
+
+
+def test_pool_discards_broken_connection():
+    pool = ConnectionPool(make_connection, min_size=0, max_size=1)
+    conn = pool.getconn()
+    pool.putconn(conn, broken=True)
+    assert conn.close.called
+    assert pool.getconn() is not conn
+
+
+def test_pool_recycles_closed_idle_connection():
+    pool = ConnectionPool(make_connection, min_size=1, max_size=1)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    conn.closed = 1
+    assert pool.getconn() is not conn
+    assert pool.stats()['recycled'] == 1
+
+
+def test_pool_pings_stale_idle_connection():
+    pool = ConnectionPool(make_connection, min_size=1, max_size=1, max_idle=0)
+    conn = pool._idle[0][0]
+    conn.cursor.return_value.__enter__.return_value.execute.side_effect = psycopg2.OperationalError
+    assert pool.getconn() is not conn
+
+
+def test_pool_stats_gauges():
+    pool = ConnectionPool(make_connection, min_size=1, max_size=3)
+    pool.getconn()
+    stats = pool.stats()
+    assert stats['in_use'] == 1
+    assert stats['idle'] == 0
+    assert stats['checkouts'] == 1
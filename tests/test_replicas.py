@@ -0,0 +1,136 @@
+#pylint: skip-file
+
+from unittest.mock import MagicMock, patch
+import pytest
+
+from stern_movies_api.replicas import (ReplicaRouter, finish_session, format_lsn, parse_lsn,
+                                       read_lsn, reading_after, start_session, write_lsn,
+                                       written)
+
+
+@pytest.fixture
+def router():
+    return ReplicaRouter({'a': 'dsn a', 'b': 'dsn b'}, MagicMock(side_effect=lambda dsn: dsn),
+                         eject_for=30)
+
+
+@pytest.fixture(autouse=True)
+def no_session():
+    finish_session()
+    yield
+    finish_session()
+
+
+@pytest.mark.parametrize('text,lsn', [('0/0', 0), ('0/16B3748', 0x16B3748),
+                                      ('16/B374D848', 0x16 << 32 | 0xB374D848)])
+def test_lsn_round_trip(text, lsn):
+    assert parse_lsn(text) == lsn
+    assert format_lsn(lsn) == text
+
+
+@pytest.mark.parametrize('text', ['', '16', '/1', '1/', 'G/1', '-1/1', '123456789/1', None])
+def test_parse_lsn_rejects(text):
+    with pytest.raises(ValueError):
+        parse_lsn(text)
+
+
+def test_session_keeps_highest_write():
+    assert read_lsn() is None
+    start_session(20)
+    written(10)
+    assert read_lsn() == 20
+    written(30)
+    session = finish_session()
+    assert (session.lsn, session.wrote) == (30, True)
+    assert read_lsn() is None
+
+
+def test_write_outside_request_starts_session():
+    written(5)
+    assert read_lsn() == 5
+
+
+def test_write_lsn_only_follows_writes():
+    start_session(20)
+    assert write_lsn() is None
+    written(30)
+    assert write_lsn() == 30
+
+
+def test_reading_after_raises_the_session_for_a_while():
+    with reading_after(None):
+        assert read_lsn() is None
+    with reading_after(10):
+        assert read_lsn() == 10
+    start_session(20)
+    with reading_after(10):
+        assert read_lsn() == 20
+    with reading_after(30):
+        assert read_lsn() == 30
+    assert read_lsn() == 20
+
+
+def test_choose_balances_reads_in_flight(router):
+    first = router.choose()
+    second = router.choose()
+    assert {first.name, second.name} == {'a', 'b'}
+    router.release(first)
+    assert router.choose() is first
+    names = set()
+    for _ in range(4):
+        replica = router.choose()
+        names.add(replica.name)
+        router.release(replica)
+    assert names == {'a', 'b'}, "Equally loaded replicas take turns."
+
+
+def test_choose_prefers_replicas_that_replayed(router):
+    a, b = router.replicas
+    router.replayed(b, 100)
+    for _ in range(3):
+        replica = router.choose(min_lsn=50)
+        assert replica is b
+        router.release(replica)
+    router.replayed(b, 40)
+    assert b.replayed_lsn == 100, "Replay positions only move forward."
+    router.replayed(a, None)
+    assert a.replayed_lsn >= 1 << 63, "A server that is not in recovery has every commit."
+
+
+def test_failed_replica_is_ejected(router):
+    a, b = router.replicas
+    router.failed(a)
+    for _ in range(3):
+        replica = router.choose()
+        assert replica is b
+        router.release(replica)
+    router.failed(b)
+    assert router.choose() is None
+    stats = router.stats()
+    assert stats['primary_reads'] == 1
+    assert [replica['healthy'] for replica in stats['replicas']] == [False, False]
+    assert stats['replicas'][1]['reads'] == 3
+
+
+def test_ejection_expires(router):
+    a, _ = router.replicas
+    with patch('stern_movies_api.replicas.time.monotonic', return_value=100.0):
+        router.failed(a)
+    with patch('stern_movies_api.replicas.time.monotonic', return_value=131.0):
+        assert a in {router.choose(), router.choose()}
+
+
+def test_pools_open_once_and_detach(router):
+    a, _ = router.replicas
+    assert router.pool(a) == 'dsn a'
+    router.pool(a)
+    assert router._open_pool.call_count == 1
+    assert router.detach_pools() == ['dsn a']
+    assert a.pool is None
+
+
+def test_release_counts_lagging_reads(router):
+    replica = router.choose()
+    router.release(replica, served=False)
+    assert router.stats()['lagging_reads'] == 1
+    assert replica.in_flight == 0 and replica.reads == 0
@@ -0,0 +1,157 @@
+#pylint: skip-file
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from stern_movies_api.singleflight import (AsyncSingleFlight, CoalescingTimeout, SingleFlight,
+                                           freeze)
+
+
+def blocked(result=None, error=None):
+    '''Return a call that blocks until released, counting its runs'''
+    started, release, calls = threading.Event(), threading.Event(), []
+
+    def call():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        if error is not None:
+            raise error
+        return result
+    return call, started, release, calls
+
+
+def test_freeze_keys_lists_and_dicts_by_value():
+    assert freeze([1, [2, 3], {'b': [4], 'a': 5}]) == (1, (2, 3), (('a', 5), ('b', (4,))))
+
+
+def test_concurrent_calls_share_one_run():
+    flights = SingleFlight()
+    call, started, release, calls = blocked({'movie_id': 1})
+    with ThreadPoolExecutor(5) as executor:
+        leader = executor.submit(flights.do, 'get', [1], call)
+        started.wait(5)
+        waiters = [executor.submit(flights.do, 'get', [1], call) for _ in range(4)]
+        time.sleep(0.05)
+        release.set()
+        results = [future.result() for future in [leader] + waiters]
+    assert results == [{'movie_id': 1}] * 5
+    assert all(result is results[0] for result in results), "The result is shared."
+    assert len(calls) == 1
+    stats = flights.stats()
+    assert (stats['executed'], stats['shared'], stats['in_flight']) == (1, 4, 0)
+    assert stats['coalesced_ratio'] == 0.8
+
+
+def test_different_keys_run_separately():
+    flights = SingleFlight()
+    assert flights.do('get', [1], lambda: 1) == 1
+    assert flights.do('get', [2], lambda: 2) == 2
+    assert flights.do('other', [1], lambda: 3) == 3
+    assert flights.stats()['executed'] == 3
+
+
+def test_unhashable_key_is_not_shared():
+    flights = SingleFlight()
+    assert flights.do('get', [{1, 2}, object], lambda: 1) == 1
+    assert flights.stats()['executed'] == 0
+
+
+def test_error_reaches_every_waiter():
+    flights = SingleFlight()
+    call, started, release, calls = blocked(error=ValueError('Movie not found'))
+    with ThreadPoolExecutor(3) as executor:
+        leader = executor.submit(flights.do, 'get', [1], call)
+        started.wait(5)
+        waiters = [executor.submit(flights.do, 'get', [1], call) for _ in range(2)]
+        time.sleep(0.05)
+        release.set()
+        for future in [leader] + waiters:
+            with pytest.raises(ValueError, match='Movie not found'):
+                future.result()
+    assert len(calls) == 1
+    assert flights.stats()['failed'] == 2
+    assert flights.do('get', [1], lambda: 'again') == 'again', "Failures are not remembered."
+
+
+def test_waiter_gives_up_after_timeout():
+    flights = SingleFlight(timeout=0.01)
+    call, started, release, calls = blocked('slow')
+    with ThreadPoolExecutor(2) as executor:
+        leader = executor.submit(flights.do, 'get', [1], call)
+        started.wait(5)
+        with pytest.raises(CoalescingTimeout):
+            flights.do('get', [1], call)
+        release.set()
+        assert leader.result() == 'slow'
+    assert flights.stats()['timed_out'] == 1
+
+
+def test_async_concurrent_calls_share_one_run():
+    flights, calls = AsyncSingleFlight(), []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {'movie_id': 1}
+
+    async def main():
+        return await asyncio.gather(*(flights.do('get', [1], call) for _ in range(5)))
+
+    assert asyncio.run(main()) == [{'movie_id': 1}] * 5
+    assert len(calls) == 1
+    assert flights.stats()['shared'] == 4
+
+
+def test_async_error_reaches_every_waiter():
+    flights = AsyncSingleFlight()
+
+    async def call():
+        await asyncio.sleep(0.01)
+        raise ValueError('Movie not found')
+
+    async def main():
+        return await asyncio.gather(*(flights.do('get', [1], call) for _ in range(3)),
+                                    return_exceptions=True)
+
+    assert all(isinstance(result, ValueError) for result in asyncio.run(main()))
+    assert (flights.stats()['executed'], flights.stats()['failed']) == (1, 2)
+
+
+def test_async_cancelled_leader_leaves_the_call_running():
+    flights = AsyncSingleFlight()
+
+    async def call():
+        await asyncio.sleep(0.02)
+        return 'done'
+
+    async def main():
+        leader = asyncio.create_task(flights.do('get', [1], call))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(flights.do('get', [1], call))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await waiter
+
+    assert asyncio.run(main()) == 'done'
+
+
+def test_async_waiter_gives_up_after_timeout():
+    flights = AsyncSingleFlight(timeout=0.01)
+
+    async def call():
+        await asyncio.sleep(0.05)
+        return 'slow'
+
+    async def main():
+        leader = asyncio.create_task(flights.do('get', [1], call))
+        await asyncio.sleep(0)
+        with pytest.raises(CoalescingTimeout):
+            await flights.do('get', [1], call)
+        return await leader
+
+    assert asyncio.run(main()) == 'slow'
+    assert flights.stats()['timed_out'] == 1
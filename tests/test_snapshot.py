@@ -0,0 +1,240 @@
+#pylint: skip-file
+
+import asyncio
+import itertools
+import random
+from datetime import date
+from decimal import Decimal
+from unittest.mock import AsyncMock, MagicMock
+import pytest
+
+pytest.importorskip('numpy')
+
+from stern_movies_api.snapshot import (AsyncCatalogueSnapshot, CatalogueSnapshot, Snapshot,
+                                      to_columns)
+
+SORTS = list(itertools.product(['movie_id', 'title', 'score', 'budget', 'revenue'],
+                               ['asc', 'desc']))
+
+
+def movie(movie_id, rng):
+    return {
+        'movie_id': movie_id,
+        'title': rng.choice(['Night', 'night river', 'River', 'Émile', 'Zebra', '_under', '']) +
+                 f' {rng.randint(0, 5)}',
+        'release_date': date(2000 + movie_id % 20, 1 + movie_id % 12, 1),
+        'score': rng.choice([None, Decimal('2.5'), Decimal('7.0'), Decimal('10.0')]),
+        'overview': rng.choice([None, 'An overview']),
+        'status_name': rng.choice(['Released', 'Rumored']),
+        'budget': rng.choice([None, 0, 100, 5000]),
+        'revenue': rng.choice([None, 10, 20]),
+        'country_id': movie_id % 3 + 1,
+        'country_name': ['AU', 'GB', 'US'][movie_id % 3],
+        'language_name': rng.choice(['English', 'French']),
+        'orig_title': rng.choice([None, 'Original']),
+        'genres': rng.sample(['Drama', 'Comedy', 'Horror'], rng.randint(0, 2)),
+    }
+
+
+def catalogue(count, seed=1, start=1):
+    rng = random.Random(seed)
+    return [movie(movie_id, rng) for movie_id in range(start, start + count)]
+
+
+def sort_key(sort_by):
+    # NULLs last in both directions, then the value, then movie_id, as the SQL listings order
+    def key(row):
+        value = row[sort_by]
+        if sort_by == 'title' and value is not None:
+            value = value.encode()
+        return (value is None, value if value is not None else 0, row['movie_id'])
+    return key
+
+
+def expected(rows, sort_by, sort_order, search=None, country_id=None, after=None):
+    rows = [row for row in rows
+            if (search is None or search.encode().lower() in row['title'].encode().lower())
+            and (country_id is None or row['country_id'] == country_id)]
+    key = sort_key(sort_by)
+    non_null = sorted((row for row in rows if row[sort_by] is not None), key=key)
+    nulls = sorted((row for row in rows if row[sort_by] is None), key=key)
+    if sort_order == 'desc':
+        non_null.reverse()
+        nulls.reverse()
+    ordered = non_null + nulls
+    if after is not None:
+        ordered = ordered[ordered.index(after) + 1:]
+    return [{k: v for k, v in row.items() if k != 'country_id'} for row in ordered]
+
+
+def cursor(row, sort_by):
+    value = row[sort_by]
+    # Scores come back from a cursor as the string they were encoded to
+    return (str(value) if isinstance(value, Decimal) else value, row['movie_id'])
+
+
+@pytest.fixture
+def rows():
+    return catalogue(200)
+
+
+@pytest.mark.parametrize('sort_by,sort_order', SORTS)
+def test_listing_matches_sql_order(rows, sort_by, sort_order):
+    snapshot = Snapshot.build(to_columns(rows))
+    assert snapshot.listing(sort_by=sort_by, sort_order=sort_order) == \
+        expected(rows, sort_by, sort_order)
+
+
+@pytest.mark.parametrize('sort_by,sort_order', SORTS)
+def test_listing_pages_follow_cursor(rows, sort_by, sort_order):
+    snapshot = Snapshot.build(to_columns(rows))
+    everything = expected(rows, sort_by, sort_order, country_id=2)
+    pages, after = [], None
+    while True:
+        page = snapshot.listing(country_id=2, sort_by=sort_by, sort_order=sort_order, limit=7,
+                                after=after)
+        if not page:
+            break
+        pages.extend(page)
+        after = cursor(next(row for row in rows if row['movie_id'] == page[-1]['movie_id']),
+                       sort_by)
+    assert pages == everything
+
+
+def test_listing_cursor_of_deleted_movie(rows):
+    snapshot = Snapshot.build(to_columns(rows[:50] + rows[51:]))
+    assert snapshot.listing(sort_by='budget', sort_order='desc', limit=5,
+                            after=cursor(rows[50], 'budget')) == \
+        expected(rows, 'budget', 'desc', after=rows[50])[:5]
+
+
+def test_listing_search_folds_ascii_only(rows):
+    snapshot = Snapshot.build(to_columns(rows))
+    found = snapshot.listing(search='NIGHT', sort_by='title')
+    assert found and found == expected(rows, 'title', 'asc', search='night')
+    assert {movie['title'] for movie in snapshot.listing(search='émile')} == set()
+    assert snapshot.listing(search='Émile') == expected(rows, 'movie_id', 'asc', search='Émile')
+
+
+def test_listing_search_remembers_matches(rows):
+    snapshot = Snapshot.build(to_columns(rows))
+    assert snapshot.listing(search='River', limit=3)
+    snapshot._searches[b'river'][:] = False
+    assert snapshot.listing(search='river', limit=3) == []
+
+
+def test_listing_search_does_not_span_titles():
+    rows = catalogue(2)
+    rows[0]['title'], rows[1]['title'] = 'ab', 'cd'
+    assert Snapshot.build(to_columns(rows)).listing(search='bc') == []
+
+
+def test_listing_defers_to_postgres():
+    snapshot = Snapshot.build(to_columns(catalogue(10)), c_collation=False)
+    assert snapshot.listing(sort_by='relevance', search='night') is None
+    assert snapshot.listing(sort_by='title') is None
+    assert snapshot.listing(search='night') is None
+    assert snapshot.listing(sort_by='budget') is not None
+    snapshot = Snapshot.build(to_columns(catalogue(10)))
+    assert snapshot.listing(sort_by='score', after=('high', 1)) is None
+
+
+def test_listing_rows_match_read_model(rows):
+    documents = Snapshot.build(to_columns(rows)).listing()
+    assert documents[0] == {k: v for k, v in rows[0].items() if k != 'country_id'}
+    assert isinstance(documents[0]['movie_id'], int)
+
+
+@pytest.mark.parametrize('changed', [3, 60])
+def test_apply_matches_rebuild(rows, changed):
+    snapshot = Snapshot.build(to_columns(rows))
+    rng = random.Random(changed)
+    updated = [movie(row['movie_id'], rng) for row in rng.sample(rows, changed)]
+    deleted = [row['movie_id'] for row in rng.sample(rows, 5)]
+    added = catalogue(changed, seed=changed, start=1000)
+    current = {row['movie_id']: row for row in rows}
+    current.update({row['movie_id']: row for row in updated + added})
+    for movie_id in deleted:
+        current.pop(movie_id, None)
+    changes = [row['movie_id'] for row in updated + added] + deleted
+    applied = snapshot.apply(changes, to_columns(current[movie_id]
+                                                for movie_id in dict.fromkeys(changes)
+                                                if movie_id in current))
+    for sort_by, sort_order in SORTS:
+        assert applied.listing(sort_by=sort_by, sort_order=sort_order) == \
+            expected(list(current.values()), sort_by, sort_order)
+    assert snapshot.listing() == expected(rows, 'movie_id', 'asc')
+
+
+def test_memory_report(rows):
+    memory = Snapshot.build(to_columns(rows)).memory()
+    assert memory['total'] == sum(memory['columns'].values())
+    assert memory['per_100k_movies'] == round(memory['total'] * 500)
+    assert {'title', 'genres', 'sort_orders'} <= set(memory['columns'])
+
+
+@pytest.fixture
+def source(rows):
+    load = MagicMock(return_value=(10, to_columns(rows), True))
+    changes = MagicMock(return_value=(11, [], to_columns([])))
+    return load, changes
+
+
+def test_catalogue_refreshes_from_changes(source, rows):
+    load, changes = source
+    catalogue_snapshot = CatalogueSnapshot(load, changes, refresh_interval=0)
+    assert len(catalogue_snapshot.get()) == 200
+    changes.return_value = (12, [1, 2], to_columns([rows[1]]))
+    assert len(catalogue_snapshot.get()) == 199
+    assert changes.call_args_list[0].args == (10,)
+    changes.return_value = (13, [], to_columns([]))
+    assert catalogue_snapshot.get().listing(limit=1) == expected(rows[1:], 'movie_id', 'asc')[:1]
+    assert changes.call_args_list[-1].args == (12,)
+    assert load.call_count == 1
+    stats = catalogue_snapshot.stats()
+    assert stats['movies'] == 199 and stats['changes_applied'] == 2
+    assert stats['memory']['total'] > 0
+
+
+def test_catalogue_waits_for_refresh_after_invalidate(source):
+    load, changes = source
+    catalogue_snapshot = CatalogueSnapshot(load, changes, refresh_interval=60)
+    first = catalogue_snapshot.get()
+    assert catalogue_snapshot.get() is first
+    assert changes.call_count == 0
+    catalogue_snapshot.invalidate()
+    catalogue_snapshot.get()
+    assert changes.call_count == 1
+
+
+def test_catalogue_rebuilds(source):
+    load, changes = source
+    catalogue_snapshot = CatalogueSnapshot(load, changes, refresh_interval=0, rebuild_interval=0)
+    catalogue_snapshot.get()
+    catalogue_snapshot.get()
+    assert load.call_count == 2
+    assert changes.call_count == 0
+
+
+def test_catalogue_serves_old_snapshot_during_refresh(source):
+    load, changes = source
+    catalogue_snapshot = CatalogueSnapshot(load, changes, refresh_interval=0)
+    first = catalogue_snapshot.get()
+    catalogue_snapshot._lock.acquire()
+    try:
+        assert catalogue_snapshot.get() is first
+    finally:
+        catalogue_snapshot._lock.release()
+    assert changes.call_count == 0
+
+
+def test_async_catalogue_refreshes(rows):
+    async def main():
+        changes = AsyncMock(return_value=(12, [1], to_columns([])))
+        catalogue_snapshot = AsyncCatalogueSnapshot(AsyncMock(return_value=(10, to_columns(rows), True)),
+                                                    changes, refresh_interval=0)
+        assert len(await catalogue_snapshot.get()) == 200
+        assert len(await catalogue_snapshot.get()) == 199
+        return changes
+
+    assert asyncio.run(main()).call_args.args == (10,)
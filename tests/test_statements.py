@@ -0,0 +1,58 @@
+#pylint: skip-file
+from unittest.mock import MagicMock
+
+import psycopg2
+import pytest
+from psycopg2 import sql
+
+from stern_movies_api.statements import StatementRegistry, render
+
+
+@pytest.fixture
+def curr():
+    return MagicMock()
+
+
+def test_render_quotes_identifiers():
+    query = sql.SQL('SELECT {} FROM {} WHERE x=%s;').format(sql.Identifier('a"b'),
+                                                           sql.Identifier('movies'))
+    assert render(query) == 'SELECT "a""b" FROM "movies" WHERE x=%s;'
+
+
+def test_statement_numbers_placeholders():
+    registry = StatementRegistry()
+    name, body, count = registry.statement("SELECT * FROM t WHERE a=%s AND b LIKE '%%x' LIMIT %s;")
+    assert body == "SELECT * FROM t WHERE a=$1 AND b LIKE '%x' LIMIT $2"
+    assert count == 2
+    assert registry.statement("SELECT * FROM t WHERE a=%s AND b LIKE '%%x' LIMIT %s;")[0] == name
+
+
+def test_execute_prepares_once_per_connection(curr):
+    registry = StatementRegistry()
+    registry.execute(curr, 'SELECT * FROM t WHERE a=%s;', (1,))
+    name = registry.statement('SELECT * FROM t WHERE a=%s;')[0]
+    curr.execute.assert_called_once_with(
+        f'PREPARE {name} AS SELECT * FROM t WHERE a=$1; EXECUTE {name} (%s);', (1,))
+    registry.execute(curr, 'SELECT * FROM t WHERE a=%s;', (2,))
+    curr.execute.assert_called_with(f'EXECUTE {name} (%s);', (2,))
+    other = MagicMock()
+    registry.execute(other, 'SELECT * FROM t WHERE a=%s;', (3,))
+    assert other.execute.call_args.args[0].startswith('PREPARE')
+    assert registry.stats() == {'statements': 1, 'prepares': 2, 'executions': 3, 'reused': 1}
+
+
+def test_execute_checks_after_failed_first_use(curr):
+    registry = StatementRegistry()
+    curr.execute.side_effect = [psycopg2.DataError('bad value'), None, None]
+    with pytest.raises(psycopg2.DataError):
+        registry.execute(curr, 'SELECT * FROM t WHERE a=%s;', ('x',))
+    curr.fetchone.return_value = {'name': 'stern'}
+    registry.execute(curr, 'SELECT * FROM t WHERE a=%s;', (1,))
+    assert 'pg_prepared_statements' in curr.execute.call_args_list[1].args[0]
+    assert curr.execute.call_args.args[0].startswith('EXECUTE')
+
+
+def test_disabled_registry_executes_directly(curr):
+    registry = StatementRegistry(enabled=False)
+    registry.execute(curr, 'SELECT 1;')
+    curr.execute.assert_called_once_with('SELECT 1;', ())
@@ -0,0 +1,51 @@
+#pylint: skip-file
+
+from werkzeug.datastructures import MIMEAccept, MultiDict
+
+from stern_movies_api.web import (MAX_BATCH_ROWS, batch_summary, created_movie_tags,
+                                  parse_batch, parse_genre_match, parse_movies_args,
+                                  parse_review_payload)
+
+
+def test_parse_batch_keeps_valid_values_and_rejects_the_rest():
+    results, reviews, error = parse_batch([{"review_text": "Good"}, {"score": 3}],
+                                          parse_review_payload, "reviews")
+    assert error is None
+    assert results == [None, {"index": 1, "error": "Missing required fields"}]
+    assert reviews == [(0, {"review_text": "Good", "score": None})]
+
+
+def test_parse_batch_rejects_a_non_array_or_oversized_batch():
+    assert parse_batch({"review_text": "Good"}, parse_review_payload, "reviews") == (
+        None, None, "Expected a JSON array of reviews")
+    _, _, error = parse_batch([{}] * (MAX_BATCH_ROWS + 1), parse_review_payload, "reviews")
+    assert error == f"A batch may contain at most {MAX_BATCH_ROWS} reviews"
+
+
+def test_batch_summary_counts_created_and_failed():
+    summary = batch_summary([None, {"index": 1, "error": "bad"}, None], [(0, {}), (2, {})],
+                            [{"movie_id": 5}, {"error": "Genre not recognized"}])
+    assert summary == {"created": 1, "failed": 2,
+                       "results": [{"index": 0, "movie_id": 5}, {"index": 1, "error": "bad"},
+                                   {"index": 2, "error": "Genre not recognized"}]}
+
+
+def test_created_movie_tags_only_cover_created_movies():
+    movies = [(0, {"country": "US"}), (1, {"country": "FR"}), (2, {"country": "DE"})]
+    assert created_movie_tags(movies, [{"movie_id": 5}, {"error": "bad"}, {"movie_id": 6}]) == [
+        "listings", "country:DE", "country:US", "movie:5", "movie:6"]
+    assert created_movie_tags(movies[:1], [{"error": "bad"}]) == []
+
+
+def test_parse_movies_args_rejects_genre_with_search():
+    search, genres, params, error = parse_movies_args(
+        MultiDict([("search", "star"), ("genre", "Drama")]))
+    assert (search, genres, params) == ("star", ["Drama"], None)
+    assert error == "genre cannot be combined with search"
+
+
+def test_parse_genre_match_rejects_a_stream():
+    args = MultiDict([("genre_match", "any")])
+    assert parse_genre_match(args, MIMEAccept()) == (False, None)
+    assert parse_genre_match(args, MIMEAccept([("application/x-ndjson", 1)])) == (
+        None, "genre cannot be combined with stream")